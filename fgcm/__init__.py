@@ -19,6 +19,7 @@ from .fgcmConfig import FgcmConfig
 from .fgcmParameters import FgcmParameters
 from .fgcmStars import FgcmStars
 from .fgcmChisq import FgcmChisq
+from .fgcmGaussNewton import FgcmGaussNewton
 from .fgcmBrightObs import FgcmBrightObs
 from .fgcmGray import FgcmGray
 from .fgcmSuperStarFlat import FgcmSuperStarFlat
@@ -42,3 +43,12 @@ from .fgcmComputeStepUnits import FgcmComputeStepUnits
 from .fgcmMirrorChromaticity import FgcmMirrorChromaticity
 from .fgcmZpsToApply import FgcmZpsToApply
 from .fgcmApplyZeropoints import FgcmApplyZeropoints
+from .fgcmWorkerPool import FgcmWorkerPool
+from .fgcmStarStore import FgcmStarStore
+from .fgcmStarCache import FgcmStarCache
+from .fgcmChunkPlanner import FgcmChunkPlanner
+from .fgcmResourcePlanner import FgcmResourcePlanner
+from .fgcmCheckpoint import FgcmCheckpoint
+from .fgcmChisqCluster import FgcmChisqCluster
+from .fgcmChisqCluster import FgcmChisqNode
+from .fgcmMatcher import FgcmMatcher
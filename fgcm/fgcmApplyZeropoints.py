@@ -12,6 +12,7 @@ from .fgcmParameters import FgcmParameters
 from .fgcmStars import FgcmStars
 from .fgcmLUT import FgcmLUT
 from .fgcmZpsToApply import FgcmZpsToApply
+from .fgcmWorkerPool import FgcmWorkerPool
 
 from .fgcmUtilities import getMemoryString, expFlagDict, obsFlagDict
 
@@ -63,6 +64,9 @@ class FgcmApplyZeropoints(object):
         self.fgcmLog = self.fgcmConfig.fgcmLog
         self.quietMode = self.fgcmConfig.quietMode
 
+        # The worker pool is shared by both applications of the zeropoints
+        self.fgcmWorkerPool = FgcmWorkerPool(self.fgcmConfig.nCore, self.fgcmLog)
+
         self.fgcmLUT = None
         self.fgcmPars = None
         self.fgcmStars = None
@@ -117,7 +121,8 @@ class FgcmApplyZeropoints(object):
         self.fgcmStars = FgcmStars(self.fgcmConfig)
         self.fgcmStars.loadStarsFromFits(self.fgcmPars, computeNobs=True)
 
-        self.fgcmZpsToApply = FgcmZpsToApply(self.fgcmConfig, self.fgcmPars, self.fgcmStars, self.fgcmLUT)
+        self.fgcmZpsToApply = FgcmZpsToApply(self.fgcmConfig, self.fgcmPars, self.fgcmStars, self.fgcmLUT,
+                                             fgcmWorkerPool=self.fgcmWorkerPool)
         self.fgcmZpsToApply.loadZeropointsFromFits()
 
         self.finishSetup()
@@ -154,6 +159,7 @@ class FgcmApplyZeropoints(object):
 
         bad, = np.where(flagMin > self.fgcmConfig.maxFlagZpsToApply)
         self.fgcmPars.expFlag[bad] |= expFlagDict['BAD_ZPFLAG']
+        self.fgcmPars.expFlagGeneration.advance()
 
         # And flag observations that do not have zeropoints...
 
@@ -163,6 +169,7 @@ class FgcmApplyZeropoints(object):
 
         bad, = np.where(zpFlag[obsExpIndex, obsCCDIndex] > self.fgcmConfig.maxFlagZpsToApply)
         obsFlag[bad] |= obsFlagDict['NO_ZEROPOINT']
+        self.fgcmStars.obsFlagGeneration.advance()
 
         # Select stars that have the minimum number of observations
         # This sets objNGoodObs
@@ -193,6 +200,9 @@ class FgcmApplyZeropoints(object):
         #  and with error modeling.
         self.fgcmZpsToApply.applyZeropoints()
 
+        self.fgcmWorkerPool.logTimingSummary()
+        self.fgcmWorkerPool.close()
+
         # Output the stars.
         if self.fgcmConfig.outputStars:
             outStarFile = '%s/%s_stdstars.fits' % (self.fgcmConfig.outputPath,
@@ -7,6 +7,8 @@ import scipy.interpolate as interpolate
 import scipy.integrate as integrate
 import os
 import sys
+import yaml
+import multiprocessing.util
 from pkg_resources import resource_exists
 from pkg_resources import resource_filename
 from pkg_resources import resource_listdir
@@ -29,6 +31,7 @@ from .modtranGenerator import ModtranGenerator
 
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
 from .fgcmLogger import FgcmLogger
+from .fgcmWorkerPool import FgcmWorkerPool
 
 class FgcmAtmosphereTable(object):
     """
@@ -42,8 +45,18 @@ class FgcmAtmosphereTable(object):
        Name of the table file
     fgcmLog: FgcmLog, optional
        Logger
+
+    Optional atmConfig variables (for generating a table)
+    ------------------------------------------------------
+    nCore: int, default=1
+       Number of MODTRAN runs to make at once
+    checkpointPath: string, default=None
+       Directory to save each MODTRAN run as it completes, so an interrupted
+       generateTable() continues where it stopped
     """
 
+    checkpointMetaFile = 'checkpoint.yaml'
+
     def __init__(self, atmConfig, atmosphereTableFile=None, fgcmLog=None):
 
         if fgcmLog is None:
@@ -107,6 +120,21 @@ class FgcmAtmosphereTable(object):
             else:
                 self.lambdaNorm = 7750.0
 
+            if ('nCore' in self.atmConfig):
+                self.nCore = self.atmConfig['nCore']
+            else:
+                self.nCore = 1
+
+            # the MODTRAN generator of each worker process (see
+            #  _getWorkerModGen())
+            self._workerModGen = None
+            self._workerModGenPid = None
+
+            if ('checkpointPath' in self.atmConfig):
+                self.checkpointPath = self.atmConfig['checkpointPath']
+            else:
+                self.checkpointPath = None
+
         self.o2Interpolator = None
         self.o3Interpolator = None
         self.rayleighInterpolator = None
@@ -291,7 +319,10 @@ class FgcmAtmosphereTable(object):
 
     def generateTable(self):
         """
-        Generate atmosphere table using MODTRAN
+        Generate atmosphere table using MODTRAN.  With nCore > 1, the
+         MODTRAN runs are made in parallel, with a temporary run directory
+         for each worker process.  With a checkpointPath, completed runs are saved and
+         are not repeated if generateTable() is run again.
 
         parameters
         ----------
@@ -301,14 +332,6 @@ class FgcmAtmosphereTable(object):
         -------
         None
         """
-        self.atmStd = self.modGen(pmb=self.pmbStd,pwv=self.pwvStd,
-                                  o3=self.o3Std,tau=self.tauStd,
-                                  alpha=self.alphaStd,zenith=self.zenithStd,
-                                  lambdaRange=self.lambdaRange/10.0,
-                                  lambdaStep=self.lambdaStep)
-        self.atmLambda = self.atmStd['LAMBDA']
-        self.atmStdTrans = self.atmStd['COMBINED']
-
         # get all the steps
         self.pmb = np.linspace(self.atmConfig['pmbRange'][0],
                                self.atmConfig['pmbRange'][1],
@@ -352,51 +375,197 @@ class FgcmAtmosphereTable(object):
         zenithPlus = np.arccos(1./secZenithPlus)*180./np.pi
 
         # run MODTRAN a bunch of times
-
-        self.fgcmLog.info("Generating %d*%d=%d PWV atmospheres..." % (pwvPlus.size,zenithPlus.size,pwvPlus.size*zenithPlus.size))
-        self.pwvAtmTable = np.zeros((pwvPlus.size,zenithPlus.size,self.atmLambda.size))
-
+        #  each task is (name, i, j, modtran parameters, output columns)
+        tasks = [('std', 0, 0,
+                  {'pmb': self.pmbStd, 'pwv': self.pwvStd, 'o3': self.o3Std,
+                   'tau': self.tauStd, 'alpha': self.alphaStd, 'zenith': self.zenithStd},
+                  None)]
         for i in range(pwvPlus.size):
-            sys.stdout.write('%d' % (i))
-            sys.stdout.flush()
             for j in range(zenithPlus.size):
-                sys.stdout.write('.')
-                sys.stdout.flush()
-                atm=self.modGen(pwv=pwvPlus[i],zenith=zenithPlus[j],
-                                lambdaRange=self.lambdaRange/10.0,
-                                lambdaStep=self.lambdaStep)
-                self.pwvAtmTable[i,j,:] = atm['H2O']
-
-        self.fgcmLog.info("\nGenerating %d*%d=%d O3 atmospheres..." % (o3Plus.size,zenithPlus.size,o3Plus.size*zenithPlus.size))
-        self.o3AtmTable = np.zeros((o3Plus.size, zenithPlus.size, self.atmLambda.size))
-
+                tasks.append(('pwv', i, j, {'pwv': pwvPlus[i], 'zenith': zenithPlus[j]},
+                              ['H2O']))
         for i in range(o3Plus.size):
-            sys.stdout.write('%d' % (i))
-            sys.stdout.flush()
             for j in range(zenithPlus.size):
-                sys.stdout.write('.')
-                sys.stdout.flush()
-                atm=self.modGen(o3=o3Plus[i],zenith=zenithPlus[j],
-                                lambdaRange=self.lambdaRange/10.0,
-                                lambdaStep=self.lambdaStep)
-                self.o3AtmTable[i,j,:] = atm['O3']
+                tasks.append(('o3', i, j, {'o3': o3Plus[i], 'zenith': zenithPlus[j]},
+                              ['O3']))
+        for j in range(zenithPlus.size):
+            tasks.append(('o2', 0, j, {'zenith': zenithPlus[j]},
+                          ['O2', 'RAYLEIGH']))
 
-        self.fgcmLog.info("\nGenerating %d O2/Rayleigh atmospheres..." % (zenithPlus.size))
+        self.fgcmLog.info("Generating %d standard, %d*%d=%d PWV, %d*%d=%d O3, and %d O2/Rayleigh atmospheres..." %
+                          (1, pwvPlus.size, zenithPlus.size, pwvPlus.size*zenithPlus.size,
+                           o3Plus.size, zenithPlus.size, o3Plus.size*zenithPlus.size,
+                           zenithPlus.size))
 
+        atms = [None] * len(tasks)
+
+        if self.checkpointPath is not None:
+            self._initCheckpoint(pwvPlus, o3Plus, zenithPlus)
+            for index, task in enumerate(tasks):
+                fileName = self._checkpointFile(task)
+                if os.path.isfile(fileName):
+                    atms[index] = np.load(fileName)
+
+        todo = [index for index in range(len(tasks)) if atms[index] is None]
+
+        if self.checkpointPath is not None:
+            self.fgcmLog.info("Found %d of %d atmospheres in checkpoint %s" %
+                              (len(tasks) - len(todo), len(tasks), self.checkpointPath))
+
+        if self.nCore > 1 and len(todo) > 1:
+            pool = FgcmWorkerPool(self.nCore, self.fgcmLog)
+            try:
+                results = pool.map(self, '_generateAtmosphere', [tasks[index] for index in todo])
+            finally:
+                # the workers remove their run directories as they exit
+                pool.close()
+        else:
+            results = [self._generateAtmosphere(tasks[index]) for index in todo]
+
+        for index, atm in zip(todo, results):
+            atms[index] = atm
+
+        self.atmStd = atms[0]
+        self.atmLambda = self.atmStd['LAMBDA']
+        self.atmStdTrans = self.atmStd['COMBINED']
+
+        self.pwvAtmTable = np.zeros((pwvPlus.size,zenithPlus.size,self.atmLambda.size))
+        self.o3AtmTable = np.zeros((o3Plus.size, zenithPlus.size, self.atmLambda.size))
         self.o2AtmTable = np.zeros((zenithPlus.size, self.atmLambda.size))
         self.rayleighAtmTable = np.zeros((zenithPlus.size, self.atmLambda.size))
 
-        for j in range(zenithPlus.size):
-            sys.stdout.write('.')
-            sys.stdout.flush()
-            atm=self.modGen(zenith=zenithPlus[j],
-                            lambdaRange=self.lambdaRange/10.0,
-                            lambdaStep=self.lambdaStep)
-            self.o2AtmTable[j,:] = atm['O2']
-            self.rayleighAtmTable[j,:] = atm['RAYLEIGH']
+        for (name, i, j, _, _), atm in zip(tasks, atms):
+            if name == 'pwv':
+                self.pwvAtmTable[i,j,:] = atm['H2O']
+            elif name == 'o3':
+                self.o3AtmTable[i,j,:] = atm['O3']
+            elif name == 'o2':
+                self.o2AtmTable[j,:] = atm['O2']
+                self.rayleighAtmTable[j,:] = atm['RAYLEIGH']
 
         self.fgcmLog.info("\nDone.")
 
+    def _generateAtmosphere(self, task):
+        """
+        Run MODTRAN for one grid point of the table, and save it to the
+         checkpoint if configured.  Not to be called on its own; see
+         generateTable().
+
+        parameters
+        ----------
+        task: tuple[5]
+           (name, i, j, modtran parameters, output columns or None for all)
+
+        returns
+        -------
+        atm: numpy recarray
+           Atmosphere with the output columns
+        """
+
+        name, i, j, pars, columns = task
+
+        if self.nCore > 1:
+            # each process needs its own MODTRAN run directory
+            modGen = self._getWorkerModGen()
+        else:
+            modGen = self.modGen
+
+        atm = modGen(lambdaRange=self.lambdaRange/10.0,
+                     lambdaStep=self.lambdaStep,
+                     **pars)
+
+        if columns is None:
+            atm = atm.copy()
+        else:
+            out = np.zeros(atm.size, dtype=[(column, atm[column].dtype) for column in columns])
+            for column in columns:
+                out[column] = atm[column]
+            atm = out
+
+        if self.checkpointPath is not None:
+            fileName = self._checkpointFile(task)
+            # write and rename, so a partial file is never taken as complete
+            tempFileName = '%s.%d.tmp.npy' % (fileName[: -len('.npy')], os.getpid())
+            np.save(tempFileName, atm)
+            os.rename(tempFileName, fileName)
+
+        sys.stdout.write('.')
+        sys.stdout.flush()
+
+        return atm
+
+    def _getWorkerModGen(self):
+        """
+        Get the MODTRAN generator of this (worker) process.  It is cloned
+         once per process, on the first run, and its run directory is removed
+         when the process exits.  Not to be called on its own.
+
+        returns
+        -------
+        modGen: ModtranGenerator
+        """
+
+        if self._workerModGen is None or self._workerModGenPid != os.getpid():
+            self._workerModGen = self.modGen.clone()
+            self._workerModGenPid = os.getpid()
+            multiprocessing.util.Finalize(None, self._workerModGen._removeRunPath,
+                                          exitpriority=10)
+
+        return self._workerModGen
+
+    def _checkpointFile(self, task):
+        """
+        Get the checkpoint file name for one grid point of the table.
+        """
+        return os.path.join(self.checkpointPath, '%s_%03d_%03d.npy' % (task[0], task[1], task[2]))
+
+    def _initCheckpoint(self, pwvPlus, o3Plus, zenithPlus):
+        """
+        Make the checkpoint directory, or check that an existing checkpoint
+         was made with the same table parameters.
+
+        parameters
+        ----------
+        pwvPlus: float array
+           PWV grid, plus one step
+        o3Plus: float array
+           O3 grid, plus one step
+        zenithPlus: float array
+           Zenith grid, plus one step
+        """
+
+        meta = {'elevation': float(self.elevation),
+                'lambdaRange': [float(x) for x in self.lambdaRange],
+                'lambdaStep': float(self.lambdaStep),
+                'pmbStd': float(self.pmbStd),
+                'pwvStd': float(self.pwvStd),
+                'o3Std': float(self.o3Std),
+                'tauStd': float(self.tauStd),
+                'alphaStd': float(self.alphaStd),
+                'zenithStd': float(self.zenithStd),
+                'pwvPlus': [float(x) for x in pwvPlus],
+                'o3Plus': [float(x) for x in o3Plus],
+                'zenithPlus': [float(x) for x in zenithPlus]}
+
+        metaFile = os.path.join(self.checkpointPath, self.checkpointMetaFile)
+
+        if os.path.isfile(metaFile):
+            with open(metaFile) as f:
+                oldMeta = yaml.load(f, Loader=yaml.SafeLoader)
+            if oldMeta != meta:
+                raise RuntimeError("Checkpoint %s was made with different table parameters; remove it to start over." %
+                                   (self.checkpointPath))
+            return
+
+        if not os.path.isdir(self.checkpointPath):
+            try:
+                os.makedirs(self.checkpointPath)
+            except:
+                raise IOError("Could not create checkpoint path: %s" % (self.checkpointPath))
+
+        with open(metaFile, 'w') as f:
+            yaml.dump(meta, f, default_flow_style=False)
+
     def saveTable(self, fileName, clobber=False):
         """
         Save atmosphere table to a file
@@ -17,11 +17,8 @@ try:
 except ImportError:
     import copyreg
 
-import multiprocessing
-from multiprocessing import Pool
-
-
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmWorkerPool import FgcmWorkerPool
 
 copyreg.pickle(types.MethodType, _pickle_method)
 
@@ -41,6 +38,8 @@ class FgcmBrightObs(object):
        Star object
     fgcmLUT: FgcmLUT
        LUT object
+    fgcmWorkerPool: FgcmWorkerPool, optional
+       Persistent worker pool.  If None, a pool is made for each run.
 
     Config variables
     ----------------
@@ -51,12 +50,20 @@ class FgcmBrightObs(object):
     nStarPerRun: int
        Number of stars per run (too many uses more memory)
     """
-    def __init__(self,fgcmConfig,fgcmPars,fgcmStars,fgcmLUT):
+
+    # These are the attributes that may change between runs, and are sent
+    #  to the persistent pool workers with each map.
+    _workerStateAttrs = ['debug', 'computeSEDSlopes', 'fgcmPars.expFlag']
+
+    def __init__(self,fgcmConfig,fgcmPars,fgcmStars,fgcmLUT,fgcmWorkerPool=None):
 
         self.fgcmLog = fgcmConfig.fgcmLog
 
         self.fgcmLog.debug('Initializing FgcmBrightObs')
 
+        # this may be None, in which case we make a pool for each run
+        self.fgcmWorkerPool = fgcmWorkerPool
+
         # need fgcmPars because it tracks good exposures
         self.fgcmPars = fgcmPars
         # need fgcmStars because it has the stars (duh)
@@ -132,36 +139,30 @@ class FgcmBrightObs(object):
 
             prepStartTime = time.time()
             nSections = goodStars.size // self.nStarPerRun + 1
-            goodStarsList = np.array_split(goodStars,nSections)
-
-            # is there a better way of getting all the first elements from the list?
-            #  note that we need to skip the first which should be zero (checked above)
-            #  see also fgcmChisq.py
-            # splitValues is the first of the goodStars in each list
-            splitValues = np.zeros(nSections-1,dtype='i4')
-            for i in range(1,nSections):
-                splitValues[i-1] = goodStarsList[i][0]
-
-            # get the indices from the goodStarsSub matched list
-            splitIndices = np.searchsorted(goodStars[goodStarsSub], splitValues)
-
-            # and split along these indices
-            goodObsList = np.split(goodObs,splitIndices)
-
-            workerList = list(zip(goodStarsList,goodObsList))
-
-            # reverse sort so the longest running go first
-            workerList.sort(key=lambda elt:elt[1].size, reverse=True)
+            workerList = self.fgcmStars.splitGoodObsIndices(goodStars, goodStarsSub,
+                                                            goodObs, nSections,
+                                                            nCore=self.nCore,
+                                                            stage='brightObs')
 
             self.fgcmLog.debug('Using %d sections (%.1f seconds)' %
                                (nSections,time.time() - prepStartTime))
 
-            # make a pool
-            pool = Pool(processes=self.nCore)
-            pool.map(self._worker,workerList,chunksize=1)
-            pool.close()
-            pool.join()
+            # use the persistent pool if we have one
+            if self.fgcmWorkerPool is not None:
+                pool = self.fgcmWorkerPool
+            else:
+                pool = FgcmWorkerPool(self.nCore, self.fgcmLog)
+
+            pool.map(self, '_worker', workerList,
+                     stateAttrs=self._workerStateAttrs)
+            self.fgcmStars.chunkPlanner.recordTiming('brightObs', workerList,
+                                                     pool.lastTaskTimes)
+
+            if self.fgcmWorkerPool is None:
+                pool.close()
 
+        # The workers have written objNGoodObs
+        self.fgcmStars.objNGoodObsGeneration.advance()
 
         if not self.quietMode:
             self.fgcmLog.info('Finished BrightObs in %.2f seconds.' %
@@ -196,9 +197,6 @@ class FgcmBrightObs(object):
         obsMagStd = snmm.getArray(self.fgcmStars.obsMagStdHandle)
         obsFlag = snmm.getArray(self.fgcmStars.obsFlagHandle)
 
-        # and the arrays for locking access
-        objMagStdMeanLock = snmm.getArrayBase(self.fgcmStars.objMagStdMeanHandle).get_lock()
-
         # and cut to those exposures that are not flagged
         if (self.debug):
             startTime = time.time()
@@ -222,56 +220,55 @@ class FgcmBrightObs(object):
 
         obsMagErr2GO = obsMagADUModelErr[goodObs]**2.
 
+        # compact local star index for the temp vars,
+        #  where uStarsGO[obsLocalIndexGO] == obsObjIDIndexGO
+        uStarsGO, obsLocalIndexGO = np.unique(obsObjIDIndexGO, return_inverse=True)
+        nBands = objMagStdMean.shape[1]
+
         # new version using fmin.at()
 
         # start with the mean temp var, set to 99s.
-        objMagStdMeanTemp = np.zeros_like(objMagStdMean)
+        objMagStdMeanTemp = np.zeros((uStarsGO.size, nBands), dtype=objMagStdMean.dtype)
         objMagStdMeanTemp[:,:] = 99.0
 
         # find the brightest (minmag) object at each index
         np.fmin.at(objMagStdMeanTemp,
-                   (obsObjIDIndexGO, obsBandIndexGO),
+                   (obsLocalIndexGO, obsBandIndexGO),
                    obsMagStdGO)
 
         # now which observations are bright *enough* to consider?
         brightEnoughGO, = np.where((obsMagStdGO -
-                                    objMagStdMeanTemp[obsObjIDIndexGO,
+                                    objMagStdMeanTemp[obsLocalIndexGO,
                                                       obsBandIndexGO]) <=
                                    self.brightObsGrayMax)
 
         # need to take the weighted mean, so a temp array here
-        #  (memory issues?)
-        wtSum = np.zeros_like(objMagStdMean,dtype='f8')
-        objNGoodObsTemp = np.zeros_like(objNGoodObs)
+        wtSum = np.zeros((uStarsGO.size, nBands), dtype='f8')
+        objNGoodObsTemp = np.zeros((uStarsGO.size, nBands), dtype=objNGoodObs.dtype)
         objMagStdMeanTemp[:,:] = 0
 
         obsMagErr2GOBE = obsMagErr2GO[brightEnoughGO]
 
         np.add.at(wtSum,
-                  (obsObjIDIndexGO[brightEnoughGO],
+                  (obsLocalIndexGO[brightEnoughGO],
                    obsBandIndexGO[brightEnoughGO]),
                   1./obsMagErr2GOBE)
         np.add.at(objMagStdMeanTemp,
-                  (obsObjIDIndexGO[brightEnoughGO],
+                  (obsLocalIndexGO[brightEnoughGO],
                    obsBandIndexGO[brightEnoughGO]),
                   obsMagStdGO[brightEnoughGO]/obsMagErr2GOBE)
         np.add.at(objNGoodObsTemp,
-                  (obsObjIDIndexGO[brightEnoughGO],
+                  (obsLocalIndexGO[brightEnoughGO],
                    obsBandIndexGO[brightEnoughGO]),
                   1)
 
         # these are good object/bands that were observed
-        gd=np.where(wtSum > 0.0)
-
-        # acquire lock to save values
-        objMagStdMeanLock.acquire()
-
-        objMagStdMean[gd] = objMagStdMeanTemp[gd] / wtSum[gd]
-        objMagStdMeanErr[gd] = np.sqrt(1./wtSum[gd])
-        objNGoodObs[gd] = objNGoodObsTemp[gd]
+        gdLocal = np.where(wtSum > 0.0)
+        gd = (uStarsGO[gdLocal[0]], gdLocal[1])
 
-        # and release
-        objMagStdMeanLock.release()
+        objMagStdMean[gd] = objMagStdMeanTemp[gdLocal] / wtSum[gdLocal]
+        objMagStdMeanErr[gd] = np.sqrt(1./wtSum[gdLocal])
+        objNGoodObs[gd] = objNGoodObsTemp[gdLocal]
 
         # finally, compute SED slopes if desired
         if (self.computeSEDSlopes):
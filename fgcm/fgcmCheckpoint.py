@@ -0,0 +1,402 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import time
+import zlib
+import hashlib
+import numpy as np
+import yaml
+
+from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+
+
+class FgcmCheckpoint(object):
+    """
+    Class to save and restore fit cycle checkpoints, so that an interrupted
+     fit cycle can be resumed from the last completed stage, or from the
+     last checkpoint of a fit in progress.
+
+    The checkpoint is a directory with one .npy file per saved array, a
+     fit state file (with the parameters and optimizer state of the fit in
+     progress), and a metadata file with the key, the last completed stage,
+     the saved scalar values and the file of each array.  The metadata file
+     is written last, so an interrupted save leaves the previous checkpoint
+     intact.  Arrays which are unchanged since the previous stage are not
+     rewritten.
+
+    parameters
+    ----------
+    checkpointPath: string
+       Directory of the checkpoint
+    key: string
+       Checkpoint key from computeKey(); a checkpoint with a different key
+       is not used for resuming
+    fgcmLog: FgcmLogger
+       Logger object
+    """
+
+    # Stages of a fit cycle, in order
+    stages = ['prefit', 'fit', 'gray', 'postfit']
+
+    metaFile = 'checkpoint.yaml'
+    fitStateFile = 'fitstate.npz'
+
+    # Increment when the checkpoint contents change
+    checkpointVersion = 1
+
+    def __init__(self, checkpointPath, key, fgcmLog):
+
+        self.checkpointPath = os.path.abspath(checkpointPath)
+        self.key = key
+        self.fgcmLog = fgcmLog
+
+        self.meta = None
+
+        metaFile = os.path.join(self.checkpointPath, self.metaFile)
+        if os.path.isfile(metaFile):
+            with open(metaFile) as f:
+                self.meta = yaml.load(f, Loader=yaml.SafeLoader)
+
+        if not os.path.isdir(self.checkpointPath):
+            try:
+                os.makedirs(self.checkpointPath)
+            except:
+                raise IOError("Could not create checkpoint path: %s" % (self.checkpointPath))
+
+    @classmethod
+    def computeKey(cls, arrays, config):
+        """
+        Compute the checkpoint key.
+
+        parameters
+        ----------
+        arrays: list of numpy arrays
+           Arrays describing the input of the fit cycle
+        config: dict
+           Configuration values (must be yaml serializable)
+
+        returns
+        -------
+        key: string
+        """
+
+        h = hashlib.sha1()
+        h.update(('version %d' % (cls.checkpointVersion)).encode('utf-8'))
+
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            h.update(str(array.dtype).encode('utf-8'))
+            h.update(str(array.shape).encode('utf-8'))
+            h.update(array.tobytes())
+
+        h.update(yaml.dump(config, default_flow_style=True).encode('utf-8'))
+
+        return h.hexdigest()
+
+    @property
+    def stage(self):
+        """
+        Last completed stage of a checkpoint with the current key (or None).
+        """
+
+        if self.meta is None or self.meta['key'] != self.key:
+            return None
+        return self.meta['stage']
+
+    def isComplete(self, stage, resumeStage):
+        """
+        Check if a stage was completed by the time of a checkpoint.
+
+        parameters
+        ----------
+        stage: string
+           Stage name
+        resumeStage: string
+           Last completed stage of the checkpoint (or None)
+
+        returns
+        -------
+        isComplete: bool
+        """
+
+        if resumeStage is None:
+            return False
+        return self.stages.index(stage) <= self.stages.index(resumeStage)
+
+    def saveStage(self, stage, arrays, values):
+        """
+        Save the state at the end of a stage, replacing the previous checkpoint
+        (and any fit state).
+
+        parameters
+        ----------
+        stage: string
+           Stage name (one of stages)
+        arrays: dict
+           Arrays to save, keyed by name
+        values: dict
+           Scalar (yaml serializable) values to save, keyed by name
+        """
+
+        if stage not in self.stages:
+            raise ValueError("Unknown checkpoint stage %s" % (stage))
+
+        startTime = time.time()
+
+        previous = {}
+        if self.meta is not None and self.meta['key'] == self.key:
+            previous = self.meta['arrays']
+        previousFiles = set([previous[name]['file'] for name in previous])
+
+        files = {}
+        nWritten = 0
+        for name in arrays:
+            array = np.ascontiguousarray(arrays[name])
+            checksum = zlib.adler32(array.reshape(-1).view(np.uint8))
+            if (name in previous and previous[name]['checksum'] == checksum and
+                    os.path.isfile(os.path.join(self.checkpointPath, previous[name]['file']))):
+                files[name] = previous[name]
+                continue
+
+            # Don't replace a file of the previous checkpoint (when a stage
+            #  is saved again), which is in use until the metadata is written
+            filename = '%s.%s.npy' % (name, stage)
+            if filename in previousFiles:
+                filename = '%s.%s.1.npy' % (name, stage)
+
+            tempFile = os.path.join(self.checkpointPath, filename + '.tmp')
+            with open(tempFile, 'wb') as f:
+                np.save(f, array)
+            os.replace(tempFile, os.path.join(self.checkpointPath, filename))
+            files[name] = {'file': filename, 'checksum': checksum}
+            nWritten += 1
+
+        meta = {'key': self.key,
+                'stage': stage,
+                'time': time.time(),
+                'arrays': files,
+                'values': dict(values)}
+        self._writeMeta(meta)
+
+        # The fit state (if any) is from before this stage
+        self.clearFitState()
+
+        # And remove the files which are no longer used (or left over
+        #  from an interrupted save)
+        inUse = set([files[name]['file'] for name in files])
+        for filename in os.listdir(self.checkpointPath):
+            if (filename.endswith('.npy') or filename.endswith('.npy.tmp')) and filename not in inUse:
+                os.remove(os.path.join(self.checkpointPath, filename))
+
+        self.fgcmLog.info('Saved checkpoint at end of %s stage (%d of %d arrays written) in %.1f seconds.' %
+                          (stage, nWritten, len(arrays), time.time() - startTime))
+
+    def readArray(self, name):
+        """
+        Read a saved array, checking it against its saved checksum.
+
+        parameters
+        ----------
+        name: string
+           Array name
+
+        returns
+        -------
+        array: numpy array, or None if the array was not saved
+        """
+
+        if self.meta is None or name not in self.meta['arrays']:
+            return None
+
+        filename = os.path.join(self.checkpointPath, self.meta['arrays'][name]['file'])
+        try:
+            array = np.load(filename)
+        except (IOError, OSError, ValueError):
+            array = None
+
+        if (array is None or
+                zlib.adler32(np.ascontiguousarray(array).reshape(-1).view(np.uint8)) !=
+                self.meta['arrays'][name]['checksum']):
+            raise RuntimeError("Checkpoint array %s does not match its checksum; remove checkpoint %s to start over." %
+                               (filename, self.checkpointPath))
+
+        return array
+
+    @property
+    def values(self):
+        """
+        Saved scalar values.
+        """
+
+        if self.meta is None:
+            return {}
+        return self.meta['values']
+
+    def saveFitState(self, fitState):
+        """
+        Save the state of the fit in progress (after the last completed stage).
+
+        parameters
+        ----------
+        fitState: dict
+           Arrays and numbers, keyed by name
+        """
+
+        tempFile = os.path.join(self.checkpointPath, self.fitStateFile + '.tmp')
+        with open(tempFile, 'wb') as f:
+            np.savez(f, key=np.array(self.key), **fitState)
+        os.replace(tempFile, os.path.join(self.checkpointPath, self.fitStateFile))
+
+    def readFitState(self):
+        """
+        Read the state of the fit in progress.
+
+        returns
+        -------
+        fitState: dict, or None if there is no fit state for this checkpoint
+        """
+
+        fitStateFile = os.path.join(self.checkpointPath, self.fitStateFile)
+        if not os.path.isfile(fitStateFile):
+            return None
+
+        with np.load(fitStateFile) as fitStateNpz:
+            fitState = {name: fitStateNpz[name] for name in fitStateNpz.files}
+
+        if str(fitState.pop('key')) != self.key:
+            return None
+
+        return fitState
+
+    def clearFitState(self):
+        """
+        Remove the state of the fit in progress.
+        """
+
+        fitStateFile = os.path.join(self.checkpointPath, self.fitStateFile)
+        if os.path.isfile(fitStateFile):
+            os.remove(fitStateFile)
+
+    def _writeMeta(self, meta):
+        """
+        Write the metadata file (atomically).  Not to be called on its own.
+        """
+
+        tempFile = os.path.join(self.checkpointPath, self.metaFile + '.tmp')
+        with open(tempFile, 'w') as f:
+            yaml.dump(meta, f, default_flow_style=False)
+        os.replace(tempFile, os.path.join(self.checkpointPath, self.metaFile))
+
+        self.meta = meta
+
+    @staticmethod
+    def getObjectState(prefix, obj, arrays, values, handleNames=None):
+        """
+        Get the state of an object to save.
+
+        parameters
+        ----------
+        prefix: string
+           Prefix for the array and value names
+        obj: object
+           Object to save
+        arrays: dict
+           Saved arrays (filled)
+        values: dict
+           Saved scalar values (filled)
+        handleNames: list of strings, optional
+           Names of the snmm handles (without 'Handle') to save (and no
+           scalars).  If None, all the numpy array and scalar attributes of
+           obj are saved instead.
+        """
+
+        if handleNames is not None:
+            for name in handleNames:
+                arrays['%s.%s' % (prefix, name)] = snmm.getArray(getattr(obj, name + 'Handle'))
+            return
+
+        for name, value in obj.__dict__.items():
+            if name.endswith('Handle'):
+                continue
+            if isinstance(value, np.ndarray):
+                if value.dtype.hasobject:
+                    continue
+                arrays['%s.%s' % (prefix, name)] = value
+            elif isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating)):
+                values['%s.%s' % (prefix, name)] = value.item() if isinstance(value, np.generic) else value
+
+    def setObjectState(self, prefix, obj, handleNames=None):
+        """
+        Restore the saved state of an object.
+
+        parameters
+        ----------
+        prefix: string
+           Prefix for the array and value names
+        obj: object
+           Object to restore
+        handleNames: list of strings, optional
+           Names of the snmm handles (without 'Handle') to restore.  If None,
+           all the saved numpy array attributes are restored instead.  In
+           both cases, all the saved scalar attributes are restored.
+        """
+
+        prefixDot = prefix + '.'
+
+        arrays = {}
+        for fullName in self.meta['arrays']:
+            if fullName.startswith(prefixDot):
+                arrays[fullName] = self.readArray(fullName)
+
+        self.applyObjectState(prefix, obj, arrays, self.values, handleNames=handleNames)
+
+    @staticmethod
+    def applyObjectState(prefix, obj, arrays, values, handleNames=None):
+        """
+        Set the state of an object, from getObjectState().
+
+        parameters
+        ----------
+        prefix: string
+           Prefix for the array and value names
+        obj: object
+           Object to set
+        arrays: dict
+           Arrays, keyed by name
+        values: dict
+           Scalar values, keyed by name
+        handleNames: list of strings, optional
+           Names of the snmm handles (without 'Handle') to set.  If None,
+           all the numpy array attributes are set instead.  In both cases,
+           all the scalar attributes are set.
+        """
+
+        prefixDot = prefix + '.'
+
+        if handleNames is not None:
+            for name in handleNames:
+                if prefixDot + name in arrays:
+                    snmm.getArray(getattr(obj, name + 'Handle'))[:] = arrays[prefixDot + name]
+        else:
+            for fullName, array in arrays.items():
+                if not fullName.startswith(prefixDot):
+                    continue
+                name = fullName[len(prefixDot):]
+                current = getattr(obj, name, None)
+                # Copy in place where possible, in case the array is shared
+                if (isinstance(current, np.ndarray) and current.shape == array.shape and
+                        current.dtype == array.dtype):
+                    current[...] = array
+                else:
+                    setattr(obj, name, array)
+
+        for fullName, value in values.items():
+            if fullName.startswith(prefixDot):
+                setattr(obj, fullName[len(prefixDot):], value)
+
+    def __getstate__(self):
+        # Don't try to pickle the logger.
+
+        state = self.__dict__.copy()
+        del state['fgcmLog']
+        return state
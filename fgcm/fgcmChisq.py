@@ -2,6 +2,7 @@ from __future__ import division, absolute_import, print_function
 from builtins import range
 
 import numpy as np
+import scipy.sparse
 import os
 import sys
 import esutil
@@ -21,10 +22,8 @@ try:
 except ImportError:
     import copyreg
 
-import multiprocessing
-from multiprocessing import Pool
-
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmWorkerPool import FgcmWorkerPool
 
 copyreg.pickle(types.MethodType, _pickle_method)
 
@@ -44,6 +43,8 @@ class FgcmChisq(object):
        Stars object
     fgcmLUT: FgcmLUT
        LUT object
+    fgcmWorkerPool: FgcmWorkerPool, optional
+       Persistent worker pool.  If None, a pool is made for each call.
 
     Config variables
     ----------------
@@ -55,12 +56,29 @@ class FgcmChisq(object):
        If set to True, then no chromatic corrections are applied.  (bad idea).
     """
 
-    def __init__(self,fgcmConfig,fgcmPars,fgcmStars,fgcmLUT):
+    # These are the attributes that may change between calls, and are sent
+    #  to the persistent pool workers with each map.
+    _workerStateAttrs = ['computeDerivatives', 'computeNormalEquations',
+                         'computeSEDSlopes', 'fitterUnits',
+                         'allExposures', 'includeReserve',
+                         'ccdGrayHandle', 'ccdGraySubCCDParsHandle',
+                         'computeAbsThroughput', 'ignoreRef', 'debug', 'nSums',
+                         'applyDelta', 'deltaAbsOffset',
+                         'fgcmPars.expLnPwv', 'fgcmPars.expO3', 'fgcmPars.expLnTau',
+                         'fgcmPars.expAlpha', 'fgcmPars.expPmb', 'fgcmPars.expQESys',
+                         'fgcmPars.expFilterOffset', 'fgcmPars.expFlag',
+                         'fgcmPars.compRetrievedLnPwvFlag', 'fgcmPars.parQESysIntercept',
+                         'fgcmPars.parFilterOffsetFitFlag', 'fgcmPars.stepUnits']
+
+    def __init__(self,fgcmConfig,fgcmPars,fgcmStars,fgcmLUT,fgcmWorkerPool=None):
 
         self.fgcmLog = fgcmConfig.fgcmLog
 
         self.fgcmLog.debug('Initializing FgcmChisq')
 
+        # this may be None, in which case we make a pool for each call
+        self.fgcmWorkerPool = fgcmWorkerPool
+
         # does this need to be shm'd?
         self.fgcmPars = fgcmPars
 
@@ -87,8 +105,12 @@ class FgcmChisq(object):
 
         self.outfileBaseWithCycle = fgcmConfig.outfileBaseWithCycle
 
+        # Per-observation quantities are computed with this precision
+        #  (chisq, weight sums, and derivatives are always summed in float64)
+        self.obsDtype = np.dtype(fgcmConfig.obsPrecision)
+
         # these are the standard *band* I10s
-        self.I10StdBand = fgcmConfig.I10StdBand
+        self.I10StdBand = fgcmConfig.I10StdBand.astype(self.obsDtype)
 
         self.illegalValue = fgcmConfig.illegalValue
 
@@ -105,8 +127,34 @@ class FgcmChisq(object):
             self.fgcmLog.info('Default: fit %d parameters.' % (self.nActualFitPars))
 
         self.clearMatchCache()
+        self.matchCacheHits = 0
+        self.matchCacheMisses = 0
 
         self.maxIterations = -1
+        # Relative improvement of the best chisq below which the fit is
+        #  stopped (0 for no limit)
+        self.chisqTolerance = 0.0
+        self.computeNormalEquations = False
+
+        # Optional subsample of stars (and the fraction of the good stars
+        #  it represents) for coarse fit iterations
+        self.subsampleStars = None
+        self.subsampleFraction = 1.0
+
+        # Optional resource planner to refine nStarPerRun from the
+        #  measured memory and time of the workers
+        self.resourcePlanner = None
+
+        # Optional cluster of nodes to evaluate the fit chisq (coordinator),
+        #  or the shard of stars to evaluate (on a node), with a function
+        #  to combine the absolute offset sums across the nodes
+        self.cluster = None
+        self.shardStars = None
+        self.absOffsetReducer = None
+
+        # Compute the magnitudes and chisq in a single worker pass when
+        #  possible (False forces two passes, for comparison)
+        self.singlePass = True
 
         numba_test(0)
 
@@ -118,6 +166,19 @@ class FgcmChisq(object):
         self.fitChisqs = []
         self._nIterations = 0
 
+    def setFitChisqList(self, fitChisqs):
+        """
+        Set the recorded list of chi-squared values (when resuming a fit).
+
+        parameters
+        ----------
+        fitChisqs: list or array of floats
+           Chi-squared values of the fit so far
+        """
+
+        self.fitChisqs = [float(fitChisq) for fitChisq in fitChisqs]
+        self._nIterations = len(self.fitChisqs)
+
     @property
     def maxIterations(self):
         return self._maxIterations
@@ -128,40 +189,30 @@ class FgcmChisq(object):
 
     def clearMatchCache(self):
         """
-        Clear the pre-match cache.  Note that this isn't working right.
+        Clear the pre-match cache.  This is not necessary when flags have
+        changed, since the cache is invalidated on the flag generations.
         """
-        self.matchesCached = False
-        self.goodObs = None
-        self.goodStarsSub = None
+        self.matchCache = None
 
-    def __call__(self,fitParams,fitterUnits=False,computeDerivatives=False,computeSEDSlopes=False,useMatchCache=False,computeAbsThroughput=False,ignoreRef=False,debug=False,allExposures=False,includeReserve=False,fgcmGray=None):
+    def computePartialSums(self, fitParams, fitterUnits=False, computeDerivatives=False,
+                           computeSEDSlopes=False, useMatchCache=False, computeAbsThroughput=False,
+                           ignoreRef=False, debug=False, allExposures=False, includeReserve=False,
+                           fgcmGray=None, computeNormalEquations=False):
         """
-        Compute the chi-squared for a given set of parameters.
+        Compute the magnitudes and the partial sums of the chi-squared (chisq,
+        number of observations and derivatives, and the normal equations in
+        self.normalMatrix and self.normalVector if computeNormalEquations is
+        set) for a given set of parameters.  Only the stars in shardStars are
+        used if set.  The fit chisq is evaluated on the cluster if set.
 
         parameters
         ----------
-        fitParams: numpy array of floats
-           Array with the numerical values of the parameters (properly formatted).
-        fitterUnits: bool, default=False
-           Are the units of fitParams normalized for the minimizer?
-        computeDerivatives: bool, default=False
-           Compute fit derivatives?
-        computeSEDSlopes: bool, default=False
-           Compute SED slopes from magnitudes?
-        useMatchCache: bool, default=False
-           Cache observation matches.  Do not use!
-        computeAbsThroughputt: `bool`, default=False
-           Compute the absolute throughput after computing mean mags
-        ignoreRef: `bool`, default=False
-           Ignore reference stars for computation...
-        debug: bool, default=False
-           Debug mode with no multiprocessing
-        allExposures: bool, default=False
-           Compute using all exposures, including flagged/non-photometric
-        includeReserve: bool, default=False
-           Compute using all objects, including those put in reserve.
-        fgcmGray: FgcmGray, default=None
-           CCD Gray information for computing with "ccd crunch"
+        See __call__.
+
+        returns
+        -------
+        partialSums: float array
+           Partial sums of the chi-squared
         """
 
         # computeDerivatives: do we want to compute the derivatives?
@@ -169,12 +220,21 @@ class FgcmChisq(object):
         # fitterUnits: units of th fitter or "true" units?
 
         self.computeDerivatives = computeDerivatives
+        self.computeNormalEquations = computeNormalEquations
         self.computeSEDSlopes = computeSEDSlopes
         self.fitterUnits = fitterUnits
         self.allExposures = allExposures
         self.useMatchCache = useMatchCache
         self.includeReserve = includeReserve
         self.fgcmGray = fgcmGray    # may be None
+        # The workers only read the CCD gray arrays, which are in shared
+        #  memory, so only their handles are sent to the pool
+        self.ccdGrayHandle = None
+        self.ccdGraySubCCDParsHandle = None
+        if fgcmGray is not None:
+            self.ccdGrayHandle = fgcmGray.ccdGrayHandle
+            if self.ccdGraySubCCD:
+                self.ccdGraySubCCDParsHandle = fgcmGray.ccdGraySubCCDParsHandle
         self.computeAbsThroughput = computeAbsThroughput
         self.ignoreRef = ignoreRef
 
@@ -189,12 +249,13 @@ class FgcmChisq(object):
         self.fgcmLog.debug('FgcmChisq: includeReserve = %d' %
                          (int(includeReserve)))
 
-        startTime = time.time()
-
         if (self.allExposures and (self.computeDerivatives or
                                    self.computeSEDSlopes)):
             raise ValueError("Cannot set allExposures and computeDerivatives or computeSEDSlopes")
 
+        if (self.computeNormalEquations and not self.computeDerivatives):
+            raise ValueError("Cannot set computeNormalEquations without computeDerivatives")
+
         # When we're doing the fitting, we want to fill in the missing qe sys values if needed
         self.fgcmPars.reloadParArray(fitParams, fitterUnits=self.fitterUnits)
         self.fgcmPars.parsToExposures()
@@ -259,39 +320,77 @@ class FgcmChisq(object):
 
         #############
 
+        # The fit chisq can be evaluated by the cluster nodes, each with a
+        #  shard of the stars
+        if (self.cluster is not None and self.computeDerivatives and
+                not self.allExposures and self.fgcmGray is None):
+            self.debug = debug
+            self.poolStartupTime = 0.0
+            self.applyDelta = False
+            self.deltaAbsOffset = None
+
+            options = {'fitterUnits': fitterUnits,
+                       'computeDerivatives': computeDerivatives,
+                       'computeSEDSlopes': computeSEDSlopes,
+                       'computeAbsThroughput': computeAbsThroughput,
+                       'ignoreRef': ignoreRef,
+                       'includeReserve': includeReserve,
+                       'computeNormalEquations': computeNormalEquations}
+            partialSums, deltaAbsOffset, normalEquations = self.cluster.computePartialSums(self, fitParams,
+                                                                                          options)
+
+            if deltaAbsOffset is not None:
+                self.applyDelta = True
+                self.deltaAbsOffset = deltaAbsOffset
+                self.fgcmPars.compAbsThroughput *= 10.**(-self.deltaAbsOffset / 2.5)
+            if self.computeNormalEquations:
+                self.normalMatrix, self.normalVector = normalEquations
+
+            return partialSums
+
         # and reset numbers if necessary
         if (not self.allExposures):
             snmm.getArray(self.fgcmStars.objMagStdMeanHandle)[:] = 99.0
             snmm.getArray(self.fgcmStars.objMagStdMeanNoChromHandle)[:] = 99.0
             snmm.getArray(self.fgcmStars.objMagStdMeanErrHandle)[:] = 99.0
 
-        goodStars = self.fgcmStars.getGoodStarIndices(includeReserve=self.includeReserve)
+        # The good stars and observations (and the split for the workers)
+        #  only change when the flags change, so they are cached on the
+        #  flag generations (which are checked against the flags in debug mode).
+        matchKey = (self.includeReserve, self.allExposures,
+                    self.fgcmStars.getFlagGenerations(check=debug),
+                    None if self.allExposures else self.fgcmPars.getExpFlagGeneration(check=debug))
+
+        if (self.matchCache is not None and self.matchCache['key'] == matchKey and
+                self.matchCache['subsampleStars'] is self.subsampleStars and
+                self.matchCache['shardStars'] is self.shardStars):
+            self.matchCacheHits += 1
+            self.fgcmLog.debug('Retrieving cached matches (%d hits, %d misses)' %
+                               (self.matchCacheHits, self.matchCacheMisses))
+        else:
+            self.matchCacheMisses += 1
 
-        if self._nIterations == 0:
-            self.fgcmLog.info('Found %d good stars for chisq' % (goodStars.size))
+            # we need to do matching
+            preStartTime=time.time()
+            self.fgcmLog.debug('Pre-matching stars and observations (%d hits, %d misses)...' %
+                               (self.matchCacheHits, self.matchCacheMisses))
 
-        if (goodStars.size == 0):
-            raise RuntimeError("No good stars to fit!")
+            goodStars = self.fgcmStars.getGoodStarIndices(includeReserve=self.includeReserve)
 
-        if self.fgcmStars.hasRefstars:
-            objRefIDIndex = snmm.getArray(self.fgcmStars.objRefIDIndexHandle)
+            if self._nIterations == 0:
+                self.fgcmLog.info('Found %d good stars for chisq' % (goodStars.size))
 
-        # do global pre-matching before giving to workers, because
-        #  it is faster this way
+            if self.shardStars is not None:
+                goodStars = np.intersect1d(goodStars, self.shardStars, assume_unique=True)
 
-        obsExpIndex = snmm.getArray(self.fgcmStars.obsExpIndexHandle)
-        obsFlag = snmm.getArray(self.fgcmStars.obsFlagHandle)
+            if self.subsampleStars is not None:
+                goodStars = np.intersect1d(goodStars, self.subsampleStars, assume_unique=True)
 
-        if (self.useMatchCache and self.matchesCached) :
-            # we have already done the matching
-            self.fgcmLog.debug('Retrieving cached matches')
-            goodObs = self.goodObs
-            goodStarsSub = self.goodStarsSub
-        else:
-            # we need to do matching
-            preStartTime=time.time()
-            self.fgcmLog.debug('Pre-matching stars and observations...')
+            if (goodStars.size == 0):
+                raise RuntimeError("No good stars to fit!")
 
+            # do global pre-matching before giving to workers, because
+            #  it is faster this way
             if not self.allExposures:
                 expFlag = self.fgcmPars.expFlag
             else:
@@ -302,11 +401,17 @@ class FgcmChisq(object):
             self.fgcmLog.debug('Pre-matching done in %.1f sec.' %
                                (time.time() - preStartTime))
 
-            if (self.useMatchCache) :
-                self.fgcmLog.debug('Caching matches for next iteration')
-                self.matchesCached = True
-                self.goodObs = goodObs
-                self.goodStarsSub = goodStarsSub
+            self.matchCache = {'key': matchKey,
+                               'subsampleStars': self.subsampleStars,
+                               'shardStars': self.shardStars,
+                               'goodStars': goodStars,
+                               'goodStarsSub': goodStarsSub,
+                               'goodObs': goodObs,
+                               'workerList': None}
+
+        goodStars = self.matchCache['goodStars']
+        goodStarsSub = self.matchCache['goodStarsSub']
+        goodObs = self.matchCache['goodObs']
 
         self.nSums = 4 # chisq, chisq_ref, nobs, nobs_ref
         if self.computeDerivatives:
@@ -317,90 +422,178 @@ class FgcmChisq(object):
             self.nSums += 4 * self.fgcmPars.nFitPars
 
         self.applyDelta = False
+        self.deltaAbsOffset = None
 
-        self.debug = debug
-        if (self.debug):
-            # debug mode: single core
-            self.totalHandleDict = {}
-            self.totalHandleDict[0] = snmm.createArray(self.nSums,dtype='f8')
+        partialSums = np.zeros(self.nSums,dtype='f8')
+        if self.computeNormalEquations:
+            self.normalMatrix = scipy.sparse.csr_matrix((self.fgcmPars.nFitPars,
+                                                         self.fgcmPars.nFitPars))
+            self.normalVector = np.zeros(self.fgcmPars.nFitPars)
 
-            self._magWorker((goodStars, goodObs))
+        # Unless the absolute offset must be computed from all the mean
+        #  magnitudes first, the magnitudes and chisq are computed in a
+        #  single pass.
+        fusedPass = (self.singlePass and not self.computeAbsThroughput and
+                     not self.allExposures)
 
-            if self.computeAbsThroughput:
-                self.applyDelta = True
-                self.deltaAbsOffset = self.fgcmStars.computeAbsOffset()
-                self.fgcmPars.compAbsThroughput *= 10.**(-self.deltaAbsOffset / 2.5)
+        self.debug = debug
+        self.poolStartupTime = 0.0
 
-            if not self.allExposures:
-                self._chisqWorker((goodStars, goodObs))
+        # split goodStars into chunks of roughly equal cost
 
-            partialSums = snmm.getArray(self.totalHandleDict[0])[:]
+        if self.fgcmGray is not None and self.ccdGraySubCCD:
+            chunkStage = 'chisqSubCCD'
         else:
-            # regular multi-core
-
-            # make a dummy process to discover starting child number
-            proc = multiprocessing.Process()
-            workerIndex = proc._identity[0]+1
-            proc = None
-
-            self.totalHandleDict = {}
-            for thisCore in range(self.nCore):
-                self.totalHandleDict[workerIndex + thisCore] = (
-                    snmm.createArray(self.nSums,dtype='f8'))
-
-            # split goodStars into a list of arrays of roughly equal size
+            chunkStage = 'chisq'
 
+        if self.matchCache['workerList'] is None:
             prepStartTime = time.time()
             nSections = goodStars.size // self.nStarPerRun + 1
-            goodStarsList = np.array_split(goodStars,nSections)
+            workerList = self.fgcmStars.splitGoodObsIndices(goodStars, goodStarsSub,
+                                                            goodObs, nSections,
+                                                            nCore=self.nCore,
+                                                            stage=chunkStage)
 
-            # is there a better way of getting all the first elements from the list?
-            #  note that we need to skip the first which should be zero (checked above)
-            #  see also fgcmBrightObs.py
-            # splitValues is the first of the goodStars in each list
-            splitValues = np.zeros(nSections-1,dtype='i4')
-            for i in range(1,nSections):
-                splitValues[i-1] = goodStarsList[i][0]
+            self.matchCache['workerList'] = workerList
 
-            # get the indices from the goodStarsSub matched list (matched to goodStars)
-            splitIndices = np.searchsorted(goodStars[goodStarsSub], splitValues)
+            self.fgcmLog.debug('Using %d chunks for %d sections (%.1f seconds)' %
+                               (len(workerList), nSections, time.time()-prepStartTime))
 
-            # and split along the indices
-            goodObsList = np.split(goodObs,splitIndices)
+        workerList = self.matchCache['workerList']
 
-            workerList = list(zip(goodStarsList,goodObsList))
+        if (self.debug):
+            # debug mode: single core, running the same chunks in the same
+            #  order as the pool so the sums are identical
+            if fusedPass:
+                for goodStarsAndObs in workerList:
+                    self._addPartialSums(partialSums, self._magAndChisqWorker(goodStarsAndObs))
+            else:
+                for goodStarsAndObs in workerList:
+                    self._magWorker(goodStarsAndObs)
 
-            # reverse sort so the longest running go first
-            workerList.sort(key=lambda elt:elt[1].size, reverse=True)
+                if self.computeAbsThroughput:
+                    self.applyDelta = True
+                    self.deltaAbsOffset = self._computeAbsOffset()
+                    self.fgcmPars.compAbsThroughput *= 10.**(-self.deltaAbsOffset / 2.5)
 
-            self.fgcmLog.debug('Using %d sections (%.1f seconds)' %
-                               (nSections,time.time()-prepStartTime))
+                if not self.allExposures:
+                    for goodStarsAndObs in workerList:
+                        self._addPartialSums(partialSums, self._chisqWorker(goodStarsAndObs))
+        else:
+            # regular multi-core
 
             self.fgcmLog.debug('Running chisq on %d cores' % (self.nCore))
 
-            # make a pool
-            pool = Pool(processes=self.nCore)
-            # Compute magnitudes
-            pool.map(self._magWorker, workerList, chunksize=1)
+            # use the persistent pool if we have one
+            if self.fgcmWorkerPool is not None:
+                pool = self.fgcmWorkerPool
+            else:
+                pool = FgcmWorkerPool(self.nCore, self.fgcmLog)
 
-            # And compute absolute offset if desired...
-            if self.computeAbsThroughput:
-                self.applyDelta = True
-                self.deltaAbsOffset = self.fgcmStars.computeAbsOffset()
-                self.fgcmPars.compAbsThroughput *= 10.**(-self.deltaAbsOffset / 2.5)
+            poolStartupTime = pool.startupTime
 
-            # And the follow-up chisq and derivatives
-            if not self.allExposures:
-                pool.map(self._chisqWorker, workerList, chunksize=1)
+            # Trace the worker memory for the resource planner
+            traceMemory = (self.resourcePlanner is not None and
+                           self.resourcePlanner.needsRefine and
+                           self.computeDerivatives)
 
-            pool.close()
-            pool.join()
+            if fusedPass:
+                # Compute magnitudes, chisq and derivatives together
+                partialArrays = pool.map(self, '_magAndChisqWorker', workerList,
+                                         stateAttrs=self._workerStateAttrs,
+                                         traceMemory=traceMemory)
+                taskTimes = pool.lastTaskTimes
+            else:
+                # Compute magnitudes
+                pool.map(self, '_magWorker', workerList,
+                         stateAttrs=self._workerStateAttrs)
+                taskTimes = pool.lastTaskTimes
+
+                # And compute absolute offset if desired...
+                if self.computeAbsThroughput:
+                    self.applyDelta = True
+                    self.deltaAbsOffset = self._computeAbsOffset()
+                    self.fgcmPars.compAbsThroughput *= 10.**(-self.deltaAbsOffset / 2.5)
+
+                # And the follow-up chisq and derivatives
+                partialArrays = []
+                if not self.allExposures:
+                    partialArrays = pool.map(self, '_chisqWorker', workerList,
+                                             stateAttrs=self._workerStateAttrs,
+                                             traceMemory=traceMemory)
+                    taskTimes = np.add(taskTimes, pool.lastTaskTimes)
+
+            # Replan the chunks on the next call if the timing shows the
+            #  cost model was off
+            if self.fgcmStars.chunkPlanner.recordTiming(chunkStage, workerList, taskTimes):
+                self.matchCache['workerList'] = None
+
+            # Refine the chunk size from the first fit iterations
+            if traceMemory:
+                if self.resourcePlanner.refine(workerList, taskTimes,
+                                               pool.lastTaskTracedMemory,
+                                               pool.lastTaskPeakRss):
+                    self.nStarPerRun = self.resourcePlanner.nStarPerRun
+                    self.matchCache['workerList'] = None
 
             # sum up the partial sums from the different jobs
-            partialSums = np.zeros(self.nSums,dtype='f8')
-            for thisCore in range(self.nCore):
-                partialSums[:] += snmm.getArray(
-                    self.totalHandleDict[workerIndex + thisCore])[:]
+            for partialArray in partialArrays:
+                self._addPartialSums(partialSums, partialArray)
+
+            self.poolStartupTime = pool.startupTime - poolStartupTime
+
+            if self.fgcmWorkerPool is None:
+                pool.close()
+
+        return partialSums
+
+    def __call__(self,fitParams,fitterUnits=False,computeDerivatives=False,computeSEDSlopes=False,useMatchCache=False,computeAbsThroughput=False,ignoreRef=False,debug=False,allExposures=False,includeReserve=False,fgcmGray=None,computeNormalEquations=False):
+        """
+        Compute the chi-squared for a given set of parameters.
+
+        parameters
+        ----------
+        fitParams: numpy array of floats
+           Array with the numerical values of the parameters (properly formatted).
+        fitterUnits: bool, default=False
+           Are the units of fitParams normalized for the minimizer?
+        computeDerivatives: bool, default=False
+           Compute fit derivatives?
+        computeSEDSlopes: bool, default=False
+           Compute SED slopes from magnitudes?
+        useMatchCache: bool, default=False
+           Deprecated and ignored: observation matches are always cached
+           until the star, observation or exposure flags change.
+        computeAbsThroughputt: `bool`, default=False
+           Compute the absolute throughput after computing mean mags
+        ignoreRef: `bool`, default=False
+           Ignore reference stars for computation...
+        debug: bool, default=False
+           Debug mode with no multiprocessing
+        allExposures: bool, default=False
+           Compute using all exposures, including flagged/non-photometric
+        includeReserve: bool, default=False
+           Compute using all objects, including those put in reserve.
+        fgcmGray: FgcmGray, default=None
+           CCD Gray information for computing with "ccd crunch"
+        computeNormalEquations: bool, default=False
+           Also compute the Gauss-Newton normal equations (J^T W J and J^T W r,
+           per degree of freedom) in self.normalMatrix and self.normalVector.
+           Requires computeDerivatives.
+        """
+
+        startTime = time.time()
+
+        partialSums = self.computePartialSums(fitParams, fitterUnits=fitterUnits,
+                                              computeDerivatives=computeDerivatives,
+                                              computeSEDSlopes=computeSEDSlopes,
+                                              useMatchCache=useMatchCache,
+                                              computeAbsThroughput=computeAbsThroughput,
+                                              ignoreRef=ignoreRef, debug=debug,
+                                              allExposures=allExposures,
+                                              includeReserve=includeReserve,
+                                              fgcmGray=fgcmGray,
+                                              computeNormalEquations=computeNormalEquations)
 
         if (not self.allExposures):
             # we get the number of fit parameters by counting which of the parameters
@@ -417,12 +610,19 @@ class FgcmChisq(object):
                 if self._nIterations == 0:
                     self.fgcmLog.info('Actually fit %d parameters.' % (self.nActualFitPars))
 
-            fitDOF = partialSums[-3] + partialSums[-1] - float(self.nActualFitPars)
+            # With a subsample of stars, the parameters are scaled to the
+            #  fraction of the constraints used, so the chisq/DOF is an
+            #  estimate of the full value.
+            fitDOF = (partialSums[-3] + partialSums[-1] -
+                      float(self.nActualFitPars) * self.subsampleFraction)
 
             if (fitDOF <= 0):
                 raise ValueError("Number of parameters fitted is more than number of constraints! (%d > %d)" % (self.fgcmPars.nFitPars,partialSums[-1]))
 
             fitChisq = (partialSums[-4] + partialSums[-2]) / fitDOF
+            if self.computeNormalEquations:
+                self.normalMatrix = self.normalMatrix / fitDOF
+                self.normalVector /= fitDOF
             if self.computeDerivatives:
                 dChisqdP = (partialSums[0:self.fgcmPars.nFitPars] +
                             partialSums[2*self.fgcmPars.nFitPars: 3*self.fgcmPars.nFitPars]) / fitDOF
@@ -481,19 +681,26 @@ class FgcmChisq(object):
                 self.fgcmLog.info('Ran over maximum number of iterations.')
                 raise MaxFitIterations
 
+            if self.chisqTolerance > 0.0 and len(self.fitChisqs) > 1:
+                previousBest = np.min(np.array(self.fitChisqs[: -1]))
+                if (fitChisq < previousBest and
+                        (previousBest - fitChisq) / previousBest < self.chisqTolerance):
+                    self.fgcmLog.info('Relative chisq improvement below tolerance.')
+                    raise MaxFitIterations
+
         else:
             try:
                 fitChisq = self.fitChisqs[-1]
             except IndexError:
                 fitChisq = 0.0
 
-        # free shared arrays
-        for key in self.totalHandleDict.keys():
-            snmm.freeArray(self.totalHandleDict[key])
-
         if not self.quietMode:
-            self.fgcmLog.info('Chisq computation took %.2f seconds.' %
-                              (time.time() - startTime))
+            if self.debug:
+                self.fgcmLog.info('Chisq computation took %.2f seconds.' %
+                                  (time.time() - startTime))
+            else:
+                self.fgcmLog.info('Chisq computation took %.2f seconds (%.2f s pool startup).' %
+                                  (time.time() - startTime, self.poolStartupTime))
 
         self.fgcmStars.magStdComputed = True
         if (self.allExposures):
@@ -504,7 +711,83 @@ class FgcmChisq(object):
         else:
             return fitChisq
 
-    def _magWorker(self, goodStarsAndObs):
+    def _magAndChisqWorker(self, goodStarsAndObs):
+        """
+        Multiprocessing worker to compute standard/mean magnitudes and then
+        chisq and derivatives for FgcmChisq in a single task, sharing the LUT
+        lookups.  Each chunk has a disjoint set of stars, so the chisq of a
+        chunk only depends on the mean magnitudes of that chunk.
+        Not to be called on its own.
+
+        Parameters
+        ----------
+        goodStarsAndObs: tuple[2]
+           (goodStars, goodObs)
+        """
+
+        goodObs = goodStarsAndObs[1]
+
+        obsExpIndex = snmm.getArray(self.fgcmStars.obsExpIndexHandle)
+        obsLUTFilterIndex = snmm.getArray(self.fgcmStars.obsLUTFilterIndexHandle)
+        obsCCD = snmm.getArray(self.fgcmStars.obsCCDHandle)
+        obsSecZenith = snmm.getArray(self.fgcmStars.obsSecZenithHandle)
+
+        # Only the rows of this chunk are taken from the full obsCCD column
+        obsCCDIndexGO = esutil.numpy_util.to_native(obsCCD[goodObs]) - self.ccdStartIndex
+
+        lutTermsGO = self._computeLUTTermsGO(esutil.numpy_util.to_native(obsLUTFilterIndex[goodObs]),
+                                             esutil.numpy_util.to_native(obsExpIndex[goodObs]),
+                                             obsSecZenith[goodObs],
+                                             obsCCDIndexGO)
+
+        self._magWorker(goodStarsAndObs, lutTermsGO=lutTermsGO, obsCCDIndexGO=obsCCDIndexGO)
+
+        return self._chisqWorker(goodStarsAndObs, lutTermsGO=lutTermsGO,
+                                 obsCCDIndexGO=obsCCDIndexGO)
+
+    def _computeLUTTermsGO(self, obsLUTFilterIndexGO, obsExpIndexGO, obsSecZenithGO, obsCCDIndexGO):
+        """
+        Compute the LUT indices and integrals for a set of observations.
+        Not to be called on its own.
+
+        Parameters
+        ----------
+        obsLUTFilterIndexGO: int array
+           LUT filter index of the observations
+        obsExpIndexGO: int array
+           Exposure index of the observations
+        obsSecZenithGO: float array
+           Secant of the zenith angle of the observations
+        obsCCDIndexGO: int array
+           CCD index of the observations
+
+        Returns
+        -------
+        lutTermsGO: tuple[3]
+           (lutIndicesGO, I0GO, I10GO)
+        """
+
+        lutIndicesGO = self.fgcmLUT.getIndices(obsLUTFilterIndexGO,
+                                               self.fgcmPars.expLnPwv[obsExpIndexGO],
+                                               self.fgcmPars.expO3[obsExpIndexGO],
+                                               self.fgcmPars.expLnTau[obsExpIndexGO],
+                                               self.fgcmPars.expAlpha[obsExpIndexGO],
+                                               obsSecZenithGO,
+                                               obsCCDIndexGO,
+                                               self.fgcmPars.expPmb[obsExpIndexGO],
+                                               flat=True)
+        I0GO, _, I10GO = self.fgcmLUT.computeI0I1(self.fgcmPars.expLnPwv[obsExpIndexGO],
+                                                  self.fgcmPars.expO3[obsExpIndexGO],
+                                                  self.fgcmPars.expLnTau[obsExpIndexGO],
+                                                  self.fgcmPars.expAlpha[obsExpIndexGO],
+                                                  obsSecZenithGO,
+                                                  self.fgcmPars.expPmb[obsExpIndexGO],
+                                                  lutIndicesGO)
+
+        return (lutIndicesGO, I0GO.astype(self.obsDtype, copy=False),
+                I10GO.astype(self.obsDtype, copy=False))
+
+    def _magWorker(self, goodStarsAndObs, lutTermsGO=None, obsCCDIndexGO=None):
         """
         Multiprocessing worker to compute standard/mean magnitudes for FgcmChisq.
         Not to be called on its own.
@@ -513,6 +796,10 @@ class FgcmChisq(object):
         ----------
         goodStarsAndObs: tuple[2]
            (goodStars, goodObs)
+        lutTermsGO: tuple[3], optional
+           Precomputed (lutIndicesGO, I0GO, I10GO) for goodObs
+        obsCCDIndexGO: int array, optional
+           Precomputed CCD index for goodObs
         """
 
         goodStars = goodStarsAndObs[0]
@@ -528,7 +815,7 @@ class FgcmChisq(object):
         obsExpIndex = snmm.getArray(self.fgcmStars.obsExpIndexHandle)
         obsBandIndex = snmm.getArray(self.fgcmStars.obsBandIndexHandle)
         obsLUTFilterIndex = snmm.getArray(self.fgcmStars.obsLUTFilterIndexHandle)
-        obsCCDIndex = snmm.getArray(self.fgcmStars.obsCCDHandle) - self.ccdStartIndex
+        obsCCD = snmm.getArray(self.fgcmStars.obsCCDHandle)
         obsFlag = snmm.getArray(self.fgcmStars.obsFlagHandle)
         obsSecZenith = snmm.getArray(self.fgcmStars.obsSecZenithHandle)
         obsMagADU = snmm.getArray(self.fgcmStars.obsMagADUHandle)
@@ -536,63 +823,48 @@ class FgcmChisq(object):
         obsMagStd = snmm.getArray(self.fgcmStars.obsMagStdHandle)
 
         # and fgcmGray stuff (if desired)
-        if (self.fgcmGray is not None):
-            ccdGray = snmm.getArray(self.fgcmGray.ccdGrayHandle)
+        if (self.ccdGrayHandle is not None):
+            ccdGray = snmm.getArray(self.ccdGrayHandle)
             # this is ccdGray[expIndex, ccdIndex]
             # and we only apply when > self.illegalValue
             # same sign as FGCM_DUST (QESys)
             if self.ccdGraySubCCD:
-                ccdGraySubCCDPars = snmm.getArray(self.fgcmGray.ccdGraySubCCDParsHandle)
-
-        # and the arrays for locking access
-        objMagStdMeanLock = snmm.getArrayBase(self.fgcmStars.objMagStdMeanHandle).get_lock()
-        obsMagStdLock = snmm.getArrayBase(self.fgcmStars.obsMagStdHandle).get_lock()
+                ccdGraySubCCDPars = snmm.getArray(self.ccdGraySubCCDParsHandle)
 
         # cut these down now, faster later
         obsObjIDIndexGO = esutil.numpy_util.to_native(obsObjIDIndex[goodObs])
         obsBandIndexGO = esutil.numpy_util.to_native(obsBandIndex[goodObs])
         obsLUTFilterIndexGO = esutil.numpy_util.to_native(obsLUTFilterIndex[goodObs])
         obsExpIndexGO = esutil.numpy_util.to_native(obsExpIndex[goodObs])
-        obsCCDIndexGO = esutil.numpy_util.to_native(obsCCDIndex[goodObs])
+        if obsCCDIndexGO is None:
+            obsCCDIndexGO = esutil.numpy_util.to_native(obsCCD[goodObs]) - self.ccdStartIndex
 
         obsSecZenithGO = obsSecZenith[goodObs]
 
+        # compact local star index for accumulating the mean magnitudes,
+        #  where uStarsGO[obsLocalIndexGO] == obsObjIDIndexGO
+        uStarsGO, obsLocalIndexGO = np.unique(obsObjIDIndexGO, return_inverse=True)
+        nBands = objMagStdMean.shape[1]
+
         # which observations are actually used in the fit?
 
         # now refer to obsBandIndex[goodObs]
         # add GO to index names that are cut to goodObs
         # add GOF to index names that are cut to goodObs[obsFitUseGO]
 
-        lutIndicesGO = self.fgcmLUT.getIndices(obsLUTFilterIndexGO,
-                                               self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                               self.fgcmPars.expO3[obsExpIndexGO],
-                                               self.fgcmPars.expLnTau[obsExpIndexGO],
-                                               self.fgcmPars.expAlpha[obsExpIndexGO],
-                                               obsSecZenithGO,
-                                               obsCCDIndexGO,
-                                               self.fgcmPars.expPmb[obsExpIndexGO])
-        I0GO = self.fgcmLUT.computeI0(self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                      self.fgcmPars.expO3[obsExpIndexGO],
-                                      self.fgcmPars.expLnTau[obsExpIndexGO],
-                                      self.fgcmPars.expAlpha[obsExpIndexGO],
-                                      obsSecZenithGO,
-                                      self.fgcmPars.expPmb[obsExpIndexGO],
-                                      lutIndicesGO)
-        I10GO = self.fgcmLUT.computeI1(self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                       self.fgcmPars.expO3[obsExpIndexGO],
-                                       self.fgcmPars.expLnTau[obsExpIndexGO],
-                                       self.fgcmPars.expAlpha[obsExpIndexGO],
-                                       obsSecZenithGO,
-                                       self.fgcmPars.expPmb[obsExpIndexGO],
-                                       lutIndicesGO) / I0GO
-
-
-        qeSysGO = self.fgcmPars.expQESys[obsExpIndexGO]
-        filterOffsetGO = self.fgcmPars.expFilterOffset[obsExpIndexGO]
+        if lutTermsGO is None:
+            lutTermsGO = self._computeLUTTermsGO(obsLUTFilterIndexGO, obsExpIndexGO,
+                                                 obsSecZenithGO, obsCCDIndexGO)
+        lutIndicesGO, I0GO, I10GO = lutTermsGO
+
+
+        qeSysGO = self.fgcmPars.expQESys[obsExpIndexGO].astype(self.obsDtype, copy=False)
+        filterOffsetGO = self.fgcmPars.expFilterOffset[obsExpIndexGO].astype(self.obsDtype,
+                                                                             copy=False)
 
         obsMagGO = obsMagADU[goodObs] + 2.5*np.log10(I0GO) + qeSysGO + filterOffsetGO
 
-        if (self.fgcmGray is not None):
+        if (self.ccdGrayHandle is not None):
             # We want to apply the "CCD Gray Crunch"
             # make sure we aren't adding something crazy, but this shouldn't happen
             # because we're filtering good observations (I hope!)
@@ -624,29 +896,24 @@ class FgcmChisq(object):
         if (self.computeSEDSlopes):
             # first, compute mean mags (code same as below.  FIXME: consolidate, but how?)
 
-            # make temp vars.  With memory overhead
+            # make temp vars, on the local index space
 
-            wtSum = np.zeros_like(objMagStdMean,dtype='f8')
-            objMagStdMeanTemp = np.zeros_like(objMagStdMean)
+            wtSum = np.zeros((uStarsGO.size, nBands), dtype='f8')
+            objMagStdMeanTemp = np.zeros((uStarsGO.size, nBands), dtype='f8')
 
             add_at_2d(wtSum,
-                   (obsObjIDIndexGO,obsBandIndexGO),
+                   (obsLocalIndexGO,obsBandIndexGO),
                    1./obsMagErr2GO)
             add_at_2d(objMagStdMeanTemp,
-                   (obsObjIDIndexGO,obsBandIndexGO),
+                   (obsLocalIndexGO,obsBandIndexGO),
                    obsMagGO/obsMagErr2GO)
 
             # these are good object/bands that were observed
-            gd=np.where(wtSum > 0.0)
+            gdLocal = np.where(wtSum > 0.0)
+            gd = (uStarsGO[gdLocal[0]], gdLocal[1])
 
-            # and acquire lock to save the values
-            objMagStdMeanLock.acquire()
-
-            objMagStdMean[gd] = objMagStdMeanTemp[gd] / wtSum[gd]
-            objMagStdMeanErr[gd] = np.sqrt(1./wtSum[gd])
-
-            # and release the lock.
-            objMagStdMeanLock.release()
+            objMagStdMean[gd] = objMagStdMeanTemp[gdLocal] / wtSum[gdLocal]
+            objMagStdMeanErr[gd] = np.sqrt(1./wtSum[gdLocal])
 
             if (self.useSedLUT):
                 self.fgcmStars.computeObjectSEDSlopesLUT(goodStars,self.fgcmLUT)
@@ -666,18 +933,13 @@ class FgcmChisq(object):
             deltaStdGO *= 0.0
 
         # we can only do this for calibration stars.
-        #  must reference the full array to save
-
-        # acquire lock when we write to and retrieve from full array
-        obsMagStdLock.acquire()
+        #  must reference the full array to save.  This chunk owns goodObs
+        #  (and goodStars), so no lock is needed.
 
         obsMagStd[goodObs] = obsMagGO + deltaStdGO
         # this is cut here
         obsMagStdGO = obsMagStd[goodObs]
 
-        # we now have a local cut copy, so release
-        obsMagStdLock.release()
-
         # kick out if we're just computing magstd for all exposures
         if (self.allExposures) :
             # kick out
@@ -685,44 +947,37 @@ class FgcmChisq(object):
 
         # compute mean mags
 
-        # we make temporary variables.  These are less than ideal because they
-        #  take up the full memory footprint.  MAYBE look at making a smaller
-        #  array just for the stars under consideration, but this would make the
-        #  indexing in the np.add.at() more difficult
+        # we make temporary variables on the local index space, so they
+        #  only take up the memory for the stars under consideration.
 
-        wtSum = np.zeros_like(objMagStdMean,dtype='f8')
-        objMagStdMeanTemp = np.zeros_like(objMagStdMean)
-        objMagStdMeanNoChromTemp = np.zeros_like(objMagStdMeanNoChrom)
+        wtSum = np.zeros((uStarsGO.size, nBands), dtype='f8')
+        objMagStdMeanTemp = np.zeros((uStarsGO.size, nBands), dtype='f8')
+        objMagStdMeanNoChromTemp = np.zeros((uStarsGO.size, nBands), dtype='f8')
 
         add_at_2d(wtSum,
-               (obsObjIDIndexGO,obsBandIndexGO),
+               (obsLocalIndexGO,obsBandIndexGO),
                1./obsMagErr2GO)
 
         add_at_2d(objMagStdMeanTemp,
-               (obsObjIDIndexGO,obsBandIndexGO),
+               (obsLocalIndexGO,obsBandIndexGO),
                obsMagStdGO/obsMagErr2GO)
 
         # And the same thing with the non-chromatic corrected values
         add_at_2d(objMagStdMeanNoChromTemp,
-               (obsObjIDIndexGO,obsBandIndexGO),
+               (obsLocalIndexGO,obsBandIndexGO),
                obsMagGO/obsMagErr2GO)
 
         # which objects/bands have observations?
-        gd=np.where(wtSum > 0.0)
+        gdLocal = np.where(wtSum > 0.0)
+        gd = (uStarsGO[gdLocal[0]], gdLocal[1])
 
-        # and acquire lock to save the values
-        objMagStdMeanLock.acquire()
-
-        objMagStdMean[gd] = objMagStdMeanTemp[gd] / wtSum[gd]
-        objMagStdMeanNoChrom[gd] = objMagStdMeanNoChromTemp[gd] / wtSum[gd]
-        objMagStdMeanErr[gd] = np.sqrt(1./wtSum[gd])
-
-        # and release the lock.
-        objMagStdMeanLock.release()
+        objMagStdMean[gd] = objMagStdMeanTemp[gdLocal] / wtSum[gdLocal]
+        objMagStdMeanNoChrom[gd] = objMagStdMeanNoChromTemp[gdLocal] / wtSum[gdLocal]
+        objMagStdMeanErr[gd] = np.sqrt(1./wtSum[gdLocal])
 
         # this is the end of the _magWorker
 
-    def _chisqWorker(self, goodStarsAndObs):
+    def _chisqWorker(self, goodStarsAndObs, lutTermsGO=None, obsCCDIndexGO=None):
         """
         Multiprocessing worker to compute chisq and derivatives for FgcmChisq.
         Not to be called on its own.
@@ -731,6 +986,10 @@ class FgcmChisq(object):
         ----------
         goodStarsAndObs: tuple[2]
            (goodStars, goodObs)
+        lutTermsGO: tuple[3], optional
+           Precomputed (lutIndicesGO, I0GO, I10GO) for goodObs
+        obsCCDIndexGO: int array, optional
+           Precomputed CCD index for goodObs
         """
 
         # kick out if we're just computing magstd for all exposures
@@ -741,11 +1000,6 @@ class FgcmChisq(object):
         goodStars = goodStarsAndObs[0]
         goodObs = goodStarsAndObs[1]
 
-        if self.debug:
-            thisCore = 0
-        else:
-            thisCore = multiprocessing.current_process()._identity[0]
-
         # Set things up
         objMagStdMean = snmm.getArray(self.fgcmStars.objMagStdMeanHandle)
         objMagStdMeanNoChrom = snmm.getArray(self.fgcmStars.objMagStdMeanNoChromHandle)
@@ -758,58 +1012,35 @@ class FgcmChisq(object):
         obsExpIndex = snmm.getArray(self.fgcmStars.obsExpIndexHandle)
         obsBandIndex = snmm.getArray(self.fgcmStars.obsBandIndexHandle)
         obsLUTFilterIndex = snmm.getArray(self.fgcmStars.obsLUTFilterIndexHandle)
-        obsCCDIndex = snmm.getArray(self.fgcmStars.obsCCDHandle) - self.ccdStartIndex
+        obsCCD = snmm.getArray(self.fgcmStars.obsCCDHandle)
         obsFlag = snmm.getArray(self.fgcmStars.obsFlagHandle)
         obsSecZenith = snmm.getArray(self.fgcmStars.obsSecZenithHandle)
         obsMagADU = snmm.getArray(self.fgcmStars.obsMagADUHandle)
         obsMagADUModelErr = snmm.getArray(self.fgcmStars.obsMagADUModelErrHandle)
         obsMagStd = snmm.getArray(self.fgcmStars.obsMagStdHandle)
 
-        # and the arrays for locking access
-        objMagStdMeanLock = snmm.getArrayBase(self.fgcmStars.objMagStdMeanHandle).get_lock()
-        obsMagStdLock = snmm.getArrayBase(self.fgcmStars.obsMagStdHandle).get_lock()
-
         # cut these down now, faster later
         obsObjIDIndexGO = esutil.numpy_util.to_native(obsObjIDIndex[goodObs])
         obsBandIndexGO = esutil.numpy_util.to_native(obsBandIndex[goodObs])
         obsLUTFilterIndexGO = esutil.numpy_util.to_native(obsLUTFilterIndex[goodObs])
         obsExpIndexGO = esutil.numpy_util.to_native(obsExpIndex[goodObs])
         obsSecZenithGO = obsSecZenith[goodObs]
-        obsCCDIndexGO = esutil.numpy_util.to_native(obsCCDIndex[goodObs])
+        if obsCCDIndexGO is None:
+            obsCCDIndexGO = esutil.numpy_util.to_native(obsCCD[goodObs]) - self.ccdStartIndex
 
 
         # now refer to obsBandIndex[goodObs]
         # add GO to index names that are cut to goodObs
         # add GOF to index names that are cut to goodObs[obsFitUseGO] (see below)
 
-        lutIndicesGO = self.fgcmLUT.getIndices(obsLUTFilterIndexGO,
-                                               self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                               self.fgcmPars.expO3[obsExpIndexGO],
-                                               self.fgcmPars.expLnTau[obsExpIndexGO],
-                                               self.fgcmPars.expAlpha[obsExpIndexGO],
-                                               obsSecZenithGO,
-                                               obsCCDIndexGO,
-                                               self.fgcmPars.expPmb[obsExpIndexGO])
-        I0GO = self.fgcmLUT.computeI0(self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                      self.fgcmPars.expO3[obsExpIndexGO],
-                                      self.fgcmPars.expLnTau[obsExpIndexGO],
-                                      self.fgcmPars.expAlpha[obsExpIndexGO],
-                                      obsSecZenithGO,
-                                      self.fgcmPars.expPmb[obsExpIndexGO],
-                                      lutIndicesGO)
-        I10GO = self.fgcmLUT.computeI1(self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                       self.fgcmPars.expO3[obsExpIndexGO],
-                                       self.fgcmPars.expLnTau[obsExpIndexGO],
-                                       self.fgcmPars.expAlpha[obsExpIndexGO],
-                                       obsSecZenithGO,
-                                       self.fgcmPars.expPmb[obsExpIndexGO],
-                                       lutIndicesGO) / I0GO
+        if lutTermsGO is None:
+            lutTermsGO = self._computeLUTTermsGO(obsLUTFilterIndexGO, obsExpIndexGO,
+                                                 obsSecZenithGO, obsCCDIndexGO)
+        lutIndicesGO, I0GO, I10GO = lutTermsGO
 
         # Compute the sub-selected error-squared, using model error when available
         obsMagErr2GO = obsMagADUModelErr[goodObs]**2.
 
-        obsMagStdLock.acquire()
-
         # If we want to apply the deltas, do it here
         if self.applyDelta:
             obsMagStd[goodObs] -= self.deltaAbsOffset[obsBandIndexGO]
@@ -817,11 +1048,6 @@ class FgcmChisq(object):
         # Make local copy of mags
         obsMagStdGO = obsMagStd[goodObs]
 
-        obsMagStdLock.release()
-
-        # and acquire lock to save the values
-        objMagStdMeanLock.acquire()
-
         if self.applyDelta:
             gdMeanStar, gdMeanBand = np.where(objMagStdMean[goodStars, :] < 90.0)
             objMagStdMean[goodStars[gdMeanStar], gdMeanBand] -= self.deltaAbsOffset[gdMeanBand]
@@ -829,8 +1055,6 @@ class FgcmChisq(object):
         objMagStdMeanGO = objMagStdMean[obsObjIDIndexGO,obsBandIndexGO]
         objMagStdMeanErr2GO = objMagStdMeanErr[obsObjIDIndexGO,obsBandIndexGO]**2.
 
-        objMagStdMeanLock.release()
-
         # New logic:
         #  Select out reference stars (if desired)
         #  Select out non-reference stars
@@ -895,7 +1119,8 @@ class FgcmChisq(object):
         partialChisq = 0.0
         partialChisqRef = 0.0
 
-        partialChisq = np.sum(deltaMagGO[obsFitUseGO]**2. * obsWeightGO[obsFitUseGO])
+        partialChisq = np.sum(deltaMagGO[obsFitUseGO]**2. * obsWeightGO[obsFitUseGO],
+                              dtype=np.float64)
 
         # And for the reference stars (if we want)
         if useRefstars:
@@ -914,7 +1139,8 @@ class FgcmChisq(object):
 
             deltaRefMagWeightedGROF = deltaMagGRO[obsFitUseGRO] * obsWeightGRO[obsFitUseGRO]
 
-            partialChisqRef += np.sum(deltaMagGRO[obsFitUseGRO]**2. * obsWeightGRO[obsFitUseGRO])
+            partialChisqRef += np.sum(deltaMagGRO[obsFitUseGRO]**2. * obsWeightGRO[obsFitUseGRO],
+                                      dtype=np.float64)
 
         partialArray = np.zeros(self.nSums, dtype='f8')
         partialArray[-4] = partialChisq
@@ -929,6 +1155,14 @@ class FgcmChisq(object):
             else:
                 units = np.ones(self.fgcmPars.nFitPars)
 
+            if self.computeNormalEquations:
+                # Jacobian terms of the residuals, as (rows, parameter indices,
+                #  values).  The rows are the fit observations, followed by the
+                #  fit reference star observations.
+                jacobianTerms = []
+            else:
+                jacobianTerms = None
+
             # this is going to be ugly.  wow, how many indices and sub-indices?
             #  or does it simplify since we need all the obs on a night?
             #  we shall see!  And speed up!
@@ -992,6 +1226,10 @@ class FgcmChisq(object):
                                             self.fgcmPars.nCampaignNights)],
                           expNightIndexGOF,
                           2.0 * deltaMagWeightedGOF * innerTermGOF)
+                self._addJacobianTerms(jacobianTerms,
+                                       np.arange(obsFitUseGO.size),
+                                       self.fgcmPars.parO3Loc + expNightIndexGOF,
+                                       dLdO3GO[obsFitUseGO])
 
                 partialArray[self.fgcmPars.parO3Loc +
                              uNightIndex] /= units[self.fgcmPars.parO3Loc +
@@ -1012,6 +1250,10 @@ class FgcmChisq(object):
                                                 self.fgcmPars.nCampaignNights)],
                               expNightIndexGROF,
                               2.0 * deltaRefMagWeightedGROF * dLdO3GO[goodRefObsGOF])
+                    self._addJacobianTerms(jacobianTerms,
+                                           obsFitUseGO.size + np.arange(goodRefObsGOF.size),
+                                           self.fgcmPars.parO3Loc + expNightIndexGROF,
+                                           dLdO3GO[goodRefObsGOF])
 
                     partialArray[2*self.fgcmPars.nFitPars +
                                  self.fgcmPars.parO3Loc +
@@ -1039,6 +1281,10 @@ class FgcmChisq(object):
                                             self.fgcmPars.nCampaignNights)],
                           expNightIndexGOF,
                           2.0 * deltaMagWeightedGOF * innerTermGOF)
+                self._addJacobianTerms(jacobianTerms,
+                                       np.arange(obsFitUseGO.size),
+                                       self.fgcmPars.parAlphaLoc + expNightIndexGOF,
+                                       dLdAlphaGO[obsFitUseGO])
 
                 partialArray[self.fgcmPars.parAlphaLoc +
                              uNightIndex] /= units[self.fgcmPars.parAlphaLoc +
@@ -1056,6 +1302,10 @@ class FgcmChisq(object):
                                                 self.fgcmPars.nCampaignNights)],
                               expNightIndexGROF,
                               2.0 * deltaRefMagWeightedGROF * dLdAlphaGO[goodRefObsGOF])
+                    self._addJacobianTerms(jacobianTerms,
+                                           obsFitUseGO.size + np.arange(goodRefObsGOF.size),
+                                           self.fgcmPars.parAlphaLoc + expNightIndexGROF,
+                                           dLdAlphaGO[goodRefObsGOF])
 
                     partialArray[2*self.fgcmPars.nFitPars +
                                  self.fgcmPars.parAlphaLoc +
@@ -1096,6 +1346,10 @@ class FgcmChisq(object):
                                                 self.fgcmPars.nCampaignNights)],
                               expNightIndexGOF[hasExtGOF],
                               2.0 * deltaMagWeightedGOF[hasExtGOF] * innerTermGOF[hasExtGOF])
+                    self._addJacobianTerms(jacobianTerms,
+                                           hasExtGOF,
+                                           self.fgcmPars.parExternalLnPwvOffsetLoc + expNightIndexGOF[hasExtGOF],
+                                           dLdLnPwvGO[obsFitUseGO[hasExtGOF]])
 
                     partialArray[self.fgcmPars.parExternalLnPwvOffsetLoc +
                                  uNightIndexHasExt] /= units[self.fgcmPars.parExternalLnPwvOffsetLoc +
@@ -1116,6 +1370,10 @@ class FgcmChisq(object):
                                expNightIndexGROF[hasExtGROF],
                                2.0 * deltaRefMagWeightedGROF[hasExtGROF] *
                                dLdLnPwvGO[goodRefObsGOF[hasExtGROF]])
+                        self._addJacobianTerms(jacobianTerms,
+                                               obsFitUseGO.size + hasExtGROF,
+                                               self.fgcmPars.parExternalLnPwvOffsetLoc + expNightIndexGROF[hasExtGROF],
+                                               dLdLnPwvGO[goodRefObsGOF[hasExtGROF]])
 
                         partialArray[2*self.fgcmPars.nFitPars +
                                      self.fgcmPars.parExternalLnPwvOffsetLoc +
@@ -1133,6 +1391,11 @@ class FgcmChisq(object):
                         np.sum(deltaMagWeightedGOF[hasExtGOF] * (
                                 self.fgcmPars.expLnPwv[obsExpIndexGOF[hasExtGOF]] *
                                 dLdLnPwvGO[obsFitUseGO[hasExtGOF]])))
+                    self._addJacobianTerms(jacobianTerms,
+                                           hasExtGOF,
+                                           np.full(hasExtGOF.size, self.fgcmPars.parExternalLnPwvScaleLoc),
+                                           (self.fgcmPars.expLnPwv[obsExpIndexGOF[hasExtGOF]] *
+                                            dLdLnPwvGO[obsFitUseGO[hasExtGOF]]))
 
                     partialArray[self.fgcmPars.parExternalLnPwvScaleLoc] /= units[self.fgcmPars.parExternalLnPwvScaleLoc]
 
@@ -1142,6 +1405,10 @@ class FgcmChisq(object):
                     if useRefstars:
                         temp = np.sum(2.0 * deltaRefMagWeightedGROF[hasExtGROF] *
                                       dLdLnPwvGO[goodRefObsGOF[hasExtGROF]])
+                        self._addJacobianTerms(jacobianTerms,
+                                               obsFitUseGO.size + hasExtGROF,
+                                               np.full(hasExtGROF.size, self.fgcmPars.parExternalLnPwvScaleLoc),
+                                               dLdLnPwvGO[goodRefObsGOF[hasExtGROF]])
 
                         partialArray[2*self.fgcmPars.nFitPars +
                                      self.fgcmPars.parExternalLnPwvScaleLoc] = temp / units[self.fgcmPars.parExternalLnPwvScaleLoc]
@@ -1292,6 +1559,10 @@ class FgcmChisq(object):
                                                 self.fgcmPars.nCampaignNights)],
                               expNightIndexGOF[noExtGOF],
                               2.0 * deltaMagWeightedGOF[noExtGOF] * innerTermGOF[noExtGOF])
+                    self._addJacobianTerms(jacobianTerms,
+                                           noExtGOF,
+                                           self.fgcmPars.parLnPwvInterceptLoc + expNightIndexGOF[noExtGOF],
+                                           dLdLnPwvGO[obsFitUseGO[noExtGOF]])
 
                     partialArray[self.fgcmPars.parLnPwvInterceptLoc +
                                  uNightIndexNoExt] /= units[self.fgcmPars.parLnPwvInterceptLoc +
@@ -1312,6 +1583,10 @@ class FgcmChisq(object):
                                   expNightIndexGROF[noExtGROF],
                                   2.0 * deltaRefMagWeightedGROF[noExtGROF] *
                                   dLdLnPwvGO[goodRefObsGOF[noExtGROF]])
+                        self._addJacobianTerms(jacobianTerms,
+                                               obsFitUseGO.size + noExtGROF,
+                                               self.fgcmPars.parLnPwvInterceptLoc + expNightIndexGROF[noExtGROF],
+                                               dLdLnPwvGO[goodRefObsGOF[noExtGROF]])
 
                         partialArray[2*self.fgcmPars.nFitPars + self.fgcmPars.parLnPwvInterceptLoc + uRefNightIndexNoExt] = units[self.fgcmPars.parLnPwvInterceptLoc + uRefNightIndexNoExt]
                         partialArray[3*self.fgcmPars.nFitPars + self.fgcmPars.parLnPwvInterceptLoc + uRefNightIndexNoExt] += 1
@@ -1339,6 +1614,11 @@ class FgcmChisq(object):
                                                 self.fgcmPars.nCampaignNights)],
                               expNightIndexGOF[noExtGOF],
                               2.0 * deltaMagWeightedGOF[noExtGOF] * innerTermGOF[noExtGOF])
+                    self._addJacobianTerms(jacobianTerms,
+                                           noExtGOF,
+                                           self.fgcmPars.parLnPwvSlopeLoc + expNightIndexGOF[noExtGOF],
+                                           (self.fgcmPars.expDeltaUT[obsExpIndexGOF[noExtGOF]] *
+                                            dLdLnPwvGO[obsFitUseGO[noExtGOF]]))
 
                     partialArray[self.fgcmPars.parLnPwvSlopeLoc +
                                  uNightIndexNoExt] /= units[self.fgcmPars.parLnPwvSlopeLoc +
@@ -1357,6 +1637,11 @@ class FgcmChisq(object):
                                   2.0 * deltaRefMagWeightedGROF[noExtGROF] *
                                   self.fgcmPars.expDeltaUT[obsExpIndexGO[goodRefObsGOF[noExtGROF]]] *
                                   dLdLnPwvGO[goodRefObsGOF[noExtGROF]])
+                        self._addJacobianTerms(jacobianTerms,
+                                               obsFitUseGO.size + noExtGROF,
+                                               self.fgcmPars.parLnPwvSlopeLoc + expNightIndexGROF[noExtGROF],
+                                               (self.fgcmPars.expDeltaUT[obsExpIndexGO[goodRefObsGOF[noExtGROF]]] *
+                                                dLdLnPwvGO[goodRefObsGOF[noExtGROF]]))
 
                         partialArray[2*self.fgcmPars.nFitPars +
                                      self.fgcmPars.parLnPwvSlopeLoc +
@@ -1393,6 +1678,11 @@ class FgcmChisq(object):
                                                     self.fgcmPars.nCampaignNights)],
                                   expNightIndexGOF[noExtGOF],
                                   2.0 * deltaMagWeightedGOF[noExtGOF] * innerTermGOF[noExtGOF])
+                        self._addJacobianTerms(jacobianTerms,
+                                               noExtGOF,
+                                               self.fgcmPars.parLnPwvQuadraticLoc + expNightIndexGOF[noExtGOF],
+                                               (self.fgcmPars.expDeltaUT[obsExpIndexGOF[noExtGOF]]**2. *
+                                                dLdLnPwvGO[obsFitUseGO[noExtGOF]]))
                         partialArray[self.fgcmPars.parLnPwvQuadraticLoc +
                                      uNightIndexNoExt] /= units[self.fgcmPars.parLnPwvQuadraticLoc +
                                                                 uNightIndexNoExt]
@@ -1410,6 +1700,11 @@ class FgcmChisq(object):
                                       2.0 * deltaRefMagWeightedGROF[noExtGROF] *
                                       self.fgcmPars.expDeltaUT[obsExpIndexGO[goodRefObsGOF[noExtGROF]]]**2. *
                                       dLdLnPwvGO[goodRefObsGOF[noExtGROF]])
+                            self._addJacobianTerms(jacobianTerms,
+                                                   obsFitUseGO.size + noExtGROF,
+                                                   self.fgcmPars.parLnPwvQuadraticLoc + expNightIndexGROF[noExtGROF],
+                                                   (self.fgcmPars.expDeltaUT[obsExpIndexGO[goodRefObsGOF[noExtGROF]]]**2. *
+                                                    dLdLnPwvGO[goodRefObsGOF[noExtGROF]]))
 
                             partialArray[2*self.fgcmPars.nFitPars +
                                          self.fgcmPars.parLnPwvQuadraticLoc +
@@ -1458,6 +1753,10 @@ class FgcmChisq(object):
                                             self.fgcmPars.nCampaignNights)],
                           expNightIndexGOF[noExtGOF],
                           2.0 * deltaMagWeightedGOF[noExtGOF] * innerTermGOF[noExtGOF])
+                self._addJacobianTerms(jacobianTerms,
+                                       noExtGOF,
+                                       self.fgcmPars.parLnTauInterceptLoc + expNightIndexGOF[noExtGOF],
+                                       dLdLnTauGO[obsFitUseGO[noExtGOF]])
 
                 partialArray[self.fgcmPars.parLnTauInterceptLoc +
                              uNightIndexNoExt] /= units[self.fgcmPars.parLnTauInterceptLoc +
@@ -1478,6 +1777,10 @@ class FgcmChisq(object):
                               expNightIndexGROF[noExtGROF],
                               2.0 * deltaRefMagWeightedGROF[noExtGROF] *
                               dLdLnTauGO[goodRefObsGOF[noExtGROF]])
+                    self._addJacobianTerms(jacobianTerms,
+                                           obsFitUseGO.size + noExtGROF,
+                                           self.fgcmPars.parLnTauInterceptLoc + expNightIndexGROF[noExtGROF],
+                                           dLdLnTauGO[goodRefObsGOF[noExtGROF]])
 
                     partialArray[2*self.fgcmPars.nFitPars +
                                  self.fgcmPars.parLnTauInterceptLoc +
@@ -1509,6 +1812,11 @@ class FgcmChisq(object):
                                             self.fgcmPars.nCampaignNights)],
                           expNightIndexGOF[noExtGOF],
                           2.0 * deltaMagWeightedGOF[noExtGOF] * innerTermGOF[noExtGOF])
+                self._addJacobianTerms(jacobianTerms,
+                                       noExtGOF,
+                                       self.fgcmPars.parLnTauSlopeLoc + expNightIndexGOF[noExtGOF],
+                                       (self.fgcmPars.expDeltaUT[obsExpIndexGOF[noExtGOF]] *
+                                        dLdLnTauGO[obsFitUseGO[noExtGOF]]))
 
                 partialArray[self.fgcmPars.parLnTauSlopeLoc +
                              uNightIndexNoExt] /= units[self.fgcmPars.parLnTauSlopeLoc +
@@ -1527,6 +1835,11 @@ class FgcmChisq(object):
                               2.0 * deltaRefMagWeightedGROF[noExtGROF] *
                               self.fgcmPars.expDeltaUT[obsExpIndexGO[goodRefObsGOF[noExtGROF]]] *
                               dLdLnTauGO[goodRefObsGOF[noExtGROF]])
+                    self._addJacobianTerms(jacobianTerms,
+                                           obsFitUseGO.size + noExtGROF,
+                                           self.fgcmPars.parLnTauSlopeLoc + expNightIndexGROF[noExtGROF],
+                                           (self.fgcmPars.expDeltaUT[obsExpIndexGO[goodRefObsGOF[noExtGROF]]] *
+                                            dLdLnTauGO[goodRefObsGOF[noExtGROF]]))
 
                     partialArray[2*self.fgcmPars.nFitPars +
                                  self.fgcmPars.parLnTauSlopeLoc +
@@ -1573,6 +1886,10 @@ class FgcmChisq(object):
                                             self.fgcmPars.parQESysIntercept.size)],
                           ravelIndexGOF,
                           2.0 * deltaMagWeightedGOF * innerTermGOF)
+                self._addJacobianTerms(jacobianTerms,
+                                       np.arange(obsFitUseGO.size),
+                                       self.fgcmPars.parQESysInterceptLoc + ravelIndexGOF,
+                                       np.ones(obsFitUseGO.size))
 
                 partialArray[self.fgcmPars.parQESysInterceptLoc +
                              uWashBandIndex] /= units[self.fgcmPars.parQESysInterceptLoc +
@@ -1592,6 +1909,13 @@ class FgcmChisq(object):
                                                     esutil.numpy_util.to_native(self.fgcmPars.expWashIndex[obsExpIndexGO[goodRefObsGOF]])),
                                                    self.fgcmPars.parQESysIntercept.shape),
                               2.0 * deltaRefMagWeightedGROF)
+                    self._addJacobianTerms(jacobianTerms,
+                                           obsFitUseGO.size + np.arange(goodRefObsGOF.size),
+                                           (self.fgcmPars.parQESysInterceptLoc +
+                                            np.ravel_multi_index((obsBandIndexGO[goodRefObsGOF],
+                                                                  esutil.numpy_util.to_native(self.fgcmPars.expWashIndex[obsExpIndexGO[goodRefObsGOF]])),
+                                                                 self.fgcmPars.parQESysIntercept.shape)),
+                                           np.ones(goodRefObsGOF.size))
 
                     partialArray[2*self.fgcmPars.nFitPars +
                                  self.fgcmPars.parQESysInterceptLoc +
@@ -1620,6 +1944,10 @@ class FgcmChisq(object):
                                             self.fgcmPars.nWashIntervals)],
                           expWashIndexGOF,
                           2.0 * deltaMagWeightedGOF * innerTermGOF)
+                self._addJacobianTerms(jacobianTerms,
+                                       np.arange(obsFitUseGO.size),
+                                       self.fgcmPars.parQESysInterceptLoc + expWashIndexGOF,
+                                       np.ones(obsFitUseGO.size))
 
                 partialArray[self.fgcmPars.parQESysInterceptLoc +
                              uWashIndex] /= units[self.fgcmPars.parQESysInterceptLoc +
@@ -1640,6 +1968,11 @@ class FgcmChisq(object):
                                                 self.fgcmPars.nWashIntervals)],
                               esutil.numpy_util.to_native(self.fgcmPars.expWashIndex[obsExpIndexGO[goodRefObsGOF]]),
                               2.0 * deltaRefMagWeightedGROF)
+                    self._addJacobianTerms(jacobianTerms,
+                                           obsFitUseGO.size + np.arange(goodRefObsGOF.size),
+                                           (self.fgcmPars.parQESysInterceptLoc +
+                                            esutil.numpy_util.to_native(self.fgcmPars.expWashIndex[obsExpIndexGO[goodRefObsGOF]])),
+                                           np.ones(goodRefObsGOF.size))
 
                     partialArray[2*self.fgcmPars.nFitPars +
                                  self.fgcmPars.parQESysInterceptLoc +
@@ -1669,6 +2002,11 @@ class FgcmChisq(object):
                                         self.fgcmPars.nLUTFilter)],
                       obsLUTFilterIndexGO[obsFitUseGO],
                       2.0 * deltaMagWeightedGOF * innerTermGOF)
+            fitFilterGOF, = np.where(self.fgcmPars.parFilterOffsetFitFlag[obsLUTFilterIndexGO[obsFitUseGO]])
+            self._addJacobianTerms(jacobianTerms,
+                                   fitFilterGOF,
+                                   self.fgcmPars.parFilterOffsetLoc + obsLUTFilterIndexGO[obsFitUseGO[fitFilterGOF]],
+                                   np.ones(fitFilterGOF.size))
             partialArray[self.fgcmPars.parFilterOffsetLoc:
                              (self.fgcmPars.parFilterOffsetLoc +
                               self.fgcmPars.nLUTFilter)] /= units[self.fgcmPars.parFilterOffsetLoc:
@@ -1687,18 +2025,154 @@ class FgcmChisq(object):
                          self.fgcmPars.parFilterOffsetLoc +
                          uOffsetIndex] += 1
 
-        # note that this store doesn't need locking because we only access
-        #  a given array from a single process
+        if self.computeNormalEquations:
+            residuals = deltaMagGO[obsFitUseGO]
+            weights = obsWeightGO[obsFitUseGO]
+            # The fit residuals are relative to the mean magnitude of each
+            #  star in each band; the reference residuals are not.
+            groups = (obsObjIDIndexGO[obsFitUseGO].astype(np.int64) * self.fgcmPars.nBands +
+                      obsBandIndexGO[obsFitUseGO])
+            if useRefstars:
+                residuals = np.append(residuals, deltaMagGRO[obsFitUseGRO])
+                weights = np.append(weights, obsWeightGRO[obsFitUseGRO])
+                groups = np.append(groups, np.zeros(obsFitUseGRO.size, dtype=np.int64) - 1)
+
+            return partialArray, self._computeNormalEquations(jacobianTerms, residuals,
+                                                              weights, groups, units)
+
+        # and we're done; the partial sums are added up by the caller
+        return partialArray
+
+    def _computeAbsOffset(self):
+        """
+        Compute the change in the absolute offset from the current mean
+         magnitudes, combined over all the cluster nodes with
+         absOffsetReducer if set.  Not to be called on its own.
+
+        returns
+        -------
+        deltaAbsOffset: float array
+           Delta offset (nBands) in abs mag
+        """
+
+        if self.absOffsetReducer is None:
+            return self.fgcmStars.computeAbsOffset()
 
-        totalArr = snmm.getArray(self.totalHandleDict[thisCore])
-        totalArr[:] = totalArr[:] + partialArray
+        return self.absOffsetReducer(self.fgcmStars.computeAbsOffsetSums(stars=self.shardStars))
+
+    def _addPartialSums(self, partialSums, workerOutput):
+        """
+        Add the output of one _chisqWorker call to the partial sums (and the
+         normal equations, if computed).  Not to be called on its own.
+
+        parameters
+        ----------
+        partialSums: float array
+           Partial sums to add to
+        workerOutput: float array or tuple
+           Output from _chisqWorker
+        """
+
+        if self.computeNormalEquations:
+            partialArray, (normalMatrix, normalVector) = workerOutput
+            self.normalMatrix = self.normalMatrix + normalMatrix
+            self.normalVector += normalVector
+        else:
+            partialArray = workerOutput
+
+        partialSums[:] += partialArray
+
+    def _addJacobianTerms(self, jacobianTerms, rows, parIndices, values):
+        """
+        Record terms of the Jacobian of the residuals, for the normal
+         equations.  Not to be called on its own.
+
+        parameters
+        ----------
+        jacobianTerms: list or None
+           List of terms to append to; nothing is done if None
+        rows: int array
+           Residual (observation) indices
+        parIndices: int array
+           Fit parameter indices
+        values: float array
+           Derivatives of the residuals with respect to the parameters
+        """
+
+        if jacobianTerms is None:
+            return
+
+        jacobianTerms.append((np.array(rows, dtype=np.int64),
+                              np.array(parIndices, dtype=np.int64),
+                              np.array(values, dtype=np.float64)))
+
+    def _computeNormalEquations(self, jacobianTerms, residuals, weights, groups, units):
+        """
+        Compute the Gauss-Newton normal equations from the Jacobian terms.
+         Not to be called on its own.
+
+        parameters
+        ----------
+        jacobianTerms: list
+           List of (rows, parIndices, values) from _addJacobianTerms()
+        residuals: float array
+           Residuals (observed - mean or reference magnitudes)
+        weights: float array
+           Weights (1/sigma^2) of the residuals
+        groups: int array
+           Star/band group of each residual, for residuals relative to the
+           weighted mean magnitude of the group.  -1 for no group.
+        units: float array
+           Parameter units
+
+        returns
+        -------
+        normalMatrix: scipy.sparse.csr_matrix
+           J^T W J, nFitPars x nFitPars
+        normalVector: float array
+           J^T W r, nFitPars
+        """
 
-        # and we're done
-        return None
+        if len(jacobianTerms) == 0:
+            return (scipy.sparse.csr_matrix((self.fgcmPars.nFitPars, self.fgcmPars.nFitPars)),
+                    np.zeros(self.fgcmPars.nFitPars))
+
+        rows = np.concatenate([term[0] for term in jacobianTerms])
+        cols = np.concatenate([term[1] for term in jacobianTerms])
+        values = np.concatenate([term[2] for term in jacobianTerms]) / units[cols]
+
+        # duplicate entries are summed
+        jacobian = scipy.sparse.csr_matrix((values, (rows, cols)),
+                                           shape=(residuals.size, self.fgcmPars.nFitPars))
+
+        jacobianT = jacobian.T.tocsr()
+        normalMatrix = jacobianT.dot(scipy.sparse.diags(weights)).dot(jacobian).tocsr()
+        normalVector = jacobianT.dot(weights * residuals)
+
+        # The Jacobian terms are the derivatives of the observed magnitudes,
+        #  so the weighted mean of each group must be projected out:
+        #  J^T W (1 - P) J = J^T W J - S^T Wg^-1 S, with S the weighted sum of
+        #  the Jacobian over each group and Wg the summed weight.
+        meanRows, = np.where(groups >= 0)
+        if meanRows.size > 0:
+            uGroups, groupIndex = np.unique(groups[meanRows], return_inverse=True)
+            groupWeight = np.bincount(groupIndex, weights=weights[meanRows])
+            groupSum = scipy.sparse.csr_matrix((weights[meanRows], (groupIndex, meanRows)),
+                                               shape=(uGroups.size, residuals.size))
+            groupJacobian = groupSum.dot(jacobian)
+            groupJacobianT = groupJacobian.T.tocsr()
+
+            normalMatrix = (normalMatrix -
+                            groupJacobianT.dot(scipy.sparse.diags(1. / groupWeight)).dot(groupJacobian)).tocsr()
+            normalVector = normalVector - groupJacobianT.dot(groupSum.dot(residuals) / groupWeight)
+
+        return normalMatrix, normalVector
 
     def __getstate__(self):
-        # Don't try to pickle the logger.
+        # Don't try to pickle the logger (or the cluster connections).
 
         state = self.__dict__.copy()
         del state['fgcmLog']
+        state['cluster'] = None
+        state['absOffsetReducer'] = None
         return state
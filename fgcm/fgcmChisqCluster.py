@@ -0,0 +1,547 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import time
+import traceback
+import zlib
+import numpy as np
+from multiprocessing.connection import Listener, Client
+
+from .fgcmChisq import FgcmChisq
+from .fgcmStars import FgcmStars
+from .fgcmCheckpoint import FgcmCheckpoint
+from .fgcmWorkerPool import FgcmWorkerPool
+
+from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+
+
+def parseNodeAddress(nodeAddress):
+    """
+    Parse a chisq node address.
+
+    parameters
+    ----------
+    nodeAddress: string
+       Address as host:port
+
+    returns
+    -------
+    address: tuple (host, port)
+    """
+
+    host, _, port = nodeAddress.rpartition(':')
+    if host == '' or not port.isdigit():
+        raise ValueError("Chisq node address must be host:port (got %s)" % (nodeAddress))
+
+    return (host, int(port))
+
+
+def readNodeAuthKey(authKeyFile=None):
+    """
+    Read the authentication key shared by the chisq coordinator and nodes.
+    There is no default key: the nodes unpickle what they receive, so anyone
+    who can connect with the key can run arbitrary code on them.
+
+    parameters
+    ----------
+    authKeyFile: string, optional
+       File with the key.  If None, the key is read from the environment
+       variable FGCM_CHISQ_NODE_AUTHKEY.
+
+    returns
+    -------
+    authKey: bytes
+    """
+
+    if authKeyFile is not None:
+        with open(authKeyFile, 'rb') as f:
+            authKey = f.read().strip()
+    else:
+        authKey = os.environ.get('FGCM_CHISQ_NODE_AUTHKEY', '').strip().encode('utf-8')
+
+    if len(authKey) == 0:
+        raise ValueError("Chisq nodes require an authentication key, from chisqNodeAuthKeyFile "
+                         "or the environment variable FGCM_CHISQ_NODE_AUTHKEY")
+
+    return authKey
+
+
+class FgcmChisqCluster(object):
+    """
+    Class to evaluate the fit chisq on a cluster of nodes (hosts), each with
+     a shard of the stars.  This is the coordinator side; the nodes run
+     FgcmChisqNode.
+
+    The stars are split into shards of neighboring healpix pixels with about
+     the same number of observations.  At the start of each fit, sync() sends
+     each node the parameters and the star arrays of its shard that change
+     over a fit cycle.  For each chisq evaluation, the parameters are sent to
+     all the nodes, each node computes the partial sums of its shard with its
+     own worker pool, and the partial sums are added up.  When the absolute
+     throughput is computed, the nodes first send their sums for the
+     absolute offset, and get back the combined offset.
+
+    The transport is multiprocessing.connection, which pickles the messages,
+     so the nodes must be on a trusted network and share a secret key (see
+     readNodeAuthKey()).
+
+    parameters
+    ----------
+    fgcmConfig: FgcmConfig
+       Config object
+    fgcmPars: FgcmParameters
+       Parameter object
+    fgcmStars: FgcmStars
+       Stars object
+
+    Config variables
+    ----------------
+    chisqNodes: list of strings
+       Addresses of the nodes (host:port)
+    chisqNodeAuthKeyFile: string
+       File with the authentication key shared with the nodes (if not set,
+       the key is read from the environment variable FGCM_CHISQ_NODE_AUTHKEY)
+    chisqShardNSide: int
+       Healpix nside of the pixels that make up the shards
+    """
+
+    def __init__(self, fgcmConfig, fgcmPars, fgcmStars):
+        self.fgcmLog = fgcmConfig.fgcmLog
+
+        self.fgcmPars = fgcmPars
+        self.fgcmStars = fgcmStars
+
+        self.nodeAddresses = [parseNodeAddress(nodeAddress) for nodeAddress in fgcmConfig.chisqNodes]
+        self.authKey = readNodeAuthKey(fgcmConfig.chisqNodeAuthKeyFile)
+        self.shardNSide = fgcmConfig.chisqShardNSide
+
+        self.connections = None
+        self.shardStars = None
+        self._subsampleStars = None
+
+    @property
+    def nNodes(self):
+        return len(self.nodeAddresses)
+
+    def connect(self):
+        """
+        Connect to the nodes, and split the stars into shards.
+        """
+
+        if self.connections is not None:
+            return
+
+        self.connections = []
+        for address in self.nodeAddresses:
+            try:
+                self.connections.append(Client(address, authkey=self.authKey))
+            except Exception as e:
+                self.close()
+                raise RuntimeError("Could not connect to chisq node %s:%d (%s)" %
+                                   (address[0], address[1], e))
+
+        if self.shardStars is None:
+            self.shardStars = self.fgcmStars.getShardStarIndices(self.nNodes, self.shardNSide)
+
+        self.fgcmLog.info('Connected to %d chisq nodes, with %s stars per shard.' %
+                          (self.nNodes, ', '.join(['%d' % (shard.size) for shard in self.shardStars])))
+
+    def sync(self):
+        """
+        Send each node the parameters and the star arrays of its shard.  To
+        be called before a fit, after the parameters or the stars changed.
+        """
+
+        self.connect()
+
+        startTime = time.time()
+
+        parArrays = {}
+        parValues = {}
+        FgcmCheckpoint.getObjectState('pars', self.fgcmPars, parArrays, parValues)
+
+        starValues = {'sedSlopeComputed': bool(self.fgcmStars.sedSlopeComputed)}
+
+        objIDChecksum = zlib.adler32(snmm.getArray(self.fgcmStars.objIDHandle).view(np.uint8))
+
+        for connection, shardStars in zip(self.connections, self.shardStars):
+            _, shardObs = self.fgcmStars.getObsIndicesForStars(shardStars)
+
+            starArrays = {}
+            for name in self.fgcmStars.checkpointArrays:
+                if not hasattr(self.fgcmStars, name + 'Handle'):
+                    continue
+                array = snmm.getArray(getattr(self.fgcmStars, name + 'Handle'))
+                if name.startswith('obs'):
+                    starArrays[name] = array[shardObs]
+                else:
+                    starArrays[name] = array[shardStars]
+
+            connection.send(('sync', {'nStars': self.fgcmStars.nStars,
+                                      'objIDChecksum': objIDChecksum,
+                                      'shardStars': shardStars,
+                                      'parArrays': parArrays,
+                                      'parValues': parValues,
+                                      'starArrays': starArrays,
+                                      'starValues': starValues}))
+
+        nGoodStars = [self._receive(i, 'synced')[1] for i in range(self.nNodes)]
+
+        # The subsample (if any) is sent again with the next evaluation
+        self._subsampleStars = None
+
+        self.fgcmLog.info('Synced %d chisq nodes in %.2f seconds (%s good stars per shard).' %
+                          (self.nNodes, time.time() - startTime,
+                           ', '.join(['%d' % (n) for n in nGoodStars])))
+
+    def computePartialSums(self, fgcmChisq, fitParams, options):
+        """
+        Compute the partial sums of the chisq on the nodes.
+
+        parameters
+        ----------
+        fgcmChisq: FgcmChisq
+           Chisq object of the coordinator (for the subsample of stars)
+        fitParams: float array
+           Parameters
+        options: dict
+           Keyword arguments for FgcmChisq.computePartialSums()
+
+        returns
+        -------
+        partialSums: float array
+           Partial sums of the chisq, added over the nodes
+        deltaAbsOffset: float array
+           Delta absolute offset (nBands), or None if not computed
+        normalEquations: tuple (normalMatrix, normalVector)
+           Normal equations added over the nodes, or None if not computed
+        """
+
+        self.connect()
+
+        # Send each node its part of a new subsample of stars
+        if fgcmChisq.subsampleStars is not self._subsampleStars:
+            for connection, shardStars in zip(self.connections, self.shardStars):
+                if fgcmChisq.subsampleStars is None:
+                    connection.send(('subsample', None))
+                else:
+                    connection.send(('subsample', np.intersect1d(fgcmChisq.subsampleStars,
+                                                                 shardStars, assume_unique=True)))
+            self._subsampleStars = fgcmChisq.subsampleStars
+
+        for connection in self.connections:
+            connection.send(('evaluate', fitParams, options))
+
+        deltaAbsOffset = None
+        if options['computeAbsThroughput']:
+            # Combine the absolute offset sums of all the shards
+            deltaOffsetSum = 0.0
+            deltaOffsetWtSum = 0.0
+            for i in range(self.nNodes):
+                _, sums = self._receive(i, 'absOffsetSums')
+                deltaOffsetSum = deltaOffsetSum + sums[0]
+                deltaOffsetWtSum = deltaOffsetWtSum + sums[1]
+
+            if self.fgcmStars.hasRefstars:
+                deltaAbsOffset = FgcmStars.absOffsetFromSums(deltaOffsetSum, deltaOffsetWtSum)
+            else:
+                deltaAbsOffset = np.zeros(self.fgcmStars.nBands)
+
+            for connection in self.connections:
+                connection.send(('absOffset', deltaAbsOffset))
+
+        partialSums = None
+        normalEquations = None
+        for i in range(self.nNodes):
+            _, nodePartialSums, nodeNormalEquations = self._receive(i, 'partialSums')
+
+            if partialSums is None:
+                partialSums = nodePartialSums.copy()
+            else:
+                partialSums += nodePartialSums
+
+            if nodeNormalEquations is not None:
+                if normalEquations is None:
+                    normalEquations = (nodeNormalEquations[0], nodeNormalEquations[1].copy())
+                else:
+                    normalEquations = (normalEquations[0] + nodeNormalEquations[0],
+                                       normalEquations[1] + nodeNormalEquations[1])
+
+        return partialSums, deltaAbsOffset, normalEquations
+
+    def close(self, shutdown=False):
+        """
+        Close the connections to the nodes.
+
+        parameters
+        ----------
+        shutdown: bool, default=False
+           Also shut down the nodes
+        """
+
+        if self.connections is None:
+            return
+
+        for connection in self.connections:
+            try:
+                if shutdown:
+                    connection.send(('shutdown', ))
+                connection.close()
+            except (IOError, OSError):
+                pass
+
+        self.connections = None
+
+    def _receive(self, index, expected):
+        """
+        Receive a reply from a node.  If the node failed, the connections
+         are closed and the error is raised.  Not to be called on its own.
+
+        parameters
+        ----------
+        index: int
+           Index of the node
+        expected: string
+           Expected type of reply
+
+        returns
+        -------
+        reply: tuple
+        """
+
+        address = self.nodeAddresses[index]
+
+        try:
+            reply = self.connections[index].recv()
+        except (EOFError, IOError, OSError) as e:
+            self.close()
+            raise RuntimeError("Lost connection to chisq node %s:%d (%s)" %
+                               (address[0], address[1], e))
+
+        if reply[0] != expected:
+            self.close()
+            if reply[0] == 'error':
+                raise RuntimeError("Chisq node %s:%d failed:\n%s" %
+                                   (address[0], address[1], reply[1]))
+            raise RuntimeError("Unexpected reply %s from chisq node %s:%d" %
+                               (reply[0], address[0], address[1]))
+
+        return reply
+
+    def __getstate__(self):
+        # Don't try to pickle the logger (or the connections).
+
+        state = self.__dict__.copy()
+        del state['fgcmLog']
+        state['connections'] = None
+        return state
+
+
+class FgcmChisqNode(object):
+    """
+    Class to serve chisq evaluations of a shard of the stars to a coordinator
+     (FgcmChisqCluster).  The node is set up from the same inputs as the
+     coordinator, and gets the changing parameters and star arrays of its
+     shard with each sync.
+
+    The node unpickles the requests it receives, and its only protection is
+     the authentication key, so it must only listen on a trusted network (see
+     readNodeAuthKey()).
+
+    parameters
+    ----------
+    fgcmConfig: FgcmConfig
+       Config object
+    fgcmPars: FgcmParameters
+       Parameter object
+    fgcmStars: FgcmStars
+       Stars object
+    fgcmLUT: FgcmLUT
+       LUT object
+    address: tuple (host, port)
+       Address to listen on (port 0 for any free port)
+
+    Config variables
+    ----------------
+    chisqNodeAuthKeyFile: string
+       File with the authentication key shared with the coordinator (if not
+       set, the key is read from the environment variable
+       FGCM_CHISQ_NODE_AUTHKEY)
+    nCore: int
+       Number of cores to run the shard on
+    """
+
+    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, address):
+        self.fgcmLog = fgcmConfig.fgcmLog
+
+        self.fgcmPars = fgcmPars
+        self.fgcmStars = fgcmStars
+
+        self.authKey = readNodeAuthKey(fgcmConfig.chisqNodeAuthKeyFile)
+
+        self.fgcmWorkerPool = FgcmWorkerPool(fgcmConfig.nCore, self.fgcmLog)
+        self.fgcmChisq = FgcmChisq(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT,
+                                   fgcmWorkerPool=self.fgcmWorkerPool)
+
+        self.listener = Listener(address, authkey=self.authKey)
+        self.address = self.listener.address
+
+    def serve(self):
+        """
+        Serve chisq evaluations, to one coordinator connection at a time,
+        until a coordinator asks for a shutdown.
+        """
+
+        self.fgcmLog.info('Chisq node listening on %s:%d' % (self.address[0], self.address[1]))
+
+        try:
+            shutdown = False
+            while not shutdown:
+                connection = self.listener.accept()
+                self.fgcmLog.info('Chisq node connected to coordinator.')
+                try:
+                    shutdown = self._serveConnection(connection)
+                finally:
+                    connection.close()
+        finally:
+            self.listener.close()
+            self.fgcmWorkerPool.close()
+
+    def _serveConnection(self, connection):
+        """
+        Serve the requests of a coordinator connection.  Not to be called on
+         its own.
+
+        parameters
+        ----------
+        connection: multiprocessing Connection
+           Connection to the coordinator
+
+        returns
+        -------
+        shutdown: bool
+           The coordinator asked for a shutdown
+        """
+
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, IOError, OSError):
+                return False
+
+            if request[0] == 'shutdown':
+                return True
+
+            try:
+                if request[0] == 'sync':
+                    connection.send(('synced', self._sync(request[1])))
+                elif request[0] == 'subsample':
+                    self.fgcmChisq.subsampleStars = request[1]
+                elif request[0] == 'evaluate':
+                    connection.send(self._evaluate(connection, request[1], request[2]))
+                else:
+                    raise ValueError("Unknown chisq node request %s" % (request[0]))
+            except Exception:
+                connection.send(('error', traceback.format_exc()))
+
+    def _sync(self, state):
+        """
+        Set the parameters and the star arrays of the shard from the
+         coordinator.  Not to be called on its own.
+
+        parameters
+        ----------
+        state: dict
+           State from FgcmChisqCluster.sync()
+
+        returns
+        -------
+        nGoodStars: int
+           Number of good stars in the shard
+        """
+
+        objIDChecksum = zlib.adler32(snmm.getArray(self.fgcmStars.objIDHandle).view(np.uint8))
+        if state['nStars'] != self.fgcmStars.nStars or state['objIDChecksum'] != objIDChecksum:
+            raise RuntimeError("The stars of the chisq node do not match the coordinator.")
+
+        shardStars = state['shardStars']
+        _, shardObs = self.fgcmStars.getObsIndicesForStars(shardStars)
+
+        FgcmCheckpoint.applyObjectState('pars', self.fgcmPars, state['parArrays'],
+                                        state['parValues'])
+
+        for name, values in state['starArrays'].items():
+            array = snmm.getArray(getattr(self.fgcmStars, name + 'Handle'))
+            if name.startswith('obs'):
+                array[shardObs] = values
+            else:
+                array[shardStars] = values
+
+        for name, value in state['starValues'].items():
+            setattr(self.fgcmStars, name, value)
+
+        # The flags were replaced, so the cached selections are stale
+        self.fgcmStars.objFlagGeneration.advance()
+        self.fgcmStars.obsFlagGeneration.advance()
+        self.fgcmStars.objNGoodObsGeneration.advance()
+        self.fgcmPars.expFlagGeneration.advance()
+        self.fgcmChisq.clearMatchCache()
+
+        self.fgcmChisq.shardStars = shardStars
+        self.fgcmChisq.subsampleStars = None
+        self.fgcmChisq.resetFitChisqList()
+
+        goodStars = self.fgcmStars.getGoodStarIndices()
+        nGoodStars = np.intersect1d(goodStars, shardStars, assume_unique=True).size
+
+        self.fgcmLog.info('Chisq node synced with %d stars (%d good) in the shard.' %
+                          (shardStars.size, nGoodStars))
+
+        return nGoodStars
+
+    def _evaluate(self, connection, fitParams, options):
+        """
+        Compute the partial sums of the chisq of the shard.  Not to be called
+         on its own.
+
+        parameters
+        ----------
+        connection: multiprocessing Connection
+           Connection to the coordinator (to combine the absolute offset)
+        fitParams: float array
+           Parameters
+        options: dict
+           Keyword arguments for FgcmChisq.computePartialSums()
+
+        returns
+        -------
+        reply: tuple
+           ('partialSums', partialSums, normalEquations)
+        """
+
+        def reduceAbsOffset(sums):
+            connection.send(('absOffsetSums', sums))
+            reply = connection.recv()
+            if reply[0] != 'absOffset':
+                raise RuntimeError("Unexpected request %s from coordinator" % (reply[0]))
+            return reply[1]
+
+        self.fgcmChisq.absOffsetReducer = reduceAbsOffset
+        try:
+            partialSums = self.fgcmChisq.computePartialSums(fitParams, **options)
+        finally:
+            self.fgcmChisq.absOffsetReducer = None
+
+        normalEquations = None
+        if options.get('computeNormalEquations', False):
+            normalEquations = (self.fgcmChisq.normalMatrix, self.fgcmChisq.normalVector)
+
+        return ('partialSums', partialSums, normalEquations)
+
+    def __getstate__(self):
+        # Don't try to pickle the logger (or the listener).
+
+        state = self.__dict__.copy()
+        del state['fgcmLog']
+        state['listener'] = None
+        return state
@@ -0,0 +1,147 @@
+from __future__ import division, absolute_import, print_function
+
+import numpy as np
+
+
+class FgcmChunkPlanner(object):
+    """
+    Class to split good stars and their observations into chunks for the
+     worker pool.
+
+    Chunks are balanced by their expected cost rather than by their number
+     of stars.  The cost of a chunk is modeled as
+     starCost * nStars + obsCost * nObs, with a separate model for each
+     stage, starting from pure observation counts and refit from the
+     per-chunk timings recorded with recordTiming().  The workers pull the
+     chunks from a queue in order, so the plan puts the full-size chunks
+     first and finishes with a tail of shrinking chunks to keep the last
+     workers from straggling.
+
+    Each star, with all its observations, is in exactly one chunk, so the
+     workers own disjoint parts of the per-star and per-observation arrays
+     and write to them without locks.
+
+    parameters
+    ----------
+    tailDivisor: int, default=4
+       Tail chunks have 1/tailDivisor of the cost of the full-size chunks
+    """
+
+    # Change in the fraction of the chunk cost from the per-star term
+    #  which makes recordTiming() report that a stage should be replanned
+    replanThreshold = 0.05
+
+    def __init__(self, tailDivisor=4):
+        self.tailDivisor = tailDivisor
+
+        # Cost model (starCost, obsCost) for each stage
+        self.costModels = {}
+        # Recorded (nStars, nObs, time) for the chunks of the last run of each stage
+        self.chunkTimings = {}
+
+    def plan(self, goodStars, goodStarsSub, goodObs, nSections, nCore=1, stage=None):
+        """
+        Split good stars and their observations into chunks.
+
+        parameters
+        ----------
+        goodStars: np.array
+           Indices of the good stars
+        goodStarsSub: np.array
+           Sub-indices of the good stars matched to good observations
+           (in increasing order)
+        goodObs: np.array
+           Indices of good observations, matched to goodStarsSub
+        nSections: int
+           Number of full-size chunks (raised to nCore if smaller)
+        nCore: int, default=1
+           Number of worker processes
+        stage: string, optional
+           Name of the stage, to select the cost model
+
+        returns
+        -------
+        workerList: list of (goodStars, goodObs) tuples
+           Chunks, in the order they should be run
+        """
+
+        if nSections <= 1 or goodStars.size <= 1:
+            return [(goodStars, goodObs)]
+
+        starCost, obsCost = self.costModels.get(stage, (0.0, 1.0))
+
+        nObsPerStar = np.bincount(goodStarsSub, minlength=goodStars.size)
+        cumCost = np.cumsum(starCost + obsCost * nObsPerStar)
+        totalCost = cumCost[-1]
+
+        # Chunks are full size (at least one per worker) until the remaining
+        #  cost is shared out among the workers, when they shrink in
+        #  proportion to the remaining cost (guided scheduling) down to
+        #  1/tailDivisor of the full size.
+        chunkCost = totalCost / max(nSections, nCore)
+        minChunkCost = chunkCost / self.tailDivisor if nCore > 1 else chunkCost
+
+        targets = []
+        target = 0.0
+        while target < totalCost:
+            target += min(chunkCost, max((totalCost - target) / (2.0 * nCore), minChunkCost))
+            targets.append(target)
+        targets = np.array(targets[: -1])
+
+        # Chunk boundaries (in goodStars), at the star nearest each target
+        starSplits = np.searchsorted(cumCost, targets) + 1
+        starSplits = np.unique(starSplits[starSplits < goodStars.size])
+
+        obsSplits = np.searchsorted(goodStarsSub, starSplits)
+
+        return list(zip(np.split(goodStars, starSplits), np.split(goodObs, obsSplits)))
+
+    def recordTiming(self, stage, workerList, taskTimes):
+        """
+        Record the time taken by each chunk of a stage, and refit the cost
+        model for the next plan of the stage.
+
+        parameters
+        ----------
+        stage: string
+           Name of the stage
+        workerList: list of (goodStars, goodObs) tuples
+           Chunks, from plan()
+        taskTimes: list of floats
+           Time taken by each chunk (seconds)
+
+        returns
+        -------
+        replan: bool
+           The cost model changed enough that the stage should be replanned
+        """
+
+        if taskTimes is None or len(taskTimes) != len(workerList):
+            return False
+
+        nStars = np.array([elt[0].size for elt in workerList], dtype=np.float64)
+        nObs = np.array([elt[1].size for elt in workerList], dtype=np.float64)
+        times = np.array(taskTimes, dtype=np.float64)
+
+        self.chunkTimings[stage] = (nStars, nObs, times)
+
+        if times.size < 3 or np.sum(nObs) == 0.0:
+            return False
+
+        # Least-squares fit of the chunk time to the number of stars and
+        #  observations; only the ratio of the costs matters.
+        coeffs, _, rank, _ = np.linalg.lstsq(np.vstack((nStars, nObs)).T, times, rcond=None)
+        if rank < 2 or coeffs[1] <= 0.0:
+            return False
+
+        # Compare the fraction of the cost of an average star which comes
+        #  from the per-star term
+        meanNObs = np.sum(nObs) / np.sum(nStars)
+        oldStarCost, oldObsCost = self.costModels.get(stage, (0.0, 1.0))
+        oldStarFraction = oldStarCost / (oldStarCost + oldObsCost * meanNObs)
+
+        starCost = max(coeffs[0] / coeffs[1], 0.0)
+        self.costModels[stage] = (starCost, 1.0)
+        starFraction = starCost / (starCost + meanNObs)
+
+        return abs(starFraction - oldStarFraction) > self.replanThreshold
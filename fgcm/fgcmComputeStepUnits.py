@@ -18,10 +18,8 @@ try:
 except ImportError:
     import copyreg
 
-import multiprocessing
-from multiprocessing import Pool
-
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmWorkerPool import FgcmWorkerPool
 
 copyreg.pickle(types.MethodType, _pickle_method)
 
@@ -39,13 +37,26 @@ class FgcmComputeStepUnits(object):
        Stars object
     fgcmLUT: FgcmLUT
        LUT object
+    fgcmWorkerPool: FgcmWorkerPool, optional
+       Persistent worker pool.  If None, a pool is made for each run.
     """
 
-    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmLUT):
+    # These are the attributes that may change between runs, and are sent
+    #  to the persistent pool workers with each map.
+    _workerStateAttrs = ['nSums',
+                         'fgcmPars.expLnPwv', 'fgcmPars.expO3', 'fgcmPars.expLnTau',
+                         'fgcmPars.expAlpha', 'fgcmPars.expPmb', 'fgcmPars.expFlag',
+                         'fgcmPars.compRetrievedLnPwvFlag', 'fgcmPars.parQESysIntercept',
+                         'fgcmPars.parFilterOffsetFitFlag']
+
+    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, fgcmWorkerPool=None):
         self.fgcmLog = fgcmConfig.fgcmLog
 
         self.fgcmLog.debug('Initializing FgcmComputeStepUnits')
 
+        # this may be None, in which case we make a pool for each run
+        self.fgcmWorkerPool = fgcmWorkerPool
+
         # does this need to be shm'd?
         self.fgcmPars = fgcmPars
 
@@ -69,6 +80,7 @@ class FgcmComputeStepUnits(object):
         self.stepUnitReference = fgcmConfig.stepUnitReference
         self.fitGradientTolerance = fgcmConfig.fitGradientTolerance
         self.saveParsForDebugging = fgcmConfig.saveParsForDebugging
+        self.fitWarmStart = fgcmConfig.fitWarmStart
         self.quietMode = fgcmConfig.quietMode
 
         self.outfileBaseWithCycle = fgcmConfig.outfileBaseWithCycle
@@ -123,47 +135,35 @@ class FgcmComputeStepUnits(object):
         # going to have one or the other, and this doesn't care which is which
         self.nSums += 2 * self.fgcmPars.nFitPars
 
-        proc = multiprocessing.Process()
-        workerIndex = proc._identity[0]+1
-        proc = None
-
-        self.totalHandleDict = {}
-        for thisCore in range(self.nCore):
-            self.totalHandleDict[workerIndex + thisCore] = (
-                snmm.createArray(self.nSums,dtype='f8'))
-
-        self._testing = workerIndex
-
         nSections = goodStars.size // self.nStarPerRun + 1
-        goodStarsList = np.array_split(goodStars,nSections)
-
-        splitValues = np.zeros(nSections-1,dtype='i4')
-        for i in range(1,nSections):
-            splitValues[i-1] = goodStarsList[i][0]
-
-        splitIndices = np.searchsorted(goodStars[goodStarsSub], splitValues)
-
-        # and split along the indices
-        goodObsList = np.split(goodObs,splitIndices)
+        workerList = self.fgcmStars.splitGoodObsIndices(goodStars, goodStarsSub,
+                                                        goodObs, nSections,
+                                                        nCore=self.nCore,
+                                                        stage='stepUnits')
+
+        # use the persistent pool if we have one
+        if self.fgcmWorkerPool is not None:
+            pool = self.fgcmWorkerPool
+        else:
+            pool = FgcmWorkerPool(self.nCore, self.fgcmLog)
 
-        workerList = list(zip(goodStarsList,goodObsList))
+        poolStartupTime = pool.startupTime
 
-        # reverse sort so the longest running go first
-        workerList.sort(key=lambda elt:elt[1].size, reverse=True)
+        # Compute the fake derivatives
+        partialArrays = pool.map(self, '_stepWorker', workerList,
+                                 stateAttrs=self._workerStateAttrs)
+        self.fgcmStars.chunkPlanner.recordTiming('stepUnits', workerList,
+                                                 pool.lastTaskTimes)
 
-        # make a pool
-        pool = Pool(processes=self.nCore)
-        # Compute magnitudes
-        pool.map(self._stepWorker, workerList, chunksize=1)
+        poolStartupTime = pool.startupTime - poolStartupTime
 
-        pool.close()
-        pool.join()
+        if self.fgcmWorkerPool is None:
+            pool.close()
 
         # sum up the partial sums from the different jobs
         partialSums = np.zeros(self.nSums,dtype='f8')
-        for thisCore in range(self.nCore):
-            partialSums[:] += snmm.getArray(
-                self.totalHandleDict[workerIndex + thisCore])[:]
+        for partialArray in partialArrays:
+            partialSums[:] += partialArray
 
         nonZero, = np.where((partialSums[self.fgcmPars.nFitPars: 2*self.fgcmPars.nFitPars] > 0) &
                             (partialSums[0: self.fgcmPars.nFitPars] != 0.0))
@@ -263,6 +263,9 @@ class FgcmComputeStepUnits(object):
                                             self.fgcmPars.nWashIntervals)] = np.median(vals)
                                             """
 
+        if self.fitWarmStart:
+            self._warmStartStepUnits(nonZero)
+
         if self.saveParsForDebugging:
             import astropy.io.fits as pyfits
             tempCat = np.zeros(1, dtype=[('o3', 'f8', self.fgcmPars.nCampaignNights),
@@ -300,13 +303,39 @@ class FgcmComputeStepUnits(object):
 
             pyfits.writeto('%s_stepUnits3.fits' % (self.outfileBaseWithCycle), tempCat, overwrite=True)
 
-        # free shared arrays
-        for key in self.totalHandleDict.keys():
-            snmm.freeArray(self.totalHandleDict[key])
+        if not self.quietMode:
+            self.fgcmLog.info('Step size computation took %.2f seconds (%.2f s pool startup).' %
+                              (time.time() - startTime, poolStartupTime))
+
+    def _warmStartStepUnits(self, nonZero):
+        """
+        Rescale the step units with the fit curvature from the previous cycle,
+        so that the curvature is uniform in fitter units.  Not to be called on
+        its own.
+
+        parameters
+        ----------
+        nonZero: int array
+           Indices of the parameters with non-zero step units
+        """
+
+        curvature = self.fgcmPars.compFitCurvature[nonZero]
+        use, = np.where(curvature > 0.0)
+
+        if use.size == 0:
+            self.fgcmLog.info('No fit curvature from previous cycle; not warm-starting step units.')
+            return
+
+        units = self.fgcmPars.stepUnits[nonZero[use]]
+
+        # Keep the median curvature in fitter units (and hence the overall
+        #  scale set by the gradient tolerance) unchanged.
+        medCurvature = np.median(curvature[use] / units**2.)
+        self.fgcmPars.stepUnits[nonZero[use]] = np.sqrt(curvature[use] / medCurvature)
 
         if not self.quietMode:
-            self.fgcmLog.info('Step size computation took %.2f seconds.' %
-                              (time.time() - startTime))
+            self.fgcmLog.info('Warm-started step units for %d parameters from previous cycle curvature.' %
+                              (use.size))
 
     def _stepWorker(self, goodStarsAndObs):
         """
@@ -322,8 +351,6 @@ class FgcmComputeStepUnits(object):
         goodStars = goodStarsAndObs[0]
         goodObs = goodStarsAndObs[1]
 
-        thisCore = multiprocessing.current_process()._identity[0]
-
         objSEDSlope = snmm.getArray(self.fgcmStars.objSEDSlopeHandle)
         objFlag = snmm.getArray(self.fgcmStars.objFlagHandle)
         objMagStdMeanErr = snmm.getArray(self.fgcmStars.objMagStdMeanErrHandle)
@@ -355,21 +382,15 @@ class FgcmComputeStepUnits(object):
                                                self.fgcmPars.expAlpha[obsExpIndexGO],
                                                obsSecZenithGO,
                                                obsCCDIndexGO,
-                                               self.fgcmPars.expPmb[obsExpIndexGO])
-        I0GO = self.fgcmLUT.computeI0(self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                      self.fgcmPars.expO3[obsExpIndexGO],
-                                      self.fgcmPars.expLnTau[obsExpIndexGO],
-                                      self.fgcmPars.expAlpha[obsExpIndexGO],
-                                      obsSecZenithGO,
-                                      self.fgcmPars.expPmb[obsExpIndexGO],
-                                      lutIndicesGO)
-        I10GO = self.fgcmLUT.computeI1(self.fgcmPars.expLnPwv[obsExpIndexGO],
-                                       self.fgcmPars.expO3[obsExpIndexGO],
-                                       self.fgcmPars.expLnTau[obsExpIndexGO],
-                                       self.fgcmPars.expAlpha[obsExpIndexGO],
-                                       obsSecZenithGO,
-                                       self.fgcmPars.expPmb[obsExpIndexGO],
-                                       lutIndicesGO) / I0GO
+                                               self.fgcmPars.expPmb[obsExpIndexGO],
+                                               flat=True)
+        I0GO, _, I10GO = self.fgcmLUT.computeI0I1(self.fgcmPars.expLnPwv[obsExpIndexGO],
+                                                  self.fgcmPars.expO3[obsExpIndexGO],
+                                                  self.fgcmPars.expLnTau[obsExpIndexGO],
+                                                  self.fgcmPars.expAlpha[obsExpIndexGO],
+                                                  obsSecZenithGO,
+                                                  self.fgcmPars.expPmb[obsExpIndexGO],
+                                                  lutIndicesGO)
 
         obsMagErr2GO = obsMagADUModelErr[goodObs]**2.
 
@@ -852,10 +873,8 @@ class FgcmComputeStepUnits(object):
                      self.fgcmPars.parFilterOffsetLoc +
                      uOffsetIndex] += 1
 
-        totalArr = snmm.getArray(self.totalHandleDict[thisCore])
-        totalArr[:] = totalArr[:] + partialArray
-
-        return None
+        # the partial sums are added up by the caller
+        return partialArray
 
     def __getstate__(self):
         # Don't try to pickle the logger.
@@ -104,6 +104,9 @@ class FgcmConfig(object):
     obsFile = ConfigField(str, required=False)
     indexFile = ConfigField(str, required=False)
     refstarFile = ConfigField(str, required=False)
+    starStorePath = ConfigField(str, required=False)
+    starCachePath = ConfigField(str, required=False)
+    checkpointPath = ConfigField(str, required=False)
     UTBoundary = ConfigField(float, default=0.0)
     washMJDs = ConfigField(np.ndarray, default=np.array((0.0)))
     epochMJDs = ConfigField(np.ndarray, default=np.array((0.0, 1e10)))
@@ -181,6 +184,8 @@ class FgcmConfig(object):
 
     mapNSide = ConfigField(int, default=256)
     nStarPerRun = ConfigField(int, default=200000)
+    memoryBudget = ConfigField(float, default=0.0)
+    obsPrecision = ConfigField(str, default='float64')
     nExpPerRun = ConfigField(int, default=1000)
     varNSig = ConfigField(float, default=100.0)
     varMinBand = ConfigField(int, default=2)
@@ -202,6 +207,8 @@ class FgcmConfig(object):
     superStarSigmaClip = ConfigField(float, default=5.0)
     clobber = ConfigField(bool, default=False)
     printOnly = ConfigField(bool, default=False)
+    resume = ConfigField(bool, default=False)
+    checkpointInterval = ConfigField(int, default=10)
     outputStars = ConfigField(bool, default=False)
     fillStars = ConfigField(bool, default=False)
     outputZeropoints = ConfigField(bool, default=False)
@@ -214,6 +221,16 @@ class FgcmConfig(object):
     tauFile = ConfigField(str, required=False)
     externalTauDeltaT = ConfigField(float, default=0.1)
     fitGradientTolerance = ConfigField(float, default=1e-5)
+    fitSolver = ConfigField(str, default='lbfgsb')
+    gaussNewtonChisqTolerance = ConfigField(float, default=1e-4)
+    fitWarmStart = ConfigField(bool, default=False)
+    fitSubsampleFractions = ConfigField(list, default=[])
+    fitSubsampleMaxIter = ConfigField(int, default=10)
+    fitSubsampleChisqTolerance = ConfigField(float, default=0.0)
+    fitSubsampleNSide = ConfigField(int, default=64)
+    chisqNodes = ConfigField(list, default=[])
+    chisqNodeAuthKeyFile = ConfigField(str, required=False)
+    chisqShardNSide = ConfigField(int, default=32)
     stepUnitReference = ConfigField(float, default=0.0001)
     experimentalMode = ConfigField(bool, default=False)
     resetParameters = ConfigField(bool, default=True)
@@ -271,14 +288,15 @@ class FgcmConfig(object):
 
         self.outfileBaseWithCycle = '%s_cycle%02d' % (self.outfileBase, self.cycleNumber)
 
+        # When resuming, the log and plots of the interrupted run are kept
         logFile = '%s/%s.log' % (self.outputPath, self.outfileBaseWithCycle)
-        if os.path.isfile(logFile) and not self.clobber:
+        if os.path.isfile(logFile) and not self.clobber and not self.resume:
             raise RuntimeError("Found logFile %s, but clobber == False." % (logFile))
 
         self.plotPath = None
         if self.doPlots:
             self.plotPath = '%s/%s_plots' % (self.outputPath,self.outfileBaseWithCycle)
-            if os.path.isdir(self.plotPath) and not self.clobber:
+            if os.path.isdir(self.plotPath) and not self.clobber and not self.resume:
                 # check if directory is empty
                 if len(os.listdir(self.plotPath)) > 0:
                     raise RuntimeError("Found plots in %s, but clobber == False." % (self.plotPath))
@@ -288,7 +306,8 @@ class FgcmConfig(object):
             self.externalLogger = False
             self.fgcmLog = FgcmLogger('%s/%s.log' % (self.outputPath,
                                                      self.outfileBaseWithCycle),
-                                      self.logLevel, printLogger=configDict['printOnly'])
+                                      self.logLevel, printLogger=configDict['printOnly'],
+                                      append=self.resume)
             if configDict['printOnly']:
                 self.fgcmLog.info('Logging to console')
             else:
@@ -435,6 +454,32 @@ class FgcmConfig(object):
         if self.sigmaCalRange[1] < self.sigmaCalRange[0]:
             raise ValueError("sigmaCalRange[1] must me equal to or larger than sigmaCalRange[0]")
 
+        if self.fitSolver not in ['lbfgsb', 'gaussnewton']:
+            raise ValueError("fitSolver must be one of lbfgsb or gaussnewton")
+        if self.gaussNewtonChisqTolerance <= 0.0:
+            raise ValueError("gaussNewtonChisqTolerance must be positive")
+        for fraction in self.fitSubsampleFractions:
+            if fraction <= 0.0 or fraction >= 1.0:
+                raise ValueError("fitSubsampleFractions must all be between 0 and 1")
+        if self.fitSubsampleMaxIter <= 0:
+            raise ValueError("fitSubsampleMaxIter must be positive")
+        if self.fitSubsampleChisqTolerance < 0.0:
+            raise ValueError("fitSubsampleChisqTolerance must be non-negative")
+        for nodeAddress in self.chisqNodes:
+            host, _, port = str(nodeAddress).rpartition(':')
+            if host == '' or not port.isdigit():
+                raise ValueError("chisqNodes must all be host:port (got %s)" % (nodeAddress))
+        if self.chisqShardNSide <= 0:
+            raise ValueError("chisqShardNSide must be positive")
+        if self.memoryBudget < 0.0:
+            raise ValueError("memoryBudget must be non-negative")
+        if self.obsPrecision not in ['float64', 'float32']:
+            raise ValueError("obsPrecision must be one of float64 or float32")
+        if self.checkpointInterval < 0:
+            raise ValueError("checkpointInterval must be non-negative")
+        if self.resume and self.checkpointPath is None:
+            raise ValueError("Must set checkpointPath to resume")
+
         if len(self.useRepeatabilityForExpGrayCuts) != 1 and \
                 len(self.useRepeatabilityForExpGrayCuts) != len(self.bands):
             raise ValueError("useRepeatabilityForExpGrayCuts must be of length 1 or number of bands")
@@ -724,6 +769,9 @@ class FgcmConfig(object):
         # default to NOT freeze atmosphere
         configDict['freezeStdAtmosphere'] = False
 
+        # the next cycle starts from the beginning
+        configDict.pop('resume', None)
+
         # do we want to increase maxIter?  Hmmm.
 
         configDict['inParameterFile'] = parFile
@@ -78,6 +78,8 @@ class FgcmExposureSelector(object):
             logFlaggedExposuresPerBand(self.fgcmLog, self.fgcmPars,
                                        'VAR_GRAY_TOO_LARGE')
 
+        self.fgcmPars.expFlagGeneration.advance()
+
         checkFlaggedExposuresPerBand(self.fgcmLog, self.fgcmPars)
 
         good,=np.where(self.fgcmPars.expFlag == 0)
@@ -114,6 +116,8 @@ class FgcmExposureSelector(object):
             logFlaggedExposuresPerBand(self.fgcmLog, self.fgcmPars,
                                        'EXP_GRAY_TOO_NEGATIVE')
 
+        self.fgcmPars.expFlagGeneration.advance()
+
         checkFlaggedExposuresPerBand(self.fgcmLog, self.fgcmPars)
 
         good,=np.where(self.fgcmPars.expFlag == 0)
@@ -157,4 +161,6 @@ class FgcmExposureSelector(object):
         if not self.quietMode:
             logFlaggedExposuresPerBand(self.fgcmLog, self.fgcmPars, 'TOO_FEW_EXP_ON_NIGHT')
 
+        self.fgcmPars.expFlagGeneration.advance()
+
         checkFlaggedExposuresPerBand(self.fgcmLog, self.fgcmPars)
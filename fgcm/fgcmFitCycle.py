@@ -2,6 +2,7 @@ from __future__ import division, absolute_import, print_function
 
 import numpy as np
 import os
+import time
 import sys
 import esutil
 import scipy.optimize as optimize
@@ -11,6 +12,8 @@ import matplotlib.pyplot as plt
 from .fgcmConfig import FgcmConfig
 from .fgcmParameters import FgcmParameters
 from .fgcmChisq import FgcmChisq
+from .fgcmChisqCluster import FgcmChisqCluster
+from .fgcmGaussNewton import FgcmGaussNewton
 from .fgcmStars import FgcmStars
 from .fgcmLUT import FgcmLUT
 from .fgcmGray import FgcmGray
@@ -30,6 +33,9 @@ from .fgcmSigmaRef import FgcmSigmaRef
 from .fgcmQeSysSlope import FgcmQeSysSlope
 from .fgcmComputeStepUnits import FgcmComputeStepUnits
 from .fgcmMirrorChromaticity import FgcmMirrorChromaticity
+from .fgcmWorkerPool import FgcmWorkerPool
+from .fgcmResourcePlanner import FgcmResourcePlanner
+from .fgcmCheckpoint import FgcmCheckpoint
 
 from .fgcmUtilities import zpFlagDict
 from .fgcmUtilities import getMemoryString
@@ -192,13 +198,34 @@ class FgcmFitCycle(object):
 
         # these are things that can happen without fits
 
+        # With a memory budget, choose nCore and nStarPerRun to fit
+        if self.fgcmConfig.memoryBudget > 0.0:
+            self.fgcmResourcePlanner = FgcmResourcePlanner(self.fgcmConfig, self.fgcmPars,
+                                                           self.fgcmStars, self.fgcmLUT)
+            self.fgcmResourcePlanner.plan()
+        else:
+            self.fgcmResourcePlanner = None
+
+        # The worker pool is shared by all the multiprocessing stages
+        #  so that the workers are not re-forked for every call
+        self.fgcmWorkerPool = FgcmWorkerPool(self.fgcmConfig.nCore, self.fgcmLog)
+
         # And prepare the chisq function
         self.fgcmChisq = FgcmChisq(self.fgcmConfig,self.fgcmPars,
-                                   self.fgcmStars,self.fgcmLUT)
+                                   self.fgcmStars,self.fgcmLUT,
+                                   fgcmWorkerPool=self.fgcmWorkerPool)
+        self.fgcmChisq.resourcePlanner = self.fgcmResourcePlanner
+
+        # And the cluster of chisq nodes (if configured), to evaluate the
+        #  fit chisq with the stars sharded across hosts
+        if len(self.fgcmConfig.chisqNodes) > 0:
+            self.fgcmChisq.cluster = FgcmChisqCluster(self.fgcmConfig, self.fgcmPars,
+                                                      self.fgcmStars)
 
         # The step unit calculator
         self.fgcmComputeStepUnits = FgcmComputeStepUnits(self.fgcmConfig, self.fgcmPars,
-                                                         self.fgcmStars, self.fgcmLUT)
+                                                         self.fgcmStars, self.fgcmLUT,
+                                                         fgcmWorkerPool=self.fgcmWorkerPool)
 
         # And the exposure selector
         self.expSelector = FgcmExposureSelector(self.fgcmConfig,self.fgcmPars)
@@ -209,6 +236,16 @@ class FgcmFitCycle(object):
         # And the qeSysSlope code
         self.fgcmQeSysSlope = FgcmQeSysSlope(self.fgcmConfig, self.fgcmPars, self.fgcmStars)
 
+        # And the checkpoint (if configured), to resume an interrupted cycle
+        if self.fgcmConfig.checkpointPath is not None:
+            self.fgcmCheckpoint = FgcmCheckpoint(self.fgcmConfig.checkpointPath,
+                                                 self._computeCheckpointKey(),
+                                                 self.fgcmLog)
+        else:
+            self.fgcmCheckpoint = None
+        # State of the fit in progress at the checkpoint (when resuming)
+        self._resumeFitState = None
+
         self.setupComplete = True
         if not self.quietMode:
             self.fgcmLog.info(getMemoryString('FitCycle Prepared'))
@@ -243,6 +280,109 @@ class FgcmFitCycle(object):
         else:
             self.fgcmLog.info('Fit cycle %d starting...' % (self.fgcmConfig.cycleNumber))
 
+        # Resume from the last checkpoint (if configured)
+        resumeStage = None
+        if self.fgcmConfig.resume:
+            resumeStage = self._restoreCheckpoint()
+
+        # Set up the magnitude error modeler
+        self.fgcmModelMagErrs = FgcmModelMagErrors(self.fgcmConfig,
+                                                   self.fgcmPars,
+                                                   self.fgcmStars)
+
+        # Run the stages, saving a checkpoint after each (if configured)
+        for stage, runStage in [('prefit', self._runPreFit),
+                                ('fit', self._runFit),
+                                ('gray', self._runGray),
+                                ('postfit', self._runPostFit)]:
+            if (self.fgcmCheckpoint is not None and
+                    self.fgcmCheckpoint.isComplete(stage, resumeStage)):
+                self.fgcmLog.info('Skipping %s stage, which was completed before the checkpoint.' %
+                                  (stage))
+                continue
+            runStage()
+            self._saveCheckpoint(stage)
+
+        # Make Zeropoints
+        # We always want to compute these because of the plots
+        # In the future we might want to streamline if something is bogging down.
+
+        self.fgcmZpts = FgcmZeropoints(self.fgcmConfig, self.fgcmPars,
+                                       self.fgcmLUT, self.fgcmGray,
+                                       self.fgcmRetrieval, self.fgcmStars)
+        self.fgcmLog.debug('FitCycle computing zeropoints.')
+        self.fgcmZpts.computeZeropoints()
+
+        # And finally compute the stars and test repeatability *after* the crunch
+        self.fgcmLog.debug('Using FgcmChisq to compute mags with CCD crunch')
+        _ = self.fgcmChisq(self.fgcmPars.getParArray(), includeReserve=True,
+                           fgcmGray=self.fgcmGray)
+
+        self.fgcmSigFgcm.computeSigFgcm(reserved=True, save=False, crunch=True)
+
+        repPhotometricCut, repHighCut = self.fgcmGray.computeExpGrayCutsFromRepeatability()
+        for i, useRep in enumerate(self.fgcmConfig.useRepeatabilityForExpGrayCuts):
+            if useRep:
+                self.updatedPhotometricCut[i] = repPhotometricCut[i]
+                self.updatedHighCut[i] = repHighCut[i]
+
+        if not self.quietMode:
+            self.fgcmLog.info(getMemoryString('After computing zeropoints'))
+
+        # We are done with the multiprocessing stages
+        self.fgcmWorkerPool.logTimingSummary()
+        self.fgcmWorkerPool.close()
+        if self.fgcmChisq.cluster is not None:
+            self.fgcmChisq.cluster.close()
+
+        if (self.useFits):
+            if self.fgcmConfig.outputZeropoints:
+                self.fgcmZpts.saveZptFits()
+                self.fgcmZpts.saveAtmFits()
+
+            # Save parameters
+            outParFile = '%s/%s_parameters.fits' % (self.fgcmConfig.outputPath,
+                                                    self.fgcmConfig.outfileBaseWithCycle)
+            self.fgcmPars.saveParsFits(outParFile)
+
+            # Save bad stars
+            outFlagStarFile = '%s/%s_flaggedstars.fits' % (self.fgcmConfig.outputPath,
+                                                           self.fgcmConfig.outfileBaseWithCycle)
+            self.fgcmStars.saveFlagStarIndices(outFlagStarFile)
+
+            if self.fgcmConfig.outputStars:
+                outStarFile = '%s/%s_stdstars.fits' % (self.fgcmConfig.outputPath,
+                                                       self.fgcmConfig.outfileBaseWithCycle)
+                self.fgcmStars.saveStdStars(outStarFile, self.fgcmPars)
+
+            # Auto-update photometric cuts
+            self.fgcmConfig.expGrayPhotometricCut[:] = self.updatedPhotometricCut
+            self.fgcmConfig.expGrayHighCut[:] = self.updatedHighCut
+
+            # Save yaml for input to next fit cycle
+            outConfFile = '%s/%s_cycle%02d_config.yml' % (self.fgcmConfig.outputPath,
+                                                          self.fgcmConfig.outfileBase,
+                                                          self.fgcmConfig.cycleNumber+1)
+            self.fgcmConfig.saveConfigForNextCycle(outConfFile,outParFile,outFlagStarFile)
+
+
+        # and make map of coverage
+
+        self.fgcmLog.debug('Making map of coverage')
+        goodExpsIndex, = np.where(self.fgcmPars.expFlag == 0)
+        self.fgcmStars.selectStarsMinObsExpIndex(goodExpsIndex)
+        self.fgcmStars.plotStarMap(mapType='final')
+
+        if not self.quietMode:
+            self.fgcmLog.info(getMemoryString('FitCycle Completed'))
+
+    def _runPreFit(self):
+        """
+        Internal method to run the stage before the fit: apply the corrections
+        from the previous cycle, select the exposures and stars, compute the
+        SEDs, the error model and the step units.
+        """
+
         # Apply aperture corrections and SuperStar if available
         # select exposures...
         if (not self.initialCycle):
@@ -261,11 +401,6 @@ class FgcmFitCycle(object):
         self.fgcmStars.selectStarsMinObsExpIndex(goodExpsIndex)
         self.fgcmStars.plotStarMap(mapType='initial')
 
-        # Set up the magnitude error modeler
-        self.fgcmModelMagErrs = FgcmModelMagErrors(self.fgcmConfig,
-                                                   self.fgcmPars,
-                                                   self.fgcmStars)
-
         # Get m^std, <m^std>, SED for all the stars.
         parArray = self.fgcmPars.getParArray(fitterUnits=False)
         if (not self.initialCycle):
@@ -289,7 +424,8 @@ class FgcmFitCycle(object):
             self.fgcmChisq(parArray,allExposures=True,includeReserve=True)
 
             # run the bright observation algorithm, computing SEDs
-            brightObs = FgcmBrightObs(self.fgcmConfig,self.fgcmPars,self.fgcmStars,self.fgcmLUT)
+            brightObs = FgcmBrightObs(self.fgcmConfig,self.fgcmPars,self.fgcmStars,self.fgcmLUT,
+                                      fgcmWorkerPool=self.fgcmWorkerPool)
             brightObs.brightestObsMeanMag(computeSEDSlopes=True)
 
             if not self.quietMode:
@@ -360,6 +496,8 @@ class FgcmFitCycle(object):
 
         # And compute the step units
         parArray = self.fgcmPars.getParArray(fitterUnits=False)
+        # nStarPerRun may have been refined by the resource planner
+        self.fgcmComputeStepUnits.nStarPerRun = self.fgcmConfig.nStarPerRun
         self.fgcmComputeStepUnits.run(parArray)
 
         # Make connectivity maps with what we know about photometric selection
@@ -374,6 +512,11 @@ class FgcmFitCycle(object):
         if not self.quietMode:
             self.fgcmLog.info(getMemoryString('FitCycle Pre-Fit'))
 
+    def _runFit(self):
+        """
+        Internal method to run the fit stage.
+        """
+
         # Perform Fit (subroutine)
         if (self.fgcmConfig.maxIter > 0):
             self._doFit(ignoreRef=False, doPlots=self.fgcmConfig.doPlots)
@@ -386,6 +529,13 @@ class FgcmFitCycle(object):
         if not self.quietMode:
             self.fgcmLog.info(getMemoryString('FitCycle Post-Fit'))
 
+    def _runGray(self):
+        """
+        Internal method to run the stage after the fit: compute the magnitudes
+        of all the stars and exposures, the exposure and ccd gray, and sigFgcm,
+        and reselect the good exposures.
+        """
+
         # another run to soak up the reserve stars...
         # FIXME: look for more efficient way of doing this
         self.fgcmLog.debug('FitCycle computing FgcmChisq all + reserve stars')
@@ -449,6 +599,13 @@ class FgcmFitCycle(object):
         self.fgcmLog.debug('FitCycle re-selecting good exposures')
         self.expSelector.selectGoodExposures()
 
+    def _runPostFit(self):
+        """
+        Internal method to run the calibration stage: compute the retrieved
+        integrals and atmosphere, superstar flats, aperture corrections, mirror
+        chromaticity, qe sys slopes, error model, sigmaCal and sigmaRef.
+        """
+
         # Compute Retrieved chromatic integrals
         self.fgcmLog.debug('FitCycle computing retrieved R0/R1')
         self.fgcmRetrieval = FgcmRetrieval(self.fgcmConfig,self.fgcmPars,
@@ -505,7 +662,8 @@ class FgcmFitCycle(object):
         #   if we don't the zeropoints before convergence will be wrong.
 
         self.fgcmLog.debug('FitCycle computing SigmaCal')
-        sigCal = FgcmSigmaCal(self.fgcmConfig, self.fgcmPars, self.fgcmStars, self.fgcmGray)
+        sigCal = FgcmSigmaCal(self.fgcmConfig, self.fgcmPars, self.fgcmStars, self.fgcmGray,
+                              fgcmWorkerPool=self.fgcmWorkerPool)
         sigCal.run()
 
         if self.fgcmStars.hasRefstars:
@@ -513,76 +671,145 @@ class FgcmFitCycle(object):
             sigRef = FgcmSigmaRef(self.fgcmConfig, self.fgcmPars, self.fgcmStars)
             sigRef.computeSigmaRef()
 
-        # Make Zeropoints
-        # We always want to compute these because of the plots
-        # In the future we might want to streamline if something is bogging down.
+    def _computeCheckpointKey(self):
+        """
+        Internal method to compute the checkpoint key from the input
+        parameters, exposure flags, stars, and the configuration.
 
-        self.fgcmZpts = FgcmZeropoints(self.fgcmConfig, self.fgcmPars,
-                                       self.fgcmLUT, self.fgcmGray,
-                                       self.fgcmRetrieval, self.fgcmStars)
-        self.fgcmLog.debug('FitCycle computing zeropoints.')
-        self.fgcmZpts.computeZeropoints()
+        returns
+        -------
+        key: string
+        """
 
-        # And finally compute the stars and test repeatability *after* the crunch
-        self.fgcmLog.debug('Using FgcmChisq to compute mags with CCD crunch')
-        _ = self.fgcmChisq(self.fgcmPars.getParArray(), includeReserve=True,
-                           fgcmGray=self.fgcmGray)
+        config = {'outfileBase': self.fgcmConfig.outfileBase,
+                  'cycleNumber': self.fgcmConfig.cycleNumber,
+                  'bands': list(self.fgcmConfig.bands),
+                  'fitBands': list(self.fgcmConfig.fitBands),
+                  'nStars': int(self.fgcmStars.nStars),
+                  'nStarObs': int(self.fgcmStars.nStarObs),
+                  'obsPrecision': self.fgcmConfig.obsPrecision,
+                  'fitSolver': self.fgcmConfig.fitSolver}
+
+        return FgcmCheckpoint.computeKey([self.fgcmPars.getParArray(fitterUnits=False),
+                                          self.fgcmPars.expFlag,
+                                          snmm.getArray(self.fgcmStars.objIDHandle),
+                                          snmm.getArray(self.fgcmStars.objFlagHandle)],
+                                         config)
+
+    def _checkpointStarArrays(self):
+        """
+        Internal method to get the names of the star arrays in checkpoints.
 
-        self.fgcmSigFgcm.computeSigFgcm(reserved=True, save=False, crunch=True)
+        returns
+        -------
+        names: list of strings
+        """
 
-        repPhotometricCut, repHighCut = self.fgcmGray.computeExpGrayCutsFromRepeatability()
-        for i, useRep in enumerate(self.fgcmConfig.useRepeatabilityForExpGrayCuts):
-            if useRep:
-                self.updatedPhotometricCut[i] = repPhotometricCut[i]
-                self.updatedHighCut[i] = repHighCut[i]
+        return [name for name in self.fgcmStars.checkpointArrays
+                if hasattr(self.fgcmStars, name + 'Handle')]
 
-        if not self.quietMode:
-            self.fgcmLog.info(getMemoryString('After computing zeropoints'))
+    def _checkpointGrayArrays(self):
+        """
+        Internal method to get the names of the gray arrays in checkpoints.
 
-        if (self.useFits):
-            if self.fgcmConfig.outputZeropoints:
-                self.fgcmZpts.saveZptFits()
-                self.fgcmZpts.saveAtmFits()
+        returns
+        -------
+        names: list of strings
+        """
 
-            # Save parameters
-            outParFile = '%s/%s_parameters.fits' % (self.fgcmConfig.outputPath,
-                                                    self.fgcmConfig.outfileBaseWithCycle)
-            self.fgcmPars.saveParsFits(outParFile)
+        return sorted([name[: -len('Handle')] for name in vars(self.fgcmGray)
+                       if name.endswith('Handle')])
 
-            # Save bad stars
-            outFlagStarFile = '%s/%s_flaggedstars.fits' % (self.fgcmConfig.outputPath,
-                                                           self.fgcmConfig.outfileBaseWithCycle)
-            self.fgcmStars.saveFlagStarIndices(outFlagStarFile)
+    def _saveCheckpoint(self, stage):
+        """
+        Internal method to save a checkpoint at the end of a stage (if configured).
 
-            if self.fgcmConfig.outputStars:
-                outStarFile = '%s/%s_stdstars.fits' % (self.fgcmConfig.outputPath,
-                                                       self.fgcmConfig.outfileBaseWithCycle)
-                self.fgcmStars.saveStdStars(outStarFile, self.fgcmPars)
+        parameters
+        ----------
+        stage: string
+           Name of the completed stage
+        """
 
-            # Auto-update photometric cuts
-            self.fgcmConfig.expGrayPhotometricCut[:] = self.updatedPhotometricCut
-            self.fgcmConfig.expGrayHighCut[:] = self.updatedHighCut
+        if self.fgcmCheckpoint is None:
+            return
 
-            # Save yaml for input to next fit cycle
-            outConfFile = '%s/%s_cycle%02d_config.yml' % (self.fgcmConfig.outputPath,
-                                                          self.fgcmConfig.outfileBase,
-                                                          self.fgcmConfig.cycleNumber+1)
-            self.fgcmConfig.saveConfigForNextCycle(outConfFile,outParFile,outFlagStarFile)
+        arrays = {}
+        values = {}
 
+        FgcmCheckpoint.getObjectState('pars', self.fgcmPars, arrays, values)
+        FgcmCheckpoint.getObjectState('stars', self.fgcmStars, arrays, values,
+                                      handleNames=self._checkpointStarArrays())
+        values['stars.magStdComputed'] = bool(self.fgcmStars.magStdComputed)
+        values['stars.allMagStdComputed'] = bool(self.fgcmStars.allMagStdComputed)
+        values['stars.sedSlopeComputed'] = bool(self.fgcmStars.sedSlopeComputed)
 
-        # and make map of coverage
+        if self.fgcmCheckpoint.isComplete('gray', stage):
+            FgcmCheckpoint.getObjectState('gray', self.fgcmGray, arrays, values,
+                                          handleNames=self._checkpointGrayArrays())
+            arrays['cycle.updatedPhotometricCut'] = self.updatedPhotometricCut
+            arrays['cycle.updatedHighCut'] = self.updatedHighCut
 
-        self.fgcmLog.debug('Making map of coverage')
-        goodExpsIndex, = np.where(self.fgcmPars.expFlag == 0)
-        self.fgcmStars.selectStarsMinObsExpIndex(goodExpsIndex)
-        self.fgcmStars.plotStarMap(mapType='final')
+        if self.fgcmCheckpoint.isComplete('postfit', stage):
+            FgcmCheckpoint.getObjectState('retrieval', self.fgcmRetrieval, arrays, values,
+                                          handleNames=['r0', 'r10'])
 
-        if not self.quietMode:
-            self.fgcmLog.info(getMemoryString('FitCycle Completed'))
+        self.fgcmCheckpoint.saveStage(stage, arrays, values)
+
+    def _restoreCheckpoint(self):
+        """
+        Internal method to restore the state from the checkpoint (and the
+        fit in progress, if any).
+
+        returns
+        -------
+        stage: string
+           Last stage completed before the checkpoint, or None if there is
+           no checkpoint for this fit cycle
+        """
+
+        stage = self.fgcmCheckpoint.stage
+        if stage is None:
+            self.fgcmLog.warn('No checkpoint for this fit cycle in %s; starting from the beginning.' %
+                              (self.fgcmCheckpoint.checkpointPath))
+            return None
+
+        self.fgcmLog.info('Resuming from the checkpoint at the end of the %s stage.' % (stage))
+
+        self.fgcmCheckpoint.setObjectState('pars', self.fgcmPars)
+        self.fgcmCheckpoint.setObjectState('stars', self.fgcmStars,
+                                           handleNames=self._checkpointStarArrays())
+
+        # The flags were replaced, so the cached selections are stale
+        self.fgcmStars.objFlagGeneration.advance()
+        self.fgcmStars.obsFlagGeneration.advance()
+        self.fgcmStars.objNGoodObsGeneration.advance()
+        self.fgcmPars.expFlagGeneration.advance()
+        self.fgcmChisq.clearMatchCache()
+
+        if self.fgcmCheckpoint.isComplete('gray', stage):
+            self.fgcmCheckpoint.setObjectState('gray', self.fgcmGray,
+                                               handleNames=self._checkpointGrayArrays())
+            self.fgcmCheckpoint.setObjectState('cycle', self)
+            self.fgcmSigFgcm = FgcmSigFgcm(self.fgcmConfig, self.fgcmPars,
+                                           self.fgcmStars)
+
+        if self.fgcmCheckpoint.isComplete('postfit', stage):
+            self.fgcmRetrieval = FgcmRetrieval(self.fgcmConfig, self.fgcmPars,
+                                               self.fgcmStars, self.fgcmLUT)
+            self.fgcmCheckpoint.setObjectState('retrieval', self.fgcmRetrieval,
+                                               handleNames=['r0', 'r10'])
+
+        if stage == 'prefit':
+            self._resumeFitState = self.fgcmCheckpoint.readFitState()
+
+        return stage
 
     def _doFit(self, doPlots=True, ignoreRef=False, maxIter=None):
         """
-        Internal method to do the fit using fmin_l_bfgs_b
+        Internal method to do the fit using fmin_l_bfgs_b, or the block
+        Gauss-Newton solver if fitSolver is gaussnewton.  If configured with
+        fitSubsampleFractions, the fit starts with coarse phases on subsamples
+        of the stars.
         """
 
         self.fgcmLog.info('Performing fit with %d iterations.' %
@@ -599,34 +826,44 @@ class FgcmFitCycle(object):
         # reset the chisq list (for plotting)
         self.fgcmChisq.resetFitChisqList()
         self.fgcmChisq.clearMatchCache()
-        self.fgcmChisq.maxIterations = maxIter
+
+        # The cluster nodes need the current parameters and stars
+        if self.fgcmChisq.cluster is not None:
+            self.fgcmChisq.cluster.sync()
 
         # In the fit, we want to compute the absolute offset if needed.  Otherwise, no.
         computeAbsThroughput = self.fgcmStars.hasRefstars
 
-        try:
-            fun = optimize.optimize.MemoizeJac(self.fgcmChisq)
-            jac = fun.derivative
-
-            res = optimize.minimize(fun,
-                                    parInitial,
-                                    args=(True,True,False,False,computeAbsThroughput,ignoreRef),
-                                    method='L-BFGS-B',
-                                    jac=jac,
-                                    bounds=parBounds,
-                                    options={'maxfun': maxIter,
-                                             'maxiter': maxIter,
-                                             'maxcor': 20,
-                                             'gtol': self.fgcmConfig.fitGradientTolerance},
-                                    callback=None)
-            pars = res.x
-
-            chisq = self.fgcmChisq.fitChisqs[-1]
-        except MaxFitIterations:
-            # We have exceeded the maximum number of iterations, force a cut
-            pars = self.fgcmPars.getParArray(fitterUnits=True)
-            chisq = self.fgcmChisq.fitChisqs[-1]
-            info = None
+        # When resuming, skip the fit phases completed before the checkpoint
+        resumeFitState = self._resumeFitState
+        self._resumeFitState = None
+        resumePhase = 0
+        if resumeFitState is not None:
+            resumePhase = int(resumeFitState['phase'])
+            self.fgcmLog.info('Resuming fit phase %d after %d chisq evaluations.' %
+                              (resumePhase, resumeFitState['fitChisqs'].size))
+
+        # Coarse fit phases on subsamples of the stars, if configured
+        nPhase = len(self.fgcmConfig.fitSubsampleFractions)
+        for phase, fraction in enumerate(self.fgcmConfig.fitSubsampleFractions):
+            if phase < resumePhase:
+                continue
+            parInitial = self._doSubsampleFit(fraction, parInitial, parBounds, ignoreRef,
+                                              phase=phase,
+                                              resumeFitState=(resumeFitState if phase == resumePhase
+                                                              else None))
+
+        fitStartTime = time.time()
+        self.fgcmChisq.maxIterations = maxIter
+
+        pars, chisq = self._runFitSolver(parInitial, parBounds, maxIter,
+                                         computeAbsThroughput, ignoreRef,
+                                         phase=nPhase,
+                                         resumeFitState=(resumeFitState if resumePhase == nPhase
+                                                         else None))
+
+        if len(self.fgcmConfig.fitSubsampleFractions) > 0:
+            self._logFitPhase('Full fit', time.time() - fitStartTime)
 
         self.fgcmLog.info('Fit completed.  Final chi^2/DOF = %.6f' % (chisq))
         self.fgcmChisq.clearMatchCache()
@@ -654,3 +891,250 @@ class FgcmFitCycle(object):
         # record new parameters
         self.fgcmPars.reloadParArray(pars, fitterUnits=True)
 
+    def _doSubsampleFit(self, fraction, parInitial, parBounds, ignoreRef, phase=0,
+                        resumeFitState=None):
+        """
+        Internal method to do a coarse fit on a spatially balanced subsample
+        of the stars.
+
+        parameters
+        ----------
+        fraction: float
+           Fraction of the good stars to use
+        parInitial: float array
+           Initial parameters (fitter units)
+        parBounds: list of tuples
+           Parameter bounds (fitter units)
+        ignoreRef: bool
+           Ignore reference stars
+        phase: int, default=0
+           Index of the fit phase (for checkpoints)
+        resumeFitState: dict, optional
+           State of this fit phase at the checkpoint to resume from
+
+        returns
+        -------
+        pars: float array
+           Fit parameters (fitter units)
+        """
+
+        startTime = time.time()
+
+        goodStars = self.fgcmStars.getGoodStarIndices()
+        subStars = self.fgcmStars.getSubsampleStarIndices(goodStars, fraction,
+                                                          self.fgcmConfig.fitSubsampleNSide)
+
+        self.fgcmLog.info('Subsample fit with %d of %d stars (fraction %.3f)' %
+                          (subStars.size, goodStars.size, fraction))
+
+        self.fgcmChisq.resetFitChisqList()
+        self.fgcmChisq.subsampleStars = subStars
+        self.fgcmChisq.subsampleFraction = float(subStars.size) / float(goodStars.size)
+        self.fgcmChisq.maxIterations = self.fgcmConfig.fitSubsampleMaxIter
+
+        # The absolute throughput is computed in the full fit
+        try:
+            pars, _ = self._runFitSolver(parInitial, parBounds,
+                                         self.fgcmConfig.fitSubsampleMaxIter,
+                                         False, ignoreRef, phase=phase,
+                                         resumeFitState=resumeFitState,
+                                         chisqTolerance=self.fgcmConfig.fitSubsampleChisqTolerance)
+        finally:
+            self.fgcmChisq.subsampleStars = None
+            self.fgcmChisq.subsampleFraction = 1.0
+
+        self._logFitPhase('Subsample fit (fraction %.3f)' % (fraction),
+                          time.time() - startTime)
+
+        self.fgcmChisq.resetFitChisqList()
+
+        return pars
+
+    def _logFitPhase(self, phaseName, phaseTime):
+        """
+        Internal method to log the chisq trajectory and time of a fit phase.
+
+        parameters
+        ----------
+        phaseName: string
+           Name of the fit phase
+        phaseTime: float
+           Wall time of the fit phase (seconds)
+        """
+
+        chisqValues = np.array(self.fgcmChisq.fitChisqs)
+        if chisqValues.size == 0:
+            return
+
+        self.fgcmLog.info('%s: %d chisq evaluations in %.2f seconds, chi^2/DOF %.6f -> %.6f' %
+                          (phaseName, chisqValues.size, phaseTime, chisqValues[0], chisqValues[-1]))
+        self.fgcmLog.info('%s chi^2/DOF trajectory: %s' %
+                          (phaseName, ', '.join(['%.6f' % (c) for c in chisqValues])))
+
+    def _runFitSolver(self, parInitial, parBounds, maxIter, computeAbsThroughput, ignoreRef,
+                      phase=0, resumeFitState=None, chisqTolerance=0.0):
+        """
+        Internal method to run the configured fit solver.
+
+        parameters
+        ----------
+        parInitial: float array
+           Initial parameters (fitter units)
+        parBounds: list of tuples
+           Parameter bounds (fitter units)
+        maxIter: int
+           Maximum number of iterations
+        computeAbsThroughput: bool
+           Compute the absolute throughput with each chisq evaluation
+        ignoreRef: bool
+           Ignore reference stars
+        phase: int, default=0
+           Index of the fit phase (for checkpoints)
+        resumeFitState: dict, optional
+           State of this fit phase at the checkpoint to resume from
+        chisqTolerance: float, default=0.0
+           Stop the fit when the relative improvement of the best chisq
+           falls below this value (0 for the solver default)
+
+        returns
+        -------
+        pars: float array
+           Fit parameters (fitter units)
+        chisq: float
+           Final chisq/DOF
+        """
+
+        # When resuming, continue from the checkpoint parameters with the
+        #  remaining chisq evaluations.
+        initialDamping = None
+        iterParsPrevious = []
+        iterGradsPrevious = []
+        if resumeFitState is not None:
+            parInitial = resumeFitState['pars']
+            self.fgcmChisq.setFitChisqList(resumeFitState['fitChisqs'])
+            maxIter = max(maxIter - len(self.fgcmChisq.fitChisqs), 1)
+            initialDamping = float(resumeFitState['damping'])
+            # The last iterate is the first evaluation of the resumed fit
+            iterParsPrevious = list(resumeFitState['iterPars'][: -1])
+            iterGradsPrevious = list(resumeFitState['iterGrads'][: -1])
+        self._fitCheckpointNEval = len(self.fgcmChisq.fitChisqs)
+
+        if self.fgcmConfig.fitSolver == 'gaussnewton':
+            # The Gauss-Newton solver counts its own chisq evaluations, and
+            #  always finishes at the best fit.
+            self.fgcmChisq.maxIterations = -1
+
+            def checkpointStep(pars, chisq, damping, nEval):
+                self._checkpointFit(phase, pars, damping=damping)
+
+            gaussNewtonChisqTolerance = None
+            if chisqTolerance > 0.0:
+                gaussNewtonChisqTolerance = max(chisqTolerance,
+                                                self.fgcmConfig.gaussNewtonChisqTolerance)
+
+            fgcmGaussNewton = FgcmGaussNewton(self.fgcmConfig, self.fgcmPars, self.fgcmChisq)
+            pars, chisq = fgcmGaussNewton.fit(parInitial, parBounds, maxIter,
+                                              computeAbsThroughput=computeAbsThroughput,
+                                              ignoreRef=ignoreRef,
+                                              initialDamping=initialDamping,
+                                              callback=checkpointStep,
+                                              chisqTolerance=gaussNewtonChisqTolerance)
+        else:
+            # Record the parameters and gradient of each chisq evaluation, to
+            #  estimate the fit curvature for warm-starting the next cycle
+            evalPars = []
+            evalGrads = []
+            iterIndices = [0]
+
+            def chisqWithHistory(fitParams, *args):
+                chisq, dChisqdP = self.fgcmChisq(fitParams, *args)
+                evalPars.append(np.array(fitParams, dtype=np.float64))
+                evalGrads.append(np.array(dChisqdP, dtype=np.float64))
+                return chisq, dChisqdP
+
+            def recordIteration(xk):
+                # The accepted iterate is the last chisq evaluation
+                if len(evalPars) > 0 and np.array_equal(evalPars[-1], xk):
+                    iterIndices.append(len(evalPars) - 1)
+                    # The optimizer state cannot be saved, so a resumed fit
+                    #  restarts from the iterate (with the curvature history)
+                    self._checkpointFit(phase, xk,
+                                        iterPars=iterParsPrevious + [evalPars[i] for i in iterIndices],
+                                        iterGrads=iterGradsPrevious + [evalGrads[i] for i in iterIndices])
+
+            self.fgcmChisq.chisqTolerance = chisqTolerance
+            try:
+                fun = optimize.optimize.MemoizeJac(chisqWithHistory)
+                jac = fun.derivative
+
+                res = optimize.minimize(fun,
+                                        parInitial,
+                                        args=(True,True,False,False,computeAbsThroughput,ignoreRef),
+                                        method='L-BFGS-B',
+                                        jac=jac,
+                                        bounds=parBounds,
+                                        options={'maxfun': maxIter,
+                                                 'maxiter': maxIter,
+                                                 'maxcor': 20,
+                                                 'gtol': self.fgcmConfig.fitGradientTolerance},
+                                        callback=recordIteration)
+                pars = res.x
+
+                chisq = self.fgcmChisq.fitChisqs[-1]
+            except MaxFitIterations:
+                # We have exceeded the maximum number of iterations, force a cut
+                pars = self.fgcmPars.getParArray(fitterUnits=True)
+                chisq = self.fgcmChisq.fitChisqs[-1]
+                info = None
+            finally:
+                self.fgcmChisq.chisqTolerance = 0.0
+
+            self.fgcmLog.info('L-BFGS-B fit took %d iterations and %d chisq evaluations (warm start: %s).' %
+                              (len(iterIndices) - 1, len(evalPars), self.fgcmConfig.fitWarmStart))
+
+            if len(evalPars) > 0:
+                self.fgcmPars.updateFitCurvature(iterParsPrevious + [evalPars[i] for i in iterIndices],
+                                                 iterGradsPrevious + [evalGrads[i] for i in iterIndices])
+
+        return pars, chisq
+
+    def _checkpointFit(self, phase, pars, damping=0.0, iterPars=None, iterGrads=None):
+        """
+        Internal method to save the state of the fit in progress, if configured
+        and at least checkpointInterval chisq evaluations were made since the
+        last save.
+
+        parameters
+        ----------
+        phase: int
+           Index of the fit phase
+        pars: float array
+           Current parameters (fitter units)
+        damping: float, default=0.0
+           Current damping (Gauss-Newton solver)
+        iterPars: list of float arrays, optional
+           Parameters (fitter units) at each fit iteration so far
+        iterGrads: list of float arrays, optional
+           Chisq gradient (fitter units) at each fit iteration so far
+        """
+
+        if self.fgcmCheckpoint is None or self.fgcmConfig.checkpointInterval == 0:
+            return
+
+        nEval = len(self.fgcmChisq.fitChisqs)
+        if (nEval - self._fitCheckpointNEval) < self.fgcmConfig.checkpointInterval:
+            return
+        self._fitCheckpointNEval = nEval
+
+        if iterPars is None:
+            iterPars = np.zeros((0, pars.size))
+            iterGrads = np.zeros((0, pars.size))
+
+        self.fgcmCheckpoint.saveFitState({'phase': phase,
+                                          'pars': np.array(pars, dtype=np.float64),
+                                          'damping': damping,
+                                          'fitChisqs': np.array(self.fgcmChisq.fitChisqs),
+                                          'iterPars': np.array(iterPars),
+                                          'iterGrads': np.array(iterGrads)})
+
+        self.fgcmLog.info('Saved fit checkpoint after %d chisq evaluations.' % (nEval))
@@ -95,6 +95,7 @@ class FgcmFlagVariables(object):
 
         # and flag
         objFlag[goodStars[varStars]] |= objFlagDict['VARIABLE']
+        self.fgcmStars.objFlagGeneration.advance()
 
         # log this
         self.fgcmLog.info('Found %d variable objects' % (varStars.size))
@@ -0,0 +1,368 @@
+from __future__ import division, absolute_import, print_function
+from builtins import range
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+import time
+
+
+class FgcmGaussNewton(object):
+    """
+    Class which fits the parameters with a block-structured Gauss-Newton solver.
+
+    Each observation constrains the atmosphere parameters of a single night, so
+    the normal equations are dominated by blocks for the nightly parameters
+    plus a dense block for the global (scale, instrument and filter offset)
+    parameters; nights only couple through the mean magnitudes of stars they
+    share.  Each step is solved with conjugate gradients, preconditioned with
+    the block solve (a Schur complement on the global block), with
+    Levenberg-Marquardt damping (updated with the ratio of the actual to the
+    predicted chisq reduction) and the parameter bounds enforced by
+    projection.
+
+    parameters
+    ----------
+    fgcmConfig: FgcmConfig
+       Config object
+    fgcmPars: FgcmParameters
+       Parameter object
+    fgcmChisq: FgcmChisq
+       Chisq object
+    """
+
+    # Initial, minimum and maximum Levenberg-Marquardt damping
+    initialDamping = 1e-3
+    minDamping = 1e-9
+    maxDamping = 1e10
+    # Maximum number of conjugate gradient iterations per step
+    maxCGIter = 100
+
+    def __init__(self, fgcmConfig, fgcmPars, fgcmChisq):
+        self.fgcmLog = fgcmConfig.fgcmLog
+
+        self.fgcmLog.debug('Initializing FgcmGaussNewton')
+
+        self.fgcmPars = fgcmPars
+        self.fgcmChisq = fgcmChisq
+
+        self.chisqTolerance = fgcmConfig.gaussNewtonChisqTolerance
+        self.quietMode = fgcmConfig.quietMode
+
+    def fit(self, parInitial, parBounds, maxIter, computeAbsThroughput=False, ignoreRef=False,
+            initialDamping=None, callback=None, chisqTolerance=None):
+        """
+        Fit the parameters.  On return, the chisq (and parameters in fgcmPars)
+        have been computed at the best-fit parameters.
+
+        parameters
+        ----------
+        parInitial: float array
+           Initial parameters (fitter units)
+        parBounds: list of tuples
+           Parameter bounds (fitter units), from fgcmPars.getParBounds()
+        maxIter: int
+           Maximum number of chisq evaluations
+        computeAbsThroughput: bool, default=False
+           Compute the absolute throughput with each evaluation
+        ignoreRef: bool, default=False
+           Ignore reference stars
+        initialDamping: float, optional
+           Initial Levenberg-Marquardt damping (when resuming a fit)
+        callback: function, optional
+           Called as callback(pars, chisq, damping, nEval) after each
+           accepted step
+        chisqTolerance: float, optional
+           Relative chisq improvement at which the fit is converged, if not
+           gaussNewtonChisqTolerance
+
+        returns
+        -------
+        pars: float array
+           Best-fit parameters (fitter units)
+        chisq: float
+           Best-fit chisq/DOF
+        """
+
+        startTime = time.time()
+
+        if chisqTolerance is None:
+            chisqTolerance = self.chisqTolerance
+
+        lowBounds = np.array([-np.inf if b[0] is None else b[0] for b in parBounds])
+        highBounds = np.array([np.inf if b[1] is None else b[1] for b in parBounds])
+        fixed = (lowBounds == highBounds)
+
+        self.parNightIndex = self.fgcmPars.getParNightIndex()
+
+        bestPars = np.clip(np.array(parInitial, dtype=np.float64), lowBounds, highBounds)
+        bestChisq, normalMatrix, normalVector = self._evaluate(bestPars,
+                                                               computeAbsThroughput,
+                                                               ignoreRef)
+        nEval = 1
+        atBest = True
+        damping = self.initialDamping if initialDamping is None else initialDamping
+        dampingFactor = 2.0
+
+        while nEval < maxIter:
+            # Parameters at an active bound (where the step would go out of
+            #  bounds) are held fixed for this step
+            diag = normalMatrix.diagonal()
+            free = ((diag > 0.0) & (~fixed) &
+                    ~((bestPars <= lowBounds) & (normalVector > 0.0)) &
+                    ~((bestPars >= highBounds) & (normalVector < 0.0)))
+
+            step = self._solveStep(normalMatrix, normalVector, damping, free)
+            trialPars = np.clip(bestPars + step, lowBounds, highBounds)
+
+            if np.all(trialPars == bestPars):
+                break
+
+            # Reduction in chisq/DOF predicted by the linearized model
+            #  (the normal equations are per degree of freedom)
+            step = trialPars - bestPars
+            predicted = -(2.0 * np.dot(step, normalVector) +
+                          np.dot(step, normalMatrix.dot(step)))
+
+            trialChisq, trialMatrix, trialVector = self._evaluate(trialPars,
+                                                                  computeAbsThroughput,
+                                                                  ignoreRef)
+            nEval += 1
+
+            if trialChisq < bestChisq:
+                converged = ((bestChisq - trialChisq) / bestChisq) < chisqTolerance
+
+                # Reduce the damping if the model predicted the step well
+                gainRatio = (bestChisq - trialChisq) / max(predicted, 1e-300)
+                damping = max(damping * max(1. / 3., 1. - (2. * gainRatio - 1.)**3.),
+                              self.minDamping)
+                dampingFactor = 2.0
+
+                bestPars = trialPars
+                bestChisq = trialChisq
+                normalMatrix = trialMatrix
+                normalVector = trialVector
+                atBest = True
+
+                if callback is not None:
+                    callback(bestPars, bestChisq, damping, nEval)
+
+                if converged:
+                    break
+            else:
+                atBest = False
+                damping *= dampingFactor
+                dampingFactor *= 2.0
+                if damping > self.maxDamping:
+                    break
+
+        if not atBest:
+            # Make sure the magnitudes and exposure parameters correspond to
+            #  the best fit.
+            self._evaluate(bestPars, computeAbsThroughput, ignoreRef)
+
+        if not self.quietMode:
+            self.fgcmLog.info('Gauss-Newton fit took %d chisq evaluations (%.2f seconds).' %
+                              (nEval, time.time() - startTime))
+
+        return bestPars, bestChisq
+
+    def _evaluate(self, pars, computeAbsThroughput, ignoreRef):
+        """
+        Compute the chisq and the normal equations.  Not to be called on its own.
+
+        parameters
+        ----------
+        pars: float array
+           Parameters (fitter units)
+        computeAbsThroughput: bool
+           Compute the absolute throughput
+        ignoreRef: bool
+           Ignore reference stars
+
+        returns
+        -------
+        chisq: float
+           chisq/DOF
+        normalMatrix: scipy.sparse.csr_matrix
+           J^T W J
+        normalVector: float array
+           J^T W r
+        """
+
+        chisq, _ = self.fgcmChisq(pars, fitterUnits=True, computeDerivatives=True,
+                                  computeAbsThroughput=computeAbsThroughput,
+                                  ignoreRef=ignoreRef, computeNormalEquations=True)
+
+        return chisq, self.fgcmChisq.normalMatrix, self.fgcmChisq.normalVector
+
+    def _solveStep(self, normalMatrix, normalVector, damping, free):
+        """
+        Solve the damped normal equations for the step with conjugate
+        gradients, preconditioned with the block (nightly + global) solve.
+        Not to be called on its own.
+
+        parameters
+        ----------
+        normalMatrix: scipy.sparse.csr_matrix
+           J^T W J
+        normalVector: float array
+           J^T W r
+        damping: float
+           Levenberg-Marquardt damping (relative to the diagonal)
+        free: bool array
+           Parameters that are free in this step
+
+        returns
+        -------
+        step: float array
+           Step in the parameters (zero for the parameters that are not free)
+        """
+
+        step = np.zeros(normalVector.size)
+
+        freeIndex, = np.where(free)
+        if freeIndex.size == 0:
+            return step
+
+        hFree = normalMatrix.tocsr()[freeIndex, :][:, freeIndex]
+        hFree = (hFree + scipy.sparse.diags(damping * hFree.diagonal())).tocsr()
+        gFree = normalVector[freeIndex]
+
+        blockSolve = self._blockSolver(hFree, self.parNightIndex[freeIndex])
+
+        # The star means couple nights that share stars, so the block solve
+        #  is only approximate; it is refined with conjugate gradients.
+        preconditioner = scipy.sparse.linalg.LinearOperator(hFree.shape, matvec=blockSolve,
+                                                            dtype=np.float64)
+        stepFree, _ = scipy.sparse.linalg.cg(hFree, -gFree, x0=blockSolve(-gFree),
+                                                M=preconditioner, maxiter=self.maxCGIter)
+
+        step[freeIndex] = stepFree
+
+        return step
+
+    def _blockSolver(self, hFree, nightIndex):
+        """
+        Make a function to solve with the nightly blocks and the global block
+        of the normal matrix (with a Schur complement on the global block),
+        dropping the couplings between different nights.  Not to be called
+        on its own.
+
+        parameters
+        ----------
+        hFree: scipy.sparse.csr_matrix
+           Damped normal matrix of the free parameters
+        nightIndex: int array
+           Night index of each free parameter (-1 for global parameters)
+
+        returns
+        -------
+        blockSolve: function
+           Function which returns the approximate solution x of hFree x = b
+        """
+
+        # Order the nightly parameters by night, followed by the global parameters
+        nightly, = np.where(nightIndex >= 0)
+        nightly = nightly[np.argsort(nightIndex[nightly], kind='stable')]
+        glob, = np.where(nightIndex < 0)
+
+        if nightly.size > 0:
+            blockInv, nightOfPar, posOfPar = self._invertNightlyBlocks(hFree[nightly, :][:, nightly],
+                                                                       nightIndex[nightly])
+
+            def applyBlockInv(arr):
+                # apply the block-diagonal inverse to an (nNightly, m) array
+                arrPadded = np.zeros((blockInv.shape[0], blockInv.shape[1], arr.shape[1]))
+                arrPadded[nightOfPar, posOfPar, :] = arr
+                return np.matmul(blockInv, arrPadded)[nightOfPar, posOfPar, :]
+
+        if glob.size > 0:
+            schur = hFree[glob, :][:, glob].toarray()
+            if nightly.size > 0:
+                hCross = hFree[nightly, :][:, glob].toarray()
+                aInvB = applyBlockInv(hCross)
+                schur -= np.dot(hCross.T, aInvB)
+
+            try:
+                schurFactor = scipy.linalg.cho_factor(schur)
+            except (np.linalg.LinAlgError, ValueError):
+                schurFactor = None
+                schurPinv = np.linalg.pinv(schur)
+
+        def blockSolve(b):
+            b = np.asarray(b).ravel()
+            x = np.zeros(b.size)
+
+            if nightly.size > 0:
+                aInvG = applyBlockInv(b[nightly, np.newaxis])[:, 0]
+
+            if glob.size > 0:
+                rhs = b[glob]
+                if nightly.size > 0:
+                    rhs = rhs - np.dot(hCross.T, aInvG)
+                if schurFactor is not None:
+                    x[glob] = scipy.linalg.cho_solve(schurFactor, rhs)
+                else:
+                    x[glob] = np.dot(schurPinv, rhs)
+
+                if nightly.size > 0:
+                    x[nightly] = aInvG - np.dot(aInvB, x[glob])
+            else:
+                x[nightly] = aInvG
+
+            return x
+
+        return blockSolve
+
+    def _invertNightlyBlocks(self, hNightly, nightIndex):
+        """
+        Invert the nightly diagonal blocks of the normal matrix.  Not to be
+        called on its own.
+
+        parameters
+        ----------
+        hNightly: scipy.sparse matrix
+           Nightly part of the normal matrix, ordered by night
+        nightIndex: int array
+           Night index of each (ordered) nightly parameter
+
+        returns
+        -------
+        blockInv: float array
+           (nNights, maxParsPerNight, maxParsPerNight) inverses, padded with
+           the identity
+        nightOfPar: int array
+           Block index of each nightly parameter
+        posOfPar: int array
+           Position of each nightly parameter in its block
+        """
+
+        uNights, nightOfPar, counts = np.unique(nightIndex, return_inverse=True,
+                                                return_counts=True)
+        starts = np.cumsum(counts) - counts
+        posOfPar = np.arange(nightIndex.size) - starts[nightOfPar]
+
+        maxCount = counts.max()
+        blocks = np.zeros((uNights.size, maxCount, maxCount))
+        blocks[:, np.arange(maxCount), np.arange(maxCount)] = 1.0
+        # Clear the padding identity for the occupied positions
+        blocks[nightOfPar, posOfPar, posOfPar] = 0.0
+
+        # Only the diagonal blocks are filled; the couplings between nights
+        #  are handled by the conjugate gradient iterations.
+        hCoo = hNightly.tocoo()
+        sameNight = (nightOfPar[hCoo.row] == nightOfPar[hCoo.col])
+        np.add.at(blocks, (nightOfPar[hCoo.row[sameNight]],
+                           posOfPar[hCoo.row[sameNight]],
+                           posOfPar[hCoo.col[sameNight]]),
+                  hCoo.data[sameNight])
+
+        try:
+            blockInv = np.linalg.inv(blocks)
+        except np.linalg.LinAlgError:
+            blockInv = np.linalg.pinv(blocks)
+
+        return blockInv, nightOfPar, posOfPar
+
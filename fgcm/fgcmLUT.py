@@ -6,6 +6,7 @@ import scipy.interpolate as interpolate
 import scipy.integrate as integrate
 import os
 import sys
+from collections import namedtuple
 from pkg_resources import resource_filename
 
 
@@ -15,6 +16,69 @@ from .fgcmAtmosphereTable import FgcmAtmosphereTable
 
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
 from .fgcmLogger import FgcmLogger
+from .fgcmNumbaUtilities import lut_interp_i0_i1
+from .fgcmWorkerPool import FgcmWorkerPool
+
+try:
+    from scipy.integrate import simps as _simps
+except ImportError:
+    # simps was removed in newer scipy, and simpson changed the default
+    #  rule for an even number of samples; keep the old (even='avg') rule.
+    def _simps(y, x):
+        return np.dot(simpsonWeights(x), y)
+
+# Flat look-up table indices, returned by FgcmLUT.getIndices(..., flat=True).
+#  The offsets are int64 element offsets into the flattened LUT arrays, and
+#  the grid indices are kept for computing the interpolation deltas.
+FgcmLUTFlatIndices = namedtuple('FgcmLUTFlatIndices',
+                                ['offset', 'offsetSecZenithPlus', 'offsetPwvPlus',
+                                 'pwvIndex', 'o3Index', 'tauIndex', 'alphaIndex',
+                                 'secZenithIndex', 'pmbFactor'])
+
+
+def simpsonWeights(x):
+    """
+    Compute the weights of Simpson's rule on the samples x, such that
+     np.dot(simpsonWeights(x), y) is the Simpson's rule integral of y(x).
+
+    For an odd number of samples this is the composite Simpson's rule for
+     unequal intervals, the same as scipy.integrate.simps(y, x).  For an even
+     number of samples, the average of the two Simpson's rule + trapezoid
+     end-interval estimates is used (the scipy default before 1.11).
+
+    parameters
+    ----------
+    x: float array
+       Sample points, increasing
+
+    returns
+    -------
+    weights: float array
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+
+    if x.size < 3:
+        raise ValueError("Need at least 3 samples for Simpson's rule")
+
+    if (x.size % 2) == 0:
+        weights = np.zeros(x.size)
+        weights[:-1] += 0.5 * simpsonWeights(x[:-1])
+        weights[-2:] += 0.5 * 0.5 * (x[-1] - x[-2])
+        weights[1:] += 0.5 * simpsonWeights(x[1:])
+        weights[:2] += 0.5 * 0.5 * (x[1] - x[0])
+        return weights
+
+    h0 = x[1:-1:2] - x[0:-2:2]
+    h1 = x[2::2] - x[1:-1:2]
+    hsum = h0 + h1
+
+    weights = np.zeros(x.size)
+    weights[0:-2:2] += hsum / 6.0 * (2.0 - h1 / h0)
+    weights[1:-1:2] += hsum / 6.0 * (hsum * hsum / (h0 * h1))
+    weights[2::2] += hsum / 6.0 * (2.0 - h0 / h1)
+
+    return weights
 
 
 class FgcmLUTMaker(object):
@@ -27,6 +91,11 @@ class FgcmLUTMaker(object):
        Dictionary with LUT config variables
     makeSeds: bool, default=False
        Make a SED-table in the look-up table (experimental)
+
+    Optional lutConfig variables
+    ----------------------------
+    nCore: int, default=1
+       Number of processes to integrate the look-up table
     """
 
     def __init__(self,lutConfig,makeSeds=False):
@@ -49,6 +118,11 @@ class FgcmLUTMaker(object):
         else:
             self.fgcmLog = FgcmLogger('dummy.log', 'INFO', printLogger=True)
 
+        if 'nCore' in lutConfig:
+            self.nCore = lutConfig['nCore']
+        else:
+            self.nCore = 1
+
     def _checkLUTConfig(self,lutConfig):
         """
         Internal method to check the lutConfig dictionary
@@ -317,13 +391,8 @@ class FgcmLUTMaker(object):
         zenithPlus = np.arccos(1./secZenithPlus)*180./np.pi
 
         # and compute the proper airmass...
-        self.airmass = self.secZenith - 0.0018167*(self.secZenith-1.0) - 0.002875*(self.secZenith-1.0)**2.0 - 0.0008083*(self.secZenith-1.0)**3.0
-        airmassPlus = secZenithPlus - 0.0018167*(secZenithPlus-1.0) - 0.002875*(secZenithPlus-1.0)**2.0 - 0.0008083*(secZenithPlus-1.0)**3.0
-
-        pwvAtmTable = self.atmosphereTable.pwvAtmTable
-        o3AtmTable = self.atmosphereTable.o3AtmTable
-        o2AtmTable = self.atmosphereTable.o2AtmTable
-        rayleighAtmTable = self.atmosphereTable.rayleighAtmTable
+        self.airmass = self.secZenithToAirmass(self.secZenith)
+        airmassPlus = self.secZenithToAirmass(secZenithPlus)
 
         # get the filters over the same lambda ranges...
         self.fgcmLog.info("\nInterpolating filters...")
@@ -350,16 +419,16 @@ class FgcmLUTMaker(object):
         self.fgcmLog.info("Computing lambdaB")
         self.lambdaB = np.zeros(len(self.filterNames))
         for i in range(len(self.filterNames)):
-            num = integrate.simps(self.atmLambda * self.throughputs[i]['THROUGHPUT_AVG'] / self.atmLambda, self.atmLambda)
-            denom = integrate.simps(self.throughputs[i]['THROUGHPUT_AVG'] / self.atmLambda, self.atmLambda)
+            num = _simps(self.atmLambda * self.throughputs[i]['THROUGHPUT_AVG'] / self.atmLambda, self.atmLambda)
+            denom = _simps(self.throughputs[i]['THROUGHPUT_AVG'] / self.atmLambda, self.atmLambda)
             self.lambdaB[i] = num / denom
             self.fgcmLog.info("Filter: %s, lambdaB = %.3f" % (self.filterNames[i], self.lambdaB[i]))
 
         self.fgcmLog.info("Computing lambdaStdFilter")
         self.lambdaStdFilter = np.zeros(len(self.filterNames))
         for i in range(len(self.filterNames)):
-            num = integrate.simps(self.atmLambda * self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans / self.atmLambda, self.atmLambda)
-            denom = integrate.simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans / self.atmLambda, self.atmLambda)
+            num = _simps(self.atmLambda * self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans / self.atmLambda, self.atmLambda)
+            denom = _simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans / self.atmLambda, self.atmLambda)
             self.lambdaStdFilter[i] = num / denom
             self.fgcmLog.info("Filter: %s, lambdaStdFilter = %.3f" % (self.filterNames[i],self.lambdaStdFilter[i]))
 
@@ -381,9 +450,9 @@ class FgcmLUTMaker(object):
         self.I2Std = np.zeros(len(self.filterNames))
 
         for i in range(len(self.filterNames)):
-            self.I0Std[i] = integrate.simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans / self.atmLambda, self.atmLambda)
-            self.I1Std[i] = integrate.simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans * (self.atmLambda - self.lambdaStd[i]) / self.atmLambda, self.atmLambda)
-            self.I2Std[i] = integrate.simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans * (self.atmLambda - self.lambdaStd[i])**2. / self.atmLambda, self.atmLambda)
+            self.I0Std[i] = _simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans / self.atmLambda, self.atmLambda)
+            self.I1Std[i] = _simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans * (self.atmLambda - self.lambdaStd[i]) / self.atmLambda, self.atmLambda)
+            self.I2Std[i] = _simps(self.throughputs[i]['THROUGHPUT_AVG'] * self.atmStdTrans * (self.atmLambda - self.lambdaStd[i])**2. / self.atmLambda, self.atmLambda)
 
         self.I10Std = self.I1Std / self.I0Std
 
@@ -392,15 +461,6 @@ class FgcmLUTMaker(object):
         #################################
 
         self.fgcmLog.info("Building look-up table...")
-        lutPlus = np.zeros((len(self.filterNames),
-                            pwvPlus.size,
-                            o3Plus.size,
-                            tauPlus.size,
-                            alphaPlus.size,
-                            zenithPlus.size,
-                            self.nCCDStep),
-                           dtype=[('I0','f4'),
-                                  ('I1','f4')])
 
         # pre-compute pmb factors
         pmbMolecularScattering = np.exp(-(pmbPlus - self.pmbElevation)/self.pmbElevation)
@@ -408,25 +468,7 @@ class FgcmLUTMaker(object):
         pmbFactorPlus = pmbMolecularScattering * pmbMolecularAbsorption
         self.pmbFactor = pmbFactorPlus[:-1]
 
-        # this set of nexted for loops could probably be vectorized in some way
-        for i in range(len(self.filterNames)):
-            self.fgcmLog.info("Working on filter %s" % (self.filterNames[i]))
-            for j in range(pwvPlus.size):
-                self.fgcmLog.info("  and on pwv #%d" % (j))
-                for k in range(o3Plus.size):
-                    self.fgcmLog.info("   and on o3 #%d" % (k))
-                    for m in range(tauPlus.size):
-                        for n in range(alphaPlus.size):
-                            for o in range(zenithPlus.size):
-                                aerosolTauLambda = np.exp(-1.0*tauPlus[m]*airmassPlus[o]*(self.atmLambda/self.lambdaNorm)**(-alphaPlus[n]))
-                                for p in range(self.nCCDStep):
-                                    if (p == self.nCCD):
-                                        Sb = self.throughputs[i]['THROUGHPUT_AVG'] * o2AtmTable[o,:] * rayleighAtmTable[o,:] * pwvAtmTable[j,o,:] * o3AtmTable[k,o,:] * aerosolTauLambda
-                                    else:
-                                        Sb = self.throughputs[i]['THROUGHPUT_CCD'][:,p] * o2AtmTable[o,:] * rayleighAtmTable[o,:] * pwvAtmTable[j,o,:] * o3AtmTable[k,o,:] * aerosolTauLambda
-
-                                    lutPlus['I0'][i,j,k,m,n,o,p] = integrate.simps(Sb / self.atmLambda, self.atmLambda)
-                                    lutPlus['I1'][i,j,k,m,n,o,p] = integrate.simps(Sb * (self.atmLambda - self.lambdaStd[i]) / self.atmLambda, self.atmLambda)
+        lutPlus = self._integrateLUT(tauPlus, alphaPlus, airmassPlus)
 
         # and create the LUT (not plus)
         self.lut = np.zeros((len(self.filterNames),
@@ -484,65 +526,22 @@ class FgcmLUTMaker(object):
 
         ## FIXME: figure out PMB derivative?
 
-        for i in range(len(self.filterNames)):
-            self.fgcmLog.info("Working on filter %s" % (self.filterNames[i]))
-            for j in range(self.pwv.size):
-                for k in range(self.o3.size):
-                    for m in range(self.tau.size):
-                        for n in range(self.alpha.size):
-                            for o in range(self.zenith.size):
-                                for p in range(self.nCCDStep):
-                                    self.lutDeriv['D_LNPWV'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I0'][i,j+1,k,m,n,o,p] -
-                                          lutPlus['I0'][i,j,k,m,n,o,p]) /
-                                         self.lnPwvDelta)
-                                        )
-                                    self.lutDeriv['D_LNPWV_I1'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I1'][i,j+1,k,m,n,o,p] -
-                                          lutPlus['I1'][i,j,k,m,n,o,p]) /
-                                         self.lnPwvDelta)
-                                        )
-                                    self.lutDeriv['D_O3'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I0'][i,j,k+1,m,n,o,p] -
-                                          lutPlus['I0'][i,j,k,m,n,o,p]) /
-                                         self.o3Delta)
-                                        )
-                                    self.lutDeriv['D_O3_I1'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I1'][i,j,k+1,m,n,o,p] -
-                                          lutPlus['I1'][i,j,k,m,n,o,p]) /
-                                         self.o3Delta)
-                                        )
-                                    self.lutDeriv['D_LNTAU'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I0'][i,j,k,m+1,n,o,p] -
-                                          lutPlus['I0'][i,j,k,m,n,o,p]) /
-                                         self.lnTauDelta)
-                                        )
-                                    self.lutDeriv['D_LNTAU_I1'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I1'][i,j,k,m+1,n,o,p] -
-                                          lutPlus['I1'][i,j,k,m,n,o,p]) /
-                                         self.lnTauDelta)
-                                        )
-                                    self.lutDeriv['D_ALPHA'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I0'][i,j,k,m,n+1,o,p] -
-                                          lutPlus['I0'][i,j,k,m,n,o,p]) /
-                                         self.alphaDelta)
-                                        )
-                                    self.lutDeriv['D_ALPHA_I1'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I1'][i,j,k,m,n+1,o,p] -
-                                          lutPlus['I1'][i,j,k,m,n,o,p]) /
-                                         self.alphaDelta)
-                                        )
-                                    self.lutDeriv['D_SECZENITH'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I0'][i,j,k,m,n,o+1,p] -
-                                          lutPlus['I0'][i,j,k,m,n,o,p]) /
-                                         self.secZenithDelta)
-                                        )
-                                    self.lutDeriv['D_SECZENITH_I1'][i,j,k,m,n,o,p] = (
-                                        ((lutPlus['I1'][i,j,k,m,n,o+1,p] -
-                                          lutPlus['I1'][i,j,k,m,n,o,p]) /
-                                         self.secZenithDelta)
-                                        )
-
+        # Each derivative is a forward difference to the next "plus" grid
+        #  point along one axis.  The difference is taken in float32 and
+        #  divided in float64, as for individual elements.
+        lutShape = self.lutDeriv.shape
+        derivAxes = [('LNPWV', 1, self.lnPwvDelta),
+                     ('O3', 2, self.o3Delta),
+                     ('LNTAU', 3, self.lnTauDelta),
+                     ('ALPHA', 4, self.alphaDelta),
+                     ('SECZENITH', 5, self.secZenithDelta)]
+        for name, axis, delta in derivAxes:
+            lo = [slice(0, n) for n in lutShape]
+            hi = list(lo)
+            hi[axis] = slice(1, lutShape[axis] + 1)
+            for lutName, derivName in [('I0', 'D_' + name), ('I1', 'D_' + name + '_I1')]:
+                diff = lutPlus[lutName][tuple(hi)] - lutPlus[lutName][tuple(lo)]
+                self.lutDeriv[derivName][:] = diff.astype(np.float64) / delta
 
         if (self.makeSeds):
             # and the SED LUT
@@ -599,8 +598,8 @@ class FgcmLUTMaker(object):
 
                 # compute synthetic mags
                 for j in range(len(self.filterNames)):
-                    num = integrate.simps(fnu * self.throughputs[j]['THROUGHPUT_AVG'][:] * self.atmStdTrans / self.atmLambda, self.atmLambda)
-                    denom = integrate.simps(self.throughputs[j]['THROUGHPUT_AVG'][:] * self.atmStdTrans / self.atmLambda, self.atmLambda)
+                    num = _simps(fnu * self.throughputs[j]['THROUGHPUT_AVG'][:] * self.atmStdTrans / self.atmLambda, self.atmLambda)
+                    denom = _simps(self.throughputs[j]['THROUGHPUT_AVG'][:] * self.atmStdTrans / self.atmLambda, self.atmLambda)
 
                     self.sedLUT['SYNTHMAG'][i,j] = -2.5*np.log10(num/denom)
 
@@ -617,6 +616,193 @@ class FgcmLUTMaker(object):
 
             fits.close()
 
+    @staticmethod
+    def secZenithToAirmass(secZenith):
+        """
+        Compute the airmass from sec(zenith).
+
+        parameters
+        ----------
+        secZenith: float array
+
+        returns
+        -------
+        airmass: float array
+        """
+        return (secZenith - 0.0018167*(secZenith-1.0) - 0.002875*(secZenith-1.0)**2.0 -
+                0.0008083*(secZenith-1.0)**3.0)
+
+    def _integrateLUT(self, tauPlus, alphaPlus, airmassPlus):
+        """
+        Integrate the I0/I1 look-up table, including the "plus" grid points.
+
+        The Simpson's rule integrals over wavelength are matrix products of
+         the throughputs of all the filters and CCDs (times the Simpson
+         weights) with the atmospheric transmissions of all the
+         tau/alpha/zenith grid points, one pwv/o3 slab at a time.  With
+         nCore > 1 the pwv slabs are split over a worker pool.
+
+        parameters
+        ----------
+        tauPlus: float array
+           Aerosol optical index grid, plus one step
+        alphaPlus: float array
+           Aerosol slope grid, plus one step
+        airmassPlus: float array
+           Airmass grid, plus one step
+
+        returns
+        -------
+        lutPlus: numpy recarray
+           I0 and I1, shape (nFilter, nPwvPlus, nO3Plus, nTauPlus, nAlphaPlus,
+           nZenithPlus, nCCD + 1)
+        """
+
+        nFilter = len(self.filterNames)
+        nPwvPlus = self.atmosphereTable.pwvAtmTable.shape[0]
+        nO3Plus = self.atmosphereTable.o3AtmTable.shape[0]
+
+        # The throughput kernels, with rows for each (I0/I1, filter, ccd),
+        #  where the last "ccd" is the focal plane average
+        weights = simpsonWeights(self.atmLambda) / self.atmLambda
+
+        tputs = np.zeros((nFilter, self.nCCDStep, self.atmLambda.size))
+        for i in range(nFilter):
+            tputs[i, :self.nCCD, :] = self.throughputs[i]['THROUGHPUT_CCD'].T
+            tputs[i, self.nCCD, :] = self.throughputs[i]['THROUGHPUT_AVG']
+        tputs *= weights
+
+        lambdaOffset = self.atmLambda[np.newaxis, :] - self.lambdaStd[:, np.newaxis]
+        self._lutKernel = np.concatenate((tputs.reshape(-1, self.atmLambda.size),
+                                          (tputs * lambdaOffset[:, np.newaxis, :]).reshape(-1, self.atmLambda.size)))
+
+        # The aerosol transmission for each (tau, alpha, zenith)
+        self._lutAerosol = np.exp(-1.0 * tauPlus[:, np.newaxis, np.newaxis, np.newaxis] *
+                                  airmassPlus[np.newaxis, np.newaxis, :, np.newaxis] *
+                                  (self.atmLambda / self.lambdaNorm)[np.newaxis, np.newaxis, np.newaxis, :] **
+                                  (-alphaPlus[np.newaxis, :, np.newaxis, np.newaxis]))
+
+        lutPlus = np.zeros((nFilter,
+                            nPwvPlus,
+                            nO3Plus,
+                            tauPlus.size,
+                            alphaPlus.size,
+                            airmassPlus.size,
+                            self.nCCDStep),
+                           dtype=[('I0','f4'),
+                                  ('I1','f4')])
+
+        pwvIndices = list(range(nPwvPlus))
+        if self.nCore > 1:
+            pool = FgcmWorkerPool(self.nCore, self.fgcmLog)
+            slabs = pool.map(self, '_integrateLUTSlab', pwvIndices)
+            pool.close()
+        else:
+            slabs = [self._integrateLUTSlab(j) for j in pwvIndices]
+
+        for j, slab in zip(pwvIndices, slabs):
+            lutPlus['I0'][:, j] = slab[0]
+            lutPlus['I1'][:, j] = slab[1]
+
+        self._lutKernel = None
+        self._lutAerosol = None
+
+        return lutPlus
+
+    def _integrateLUTSlab(self, pwvIndex):
+        """
+        Integrate the I0/I1 look-up table for one pwv grid point.  Not to be
+         called on its own; see _integrateLUT().
+
+        parameters
+        ----------
+        pwvIndex: int
+           Index in the pwv ("plus") grid
+
+        returns
+        -------
+        slab: float array
+           I0/I1 for this pwv, shape (2, nFilter, nO3Plus, nTauPlus,
+           nAlphaPlus, nZenithPlus, nCCD + 1)
+        """
+
+        nFilter = len(self.filterNames)
+        nO3Plus = self.atmosphereTable.o3AtmTable.shape[0]
+        nTau, nAlpha, nZenith, nLambda = self._lutAerosol.shape
+
+        self.fgcmLog.info("  Working on pwv #%d" % (pwvIndex))
+
+        slab = np.zeros((2, nFilter, nO3Plus, nTau, nAlpha, nZenith, self.nCCDStep),
+                        dtype=np.float32)
+
+        for k in range(nO3Plus):
+            atmTrans = (self.atmosphereTable.o2AtmTable *
+                        self.atmosphereTable.rayleighAtmTable *
+                        self.atmosphereTable.pwvAtmTable[pwvIndex, :, :] *
+                        self.atmosphereTable.o3AtmTable[k, :, :])
+            trans = (self._lutAerosol * atmTrans[np.newaxis, np.newaxis, :, :]).reshape(-1, nLambda)
+
+            # (I0/I1, filter, ccd) x (tau, alpha, zenith)
+            integrals = np.dot(self._lutKernel, trans.T)
+            integrals = integrals.reshape(2, nFilter, self.nCCDStep, nTau, nAlpha, nZenith)
+            slab[:, :, k, :, :, :, :] = np.moveaxis(integrals, 2, -1)
+
+        return slab
+
+    def _integrateLUTLoop(self, tauPlus, alphaPlus, airmassPlus):
+        """
+        Integrate the I0/I1 look-up table one grid point at a time.  This is
+         the slow reference for _integrateLUT(), and is only used to check it
+         (see benchmarkFgcmLUTMaker.py).
+
+        parameters
+        ----------
+        tauPlus: float array
+           Aerosol optical index grid, plus one step
+        alphaPlus: float array
+           Aerosol slope grid, plus one step
+        airmassPlus: float array
+           Airmass grid, plus one step
+
+        returns
+        -------
+        lutPlus: numpy recarray
+           I0 and I1, as for _integrateLUT()
+        """
+
+        pwvAtmTable = self.atmosphereTable.pwvAtmTable
+        o3AtmTable = self.atmosphereTable.o3AtmTable
+        o2AtmTable = self.atmosphereTable.o2AtmTable
+        rayleighAtmTable = self.atmosphereTable.rayleighAtmTable
+
+        lutPlus = np.zeros((len(self.filterNames),
+                            pwvAtmTable.shape[0],
+                            o3AtmTable.shape[0],
+                            tauPlus.size,
+                            alphaPlus.size,
+                            airmassPlus.size,
+                            self.nCCDStep),
+                           dtype=[('I0','f4'),
+                                  ('I1','f4')])
+
+        for i in range(len(self.filterNames)):
+            for j in range(pwvAtmTable.shape[0]):
+                for k in range(o3AtmTable.shape[0]):
+                    for m in range(tauPlus.size):
+                        for n in range(alphaPlus.size):
+                            for o in range(airmassPlus.size):
+                                aerosolTauLambda = np.exp(-1.0*tauPlus[m]*airmassPlus[o]*(self.atmLambda/self.lambdaNorm)**(-alphaPlus[n]))
+                                for p in range(self.nCCDStep):
+                                    if (p == self.nCCD):
+                                        Sb = self.throughputs[i]['THROUGHPUT_AVG'] * o2AtmTable[o,:] * rayleighAtmTable[o,:] * pwvAtmTable[j,o,:] * o3AtmTable[k,o,:] * aerosolTauLambda
+                                    else:
+                                        Sb = self.throughputs[i]['THROUGHPUT_CCD'][:,p] * o2AtmTable[o,:] * rayleighAtmTable[o,:] * pwvAtmTable[j,o,:] * o3AtmTable[k,o,:] * aerosolTauLambda
+
+                                    lutPlus['I0'][i,j,k,m,n,o,p] = _simps(Sb / self.atmLambda, self.atmLambda)
+                                    lutPlus['I1'][i,j,k,m,n,o,p] = _simps(Sb * (self.atmLambda - self.lambdaStd[i]) / self.atmLambda, self.atmLambda)
+
+        return lutPlus
+
     def saveLUT(self,lutFile,clobber=False):
         """
         """
@@ -791,6 +977,9 @@ class FgcmLUT(object):
         sizeTuple = (len(self.filterNames), self.pwv.size, self.o3.size,
                      self.tau.size, self.alpha.size, self.zenith.size, self.nCCDStep)
 
+        # element strides of the LUT arrays, for flat indexing
+        self.lutStrides = np.cumprod((1,) + sizeTuple[: 0: -1])[:: -1].astype(np.int64)
+
         self.lutI0Handle = snmm.createArray(sizeTuple,dtype='f4')
         snmm.getArray(self.lutI0Handle)[:, :, :, :, :, :, :] = \
             lutFlat['I0'].reshape(origSizeTuple)[usedLutFilterMark, :, :, :, :, :, :]
@@ -909,7 +1098,8 @@ class FgcmLUT(object):
                    sedLUT=sedLUT, filterToBand=filterToBand)
 
 
-    def getIndices(self, filterIndex, lnPwv, o3, lnTau, alpha, secZenith, ccdIndex, pmb):
+    def getIndices(self, filterIndex, lnPwv, o3, lnTau, alpha, secZenith, ccdIndex, pmb,
+                   flat=False):
         """
         Compute indices in the look-up table.  These are in regular (non-normalized) units.
 
@@ -925,22 +1115,78 @@ class FgcmLUT(object):
         ccdIndex: int array
            Array with values point to the ccd index
         pmb: float array
+        flat: bool, default=False
+           Return FgcmLUTFlatIndices with int64 offsets into the flattened
+           LUT arrays rather than a tuple of per-axis indices.
+
+        returns
+        -------
+        indices: tuple or FgcmLUTFlatIndices
+        """
+
+        indices = (filterIndex,
+                   np.clip(((lnPwv - self.lnPwv[0])/self.lnPwvDelta).astype(np.int32), 0,
+                           self.lnPwv.size-1),
+                   np.clip(((o3 - self.o3[0])/self.o3Delta).astype(np.int32), 0,
+                           self.o3.size-1),
+                   np.clip(((lnTau - self.lnTau[0])/self.lnTauDelta).astype(np.int32), 0,
+                           self.lnTau.size-1),
+                   np.clip(((alpha - self.alpha[0])/self.alphaDelta).astype(np.int32), 0,
+                           self.alpha.size-1),
+                   np.clip(((secZenith - self.secZenith[0])/self.secZenithDelta).astype(np.int32), 0,
+                           self.secZenith.size-1),
+                   ccdIndex,
+                   (np.exp(-(pmb - self.pmbElevation)/self.pmbElevation)) ** 1.6)
+
+        if flat:
+            return self._flattenIndices(indices)
+
+        return indices
+
+    def _flattenIndices(self, indices):
+        """
+        Convert a tuple of indices from getIndices() to FgcmLUTFlatIndices.
+
+        parameters
+        ----------
+        indices: tuple, from getIndices()
+
+        returns
+        -------
+        flatIndices: FgcmLUTFlatIndices
+        """
+
+        offset = np.zeros(np.size(indices[1]), dtype=np.int64)
+        for i in range(len(self.lutStrides)):
+            offset += np.asarray(indices[i], dtype=np.int64) * self.lutStrides[i]
+
+        # Neighbouring offsets, clipped at the edge of the grid
+        offsetSecZenithPlus = offset + (indices[5] < (self.secZenith.size - 1)) * self.lutStrides[5]
+        offsetPwvPlus = offset + (indices[1] < (self.lnPwv.size - 1)) * self.lutStrides[1]
+
+        return FgcmLUTFlatIndices(offset, offsetSecZenithPlus, offsetPwvPlus,
+                                  indices[1], indices[2], indices[3], indices[4], indices[5],
+                                  indices[-1])
+
+    def _getLUTValues(self, handle, indices):
+        """
+        Gather values from a look-up table.
+
+        parameters
+        ----------
+        handle: snmm handle
+           Handle of the look-up table array
+        indices: tuple or FgcmLUTFlatIndices, from getIndices()
+
+        returns
+        -------
+        values: float array
         """
 
-        return (filterIndex,
-                np.clip(((lnPwv - self.lnPwv[0])/self.lnPwvDelta).astype(np.int32), 0,
-                        self.lnPwv.size-1),
-                np.clip(((o3 - self.o3[0])/self.o3Delta).astype(np.int32), 0,
-                        self.o3.size-1),
-                np.clip(((lnTau - self.lnTau[0])/self.lnTauDelta).astype(np.int32), 0,
-                        self.lnTau.size-1),
-                np.clip(((alpha - self.alpha[0])/self.alphaDelta).astype(np.int32), 0,
-                        self.alpha.size-1),
-                np.clip(((secZenith - self.secZenith[0])/self.secZenithDelta).astype(np.int32), 0,
-                        self.secZenith.size-1),
-                ccdIndex,
-                (np.exp(-(pmb - self.pmbElevation)/self.pmbElevation)) ** 1.6)
+        if isinstance(indices, FgcmLUTFlatIndices):
+            return snmm.getArray(handle).reshape(-1).take(indices.offset)
 
+        return snmm.getArray(handle)[indices[:-1]]
 
     def computeI0(self, lnPwv, o3, lnTau, alpha, secZenith, pmb, indices):
         """
@@ -1030,6 +1276,63 @@ class FgcmLUT(object):
                             dlnPwv * (dlnPwv - self.lnPwvDelta) * (snmm.getArray(self.lutDLnPwvI1Handle)[tuple(indicesPwvPlus)] -
                                                              snmm.getArray(self.lutDLnPwvI1Handle)[indices[:-1]]))
 
+    def computeI0I1(self, lnPwv, o3, lnTau, alpha, secZenith, pmb, indices):
+        """
+        Compute I0, I1, and I10 from the look-up table in a single pass.  This
+         gives the same results as computeI0() and computeI1(), but uses the
+         fused interpolation kernel in fgcmNumbaUtilities (with a numpy fallback).
+
+        parameters
+        ----------
+        lnPwv: float array
+        o3: float array
+        lnTau: float array
+        alpha: float array
+        secZenith: float array
+        pmb: float array
+        indices: tuple or FgcmLUTFlatIndices, from getIndices()
+
+        returns
+        -------
+        I0: float array
+        I1: float array
+        I10: float array
+        """
+
+        if not isinstance(indices, FgcmLUTFlatIndices):
+            indices = self._flattenIndices(indices)
+
+        i0Luts = (snmm.getArray(self.lutI0Handle).reshape(-1),
+                  snmm.getArray(self.lutDLnPwvHandle).reshape(-1),
+                  snmm.getArray(self.lutDO3Handle).reshape(-1),
+                  snmm.getArray(self.lutDLnTauHandle).reshape(-1),
+                  snmm.getArray(self.lutDAlphaHandle).reshape(-1),
+                  snmm.getArray(self.lutDSecZenithHandle).reshape(-1))
+        i1Luts = (snmm.getArray(self.lutI1Handle).reshape(-1),
+                  snmm.getArray(self.lutDLnPwvI1Handle).reshape(-1),
+                  snmm.getArray(self.lutDO3I1Handle).reshape(-1),
+                  snmm.getArray(self.lutDLnTauI1Handle).reshape(-1),
+                  snmm.getArray(self.lutDAlphaI1Handle).reshape(-1),
+                  snmm.getArray(self.lutDSecZenithI1Handle).reshape(-1))
+
+        gridStart = (float(self.lnPwv[0]), float(self.o3[0]), float(self.lnTau[0]),
+                     float(self.alpha[0]), float(self.secZenith[0]))
+        gridDelta = (float(self.lnPwvDelta), float(self.o3Delta), float(self.lnTauDelta),
+                     float(self.alphaDelta), float(self.secZenithDelta))
+
+        gridIndices = (np.atleast_1d(indices.pwvIndex), np.atleast_1d(indices.o3Index),
+                       np.atleast_1d(indices.tauIndex), np.atleast_1d(indices.alphaIndex),
+                       np.atleast_1d(indices.secZenithIndex))
+
+        return lut_interp_i0_i1(np.atleast_1d(indices.offset),
+                                np.atleast_1d(indices.offsetSecZenithPlus),
+                                np.atleast_1d(indices.offsetPwvPlus),
+                                gridIndices, gridStart, gridDelta,
+                                np.atleast_1d(lnPwv), np.atleast_1d(o3),
+                                np.atleast_1d(lnTau), np.atleast_1d(alpha),
+                                np.atleast_1d(secZenith), np.atleast_1d(indices.pmbFactor),
+                                i0Luts, i1Luts)
+
     def computeI1Old(self, indices):
         """
         Unused
@@ -1042,16 +1345,16 @@ class FgcmLUT(object):
 
         parameters
         ----------
-        indices: tuple, from getIndices()
+        indices: tuple or FgcmLUTFlatIndices, from getIndices()
         I0: float array, from computeI0()
         """
 
         # dL(i,j|p) = d/dp(2.5*log10(LUT(i,j|p)))
         #           = 1.086*(LUT'(i,j|p)/LUT(i,j|p))
-        return (self.magConstant*snmm.getArray(self.lutDLnPwvHandle)[indices[:-1]] / I0,
-                self.magConstant*snmm.getArray(self.lutDO3Handle)[indices[:-1]] / I0,
-                self.magConstant*snmm.getArray(self.lutDLnTauHandle)[indices[:-1]] / I0,
-                self.magConstant*snmm.getArray(self.lutDAlphaHandle)[indices[:-1]] / I0)
+        return (self.magConstant*self._getLUTValues(self.lutDLnPwvHandle, indices) / I0,
+                self.magConstant*self._getLUTValues(self.lutDO3Handle, indices) / I0,
+                self.magConstant*self._getLUTValues(self.lutDLnTauHandle, indices) / I0,
+                self.magConstant*self._getLUTValues(self.lutDAlphaHandle, indices) / I0)
 
 
     def computeLogDerivativesI1(self, indices, I0, I10, sedSlope):
@@ -1060,7 +1363,7 @@ class FgcmLUT(object):
 
         parameters
         ----------
-        indices: tuple, from getIndices()
+        indices: tuple or FgcmLUTFlatIndices, from getIndices()
         I0: float array, from computeI0()
         I10: float array, from computeI1()/computeI0()
         sedSlope: float array, fnuprime
@@ -1070,14 +1373,14 @@ class FgcmLUT(object):
 
         preFactor = self.magConstant * (sedSlope / (1. + sedSlope * I10)) * (1. / I0)
 
-        return (preFactor * (snmm.getArray(self.lutDLnPwvI1Handle)[indices[: -1]] -
-                             I10 * snmm.getArray(self.lutDLnPwvHandle)[indices[: -1]]),
-                preFactor * (snmm.getArray(self.lutDO3I1Handle)[indices[: -1]] -
-                             I10 * snmm.getArray(self.lutDO3Handle)[indices[: -1]]),
-                preFactor * (snmm.getArray(self.lutDLnTauI1Handle)[indices[: -1]] -
-                             I10 * snmm.getArray(self.lutDLnTauHandle)[indices[: -1]]),
-                preFactor * (snmm.getArray(self.lutDAlphaI1Handle)[indices[: -1]] -
-                             I10 * snmm.getArray(self.lutDAlphaHandle)[indices[: -1]]))
+        return (preFactor * (self._getLUTValues(self.lutDLnPwvI1Handle, indices) -
+                             I10 * self._getLUTValues(self.lutDLnPwvHandle, indices)),
+                preFactor * (self._getLUTValues(self.lutDO3I1Handle, indices) -
+                             I10 * self._getLUTValues(self.lutDO3Handle, indices)),
+                preFactor * (self._getLUTValues(self.lutDLnTauI1Handle, indices) -
+                             I10 * self._getLUTValues(self.lutDLnTauHandle, indices)),
+                preFactor * (self._getLUTValues(self.lutDAlphaI1Handle, indices) -
+                             I10 * self._getLUTValues(self.lutDAlphaHandle, indices)))
 
     def computeSEDSlopes(self, objectSedColor):
         """
@@ -18,9 +18,11 @@ class FgcmLogger(object):
        Set to 'INFO' or 'DEBUG'
     printLogger: bool, default=False
        Only print log messages to stdout, and do not open logFile
+    append: bool, default=False
+       Append to an existing logFile (when resuming a run)
     """
 
-    def __init__(self,logFile,logLevel,printLogger=False):
+    def __init__(self,logFile,logLevel,printLogger=False,append=False):
 
         self.logFile = logFile
         self.printLogger = printLogger
@@ -28,7 +30,7 @@ class FgcmLogger(object):
 
         if not printLogger:
             # this might fail.  Let it throw its exception?
-            self.logF = open(self.logFile,'w')
+            self.logF = open(self.logFile,'a' if append else 'w')
             self.logging = True
 
         self.logLevel = logLevel
@@ -9,6 +9,9 @@ import glob
 import healpy as hp
 
 from .fgcmLogger import FgcmLogger
+from .fgcmWorkerPool import FgcmWorkerPool
+from .fgcmUtilities import getFilterCodes
+from .fgcmMatcher import FgcmMatcher
 
 
 class FgcmMakeStars(object):
@@ -43,8 +46,17 @@ class FgcmMakeStars(object):
        List of primary bands
     matchNSide: int
        Healpix nside to do smatch matching.  Should just be 4096.
+    matcher: string, optional
+       Matcher backend: 'auto' (smatch if available, otherwise kdtree),
+       'smatch', 'kdtree', or 'htm'.  Default 'auto'.
+    matchChunkSize: int, optional
+       Number of positions to query at a time with the kdtree matcher.
+       Default 1000000.
     coarseNSide: int
        Healpix nside to break down into coarse pixels (save memory)
+    nCore: int, optional
+       Number of processes to match the coarse pixels of the primary stars.
+       Default 1.
     brightStarFile: string, optional
        File with (very) bright stars (ra/dec/radius) for masking
     """
@@ -64,11 +76,28 @@ class FgcmMakeStars(object):
 
         if 'quantitiesToAverage' not in starConfig:
             starConfig['quantitiesToAverage'] = []
+        if 'nCore' not in starConfig:
+            starConfig['nCore'] = 1
+        if 'matcher' not in starConfig:
+            starConfig['matcher'] = 'auto'
+        if 'matchChunkSize' not in starConfig:
+            starConfig['matchChunkSize'] = 1000000
 
         self.objCat = None
+        # Inputs of the coarse pixel matching (while making primary stars)
+        self._primaryMatchInputs = None
 
-        # Note that the order doesn't matter for the making of the stars
-        self.filterNames = starConfig['filterToBand'].keys()
+        # Note that the order doesn't matter for the making of the stars,
+        #  but it sets the filter codes
+        self.filterNames = list(starConfig['filterToBand'].keys())
+
+        # Band code of each filter code (with a trailing -1 for unknown filters)
+        self.bandNames = []
+        for filterName in self.filterNames:
+            if starConfig['filterToBand'][filterName] not in self.bandNames:
+                self.bandNames.append(starConfig['filterToBand'][filterName])
+        self.filterBandCodes = np.array([self.bandNames.index(starConfig['filterToBand'][filterName])
+                                         for filterName in self.filterNames] + [-1], dtype=np.int16)
 
         # check that the requiredBands are there...
         for reqBand in starConfig['requiredBands']:
@@ -89,6 +118,10 @@ class FgcmMakeStars(object):
         else:
             self.fgcmLog = FgcmLogger('dummy.log', 'INFO', printLogger=True)
 
+        self.matcher = FgcmMatcher(starConfig['matcher'],
+                                   nside=starConfig['matchNSide'],
+                                   chunkSize=starConfig['matchChunkSize'])
+
 
     def runFromFits(self, clobber=False):
         """
@@ -177,14 +210,14 @@ class FgcmMakeStars(object):
             brightStarDec = None
             brightStarRadius = None
 
-        filterNameArray = np.core.defchararray.strip(obsCat['filtername'])
+        filterCodeArray = getFilterCodes(obsCat['filtername'], self.filterNames)
 
         if len(self.starConfig['quantitiesToAverage']) > 0:
             extraQuantityArrays = obsCat[extraColumns]
         else:
             extraQuantityArrays = None
 
-        self.makePrimaryStars(obsCat['ra'], obsCat['dec'], filterNameArray,
+        self.makePrimaryStars(obsCat['ra'], obsCat['dec'], filterCodeArray,
                               extraQuantityArrays=extraQuantityArrays,
                               brightStarRA=brightStarRA,
                               brightStarDec=brightStarDec,
@@ -202,6 +235,9 @@ class FgcmMakeStars(object):
         observationFile: string
         obsIndexFile: string
            File output from makePrimaryStarsFromFits
+
+        The INDEX extension of obsIndexFile has the filter code of each
+         observation, which is the index in the FILTERS extension.
         """
 
         import fitsio
@@ -215,9 +251,9 @@ class FgcmMakeStars(object):
         obsCat = fitsio.read(observationFile, ext=1, lower=True,
                              columns=['ra','dec','filtername'])
 
-        filterNameArray = np.core.defchararray.strip(obsCat['filtername'])
+        filterCodeArray = getFilterCodes(obsCat['filtername'], self.filterNames)
 
-        self.makeMatchedStars(obsCat['ra'], obsCat['dec'], filterNameArray)
+        self.makeMatchedStars(obsCat['ra'], obsCat['dec'], filterCodeArray)
 
         # and save the outputs...
         fits=fitsio.FITS(obsIndexFile, mode='rw', clobber=True)
@@ -227,6 +263,13 @@ class FgcmMakeStars(object):
         fits.create_table_hdu(data=self.obsIndexCat, extname='INDEX')
         fits[2].write(self.obsIndexCat)
 
+        # The filter names of the FILTERCODE column in INDEX
+        maxFilterLen = len(max(self.filterNames, key=len))
+        filterCat = np.zeros(len(self.filterNames), dtype=[('filtername', 'a%d' % (maxFilterLen))])
+        filterCat['filtername'] = self.filterNames
+        fits.create_table_hdu(data=filterCat, extname='FILTERS')
+        fits[3].write(filterCat)
+
     def makeReferenceMatchesFromFits(self, refLoader, clobber=False):
         """
         Make an absolute reference match catalog, saving to fits.
@@ -267,8 +310,8 @@ class FgcmMakeStars(object):
            RA for each observation
         decArray: double array
            Dec for each observation
-        filterNameArray: string array
-           Array of filterNames.
+        filterNameArray: string or int array
+           Array of filterNames, or of filter codes (indices in filterNames)
         extraQuantityArrays: numpy recarray, optional
            Record array of extra quantities to average.  Default None.
         bandSelected: bool, default=False
@@ -286,14 +329,7 @@ class FgcmMakeStars(object):
            Catalog of unique objects selected from primary band
         """
 
-        # can we use the better smatch code?
-        try:
-            import smatch
-            hasSmatch = True
-            self.fgcmLog.info("Using smatch for matching.")
-        except ImportError:
-            hasSmatch = False
-            self.fgcmLog.info("Using htm for matching.")
+        self.fgcmLog.info("Using %s for matching." % (self.matcher.backend))
 
         if (raArray.size != decArray.size):
             raise ValueError("raArray, decArray must be same length.")
@@ -325,8 +361,6 @@ class FgcmMakeStars(object):
                 if quant not in extraQuantityArrays.dtype.names:
                     raise RuntimeError("quantity to average %s not in extraQuantityArrays" % (quant))
 
-        pixelCats = []
-
         # Split into pixels
         ipring = hp.ang2pix(self.starConfig['coarseNSide'],
                             (90.0 - decArray) * np.pi / 180.,
@@ -336,194 +370,58 @@ class FgcmMakeStars(object):
         gdpix, = np.where(hpix > 0)
         self.fgcmLog.info("Matching primary stars in %d pixels" % (gdpix.size))
 
-        for ii, gpix in enumerate(gdpix):
-            # This is the array of all the observations in the coarse pixel
-            p1a=revpix[revpix[gpix]: revpix[gpix + 1]]
-
-            if p1a.size == 0:
-                continue
-
-            bandPixelCat = None
-
-            filterNameArrayIsEncoded = False
-            try:
-                test = filterNameArray[0].decode('utf-8')
-                filterNameArrayIsEncoded = True
-            except AttributeError:
-                pass
-
-            # loop over bands...
-            for primaryBand in self.starConfig['primaryBands']:
-                # We first need to select based on the band, not on the filter name
-                useFlag = None
-                for filterName in self.filterNames:
-                    if (self.starConfig['filterToBand'][filterName] == primaryBand):
-                        if useFlag is None:
-                            if filterNameArrayIsEncoded:
-                                useFlag = (filterNameArray[p1a] == filterName.encode('utf-8'))
-                            else:
-                                useFlag = (filterNameArray[p1a] == filterName)
-                        else:
-                            if filterNameArrayIsEncoded:
-                                useFlag |= (filterNameArray[p1a] == filterName.encode('utf-8'))
-                            else:
-                                useFlag = (filterNameArray[p1a] == filterName)
-
-                raArrayUse = raArray[p1a[useFlag]]
-                decArrayUse = decArray[p1a[useFlag]]
-
-                if hasExtraQuantities:
-                    extraQuantityArraysUse = extraQuantityArrays[p1a[useFlag]]
-
-                if raArrayUse.size == 0:
-                    self.fgcmLog.info("Nothing found for pixel %d" % (ipring[p1a[0]]))
-                    continue
-
-                esutil.numpy_util.to_native(raArrayUse, inplace=True)
-                esutil.numpy_util.to_native(decArrayUse, inplace=True)
-
-                if hasSmatch:
-                    # faster match...
-                    self.fgcmLog.info("Starting smatch...")
-                    matches = smatch.match(raArrayUse, decArrayUse,
-                                           self.starConfig['matchRadius'] / 3600.0,
-                                           raArrayUse, decArrayUse,
-                                           nside=self.starConfig['matchNSide'], maxmatch=0)
-                    i1 = matches['i1']
-                    i2 = matches['i2']
-                    self.fgcmLog.info("Finished smatch.")
-                else:
-                    # slower htm matching...
-                    htm = esutil.htm.HTM(11)
-
-                    matcher = esutil.htm.Matcher(11, raArrayUse, decArrayUse)
-                    matches = matcher.match(raArrayUse, decArrayUse,
-                                            self.starConfig['matchRadius'] / 3600.0,
-                                            maxmatch=0)
-                    i1 = matches[1]
-                    i2 = matches[0]
-
-                """
-                # Try this instead...
-
-                counter = np.zeros(raArrayUse.size, dtype=np.int64)
-                minId = np.zeros(raArrayUse.size, dtype=np.int64) + raArrayUse.size + 1
-                raMeanAll = np.zeros(raArrayUse.size, dtype=np.float64)
-                decMeanAll = np.zeros(raArrayUse.size, dtype=np.float64)
-
-                # Count the number of observations of each matched observation
-                np.add.at(counter, i1, 1)
-                # Find the minimum id of the match to key on a unique value
-                # for each
-                np.fmin.at(minId, i2, i1)
-                # Compute the mean ra/dec
-                np.add.at(raMeanAll, i1, raArrayUse[i2])
-                raMeanAll /= counter
-                np.add.at(decMeanAll, i1, decArrayUse[i2])
-                decMeanAll /= counter
-
-                uId = np.unique(minId)
-
-                bandPixelCatTemp = np.zeros(uId.size, dtype=dtype)
-                bandPixelCatTemp['ra'] = raMeanAll[uId]
-                bandPixelCatTemp['dec'] = decMeanAll[uId]
-
-                # Any extra quantities?
-                if len(self.starConfig['quantitiesToAverage']) > 0:
-                    for quant in enumerate(self.starConfig['quantitiesToAverage']):
-                        quantMeanAll = np.zeros(raArrayUse.size, dtype=np.float64)
-                        np.add.at(quantMeanAll, i1, extraQuantityArrays[quant][p1a[useFlag[i2]]])
-                        quantMeanAll /= counter
-                        bandPixelCatTemp[quant] = quantMeanAll[uId]
-                        """
-
-                # This is the official working version, but slower
-                fakeId = np.arange(p1a.size)
-                hist, rev = esutil.stat.histogram(fakeId[i1], rev=True)
-
-                if (hist.max() == 1):
-                    self.fgcmLog.warn("No matches found for pixel %d, band %s!" %
-                                      (ipring[p1a[0]], primaryBand))
-                    continue
-
-                maxObs = hist.max()
-
-                # how many unique objects do we have?
-                histTemp = hist.copy()
-                count=0
-                for j in range(histTemp.size):
-                    jj = fakeId[j]
-                    if (histTemp[jj] >= self.starConfig['minPerBand']):
-                        i1a = rev[rev[jj]: rev[jj + 1]]
-                        histTemp[i2[i1a]] = 0
-                        count = count + 1
-
-                # make a temporary catalog...
-                bandPixelCatTemp = np.zeros(count, dtype=dtype)
-
-                # Rotate.  This works for DES, but maybe not in general?
-                raTemp = raArrayUse.copy()
-
-                hi, = np.where(raTemp > 180.0)
-                raTemp[hi] -= 360.0
-
-                # Compute mean ra/dec
-                index = 0
-                for j in range(hist.size):
-                    jj = fakeId[j]
-                    if (hist[jj] >= self.starConfig['minPerBand']):
-                        i1a = rev[rev[jj]: rev[jj + 1]]
-                        starInd = i2[i1a]
-                        # make sure this doesn't get used again
-                        hist[starInd] = 0
-                        bandPixelCatTemp['ra'][index] = np.sum(raTemp[starInd]) / starInd.size
-                        bandPixelCatTemp['dec'][index] = np.sum(decArrayUse[starInd]) / starInd.size
-                        if hasExtraQuantities:
-                            for quant in self.starConfig['quantitiesToAverage']:
-                                ok, = np.where((extraQuantityArraysUse[quant + '_err'][starInd] > 0.0))
-                                wt = 1./extraQuantityArraysUse[quant + '_err'][starInd[ok]]**2.
-                                bandPixelCatTemp[quant][index] = np.sum(wt * extraQuantityArraysUse[quant][starInd[ok]]) / np.sum(wt)
-
-                        index = index + 1
-
-                # Restore negative RAs
-                lo, = np.where(bandPixelCatTemp['ra'] < 0.0)
-                bandPixelCatTemp['ra'][lo] += 360.0
-
-                # Match to previously pixel catalog if available, and remove dupes
-                if bandPixelCat is None:
-                    # First time through, these are all new objects
-                    bandPixelCat = bandPixelCatTemp
-                    self.fgcmLog.info(" Found %d primary stars in %s band" % (bandPixelCatTemp.size, primaryBand))
-                else:
-                    # We already have objects, need to match/append
-                    if hasSmatch:
-                        bandMatches = smatch.match(bandPixelCat['ra'], bandPixelCat['dec'],
-                                                   self.starConfig['matchRadius'] / 3600.0,
-                                                   bandPixelCatTemp['ra'], bandPixelCatTemp['dec'],
-                                                   maxmatch=0)
-                        i1b = matches['i1']
-                        i2b = matches['i2']
-                    else:
-                        matcher = esutil.htm.Matcher(11, bandPixelCat['ra'], bandPixelCat['dec'])
-                        matches = matcher.match(bandPixelCatTemp['ra'], bandPixelCatTemp['dec'],
-                                                self.starConfig['matchRadius'] / 3600.0,
-                                                maxmatch=0)
-                        i1b = matches[1]
-                        i2b = matches[0]
+        # The filter names are converted once to codes; primaryFilterFlags
+        #  flags the codes of each primary band (with -1 an unknown filter)
+        filterCodeArray = getFilterCodes(filterNameArray, self.filterNames)
+        primaryFilterFlags = np.zeros((len(self.starConfig['primaryBands']), len(self.filterNames) + 1),
+                                      dtype=bool)
+        for i, primaryBand in enumerate(self.starConfig['primaryBands']):
+            for j, filterName in enumerate(self.filterNames):
+                if (self.starConfig['filterToBand'][filterName] == primaryBand):
+                    primaryFilterFlags[i, j] = True
+
+        # The pixels are matched independently, so they can be spread over
+        #  the worker pool.  The inputs are inherited by the forked workers.
+        self._primaryMatchInputs = {'raArray': raArray,
+                                    'decArray': decArray,
+                                    'filterCodeArray': filterCodeArray,
+                                    'primaryFilterFlags': primaryFilterFlags,
+                                    'extraQuantityArrays': (extraQuantityArrays if hasExtraQuantities
+                                                            else None),
+                                    'dtype': dtype,
+                                    'ipring': ipring,
+                                    'revpix': revpix}
+
+        pixelBatches = self._planPixelBatches(gdpix, hpix[gdpix])
 
-                    # Remove all matches from the temp catalog
-                    bandPixelCatTemp = np.delete(bandPixelCatTemp, i2b)
-                    self.fgcmLog.info(" Found %d new primary stars in %s band" % (bandPixelCatTemp.size, primaryBand))
+        try:
+            if self.starConfig['nCore'] > 1 and len(pixelBatches) > 1:
+                fgcmWorkerPool = FgcmWorkerPool(self.starConfig['nCore'], self.fgcmLog)
+                try:
+                    batchCats = fgcmWorkerPool.map(self, '_primaryPixelWorker', pixelBatches)
+                finally:
+                    fgcmWorkerPool.close()
+            else:
+                batchCats = [self._primaryPixelWorker(pixelBatch) for pixelBatch in pixelBatches]
+        finally:
+            self._primaryMatchInputs = None
 
-                    bandPixelCat = np.append(bandPixelCat, bandPixelCatTemp)
+        # Collect the catalogs in pixel order (not batch order), so that the
+        #  fgcm_ids do not depend on how the pixels were batched
+        pixelCatDict = {}
+        for pixelBatch, cats in zip(pixelBatches, batchCats):
+            for gpix, cat in zip(pixelBatch, cats):
+                pixelCatDict[gpix] = cat
 
+        pixelCats = []
+        for ii, gpix in enumerate(gdpix):
+            bandPixelCat = pixelCatDict[gpix]
             if bandPixelCat is not None:
                 # Append to list of catalogs...
                 pixelCats.append(bandPixelCat)
 
                 self.fgcmLog.info("Found %d unique objects in pixel %d (%d of %d)." %
-                                  (bandPixelCat.size, ipring[p1a[0]], ii, gdpix.size - 1))
+                                  (bandPixelCat.size, ipring[revpix[revpix[gpix]]], ii, gdpix.size - 1))
 
         # now assemble into a total objCat
         count = 0
@@ -545,49 +443,17 @@ class FgcmMakeStars(object):
 
         if (cutBrightStars):
             self.fgcmLog.info("Matching to bright stars for masking...")
-            if (hasSmatch):
-                # faster smatch...
-                matches = smatch.match(brightStarRA, brightStarDec, brightStarRadius,
-                                       self.objCat['ra'], self.objCat['dec'], nside=self.starConfig['matchNSide'],
-                                       maxmatch=0)
-                i1=matches['i1']
-                i2=matches['i2']
-            else:
-                # slower htm matching...
-                htm = esutil.htm.HTM(11)
-
-                matcher = esutil.htm.Matcher(10, brightStarRA, brightStarDec)
-                matches = matcher.match(self.objCat['ra'], self.objCat['dec'], brightStarRadius,
-                                        maxmatch=0)
-                # matches[0] -> m1 -> array from matcher.match() call (self.objCat)
-                # matches[1] -> m2 -> array from htm.Matcher() (brightStar)
-                i1=matches[1]
-                i2=matches[0]
+            i1, i2 = self.matcher.match(brightStarRA, brightStarDec, brightStarRadius,
+                                        self.objCat['ra'], self.objCat['dec'], maxmatch=0)
 
             self.fgcmLog.info("Cutting %d objects too near bright stars." % (i2.size))
             self.objCat = np.delete(self.objCat,i2)
 
         # and remove stars with near neighbors
         self.fgcmLog.info("Matching stars to neighbors...")
-        if (hasSmatch):
-            # faster smatch...
-
-            matches=smatch.match(self.objCat['ra'], self.objCat['dec'],
-                                 self.starConfig['isolationRadius']/3600.0,
-                                 self.objCat['ra'], self.objCat['dec'],
-                                 nside=self.starConfig['matchNSide'], maxmatch=0)
-            i1=matches['i1']
-            i2=matches['i2']
-        else:
-            # slower htm matching...
-            htm = esutil.htm.HTM(11)
-
-            matcher = esutil.htm.Matcher(11, self.objCat['ra'], self.objCat['dec'])
-            matches = matcher.match(self.objCat['ra'], self.objCat['dec'],
+        i1, i2 = self.matcher.match(self.objCat['ra'], self.objCat['dec'],
                                     self.starConfig['isolationRadius']/3600.0,
-                                    maxmatch = 0)
-            i1=matches[1]
-            i2=matches[0]
+                                    self.objCat['ra'], self.objCat['dec'], maxmatch=0)
 
         use,=np.where(i1 != i2)
 
@@ -599,6 +465,225 @@ class FgcmMakeStars(object):
 
         # and we're done
 
+    def _primaryPixelWorker(self, pixelBatch):
+        """
+        Multiprocessing worker to match the observations in a batch of coarse
+         pixels into primary stars.  Not to be called on its own.
+
+        parameters
+        ----------
+        pixelBatch: list of ints
+           Indices of the coarse pixels (in the pixel histogram)
+
+        returns
+        -------
+        pixelCats: list of numpy recarrays
+           Catalog of unique objects in each pixel (None if there are none)
+        """
+
+        return [self._matchPrimaryPixel(gpix) for gpix in pixelBatch]
+
+    def _matchPrimaryPixel(self, gpix):
+        """
+        Match the observations in a coarse pixel into primary stars, removing
+         the duplicates between the primary bands.  Not to be called on its own.
+
+        parameters
+        ----------
+        gpix: int
+           Index of the coarse pixel (in the pixel histogram)
+
+        returns
+        -------
+        bandPixelCat: numpy recarray
+           Catalog of unique objects in the pixel (None if there are none)
+        """
+
+        raArray = self._primaryMatchInputs['raArray']
+        decArray = self._primaryMatchInputs['decArray']
+        filterCodeArray = self._primaryMatchInputs['filterCodeArray']
+        primaryFilterFlags = self._primaryMatchInputs['primaryFilterFlags']
+        extraQuantityArrays = self._primaryMatchInputs['extraQuantityArrays']
+        hasExtraQuantities = extraQuantityArrays is not None
+        dtype = self._primaryMatchInputs['dtype']
+        ipring = self._primaryMatchInputs['ipring']
+        revpix = self._primaryMatchInputs['revpix']
+
+        # This is the array of all the observations in the coarse pixel
+        p1a = revpix[revpix[gpix]: revpix[gpix + 1]]
+
+        bandPixelCat = None
+
+        # loop over bands...
+        for primaryBandIndex, primaryBand in enumerate(self.starConfig['primaryBands']):
+            # We first need to select based on the band, not on the filter name
+            useFlag = primaryFilterFlags[primaryBandIndex, filterCodeArray[p1a]]
+
+            raArrayUse = raArray[p1a[useFlag]]
+            decArrayUse = decArray[p1a[useFlag]]
+
+            if hasExtraQuantities:
+                extraQuantityArraysUse = extraQuantityArrays[p1a[useFlag]]
+
+            if raArrayUse.size == 0:
+                self.fgcmLog.info("Nothing found for pixel %d" % (ipring[p1a[0]]))
+                continue
+
+            esutil.numpy_util.to_native(raArrayUse, inplace=True)
+            esutil.numpy_util.to_native(decArrayUse, inplace=True)
+
+            self.fgcmLog.info("Starting %s match..." % (self.matcher.backend))
+            i1, i2 = self.matcher.match(raArrayUse, decArrayUse,
+                                        self.starConfig['matchRadius'] / 3600.0,
+                                        raArrayUse, decArrayUse, maxmatch=0)
+            self.fgcmLog.info("Finished %s match." % (self.matcher.backend))
+
+            """
+            # Try this instead...
+
+            counter = np.zeros(raArrayUse.size, dtype=np.int64)
+            minId = np.zeros(raArrayUse.size, dtype=np.int64) + raArrayUse.size + 1
+            raMeanAll = np.zeros(raArrayUse.size, dtype=np.float64)
+            decMeanAll = np.zeros(raArrayUse.size, dtype=np.float64)
+
+            # Count the number of observations of each matched observation
+            np.add.at(counter, i1, 1)
+            # Find the minimum id of the match to key on a unique value
+            # for each
+            np.fmin.at(minId, i2, i1)
+            # Compute the mean ra/dec
+            np.add.at(raMeanAll, i1, raArrayUse[i2])
+            raMeanAll /= counter
+            np.add.at(decMeanAll, i1, decArrayUse[i2])
+            decMeanAll /= counter
+
+            uId = np.unique(minId)
+
+            bandPixelCatTemp = np.zeros(uId.size, dtype=dtype)
+            bandPixelCatTemp['ra'] = raMeanAll[uId]
+            bandPixelCatTemp['dec'] = decMeanAll[uId]
+
+            # Any extra quantities?
+            if len(self.starConfig['quantitiesToAverage']) > 0:
+                for quant in enumerate(self.starConfig['quantitiesToAverage']):
+                    quantMeanAll = np.zeros(raArrayUse.size, dtype=np.float64)
+                    np.add.at(quantMeanAll, i1, extraQuantityArrays[quant][p1a[useFlag[i2]]])
+                    quantMeanAll /= counter
+                    bandPixelCatTemp[quant] = quantMeanAll[uId]
+                    """
+
+            # This is the official working version, but slower
+            fakeId = np.arange(p1a.size)
+            hist, rev = esutil.stat.histogram(fakeId[i1], rev=True)
+
+            if (hist.max() == 1):
+                self.fgcmLog.warn("No matches found for pixel %d, band %s!" %
+                                  (ipring[p1a[0]], primaryBand))
+                continue
+
+            maxObs = hist.max()
+
+            # how many unique objects do we have?
+            histTemp = hist.copy()
+            count=0
+            for j in range(histTemp.size):
+                jj = fakeId[j]
+                if (histTemp[jj] >= self.starConfig['minPerBand']):
+                    i1a = rev[rev[jj]: rev[jj + 1]]
+                    histTemp[i2[i1a]] = 0
+                    count = count + 1
+
+            # make a temporary catalog...
+            bandPixelCatTemp = np.zeros(count, dtype=dtype)
+
+            # Rotate.  This works for DES, but maybe not in general?
+            raTemp = raArrayUse.copy()
+
+            hi, = np.where(raTemp > 180.0)
+            raTemp[hi] -= 360.0
+
+            # Compute mean ra/dec
+            index = 0
+            for j in range(hist.size):
+                jj = fakeId[j]
+                if (hist[jj] >= self.starConfig['minPerBand']):
+                    i1a = rev[rev[jj]: rev[jj + 1]]
+                    starInd = i2[i1a]
+                    # make sure this doesn't get used again
+                    hist[starInd] = 0
+                    bandPixelCatTemp['ra'][index] = np.sum(raTemp[starInd]) / starInd.size
+                    bandPixelCatTemp['dec'][index] = np.sum(decArrayUse[starInd]) / starInd.size
+                    if hasExtraQuantities:
+                        for quant in self.starConfig['quantitiesToAverage']:
+                            ok, = np.where((extraQuantityArraysUse[quant + '_err'][starInd] > 0.0))
+                            wt = 1./extraQuantityArraysUse[quant + '_err'][starInd[ok]]**2.
+                            bandPixelCatTemp[quant][index] = np.sum(wt * extraQuantityArraysUse[quant][starInd[ok]]) / np.sum(wt)
+
+                    index = index + 1
+
+            # Restore negative RAs
+            lo, = np.where(bandPixelCatTemp['ra'] < 0.0)
+            bandPixelCatTemp['ra'][lo] += 360.0
+
+            # Match to previously pixel catalog if available, and remove dupes
+            if bandPixelCat is None:
+                # First time through, these are all new objects
+                bandPixelCat = bandPixelCatTemp
+                self.fgcmLog.info(" Found %d primary stars in %s band" % (bandPixelCatTemp.size, primaryBand))
+            else:
+                # We already have objects, need to match/append
+                i1b, i2b = self.matcher.match(bandPixelCat['ra'], bandPixelCat['dec'],
+                                              self.starConfig['matchRadius'] / 3600.0,
+                                              bandPixelCatTemp['ra'], bandPixelCatTemp['dec'],
+                                              maxmatch=0)
+
+                # Remove all matches from the temp catalog
+                bandPixelCatTemp = np.delete(bandPixelCatTemp, i2b)
+                self.fgcmLog.info(" Found %d new primary stars in %s band" % (bandPixelCatTemp.size, primaryBand))
+
+                bandPixelCat = np.append(bandPixelCat, bandPixelCatTemp)
+
+        return bandPixelCat
+
+    def _planPixelBatches(self, gdpix, nObsPix):
+        """
+        Split the coarse pixels into batches for the worker pool, largest
+         pixels first.  Not to be called on its own.
+
+        parameters
+        ----------
+        gdpix: int array
+           Indices of the coarse pixels with observations
+        nObsPix: int array
+           Number of observations in each pixel
+
+        returns
+        -------
+        pixelBatches: list of lists of ints
+           Pixel indices in each batch, in the order they should be run
+        """
+
+        order = np.argsort(-nObsPix, kind='stable')
+
+        # Aim for a few batches per core, so the tail of small pixels fills
+        #  in behind the large ones
+        batchObs = float(np.sum(nObsPix)) / (self.starConfig['nCore'] * 4)
+
+        pixelBatches = []
+        pixelBatch = []
+        nObsBatch = 0
+        for i in order:
+            pixelBatch.append(int(gdpix[i]))
+            nObsBatch += nObsPix[i]
+            if nObsBatch >= batchObs:
+                pixelBatches.append(pixelBatch)
+                pixelBatch = []
+                nObsBatch = 0
+        if len(pixelBatch) > 0:
+            pixelBatches.append(pixelBatch)
+
+        return pixelBatches
+
     def makeMatchedStars(self, raArray, decArray, filterNameArray):
         """
         Make matched stars, from pre-loaded arrays.  Requires self.objCat was
@@ -610,66 +695,28 @@ class FgcmMakeStars(object):
            RA for each observation
         decArray: double array
            Dec for each observation
-        filterNameArray: numpy string array
-           filterName for each array
+        filterNameArray: numpy string or int array
+           filterName (or filter code, the index in filterNames) for each array
         """
 
         if (self.objCat is None):
             raise ValueError("Must run makePrimaryStars first")
 
-        # can we use the better smatch code?
-        try:
-            import smatch
-            hasSmatch = True
-        except ImportError:
-            hasSmatch = False
-
         if (raArray.size != decArray.size or
             raArray.size != filterNameArray.size):
             raise ValueError("raArray, decArray, filterNameArray must be same length")
 
-        # translate filterNameArray to bandArray ... can this be made faster, or
-        #  does it need to be?
-
-        filterNameArrayIsEncoded = False
-        try:
-            test = filterNameArray[0].decode('utf-8')
-            filterNameArrayIsEncoded = True
-        except AttributeError:
-            pass
-
-        bandArray = np.zeros_like(filterNameArray)
-        for filterName in self.filterNames:
-            if filterNameArrayIsEncoded:
-                use, = np.where(filterNameArray == filterName.encode('utf-8'))
-            else:
-                use, = np.where(filterNameArray == filterName)
-            bandArray[use] = self.starConfig['filterToBand'][filterName]
+        # translate filterNameArray to filter and band codes (-1 is unknown)
+        filterCodeArray = getFilterCodes(filterNameArray, self.filterNames)
+        bandCodeArray = self.filterBandCodes[filterCodeArray]
 
         self.fgcmLog.info("Matching positions to observations...")
 
-        if (hasSmatch):
-            # faster smatch...
-
-            matches=smatch.match(self.objCat['ra'], self.objCat['dec'],
-                                 self.starConfig['matchRadius']/3600.0,
-                                 raArray, decArray,
-                                 nside=self.starConfig['matchNSide'],
-                                 maxmatch=0)
-            i1=matches['i1']
-            i2=matches['i2']
-        else:
-            # slower htm matching...
-            htm = esutil.htm.HTM(11)
-
-            matcher = esutil.htm.Matcher(11, self.objCat['ra'], self.objCat['dec'])
-            matches = matcher.match(raArray, decArray,
-                                    self.starConfig['matchRadius']/3600.,
-                                    maxmatch=0)
-            # matches[0] -> m1 -> array from matcher.match() call (ra/decArray)
-            # matches[1] -> m2 -> array from htm.Matcher() (self.objCat)
-            i2 = matches[0]
-            i1 = matches[1]
+        # i1 -> self.objCat
+        # i2 -> ra/decArray
+        i1, i2 = self.matcher.match(self.objCat['ra'], self.objCat['dec'],
+                                    self.starConfig['matchRadius']/3600.0,
+                                    raArray, decArray, maxmatch=0)
 
         self.fgcmLog.info("Collating observations")
         nObsPerObj, obsInd = esutil.stat.histogram(i1, rev=True)
@@ -686,13 +733,14 @@ class FgcmMakeStars(object):
         if len(self.starConfig['requiredBands']) > 0:
 
             # which stars have at least minPerBand observations in each required band?
-            reqBands = np.array(self.starConfig['requiredBands'], dtype=bandArray.dtype)
+            reqBands = np.array([self.bandNames.index(reqBand) for reqBand in
+                                 self.starConfig['requiredBands']], dtype=np.int16)
 
             # this could be made more efficient
             self.fgcmLog.info("Computing number of observations per band")
             nObs = np.zeros((reqBands.size, self.objCat.size), dtype='i4')
             for i in range(reqBands.size):
-                use,=np.where(bandArray[i2] == reqBands[i])
+                use,=np.where(bandCodeArray[i2] == reqBands[i])
                 hist = esutil.stat.histogram(i1[use], min=0, max=self.objCat.size-1)
                 nObs[i,:] = hist
 
@@ -762,13 +810,17 @@ class FgcmMakeStars(object):
         nTotObs = self.objIndexCat['obsarrindex'][-1] + self.objIndexCat['nobs'][-1]
 
         self.obsIndexCat = np.zeros(nTotObs,
-                                    dtype=[('obsindex','i4')])
+                                    dtype=[('obsindex','i4'),
+                                           ('filtercode','i2')])
         ctr = 0
         self.fgcmLog.info("Spooling out %d observation indices." % (nTotObs))
         for i in gd:
-            self.obsIndexCat[ctr:ctr+nObsPerObj[i]] = i2[obsInd[obsInd[i]:obsInd[i+1]]]
+            self.obsIndexCat['obsindex'][ctr:ctr+nObsPerObj[i]] = i2[obsInd[obsInd[i]:obsInd[i+1]]]
             ctr+=nObsPerObj[i]
 
+        # and the filter code (index in filterNames) of each observation
+        self.obsIndexCat['filtercode'][:] = filterCodeArray[self.obsIndexCat['obsindex']]
+
         # and we're done
 
     def makeReferenceMatches(self, refLoader):
@@ -781,13 +833,6 @@ class FgcmMakeStars(object):
            Object which has refLoader.getFgcmReferenceStarsHealpix
         """
 
-        # can we use the better smatch code?
-        try:
-            import smatch
-            hasSmatch = True
-        except ImportError:
-            hasSmatch = False
-
         ipring = hp.ang2pix(self.starConfig['coarseNSide'],
                             np.radians(90.0 - self.objIndexCat['dec']),
                             np.radians(self.objIndexCat['ra']))
@@ -835,30 +880,12 @@ class FgcmMakeStars(object):
                 # No stars in this pixel.  That's okay.
                 continue
 
-            if hasSmatch:
-                matches = smatch.match(self.objIndexCat['ra'][p1a],
-                                       self.objIndexCat['dec'][p1a],
-                                       self.starConfig['matchRadius']/3600.0,
-                                       refCat['ra'], refCat['dec'],
-                                       nside=self.starConfig['matchNSide'],
-                                       maxmatch=1)
-                i1 = matches['i1']
-                i2 = matches['i2']
-            else:
-                htm = esutil.htm.HTM(11)
-
-                matcher = esutil.htm.Matcher(11,
-                                             self.objIndexCat['ra'][p1a],
-                                             self.objIndexCat['dec'][p1a])
-                matches = matcher.match(refCat['ra'], refCat['dec'],
+            i1, i2 = self.matcher.match(self.objIndexCat['ra'][p1a],
+                                        self.objIndexCat['dec'][p1a],
                                         self.starConfig['matchRadius']/3600.0,
+                                        refCat['ra'], refCat['dec'],
                                         maxmatch=1)
 
-                # matches[0] -> m1 -> array from matcher.match() call (refCat)
-                # matches[1] -> m2 -> array from htm.Matcher() (self.objIndexCat)
-                i2 = matches[0]
-                i1 = matches[1]
-
             # i1 -> objIndexCat[p1a]
             # i2 -> refCat
 
@@ -0,0 +1,186 @@
+from __future__ import division, absolute_import, print_function
+
+import numpy as np
+import esutil
+
+
+class FgcmMatcher(object):
+    """
+    Class to match positions on the sky, with a choice of backend.
+
+    The backends are:
+       'smatch': healpix matching with smatch (fastest, optional package)
+       'kdtree': scipy cKDTree on 3-D unit vectors, with the second set of
+          positions queried in chunks, so the memory is bounded by the
+          chunk matches and the output.
+       'htm': esutil htm matching (slow and memory-hungry on dense fields)
+       'auto': smatch if it can be imported, and otherwise kdtree
+
+    parameters
+    ----------
+    backend: string, default='auto'
+       Matcher backend
+    nside: int, default=4096
+       Healpix nside for smatch matching
+    htmDepth: int, default=11
+       Depth of the htm matcher
+    chunkSize: int, default=1000000
+       Number of positions of the second set to query at a time (kdtree)
+    """
+
+    backends = ['auto', 'smatch', 'kdtree', 'htm']
+
+    def __init__(self, backend='auto', nside=4096, htmDepth=11, chunkSize=1000000):
+
+        if backend not in self.backends:
+            raise ValueError("Matcher backend %s not one of %s" % (backend, ', '.join(self.backends)))
+
+        if backend == 'auto' or backend == 'smatch':
+            try:
+                import smatch
+                backend = 'smatch'
+            except ImportError:
+                if backend == 'smatch':
+                    raise ValueError("Matcher backend smatch requested, but smatch could not be imported")
+                backend = 'kdtree'
+
+        if chunkSize < 1:
+            raise ValueError("Matcher chunkSize must be positive")
+
+        self.backend = backend
+        self.nside = nside
+        self.htmDepth = htmDepth
+        self.chunkSize = chunkSize
+
+    def match(self, ra1, dec1, radius, ra2, dec2, maxmatch=0):
+        """
+        Match two sets of positions.
+
+        parameters
+        ----------
+        ra1: double array
+           RA of the first set (degrees)
+        dec1: double array
+           Dec of the first set (degrees)
+        radius: float or float array
+           Match radius (degrees), or the radius of each of the first set
+        ra2: double array
+           RA of the second set (degrees)
+        dec2: double array
+           Dec of the second set (degrees)
+        maxmatch: int, default=0
+           Maximum number of (closest) matches to each of the second set.
+           Zero for all matches.
+
+        returns
+        -------
+        i1: int array
+           Indices of the matches in the first set
+        i2: int array
+           Indices of the matches in the second set
+        """
+
+        if self.backend == 'smatch':
+            import smatch
+
+            matches = smatch.match(ra1, dec1, radius, ra2, dec2,
+                                   nside=self.nside, maxmatch=maxmatch)
+            return matches['i1'], matches['i2']
+        elif self.backend == 'kdtree':
+            return self._matchKDTree(ra1, dec1, radius, ra2, dec2, maxmatch)
+        else:
+            return self._matchHTM(ra1, dec1, radius, ra2, dec2, maxmatch)
+
+    def _matchHTM(self, ra1, dec1, radius, ra2, dec2, maxmatch):
+        """
+        Match with the esutil htm matcher.
+        """
+
+        if np.ndim(radius) == 0:
+            matcher = esutil.htm.Matcher(self.htmDepth, ra1, dec1)
+            matches = matcher.match(ra2, dec2, radius, maxmatch=maxmatch)
+            # matches[0] -> m1 -> array from matcher.match() call (set 2)
+            # matches[1] -> m2 -> array from htm.Matcher() (set 1)
+            return matches[1], matches[0]
+
+        # htm takes the radius of each position of the matched set, which
+        #  here is the first set
+        if maxmatch > 0:
+            raise ValueError("htm matching with a radius per position requires maxmatch=0")
+        matcher = esutil.htm.Matcher(self.htmDepth, ra2, dec2)
+        matches = matcher.match(ra1, dec1, radius, maxmatch=0)
+        return matches[0], matches[1]
+
+    def _matchKDTree(self, ra1, dec1, radius, ra2, dec2, maxmatch):
+        """
+        Match with a cKDTree of the first set, querying the second set in
+        chunks.  The matches are sorted by the index in the second set.
+        """
+
+        from scipy.spatial import cKDTree
+
+        xyz1 = self._unitVectors(ra1, dec1)
+        xyz2 = self._unitVectors(ra2, dec2)
+
+        # Chord length of the match radius on the unit sphere
+        chord = 2.0 * np.sin(np.radians(np.asarray(radius, dtype=np.float64)) / 2.0)
+        perPosition = (chord.ndim > 0)
+        maxChord = chord.max() if chord.size > 0 else 0.0
+
+        i1s = []
+        i2s = []
+        dists = []
+        if xyz1.shape[0] > 0 and xyz2.shape[0] > 0:
+            tree1 = cKDTree(xyz1)
+            for i0 in range(0, xyz2.shape[0], self.chunkSize):
+                tree2 = cKDTree(xyz2[i0: i0 + self.chunkSize])
+                pairs = tree1.sparse_distance_matrix(tree2, maxChord, output_type='ndarray')
+                tree2 = None
+
+                if perPosition:
+                    pairs = pairs[pairs['v'] <= chord[pairs['i']]]
+
+                i1s.append(pairs['i'])
+                i2s.append(pairs['j'] + i0)
+                dists.append(pairs['v'])
+                pairs = None
+
+        if len(i1s) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        i1 = np.concatenate(i1s)
+        i2 = np.concatenate(i2s)
+        dist = np.concatenate(dists)
+        i1s = None
+        i2s = None
+        dists = None
+
+        if maxmatch > 0:
+            # Keep the closest maxmatch matches to each of the second set
+            st = np.lexsort((i1, dist, i2))
+            i1 = i1[st]
+            i2 = i2[st]
+            groupStart = np.searchsorted(i2, i2, side='left')
+            keep, = np.where((np.arange(i2.size) - groupStart) < maxmatch)
+            st = keep[np.lexsort((i1[keep], i2[keep]))]
+        else:
+            st = np.lexsort((i1, i2))
+
+        return i1[st], i2[st]
+
+    @staticmethod
+    def _unitVectors(ra, dec):
+        """
+        Convert RA/Dec (degrees) to unit vectors.
+        """
+
+        raRad = np.radians(np.asarray(ra, dtype=np.float64))
+        decRad = np.radians(np.asarray(dec, dtype=np.float64))
+        cosDec = np.cos(decRad)
+
+        xyz = np.zeros((raRad.size, 3))
+        xyz[:, 0] = cosDec * np.cos(raRad)
+        xyz[:, 1] = cosDec * np.sin(raRad)
+        xyz[:, 2] = np.sin(decRad)
+
+        return xyz
@@ -1,5 +1,7 @@
 from __future__ import division, absolute_import, print_function
 
+import numpy as np
+
 try:
     from numba import jit
     has_numba = True
@@ -33,13 +35,59 @@ if has_numba:
         for i in range(indices[0].size):
             array[indices[0][i], indices[1][i], indices[2][i]] += value
 
+    @jit(nopython=True)
+    def lut_interp_i0_i1(offset, offsetSecZenithPlus, offsetPwvPlus, gridIndices,
+                         gridStart, gridDelta, lnPwv, o3, lnTau, alpha, secZenith,
+                         pmbFactor, i0Luts, i1Luts):
+        nObs = pmbFactor.size
+        I0 = np.zeros(nObs)
+        I1 = np.zeros(nObs)
+        I10 = np.zeros(nObs)
+
+        for i in range(nObs):
+            off = offset[i]
+            offZ = offsetSecZenithPlus[i]
+            offP = offsetPwvPlus[i]
+
+            dlnPwv = lnPwv[i] - (gridStart[0] + gridIndices[0][i] * gridDelta[0])
+            dO3 = o3[i] - (gridStart[1] + gridIndices[1][i] * gridDelta[1])
+            dlnTau = lnTau[i] - (gridStart[2] + gridIndices[2][i] * gridDelta[2])
+            dAlpha = alpha[i] - (gridStart[3] + gridIndices[3][i] * gridDelta[3])
+            dSecZenith = secZenith[i] - (gridStart[4] + gridIndices[4][i] * gridDelta[4])
+
+            I0[i] = pmbFactor[i] * (i0Luts[0][off] +
+                                    dlnPwv * i0Luts[1][off] +
+                                    dO3 * i0Luts[2][off] +
+                                    dlnTau * i0Luts[3][off] +
+                                    dAlpha * i0Luts[4][off] +
+                                    dSecZenith * i0Luts[5][off] +
+                                    dlnTau * dSecZenith * (i0Luts[3][offZ] -
+                                                           i0Luts[3][off]) / gridDelta[4] +
+                                    dlnPwv * dSecZenith * (i0Luts[1][offZ] -
+                                                           i0Luts[1][off]) / gridDelta[4] +
+                                    dlnPwv * (dlnPwv - gridDelta[0]) * (i0Luts[1][offP] -
+                                                                        i0Luts[1][off]))
+            I1[i] = pmbFactor[i] * (i1Luts[0][off] +
+                                    dlnPwv * i1Luts[1][off] +
+                                    dO3 * i1Luts[2][off] +
+                                    dlnTau * i1Luts[3][off] +
+                                    dAlpha * i1Luts[4][off] +
+                                    dSecZenith * i1Luts[5][off] +
+                                    dlnTau * dSecZenith * (i1Luts[3][offZ] -
+                                                           i1Luts[3][off]) / gridDelta[4] +
+                                    dlnPwv * dSecZenith * (i1Luts[1][offZ] -
+                                                           i1Luts[1][off]) / gridDelta[4] +
+                                    dlnPwv * (dlnPwv - gridDelta[0]) * (i1Luts[1][offP] -
+                                                                        i1Luts[1][off]))
+            I10[i] = I1[i] / I0[i]
+
+        return I0, I1, I10
+
     @jit
     def numba_test(value):
         pass
 
 else:
-    import numpy as np
-
     add_at_single = np.add.at
     add_at = np.add.at
     add_at_2d = np.add.at
@@ -51,3 +99,64 @@ else:
         pass
 
 
+
+
+def lut_interp_i0_i1_numpy(offset, offsetSecZenithPlus, offsetPwvPlus, gridIndices,
+                           gridStart, gridDelta, lnPwv, o3, lnTau, alpha, secZenith,
+                           pmbFactor, i0Luts, i1Luts):
+    """
+    Pure numpy version of lut_interp_i0_i1, with identical results.
+
+    parameters
+    ----------
+    offset: int64 array
+       Flat offset into the look-up tables
+    offsetSecZenithPlus: int64 array
+       Flat offset of the secZenith + 1 neighbour (clipped at the edge)
+    offsetPwvPlus: int64 array
+       Flat offset of the pwv + 1 neighbour (clipped at the edge)
+    gridIndices: tuple[5] of int arrays
+       Grid indices of lnPwv, o3, lnTau, alpha, secZenith
+    gridStart: tuple[5]
+       First grid value of lnPwv, o3, lnTau, alpha, secZenith
+    gridDelta: tuple[5]
+       Grid spacing of lnPwv, o3, lnTau, alpha, secZenith
+    lnPwv, o3, lnTau, alpha, secZenith, pmbFactor: float arrays
+    i0Luts: tuple[6] of flattened float arrays
+       I0, dLnPwv, dO3, dLnTau, dAlpha, dSecZenith look-up tables
+    i1Luts: tuple[6] of flattened float arrays
+       I1, dLnPwvI1, dO3I1, dLnTauI1, dAlphaI1, dSecZenithI1 look-up tables
+
+    returns
+    -------
+    I0, I1, I10: float arrays
+    """
+
+    dlnPwv = lnPwv - (gridStart[0] + gridIndices[0] * gridDelta[0])
+    dO3 = o3 - (gridStart[1] + gridIndices[1] * gridDelta[1])
+    dlnTau = lnTau - (gridStart[2] + gridIndices[2] * gridDelta[2])
+    dAlpha = alpha - (gridStart[3] + gridIndices[3] * gridDelta[3])
+    dSecZenith = secZenith - (gridStart[4] + gridIndices[4] * gridDelta[4])
+
+    Is = []
+    for luts in (i0Luts, i1Luts):
+        dLnPwvLut = luts[1].take(offset)
+        dLnTauLut = luts[3].take(offset)
+        Is.append(pmbFactor * (luts[0].take(offset) +
+                               dlnPwv * dLnPwvLut +
+                               dO3 * luts[2].take(offset) +
+                               dlnTau * dLnTauLut +
+                               dAlpha * luts[4].take(offset) +
+                               dSecZenith * luts[5].take(offset) +
+                               dlnTau * dSecZenith * (luts[3].take(offsetSecZenithPlus) -
+                                                      dLnTauLut) / gridDelta[4] +
+                               dlnPwv * dSecZenith * (luts[1].take(offsetSecZenithPlus) -
+                                                      dLnPwvLut) / gridDelta[4] +
+                               dlnPwv * (dlnPwv - gridDelta[0]) * (luts[1].take(offsetPwvPlus) -
+                                                                   dLnPwvLut)))
+
+    return Is[0], Is[1], Is[1] / Is[0]
+
+
+if not has_numba:
+    lut_interp_i0_i1 = lut_interp_i0_i1_numpy
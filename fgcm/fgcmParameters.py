@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 
 from .fgcmUtilities import expFlagDict
 from .fgcmUtilities import retrievalFlagDict
+from .fgcmUtilities import FlagGeneration
 
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
 
@@ -398,6 +399,9 @@ class FgcmParameters(object):
         # do lookups on parameter array
         self._arrangeParArray()
 
+        # and the fit curvature (for warm-starting the next cycle)
+        self.compFitCurvature = np.zeros(self.nFitPars, dtype='f8')
+
         # and we're done
 
     def _loadOldParameters(self, expInfo, inParInfo, inParams, inSuperStar):
@@ -495,6 +499,16 @@ class FgcmParameters(object):
 
         self._arrangeParArray()
 
+        # The fit curvature is only used if the fit parameters match
+        self.compFitCurvature = np.zeros(self.nFitPars, dtype='f8')
+        try:
+            inFitCurvature = np.atleast_1d(inParams['COMPFITCURVATURE'][0])
+            if inFitCurvature.size == self.nFitPars:
+                self.compFitCurvature[:] = inFitCurvature
+        except ValueError:
+            # This is okay, there will be no warm start from an old run
+            pass
+
         # need to load the superstarflats
         self.parSuperStarFlat = inSuperStar
 
@@ -550,6 +564,7 @@ class FgcmParameters(object):
 
         self.expArray = expInfo[self.expField]
         self.expFlag = np.zeros(self.nExp,dtype=np.int16)
+        self.expFlagGeneration = FlagGeneration()
         self.expExptime = expInfo['EXPTIME']
 
         # Load in the expSeeingVariable
@@ -685,6 +700,7 @@ class FgcmParameters(object):
         if (bad.size > 0):
             self.fgcmLog.warn('%d exposures with band not in LUT! Will not be fit.' % (bad.size))
             self.expFlag[bad] = self.expFlag[bad] | expFlagDict['BAND_NOT_IN_LUT']
+            self.expFlagGeneration.advance()
 
         # Flag exposures that are not in the fit bands
         self.expNotFitBandFlag = np.zeros(self.nExp, dtype=np.bool)
@@ -959,7 +975,8 @@ class FgcmParameters(object):
                ('PARRETRIEVEDLNPWVSCALE','f8'),
                ('PARRETRIEVEDLNPWVOFFSET','f8'),
                ('PARRETRIEVEDLNPWVNIGHTLYOFFSET','f8',self.parRetrievedLnPwvNightlyOffset.size),
-               ('COMPRETRIEVEDTAUNIGHT','f8',self.compRetrievedTauNight.size)]
+               ('COMPRETRIEVEDTAUNIGHT','f8',self.compRetrievedTauNight.size),
+               ('COMPFITCURVATURE','f8',self.compFitCurvature.size)]
 
         if (self.hasExternalPwv):
             dtype.extend([('PAREXTERNALLNPWVSCALE','f8'),
@@ -1024,6 +1041,8 @@ class FgcmParameters(object):
 
         pars['COMPRETRIEVEDTAUNIGHT'][:] = self.compRetrievedTauNight
 
+        pars['COMPFITCURVATURE'][:] = self.compFitCurvature
+
         return parInfo, pars
 
     def loadExternalPwv(self, externalPwvDeltaT):
@@ -1671,6 +1690,104 @@ class FgcmParameters(object):
 
         return parBounds
 
+    def getExpFlagGeneration(self, check=False):
+        """
+        Get the generation of the exposure flags, which is advanced whenever
+        expFlag is written.
+
+        parameters
+        ----------
+        check: bool, default=False
+           Check (with a checksum) that expFlag has not changed without
+           advancing its generation.  For debugging.
+
+        returns
+        -------
+        generation: int
+           Generation of expFlag
+        """
+
+        if check:
+            return self.expFlagGeneration.check(self.expFlag)
+
+        return self.expFlagGeneration.generation
+
+    def getParNightIndex(self):
+        """
+        Get the campaign night index of each fit parameter.
+
+        parameters
+        ----------
+        None
+
+        returns
+        -------
+        parNightIndex: int array
+           Night index of each nightly parameter, and -1 for the global
+           (scale, instrument and filter offset) parameters
+        """
+
+        parNightIndex = np.zeros(self.nFitPars, dtype=np.int32) - 1
+
+        nightLocs = [self.parO3Loc,
+                     self.parLnTauInterceptLoc,
+                     self.parLnTauSlopeLoc,
+                     self.parAlphaLoc]
+        if not self.useRetrievedPwv:
+            nightLocs.extend([self.parLnPwvInterceptLoc,
+                              self.parLnPwvSlopeLoc,
+                              self.parLnPwvQuadraticLoc])
+        if self.hasExternalPwv and not self.useRetrievedPwv:
+            nightLocs.append(self.parExternalLnPwvOffsetLoc)
+        if self.hasExternalTau:
+            nightLocs.append(self.parExternalLnTauOffsetLoc)
+        if self.useRetrievedPwv and self.useNightlyRetrievedPwv:
+            nightLocs.append(self.parRetrievedLnPwvNightlyOffsetLoc)
+
+        for loc in nightLocs:
+            parNightIndex[loc: loc + self.nCampaignNights] = np.arange(self.nCampaignNights)
+
+        return parNightIndex
+
+    def updateFitCurvature(self, parHistory, gradHistory):
+        """
+        Estimate the (diagonal) fit curvature from the curvature pairs of a
+        fit, to warm-start the step units of the next cycle.
+
+        parameters
+        ----------
+        parHistory: list of float arrays
+           Parameters (fitter units) at each fit iteration
+        gradHistory: list of float arrays
+           Chisq gradient (fitter units) at each fit iteration
+        """
+
+        if len(parHistory) < 2:
+            return
+
+        # Curvature pairs s = delta(pars), y = delta(gradient)
+        s = np.diff(np.array(parHistory), axis=0)
+        y = np.diff(np.array(gradHistory), axis=0)
+
+        # Per-parameter secant estimate, only using positive curvature pairs
+        sy = s * y
+        sy[sy < 0.0] = 0.0
+        sumSY = np.sum(sy, axis=0)
+        sumYY = np.sum(np.where(sy > 0.0, y * y, 0.0), axis=0)
+
+        curvature = np.zeros(self.nFitPars)
+        ok, = np.where(sumSY > 0.0)
+        curvature[ok] = sumYY[ok] / sumSY[ok]
+
+        # Convert from fitter units to parameter units, which are
+        #  independent of the step units in the next cycle.
+        updated = (curvature > 0.0)
+        self.compFitCurvature[updated] = curvature[updated] * self.stepUnits[updated]**2.
+
+        if not self.quietMode:
+            self.fgcmLog.info('Updated fit curvature for %d parameters from %d curvature pairs.' %
+                              (updated.sum(), s.shape[0]))
+
     @property
     def superStarFlatCenter(self):
         """
@@ -0,0 +1,242 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import numpy as np
+
+from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmUtilities import getProcessMemory
+
+
+class FgcmResourcePlanner(object):
+    """
+    Class to choose the number of worker processes (nCore) and the number
+     of stars per worker chunk (nStarPerRun) from a memory budget.
+
+    The peak memory of each worker is modeled as a fixed part (the process
+     itself, the shared look-up table pages it reads, and the per-parameter
+     sums) plus the temporaries of a chunk, which scale with the number of
+     observations and stars in the chunk.  The budget has to hold the main
+     process (as measured when planning) plus nCore workers.  The choice of
+     nStarPerRun is refined with refine() from the memory allocated by the
+     chunks (traced in the workers) and the throughput of the first chisq
+     iterations.
+
+    parameters
+    ----------
+    fgcmConfig: FgcmConfig
+       Config object, with memoryBudget (GB).  The chosen nCore and
+       nStarPerRun are set in the config.
+    fgcmPars: FgcmParameters
+       Parameter object
+    fgcmStars: FgcmStars
+       Star object (with stars loaded)
+    fgcmLUT: FgcmLUT
+       Look-up table object
+    """
+
+    # Memory of a forked worker process before any work (bytes)
+    workerBaseBytes = 50 * 1024**2
+    # Temporary memory per observation in a chunk of the chisq worker (bytes)
+    obsBytes = 350
+    # Temporary memory per star and band in a chunk (bytes)
+    starBandBytes = 48
+    # Temporary memory per fit parameter in a worker (bytes)
+    fitParBytes = 64
+    # Smallest chunk worth running (stars)
+    minStarPerRun = 1000
+    # Number of chisq calls used to refine the choice
+    nRefineCalls = 2
+    # Target fraction of each chunk's time spent on the work that scales
+    #  with its size (rather than the fixed overhead per chunk)
+    chunkEfficiency = 0.95
+
+    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmLUT):
+        self.fgcmLog = fgcmConfig.fgcmLog
+        self.fgcmConfig = fgcmConfig
+
+        self.memoryBudget = fgcmConfig.memoryBudget * 1024**3
+        self.maxCore = fgcmConfig.nCore
+        self.nBands = fgcmPars.nBands
+        self.nFitPars = fgcmPars.nFitPars
+        self.nStars = fgcmStars.nStars
+        self.obsPerStar = float(fgcmStars.nStarObs) / max(fgcmStars.nStars, 1)
+
+        # The look-up table is in shared memory, but each worker reads
+        #  (and so maps) all of it over a fit.
+        self.lutBytes = 0
+        for name in dir(fgcmLUT):
+            if name.startswith('lut') and name.endswith('Handle'):
+                self.lutBytes += snmm.getArray(getattr(fgcmLUT, name)).nbytes
+
+        # Scale applied to the modeled chunk temporaries, from refine()
+        self.memoryScale = 1.0
+        self.nRefined = 0
+
+        self.nCore = fgcmConfig.nCore
+        self.nStarPerRun = fgcmConfig.nStarPerRun
+
+    def plan(self):
+        """
+        Choose nCore and nStarPerRun from the memory budget, and set them in
+        the config.
+
+        returns
+        -------
+        nCore: int
+           Number of worker processes
+        nStarPerRun: int
+           Number of stars per worker chunk
+        """
+
+        mainRss, _ = getProcessMemory()
+        self.workerBudget = self.memoryBudget - mainRss
+
+        maxCore = self.maxCore
+        cpuCount = os.cpu_count()
+        if cpuCount is not None:
+            maxCore = min(maxCore, cpuCount)
+
+        # Use as many workers as can each run a chunk of at least
+        #  minStarPerRun stars (with at least one worker)
+        minWorkerBytes = self._workerBytes(self.minStarPerRun)
+        nCore = int(min(maxCore, self.workerBudget // minWorkerBytes))
+        if nCore < 1:
+            self.fgcmLog.warn('Memory budget of %.2f GB is too small for a worker with %d stars '
+                              '(%.1f MB, plus %.1f MB in the main process); using 1 core.' %
+                              (self.memoryBudget / 1024.**3, self.minStarPerRun,
+                               minWorkerBytes / 1024.**2, mainRss / 1024.**2))
+            nCore = 1
+
+        self.nCore = nCore
+        self.nStarPerRun = self._maxStarPerRun()
+
+        self.fgcmConfig.nCore = self.nCore
+        self.fgcmConfig.nStarPerRun = self.nStarPerRun
+
+        self.fgcmLog.info('Memory budget of %.2f GB (%.1f MB in the main process): '
+                          'using nCore = %d, nStarPerRun = %d (predicted worker peak %.1f MB).' %
+                          (self.memoryBudget / 1024.**3, mainRss / 1024.**2, self.nCore,
+                           self.nStarPerRun, self._workerBytes(self.nStarPerRun) / 1024.**2))
+
+        return self.nCore, self.nStarPerRun
+
+    @property
+    def needsRefine(self):
+        """
+        Should the next chisq call be measured for refine()?
+        """
+        return self.nRefined < self.nRefineCalls
+
+    def refine(self, workerList, taskTimes, taskTracedMemory, taskPeakRss):
+        """
+        Refine nStarPerRun from the measured memory and time of the chunks of
+        a chisq call.  Only the first nRefineCalls calls are used.
+
+        parameters
+        ----------
+        workerList: list of (goodStars, goodObs) tuples
+           Chunks of the call
+        taskTimes: list of floats
+           Time taken by each chunk (seconds)
+        taskTracedMemory: list of ints
+           Peak memory allocated by each chunk, traced in the workers (bytes)
+        taskPeakRss: list of ints
+           Peak resident memory of the worker for each chunk (bytes)
+
+        returns
+        -------
+        changed: bool
+           True if nStarPerRun changed (and was set in the config)
+        """
+
+        if not self.needsRefine:
+            return False
+        if taskTimes is None or taskTracedMemory is None or len(taskTimes) != len(workerList):
+            return False
+
+        self.nRefined += 1
+
+        nStars = np.array([elt[0].size for elt in workerList], dtype=np.float64)
+        nObs = np.array([elt[1].size for elt in workerList], dtype=np.float64)
+        times = np.array(taskTimes, dtype=np.float64)
+        measured = np.array(taskTracedMemory, dtype=np.float64)
+
+        # Memory: scale the modeled chunk temporaries to the worst measured chunk
+        predicted = self._chunkBytes(nStars, nObs)
+        predictedPeak = np.max(self._workerBytes(nStars, nObs))
+        use, = np.where((predicted > 0.0) & (measured > 0.0))
+        if use.size > 0:
+            self.memoryScale = max(np.max(self.memoryScale * measured[use] / predicted[use]), 0.5)
+
+        # The resident memory of the workers also counts the shared memory
+        #  (and memory inherited from the main process) that they touch.
+        self.fgcmLog.info('Worker peak memory: predicted %.1f MB (%.1f MB for the largest chunk), '
+                          'measured %.1f MB for the largest chunk and %.1f MB peak RSS.' %
+                          (predictedPeak / 1024.**2, np.max(predicted) / 1024.**2,
+                           np.max(measured) / 1024.**2, np.max(taskPeakRss) / 1024.**2))
+
+        nStarPerRun = self._maxStarPerRun()
+
+        # Throughput: fit the chunk time as a fixed overhead plus a time per
+        #  observation, and make the chunks large enough that the overhead
+        #  is small (as allowed by the memory).
+        if times.size >= 3 and np.sum(times) > 0.0:
+            self.fgcmLog.info('Measured throughput of %.0f stars per second per worker.' %
+                              (np.sum(nStars) / np.sum(times)))
+
+            coeffs, _, rank, _ = np.linalg.lstsq(np.vstack((np.ones(times.size), nObs)).T,
+                                                 times, rcond=None)
+            if rank == 2 and coeffs[0] > 0.0 and coeffs[1] > 0.0:
+                minObs = coeffs[0] * self.chunkEfficiency / ((1.0 - self.chunkEfficiency) * coeffs[1])
+                nStarPerRun = min(nStarPerRun, max(self.nStarPerRun,
+                                                   int(minObs / self.obsPerStar)))
+
+        nStarPerRun = max(nStarPerRun, 1)
+        if nStarPerRun == self.nStarPerRun:
+            return False
+
+        self.fgcmLog.info('Refined nStarPerRun from %d to %d.' % (self.nStarPerRun, nStarPerRun))
+
+        self.nStarPerRun = nStarPerRun
+        self.fgcmConfig.nStarPerRun = nStarPerRun
+
+        return True
+
+    def _maxStarPerRun(self):
+        """
+        Get the largest nStarPerRun for nCore workers within the budget,
+        but with at least one chunk per worker.  Not to be called on its own.
+        """
+
+        perWorker = self.workerBudget / self.nCore - self._workerBytes(0)
+        perStar = self._chunkBytes(1.0, self.obsPerStar)
+
+        nStarPerRun = int(max(perWorker, 0.0) // perStar)
+
+        return int(max(min(nStarPerRun, self.nStars // self.nCore + 1), 1))
+
+    def _chunkBytes(self, nStars, nObs):
+        """
+        Modeled temporary memory of a chunk.  Not to be called on its own.
+        """
+
+        return self.memoryScale * (self.obsBytes * nObs + self.starBandBytes * self.nBands * nStars)
+
+    def _workerBytes(self, nStars, nObs=None):
+        """
+        Modeled peak memory of a worker running a chunk.  Not to be called
+        on its own.
+        """
+
+        if nObs is None:
+            nObs = nStars * self.obsPerStar
+
+        return (self.workerBaseBytes + self.lutBytes + self.fitParBytes * self.nFitPars +
+                self._chunkBytes(nStars, nObs))
+
+    def __getstate__(self):
+        # Don't try to pickle the logger.
+
+        state = self.__dict__.copy()
+        del state['fgcmLog']
+        return state
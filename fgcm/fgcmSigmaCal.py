@@ -16,10 +16,8 @@ try:
 except ImportError:
     import copyreg
 
-import multiprocessing
-from multiprocessing import Pool
-
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmWorkerPool import FgcmWorkerPool
 
 copyreg.pickle(types.MethodType, _pickle_method)
 
@@ -35,14 +33,26 @@ class FgcmSigmaCal(object):
        Parameter object
     fgcmStars: FgcmStars
        Stars object
+    fgcmGray: FgcmGray
+       Gray object
+    fgcmWorkerPool: FgcmWorkerPool, optional
+       Persistent worker pool.  If None, a pool is made for each run.
     """
 
-    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmGray):
+    # These are the attributes that may change between maps, and are sent
+    #  to the persistent pool workers with each map.
+    _workerStateAttrs = ['sigmaCal', 'applyGray',
+                         'fgcmPars.compSigFgcm', 'fgcmPars.expFlag']
+
+    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmGray, fgcmWorkerPool=None):
 
         self.fgcmLog = fgcmConfig.fgcmLog
 
         self.fgcmLog.debug('Initializing FgcmSigmaCal')
 
+        # this may be None, in which case we make a pool for each run
+        self.fgcmWorkerPool = fgcmWorkerPool
+
         self.fgcmPars = fgcmPars
         self.fgcmStars = fgcmStars
         self.fgcmGray = fgcmGray
@@ -101,22 +111,10 @@ class FgcmSigmaCal(object):
                            (time.time() - preStartTime))
 
         nSections = goodStars.size // self.nStarPerRun + 1
-        goodStarsList = np.array_split(goodStars, nSections)
-
-        splitValues = np.zeros(nSections-1,dtype='i4')
-        for i in range(1, nSections):
-            splitValues[i-1] = goodStarsList[i][0]
-
-        # get the indices from the goodStarsSub matched list (matched to goodStars)
-        splitIndices = np.searchsorted(goodStars[goodStarsSub], splitValues)
-
-        # and split along the indices
-        goodObsList = np.split(goodObs, splitIndices)
-
-        workerList = list(zip(goodStarsList, goodObsList))
-
-        # reverse sort so the longest running go first
-        workerList.sort(key=lambda elt:elt[1].size, reverse=True)
+        workerList = self.fgcmStars.splitGoodObsIndices(goodStars, goodStarsSub,
+                                                        goodObs, nSections,
+                                                        nCore=self.nCore,
+                                                        stage='sigmaCal')
 
         if not self.quietMode:
             self.fgcmLog.info('Running SigmaCal on %d cores' % (self.nCore))
@@ -190,14 +188,21 @@ class FgcmSigmaCal(object):
             plotMags = np.zeros((sigmaCals.size, self.fgcmPars.nBands, nPlotBin))
             plotChi2s = np.zeros_like(plotMags)
 
+        # use the persistent pool if we have one; otherwise one pool
+        #  is used for all the sigmaCals
+        if self.fgcmWorkerPool is not None:
+            pool = self.fgcmWorkerPool
+        else:
+            pool = FgcmWorkerPool(self.nCore, self.fgcmLog)
+
         # And do all the sigmaCals:
         for i, s in enumerate(sigmaCals):
             self.sigmaCal = s
 
-            pool = Pool(processes=self.nCore)
-            pool.map(self._worker, workerList, chunksize=1)
-            pool.close()
-            pool.join()
+            pool.map(self, '_worker', workerList,
+                     stateAttrs=self._workerStateAttrs)
+            self.fgcmStars.chunkPlanner.recordTiming('sigmaCal', workerList,
+                                                     pool.lastTaskTimes)
 
             for bandIndex, band in enumerate(self.fgcmPars.bands):
                 if not self.fgcmPars.hasExposuresInBand[bandIndex]:
@@ -225,6 +230,9 @@ class FgcmSigmaCal(object):
                         plotMags[i, bandIndex, j] = np.median(objMagStdMean[goodStars[plotIndices[band][ok[i1a]]], bandIndex])
                         plotChi2s[i, bandIndex, j] = np.median(objChi2[goodStars[plotIndices[band][ok[i1a]]], bandIndex])
 
+        if self.fgcmWorkerPool is None:
+            pool.close()
+
         # And get the minima...
         mininds = np.zeros(self.fgcmPars.nBands, dtype=np.int32)
         for bandIndex, band in enumerate(self.fgcmPars.bands):
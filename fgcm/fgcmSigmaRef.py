@@ -188,6 +188,7 @@ class FgcmSigmaRef(object):
                         if bad.size > 0:
                             message = "Marked %d reference stars as REFSTAR_OUTLIER from observations in the %s band." % (bad.size, band)
                             objFlag[goodRefStars[refUse[bad]]] |= objFlagDict['REFSTAR_OUTLIER']
+                            self.fgcmStars.objFlagGeneration.advance()
                         else:
                             message = None
 
@@ -0,0 +1,186 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import time
+import hashlib
+import numpy as np
+import yaml
+
+
+class FgcmStarCache(object):
+    """
+    Class to describe an on-disk cache of the star arrays derived when loading
+     stars (exposure, filter and object indices, secZenith, etc.), so that
+     subsequent fit cycles can skip rebuilding them.
+
+    The cache is a directory with one .npy file per array, plus a metadata
+     file with the cache key.  The key is a hash of the star file signatures,
+     the exposure information and the configuration fields that enter the
+     derived arrays; a cache with a different key is rebuilt.
+
+    parameters
+    ----------
+    cachePath: string
+       Directory of the star cache
+    fgcmLog: FgcmLogger
+       Logger object
+    """
+
+    metaFile = 'cache.yaml'
+
+    # Increment when the cached arrays change
+    cacheVersion = 1
+
+    def __init__(self, cachePath, fgcmLog):
+
+        self.cachePath = os.path.abspath(cachePath)
+        self.fgcmLog = fgcmLog
+
+        self.meta = None
+
+        metaFile = os.path.join(self.cachePath, self.metaFile)
+        if os.path.isfile(metaFile):
+            # A metadata file which cannot be read is treated as a missing
+            #  cache, which will be rebuilt
+            try:
+                with open(metaFile) as f:
+                    meta = yaml.load(f, Loader=yaml.SafeLoader)
+            except (IOError, OSError, yaml.YAMLError):
+                meta = None
+            if isinstance(meta, dict) and 'key' in meta:
+                self.meta = meta
+            else:
+                self.fgcmLog.info('Star cache metadata %s is incomplete, and will be ignored.' %
+                                  (metaFile))
+
+    @classmethod
+    def computeKey(cls, filenames, arrays, config):
+        """
+        Compute the cache key.
+
+        parameters
+        ----------
+        filenames: list of strings
+           Star files; the path, size and modification time enter the key
+           (or just the path, if the file does not exist)
+        arrays: list of numpy arrays
+           Exposure information arrays
+        config: dict
+           Configuration values (must be yaml serializable)
+
+        returns
+        -------
+        key: string
+        """
+
+        h = hashlib.sha1()
+        h.update(('version %d' % (cls.cacheVersion)).encode('utf-8'))
+
+        for filename in filenames:
+            if filename is None or not os.path.isfile(filename):
+                h.update(('%s missing' % (filename)).encode('utf-8'))
+                continue
+            st = os.stat(filename)
+            h.update(('%s %d %f' % (os.path.abspath(filename), st.st_size,
+                                    st.st_mtime)).encode('utf-8'))
+
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            h.update(str(array.dtype).encode('utf-8'))
+            h.update(str(array.shape).encode('utf-8'))
+            h.update(array.tobytes())
+
+        h.update(yaml.dump(config, default_flow_style=True).encode('utf-8'))
+
+        return h.hexdigest()
+
+    def isCurrent(self, key):
+        """
+        Check if the cache is complete and was made with the given key.
+
+        parameters
+        ----------
+        key: string
+           Cache key from computeKey()
+
+        returns
+        -------
+        isCurrent: bool
+        """
+
+        return (self.meta is not None and self.meta.get('key') == key)
+
+    def save(self, key, arrays, **meta):
+        """
+        Save arrays to the cache, replacing any previous cache.
+
+        parameters
+        ----------
+        key: string
+           Cache key from computeKey()
+        arrays: dict
+           Arrays to save, keyed by name
+        **meta:
+           Additional (yaml serializable) values to record
+        """
+
+        startTime = time.time()
+
+        if self.meta is not None:
+            # Invalidate the previous cache first, then remove its arrays
+            os.remove(os.path.join(self.cachePath, self.metaFile))
+            for name in self.meta.get('arrays', []):
+                filename = os.path.join(self.cachePath, name + '.npy')
+                if os.path.isfile(filename):
+                    os.remove(filename)
+            self.meta = None
+
+        if not os.path.isdir(self.cachePath):
+            try:
+                os.makedirs(self.cachePath)
+            except:
+                raise IOError("Could not create star cache path: %s" % (self.cachePath))
+
+        for name in arrays:
+            np.save(os.path.join(self.cachePath, name + '.npy'), arrays[name])
+
+        # The metadata file is written last, and marks the cache as complete.
+        #  It is written to a temporary file and moved into place, so that
+        #  it is never left incomplete.
+        self.meta = dict(meta)
+        self.meta['key'] = key
+        self.meta['arrays'] = sorted(arrays.keys())
+        tempName = os.path.join(self.cachePath, '%s.tmp%d' % (self.metaFile, os.getpid()))
+        try:
+            with open(tempName, 'w') as f:
+                yaml.dump(self.meta, f, default_flow_style=False)
+            os.replace(tempName, os.path.join(self.cachePath, self.metaFile))
+        except:
+            if os.path.isfile(tempName):
+                os.remove(tempName)
+            raise
+
+        self.fgcmLog.info('Saved %d arrays to star cache %s in %.1f seconds.' %
+                          (len(arrays), self.cachePath, time.time() - startTime))
+
+    def read(self, name):
+        """
+        Get a read-only memory map of a cached array.
+
+        parameters
+        ----------
+        name: string
+           Array name
+
+        returns
+        -------
+        array: numpy memmap
+        """
+        return np.load(os.path.join(self.cachePath, name + '.npy'), mmap_mode='r')
+
+    def __getstate__(self):
+        # Don't try to pickle the logger.
+
+        state = self.__dict__.copy()
+        del state['fgcmLog']
+        return state
@@ -0,0 +1,393 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import time
+import atexit
+import shutil
+import tempfile
+import numpy as np
+import yaml
+
+from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmUtilities import getFilterCodes
+
+
+class FgcmStarStore(object):
+    """
+    Class to describe an on-disk, memory-mapped store of star observations.
+
+    The store is a directory with one .npy file per observation column, in
+     the order of the index file OBSINDEX, plus the star position table.  It
+     is written once from the observation/index fits files with convert().
+     The static columns are mapped read-only, and the columns which are
+     modified in the fit are made as memory-mapped scratch files in the
+     store, so all worker processes share the same pages and the observations
+     need not fit in memory.
+
+    parameters
+    ----------
+    storePath: string
+       Directory of the star store
+    fgcmLog: FgcmLogger
+       Logger object
+
+    Store columns
+    -------------
+    obsExp: int array
+       Exposure number (expField)
+    obsCCD: int array
+       CCD number (ccdField)
+    obsRA: double array
+    obsDec: double array
+    obsMag: float array
+       Raw ADU magnitude
+    obsMagErr: float array
+       Raw ADU magnitude error
+    obsFilterCode: int array
+       Filter code (index in the store filterNames)
+    obsX: float array, optional
+    obsY: float array, optional
+    """
+
+    metaFile = 'store.yaml'
+    posFile = 'pos.npy'
+
+    # store column name, fits column name (or the expField/ccdField config
+    #  name), and dtype (matching the FgcmStars shared arrays)
+    obsColumns = [('obsExp', 'expField', 'i4'),
+                  ('obsCCD', 'ccdField', 'i2'),
+                  ('obsRA', 'RA', 'f8'),
+                  ('obsDec', 'DEC', 'f8'),
+                  ('obsMag', 'MAG', 'f4'),
+                  ('obsMagErr', 'MAGERR', 'f4'),
+                  ('obsFilterCode', 'FILTERNAME', 'i2')]
+    xyColumns = [('obsX', 'X', 'f4'),
+                 ('obsY', 'Y', 'f4')]
+
+    def __init__(self, storePath, fgcmLog):
+
+        self.storePath = os.path.abspath(storePath)
+        self.fgcmLog = fgcmLog
+
+        metaFile = os.path.join(self.storePath, self.metaFile)
+        if not os.path.isfile(metaFile):
+            raise IOError("Could not find star store metadata %s" % (metaFile))
+
+        with open(metaFile) as f:
+            self.meta = yaml.load(f, Loader=yaml.SafeLoader)
+
+        self.nStarObs = self.meta['nStarObs']
+        self.hasXY = self.meta['hasXY']
+        self.filterNames = self.meta.get('filterNames', [])
+
+        self.scratchPath = None
+
+    @staticmethod
+    def exists(storePath):
+        """
+        Check if a complete star store exists.
+
+        parameters
+        ----------
+        storePath: string
+           Directory of the star store
+        """
+        return os.path.isfile(os.path.join(storePath, FgcmStarStore.metaFile))
+
+    @staticmethod
+    def _sourceSignature(filename):
+        """
+        Get the size and modification time of a source file, to check if the
+        store is up to date.
+        """
+        st = os.stat(filename)
+        return {'file': os.path.abspath(filename), 'size': int(st.st_size),
+                'mtime': float(st.st_mtime)}
+
+    @staticmethod
+    def _learnFilterCodes(filterNameArray, filterNames):
+        """
+        Get the filter codes of filter names, appending any new names to
+        filterNames.
+
+        parameters
+        ----------
+        filterNameArray: string array
+           Filter name of each observation
+        filterNames: list of strings
+           Filter names, in code order.  Modified in place.
+
+        returns
+        -------
+        filterCodes: int16 array
+        """
+
+        filterCodes = getFilterCodes(filterNameArray, filterNames)
+        missing, = np.where(filterCodes < 0)
+        if missing.size > 0:
+            for name in np.unique(np.char.strip(filterNameArray[missing])):
+                filterNames.append(name.decode('utf-8') if isinstance(name, bytes) else str(name))
+            filterCodes[missing] = getFilterCodes(filterNameArray[missing], filterNames)
+
+        return filterCodes
+
+    @classmethod
+    def convert(cls, obsFile, indexFile, storePath, fgcmLog, expField='EXPNUM',
+                ccdField='CCDNUM', nObsPerChunk=5000000, clobber=False):
+        """
+        Convert observation and index fits files into a star store.
+
+        parameters
+        ----------
+        obsFile: string
+           Star observation file
+        indexFile: string
+           Star index file
+        storePath: string
+           Directory of the star store
+        fgcmLog: FgcmLogger
+           Logger object
+        expField: string, default='EXPNUM'
+           Exposure field name in obsFile
+        ccdField: string, default='CCDNUM'
+           CCD field name in obsFile
+        nObsPerChunk: int, default=5000000
+           Number of observations to read at a time
+        clobber: bool, default=False
+           Overwrite an existing store
+
+        returns
+        -------
+        fgcmStarStore: FgcmStarStore
+        """
+
+        import fitsio
+
+        if cls.exists(storePath):
+            if not clobber:
+                raise RuntimeError("Found star store %s, but clobber == False." % (storePath))
+            shutil.rmtree(storePath)
+
+        if not os.path.isdir(storePath):
+            try:
+                os.makedirs(storePath)
+            except:
+                raise IOError("Could not create star store path: %s" % (storePath))
+
+        startTime = time.time()
+        fgcmLog.info('Converting %s to star store %s' % (obsFile, storePath))
+
+        # The filter codes are taken from the index file if it has them,
+        #  and otherwise are made from the observation filter names
+        indexFilterCode = None
+        filterNames = []
+        with fitsio.FITS(indexFile) as indexFits:
+            index = indexFits['INDEX'].read(upper=True)
+            obsIndex = index['OBSINDEX']
+            if 'FILTERCODE' in index.dtype.names and 'FILTERS' in indexFits:
+                if index['FILTERCODE'].min(initial=0) >= 0:
+                    indexFilterCode = index['FILTERCODE']
+                    for name in np.char.strip(indexFits['FILTERS'].read(upper=True)['FILTERNAME']):
+                        filterNames.append(name.decode('utf-8') if isinstance(name, bytes) else str(name))
+            index = None
+
+        pos = fitsio.read(indexFile, ext='POS', upper=True)
+        np.save(os.path.join(storePath, cls.posFile), pos)
+
+        nStarObs = obsIndex.size
+
+        with fitsio.FITS(obsFile) as fits:
+            hdu = fits[1]
+            colNames = {name.upper(): name for name in hdu.get_colnames()}
+
+            columns = list(cls.obsColumns)
+            hasXY = ('X' in colNames and 'Y' in colNames)
+            if hasXY:
+                columns.extend(cls.xyColumns)
+
+            fitsNames = []
+            for column, fitsName, dtype in columns:
+                if fitsName == 'expField':
+                    fitsName = expField
+                elif fitsName == 'ccdField':
+                    fitsName = ccdField
+                elif column == 'obsFilterCode' and indexFilterCode is not None:
+                    fitsNames.append(None)
+                    continue
+                if fitsName.upper() not in colNames:
+                    raise ValueError("Could not find column %s in %s" % (fitsName, obsFile))
+                fitsNames.append(colNames[fitsName.upper()])
+            readNames = [fitsName for fitsName in fitsNames if fitsName is not None]
+
+            outArrays = None
+            for i0 in range(0, nStarObs, nObsPerChunk):
+                chunkIndex = obsIndex[i0: i0 + nObsPerChunk]
+
+                # read sorted unique rows, then put them in OBSINDEX order
+                rows, inv = np.unique(chunkIndex, return_inverse=True)
+                chunk = hdu.read(columns=readNames, rows=rows)
+
+                if outArrays is None:
+                    outArrays = []
+                    for column, _, dtype in columns:
+                        outArrays.append(np.lib.format.open_memmap(
+                                os.path.join(storePath, column + '.npy'),
+                                mode='w+', dtype=dtype, shape=(nStarObs, )))
+
+                for outArray, fitsName, (column, _, _) in zip(outArrays, fitsNames, columns):
+                    if column == 'obsFilterCode':
+                        if indexFilterCode is not None:
+                            outArray[i0: i0 + chunkIndex.size] = indexFilterCode[i0: i0 + chunkIndex.size]
+                        else:
+                            outArray[i0: i0 + chunkIndex.size] = cls._learnFilterCodes(chunk[fitsName][inv],
+                                                                                     filterNames)
+                    else:
+                        outArray[i0: i0 + chunkIndex.size] = chunk[fitsName][inv]
+
+                fgcmLog.debug('Converted %d of %d observations' %
+                              (min(i0 + nObsPerChunk, nStarObs), nStarObs))
+
+            if outArrays is not None:
+                for outArray in outArrays:
+                    outArray.flush()
+                outArrays = None
+
+        # The metadata file is written last, and marks the store as complete
+        meta = {'nStarObs': int(nStarObs),
+                'nStars': int(pos.size),
+                'hasXY': bool(hasXY),
+                'expField': expField,
+                'ccdField': ccdField,
+                'filterNames': filterNames,
+                'obsFile': cls._sourceSignature(obsFile),
+                'indexFile': cls._sourceSignature(indexFile)}
+        with open(os.path.join(storePath, cls.metaFile), 'w') as f:
+            yaml.dump(meta, f, default_flow_style=False)
+
+        fgcmLog.info('Converted %d observations to star store in %.1f seconds.' %
+                     (nStarObs, time.time() - startTime))
+
+        return cls(storePath, fgcmLog)
+
+    def isCurrent(self, obsFile, indexFile, expField, ccdField):
+        """
+        Check if the store was made from the given files and fields.
+
+        parameters
+        ----------
+        obsFile: string
+           Star observation file
+        indexFile: string
+           Star index file
+        expField: string
+           Exposure field name
+        ccdField: string
+           CCD field name
+
+        returns
+        -------
+        isCurrent: bool
+        """
+
+        if self.meta['expField'] != expField or self.meta['ccdField'] != ccdField:
+            return False
+
+        # Stores from before the filter codes have filter name strings
+        if 'filterNames' not in self.meta:
+            return False
+
+        for key, filename in zip(['obsFile', 'indexFile'], [obsFile, indexFile]):
+            if not os.path.isfile(filename):
+                # Allow the store to be used without the original files
+                continue
+            if self._sourceSignature(filename) != self.meta[key]:
+                return False
+
+        return True
+
+    def readPositions(self):
+        """
+        Read the star position table.
+
+        returns
+        -------
+        pos: numpy recarray
+           The POS table of the index file
+        """
+        return np.load(os.path.join(self.storePath, self.posFile))
+
+    def getColumn(self, column):
+        """
+        Get a read-only memory map of a store column.
+
+        parameters
+        ----------
+        column: string
+           Store column name
+
+        returns
+        -------
+        array: numpy memmap
+        """
+        return np.load(os.path.join(self.storePath, column + '.npy'), mmap_mode='r')
+
+    def mapColumn(self, column):
+        """
+        Map a store column read-only into a shared array handle.
+
+        parameters
+        ----------
+        column: string
+           Store column name
+
+        returns
+        -------
+        handle: int
+           snmm handle
+        """
+        return snmm.mapArray(os.path.join(self.storePath, column + '.npy'), readOnly=True)
+
+    def createScratchArray(self, name, dtype, syncAccess=False):
+        """
+        Create a writable per-observation array, as a memory-mapped scratch
+        file in the store.  The file is removed when the array is freed, or
+        at exit.
+
+        parameters
+        ----------
+        name: string
+           Name of the array
+        dtype: numpy dtype
+        syncAccess: bool, default=False
+           Associate array with lock
+
+        returns
+        -------
+        handle: int
+           snmm handle
+        """
+
+        if self.scratchPath is None:
+            self.scratchPath = tempfile.mkdtemp(prefix='scratch_%d_' % (os.getpid()),
+                                                dir=self.storePath)
+            self.scratchPid = os.getpid()
+            atexit.register(self.removeScratch)
+
+        return snmm.createArray(self.nStarObs, dtype=dtype, syncAccess=syncAccess,
+                                mmapFile=os.path.join(self.scratchPath, name + '.npy'))
+
+    def removeScratch(self):
+        """
+        Remove the scratch directory, if it was made by this process.  The
+        scratch arrays must not be used after this.
+        """
+        if self.scratchPath is not None and os.getpid() == self.scratchPid:
+            shutil.rmtree(self.scratchPath, ignore_errors=True)
+            self.scratchPath = None
+
+    def __getstate__(self):
+        # Don't try to pickle the logger.
+
+        state = self.__dict__.copy()
+        del state['fgcmLog']
+        return state
@@ -9,8 +9,14 @@ import matplotlib.pyplot as plt
 
 from .fgcmUtilities import objFlagDict
 from .fgcmUtilities import obsFlagDict
+from .fgcmUtilities import getMemoryString
+from .fgcmUtilities import FlagGeneration
+from .fgcmUtilities import getFilterCodes
 
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmStarStore import FgcmStarStore
+from .fgcmStarCache import FgcmStarCache
+from .fgcmChunkPlanner import FgcmChunkPlanner
 
 class FgcmStars(object):
     """
@@ -43,8 +49,26 @@ class FgcmStars(object):
        Star observation file
     indexFile: string, only if using fits mode
        Star index file
+    starStorePath: string, optional, only if using fits mode
+       Memory-mapped star store directory (see FgcmStarStore)
+    starCachePath: string, optional, only if using fits mode
+       Directory to cache derived star arrays between cycles (see FgcmStarCache)
+    obsPrecision: string
+       Precision of the per-observation floating-point arrays ('float64' or 'float32')
     """
 
+    # Derived observation arrays saved in the star cache
+    starCacheObsArrays = ['obsExpIndex', 'obsBandIndex', 'obsLUTFilterIndex', 'obsFlag',
+                          'obsSecZenith', 'obsMagADU', 'obsMagADUErr', 'obsObjIDIndex']
+    # Input observation arrays saved in the star cache (without a star store)
+    starCacheInputArrays = ['obsExp', 'obsCCD', 'obsRA', 'obsDec']
+    # Object arrays saved in the star cache
+    starCacheObjArrays = ['objID', 'objRA', 'objDec', 'objObsIndex', 'objNobs']
+    # Arrays changed by a fit cycle, saved in fit cycle checkpoints (if present)
+    checkpointArrays = ['obsFlag', 'obsMagADU', 'obsMagADUModelErr', 'obsSuperStarApplied',
+                        'obsMagStd', 'objFlag', 'objNGoodObs', 'objNTotalObs', 'objNPsfCandidate',
+                        'objSEDSlope', 'objMagStdMean', 'objMagStdMeanErr', 'objMagStdMeanNoChrom']
+
     def __init__(self,fgcmConfig):
 
         self.fgcmLog = fgcmConfig.fgcmLog
@@ -54,6 +78,10 @@ class FgcmStars(object):
         self.obsFile = fgcmConfig.obsFile
         self.indexFile = fgcmConfig.indexFile
         self.refstarFile = fgcmConfig.refstarFile
+        self.starStorePath = fgcmConfig.starStorePath
+        self.starStore = None
+        self.starCachePath = fgcmConfig.starCachePath
+        self.obsFloatDtype = 'f4' if fgcmConfig.obsPrecision == 'float32' else 'f8'
 
         self.bands = fgcmConfig.bands
         self.nBands = len(fgcmConfig.bands)
@@ -91,6 +119,14 @@ class FgcmStars(object):
         self.bandNotFitIndex = fgcmConfig.bandNotFitIndex
         self.lutFilterNames = fgcmConfig.lutFilterNames
         self.filterToBand = fgcmConfig.filterToBand
+
+        # Band index of each LUT filter (-1 for filters not in the config)
+        self.lutFilterBandIndex = np.zeros(len(self.lutFilterNames), dtype=np.int16)
+        for filterIndex, filterName in enumerate(self.lutFilterNames):
+            try:
+                self.lutFilterBandIndex[filterIndex] = self.bands.index(self.filterToBand[filterName])
+            except KeyError:
+                self.lutFilterBandIndex[filterIndex] = -1
         self.colorSplitIndices = fgcmConfig.colorSplitIndices
 
         self.superStarSubCCD = fgcmConfig.superStarSubCCD
@@ -119,15 +155,29 @@ class FgcmStars(object):
 
         self.starsLoaded = False
 
-    def loadStarsFromFits(self,fgcmPars,computeNobs=True):
+        # Generation counters for caching the good star/observation selections
+        self.objFlagGeneration = FlagGeneration()
+        self.obsFlagGeneration = FlagGeneration()
+        self.objNGoodObsGeneration = FlagGeneration()
+
+        # Chunk planner for splitting the stars among the workers
+        self.chunkPlanner = FgcmChunkPlanner()
+
+    def loadStarsFromFits(self, fgcmPars, computeNobs=True, nObsPerChunk=5000000):
         """
         Load stars from fits files.
 
+        Only the required columns of the observation file are read, in
+         chunks of rows, and the indexed observations are written directly
+         into the shared arrays.
+
         parameters
         ----------
         fgcmPars: FgcmParameters
         computeNobs: bool, default=True
            Compute number of observations of each star/band
+        nObsPerChunk: int, default=5000000
+           Number of rows of the observation file to read at a time
 
         Config variables
         ----------------
@@ -137,27 +187,56 @@ class FgcmStars(object):
            Star observation file
         inFlagStarFile: string, optional
            Flagged star file
+        starCachePath: string, optional
+           Star cache directory
         """
 
         import fitsio
 
+        starCacheKey = None
+        if self.starCachePath is not None:
+            starCacheKey = self._computeStarCacheKey(fgcmPars)
+            starCache = FgcmStarCache(self.starCachePath, self.fgcmLog)
+            if (starCache.isCurrent(starCacheKey) and
+                (self.starStorePath is None or FgcmStarStore.exists(self.starStorePath))):
+                self._loadStarsFromCache(fgcmPars, starCache, computeNobs=computeNobs)
+                return
+            self.fgcmLog.info('Star cache %s is missing or out of date, and will be rebuilt.' %
+                              (self.starCachePath))
+
+        if self.starStorePath is not None:
+            self.loadStarsFromStore(fgcmPars, computeNobs=computeNobs,
+                                    nObsPerChunk=nObsPerChunk,
+                                    starCacheKey=starCacheKey)
+            return
+
+        loadStartTime = time.time()
+        if not self.quietMode:
+            self.fgcmLog.info(getMemoryString('Before loading stars'))
+
         # read in the observation indices...
         startTime = time.time()
         self.fgcmLog.debug('Reading in observation indices...')
-        index = fitsio.read(self.indexFile, ext='INDEX', upper=True)
+        obsLUTFilterIndex = None
+        with fitsio.FITS(self.indexFile) as indexFits:
+            indexColNames = [name.upper() for name in indexFits['INDEX'].get_colnames()]
+            if 'FILTERCODE' in indexColNames and 'FILTERS' in indexFits:
+                # The index has the filter code of each observation, so the
+                #  filter names need not be read from the observation file
+                obsIndexCat = indexFits['INDEX'].read(columns=['OBSINDEX', 'FILTERCODE'],
+                                                      upper=True)
+                obsIndex = obsIndexCat['OBSINDEX']
+                indexFilterNames = indexFits['FILTERS'].read(upper=True)['FILTERNAME']
+                if obsIndexCat['FILTERCODE'].min(initial=0) >= 0:
+                    # LUT filter index of each index filter code
+                    indexFilterLUTIndex = getFilterCodes(indexFilterNames, self.lutFilterNames)
+                    obsLUTFilterIndex = indexFilterLUTIndex[obsIndexCat['FILTERCODE']]
+                obsIndexCat = None
+            else:
+                obsIndex = indexFits['INDEX'].read(columns=['OBSINDEX'], upper=True)['OBSINDEX']
         if not self.quietMode:
             self.fgcmLog.info('Done reading in %d observation indices in %.1f seconds.' %
-                              (index.size, time.time() - startTime))
-
-        # read in obsfile and cut
-        startTime = time.time()
-        self.fgcmLog.debug('Reading in star observations...')
-        obs = fitsio.read(self.obsFile, ext=1, upper=True)
-        # cut down to those that are indexed
-        obs = obs[index['OBSINDEX']]
-        if not self.quietMode:
-            self.fgcmLog.info('Done reading in %d observations in %.1f seconds.' %
-                              (obs.size, time.time() - startTime))
+                              (obsIndex.size, time.time() - startTime))
 
         # and positions...
         startTime = time.time()
@@ -167,94 +246,390 @@ class FgcmStars(object):
             self.fgcmLog.info('Done reading in %d unique star positions in %.1f seconds.' %
                               (pos.size, time.time() - startTime))
 
-        # Cut down the stars here if desired.
-        if len(self.quantityCuts) > 0:
-            cut = None
-            for qcut in self.quantityCuts:
-                quant = qcut[0].upper()
-                qmin = qcut[1]
-                qmax = qcut[2]
+        pos = self._applyQuantityCuts(pos)
 
-                if quant not in pos.dtype.names:
-                    raise ValueError("Could not find cut quantity %s in indexfile %s[POS]" %
-                                     (quant, self.indexFile))
+        refID, refMag, refMagErr = self._readRefstars()
+        flagID, flagFlag = self._readFlagStars()
 
-                if cut is None:
-                    cut = ((pos[quant] >= qmin) & (pos[quant] <= qmax))
-                else:
-                    cut &= ((pos[quant] >= qmin) & (pos[quant] <= qmax))
-
-            nCut = np.sum(~cut)
-            self.fgcmLog.info('Cutting %d objects from extra quantities' % (nCut))
+        # read in the observations
+        startTime = time.time()
+        self.fgcmLog.debug('Reading in star observations...')
 
-            pos = pos[cut]
+        with fitsio.FITS(self.obsFile) as fits:
+            hdu = fits[1]
+            colNames = {name.upper(): name for name in hdu.get_colnames()}
+
+            hasXY = ('X' in colNames and 'Y' in colNames)
+            if hasXY:
+                self.fgcmLog.debug('Found X/Y in input observations')
+
+            fitsNames = []
+            for name in [self.expField, self.ccdField, 'RA', 'DEC', 'MAG', 'MAGERR'] + \
+                    (['X', 'Y'] if hasXY else []) + \
+                    (['FILTERNAME'] if obsLUTFilterIndex is None else []):
+                if name.upper() not in colNames:
+                    raise ValueError("Could not find column %s in %s" % (name, self.obsFile))
+                fitsNames.append(colNames[name.upper()])
+
+            self._allocateObsArrays(obsIndex.size, hasXY)
+
+            # For each row of the observation file, the position in the
+            #  indexed observation arrays (or -1 if not indexed)
+            nRows = hdu.get_nrows()
+            obsRowIndex = np.full(nRows, -1, dtype=np.int64)
+            obsRowIndex[obsIndex] = np.arange(obsIndex.size)
+            obsIndex = None
+
+            filterCounts = np.zeros(len(self.lutFilterNames), dtype=np.int64)
+            for r0 in range(0, nRows, nObsPerChunk):
+                r1 = min(r0 + nObsPerChunk, nRows)
+                dest = obsRowIndex[r0: r1]
+                use, = np.where(dest >= 0)
+                if use.size == 0:
+                    continue
 
-        obsFilterName = np.core.defchararray.strip(obs['FILTERNAME'][:])
+                chunk = hdu.read(columns=fitsNames, rows=np.arange(r0, r1))[use]
 
-        # And refstars if available
-        if self.refstarFile is not None:
-            startTime = time.time()
-            self.fgcmLog.debug('Reading in reference stars...')
-            ref = fitsio.read(self.refstarFile, ext=1, lower=True)
-            if not self.quietMode:
-                self.fgcmLog.info('Done reading %d reference stars in %.1f seconds.' %
-                                  (ref.size, time.time() - startTime))
-            refID = ref['fgcm_id']
-            refMag = ref['mag']
-            refMagErr = ref['mag_err']
-        else:
-            refID = None
-            refMag = None
-            refMagErr = None
+                if obsLUTFilterIndex is not None:
+                    chunkLUTFilterIndex = obsLUTFilterIndex[dest[use]]
+                else:
+                    chunkLUTFilterIndex = getFilterCodes(chunk[fitsNames[-1]], self.lutFilterNames)
 
-        if (self.inFlagStarFile is not None):
-            self.fgcmLog.debug('Reading in list of previous flagged stars from %s' %
-                               (self.inFlagStarFile))
+                filterCounts += self._fillObsArrays(dest[use],
+                                                    chunk[fitsNames[0]],
+                                                    chunk[fitsNames[1]],
+                                                    chunk[fitsNames[2]],
+                                                    chunk[fitsNames[3]],
+                                                    chunk[fitsNames[4]],
+                                                    chunk[fitsNames[5]],
+                                                    chunkLUTFilterIndex,
+                                                    obsX=chunk[fitsNames[6]] if hasXY else None,
+                                                    obsY=chunk[fitsNames[7]] if hasXY else None)
+                chunk = None
 
-            inFlagStars = fitsio.read(self.inFlagStarFile, ext=1, upper=True)
+                self.fgcmLog.debug('Read %d of %d observation rows' % (r1, nRows))
 
-            flagID = inFlagStars['OBJID']
-            flagFlag = inFlagStars['OBJFLAG']
-        else:
-            flagID = None
-            flagFlag = None
+            obsRowIndex = None
+            obsLUTFilterIndex = None
 
-        if ('X' in obs.dtype.names and 'Y' in obs.dtype.names):
-            self.fgcmLog.debug('Found X/Y in input observations')
-            obsX = obs['X']
-            obsY = obs['Y']
-        else:
-            obsX = None
-            obsY = None
+        if not self.quietMode:
+            self.fgcmLog.info('Done reading in %d observations in %.1f seconds.' %
+                              (self.nStarObs, time.time() - startTime))
 
         # process
-        self.loadStars(fgcmPars,
-                       obs[self.expField],
-                       obs[self.ccdField],
-                       obs['RA'],
-                       obs['DEC'],
-                       obs['MAG'],
-                       obs['MAGERR'],
-                       obsFilterName,
-                       pos['FGCM_ID'],
-                       pos['RA'],
-                       pos['DEC'],
-                       pos['OBSARRINDEX'],
-                       pos['NOBS'],
-                       obsX=obsX,
-                       obsY=obsY,
-                       refID=refID,
-                       refMag=refMag,
-                       refMagErr=refMagErr,
-                       flagID=flagID,
-                       flagFlag=flagFlag,
-                       computeNobs=computeNobs)
+        self._finishLoadStars(fgcmPars,
+                              filterCounts,
+                              pos['FGCM_ID'],
+                              pos['RA'],
+                              pos['DEC'],
+                              pos['OBSARRINDEX'],
+                              pos['NOBS'],
+                              refID=refID,
+                              refMag=refMag,
+                              refMagErr=refMagErr,
+                              flagID=flagID,
+                              flagFlag=flagFlag,
+                              computeNobs=computeNobs,
+                              starCacheKey=starCacheKey)
 
         # and clear memory
-        index = None
-        obs = None
         pos = None
-        ref = None
+
+        if not self.quietMode:
+            self.fgcmLog.info('Loaded %d observations of %d stars in %.1f seconds.' %
+                              (self.nStarObs, self.nStars, time.time() - loadStartTime))
+            self.fgcmLog.info(getMemoryString('After loading stars'))
+
+    def loadStarsFromStore(self, fgcmPars, computeNobs=True, nObsPerChunk=5000000,
+                           starCacheKey=None):
+        """
+        Load stars from a memory-mapped star store.  The store is converted
+         from the fits files if it does not exist or is out of date.  The
+         static observation columns are mapped read-only, and the others are
+         memory-mapped scratch arrays, so the observations need not fit in
+         memory.
+
+        parameters
+        ----------
+        fgcmPars: FgcmParameters
+        computeNobs: bool, default=True
+           Compute number of observations of each star/band
+        nObsPerChunk: int, default=5000000
+           Number of observations to fill at a time
+        starCacheKey: string, optional
+           Save the derived arrays to the star cache with this key
+
+        Config variables
+        ----------------
+        starStorePath: string
+           Star store directory
+        indexFile: string
+           Star index file (for conversion)
+        obsFile: string
+           Star observation file (for conversion)
+        inFlagStarFile: string, optional
+           Flagged star file
+        """
+
+        startTime = time.time()
+
+        starStore = None
+        if FgcmStarStore.exists(self.starStorePath):
+            starStore = FgcmStarStore(self.starStorePath, self.fgcmLog)
+            if not starStore.isCurrent(self.obsFile, self.indexFile,
+                                       self.expField, self.ccdField):
+                self.fgcmLog.info('Star store %s is out of date.' % (self.starStorePath))
+                starStore = None
+
+        if starStore is None:
+            starStore = FgcmStarStore.convert(self.obsFile, self.indexFile,
+                                              self.starStorePath, self.fgcmLog,
+                                              expField=self.expField,
+                                              ccdField=self.ccdField,
+                                              clobber=True)
+
+        self.starStore = starStore
+
+        pos = self._applyQuantityCuts(starStore.readPositions())
+
+        if not self.quietMode:
+            self.fgcmLog.info('Opened star store with %d observations of %d stars in %.1f seconds.' %
+                              (starStore.nStarObs, pos.size, time.time() - startTime))
+
+        refID, refMag, refMagErr = self._readRefstars()
+        flagID, flagFlag = self._readFlagStars()
+
+        self._allocateObsArrays(starStore.nStarObs, starStore.hasXY)
+
+        # The static columns are mapped, so only the magnitudes and filter
+        #  codes need to be read from the store.
+        obsMag = starStore.getColumn('obsMag')
+        obsMagErr = starStore.getColumn('obsMagErr')
+        obsFilterCode = starStore.getColumn('obsFilterCode')
+
+        # LUT filter index of each store filter code (with -1 for -1)
+        storeFilterLUTIndex = np.append(getFilterCodes(starStore.filterNames, self.lutFilterNames),
+                                        np.int16(-1))
+
+        filterCounts = np.zeros(len(self.lutFilterNames), dtype=np.int64)
+        for i0 in range(0, self.nStarObs, nObsPerChunk):
+            i1 = min(i0 + nObsPerChunk, self.nStarObs)
+            filterCounts += self._fillObsArrays(slice(i0, i1), None, None, None, None,
+                                                obsMag[i0: i1], obsMagErr[i0: i1],
+                                                storeFilterLUTIndex[obsFilterCode[i0: i1]])
+
+        obsMag = None
+        obsMagErr = None
+        obsFilterCode = None
+
+        self._finishLoadStars(fgcmPars,
+                              filterCounts,
+                              pos['FGCM_ID'],
+                              pos['RA'],
+                              pos['DEC'],
+                              pos['OBSARRINDEX'],
+                              pos['NOBS'],
+                              refID=refID,
+                              refMag=refMag,
+                              refMagErr=refMagErr,
+                              flagID=flagID,
+                              flagFlag=flagFlag,
+                              computeNobs=computeNobs,
+                              starCacheKey=starCacheKey)
+
+    def _computeStarCacheKey(self, fgcmPars):
+        """
+        Compute the star cache key from the star files, the exposure
+        information, and the configuration that enters the derived arrays.
+
+        parameters
+        ----------
+        fgcmPars: FgcmParameters
+
+        returns
+        -------
+        key: string
+        """
+
+        # A star store is checked against the same star files
+        filenames = [self.obsFile, self.indexFile]
+
+        arrays = [fgcmPars.expArray,
+                  fgcmPars.expTelHA,
+                  fgcmPars.expTelRA,
+                  np.array([fgcmPars.sinLatitude, fgcmPars.cosLatitude])]
+
+        config = {'expField': self.expField,
+                  'ccdField': self.ccdField,
+                  'quantityCuts': [[str(qcut[0]), float(qcut[1]), float(qcut[2])]
+                                   for qcut in self.quantityCuts],
+                  'bands': list(self.bands),
+                  'lutFilterNames': list(self.lutFilterNames),
+                  'filterToBand': dict(self.filterToBand),
+                  'sigma0Phot': float(self.sigma0Phot),
+                  'zptABNoThroughput': float(self.zptABNoThroughput),
+                  'starStore': self.starStorePath is not None,
+                  'obsFloatDtype': self.obsFloatDtype}
+
+        return FgcmStarCache.computeKey(filenames, arrays, config)
+
+    def _saveStarCache(self, starCacheKey):
+        """
+        Save the derived star arrays to the star cache.
+
+        parameters
+        ----------
+        starCacheKey: string
+           Cache key from _computeStarCacheKey()
+        """
+
+        names = list(self.starCacheObsArrays)
+        if self.starStore is None:
+            names.extend(self.starCacheInputArrays)
+            if self.hasXY:
+                names.extend(['obsX', 'obsY'])
+        if self.hasPsfCandidate:
+            names.append('psfCandidate')
+        names.extend(self.starCacheObjArrays)
+
+        arrays = {name: snmm.getArray(getattr(self, name + 'Handle')) for name in names}
+
+        starCache = FgcmStarCache(self.starCachePath, self.fgcmLog)
+        starCache.save(starCacheKey, arrays,
+                       nStarObs=int(self.nStarObs),
+                       nStars=int(self.nStars),
+                       hasXY=bool(self.hasXY),
+                       hasPsfCandidate=bool(self.hasPsfCandidate))
+
+    def _loadStarsFromCache(self, fgcmPars, starCache, computeNobs=True):
+        """
+        Load stars from the star cache, skipping the matching and indexing
+        of the observations.
+
+        parameters
+        ----------
+        fgcmPars: FgcmParameters
+        starCache: FgcmStarCache
+           Current star cache
+        computeNobs: bool, default=True
+           Compute number of observations of each star/band
+        """
+
+        startTime = time.time()
+
+        if self.starStorePath is not None:
+            self.starStore = FgcmStarStore(self.starStorePath, self.fgcmLog)
+
+        refID, refMag, refMagErr = self._readRefstars()
+        flagID, flagFlag = self._readFlagStars()
+
+        self._allocateObsArrays(starCache.meta['nStarObs'], starCache.meta['hasXY'],
+                                hasPsfCandidate=starCache.meta['hasPsfCandidate'])
+        self._allocateObjArrays(starCache.meta['nStars'])
+
+        for name in starCache.meta['arrays']:
+            snmm.getArray(getattr(self, name + 'Handle'))[:] = starCache.read(name)
+
+        # These start out the same as the raw magnitudes and errors
+        snmm.getArray(self.obsMagStdHandle)[:] = snmm.getArray(self.obsMagADUHandle)
+        snmm.getArray(self.obsMagADUModelErrHandle)[:] = snmm.getArray(self.obsMagADUErrHandle)
+
+        self.minObjID = np.min(snmm.getArray(self.objIDHandle))
+        self.maxObjID = np.max(snmm.getArray(self.objIDHandle))
+
+        self._loadRefstars(refID, refMag, refMagErr)
+
+        if not self.quietMode:
+            self.fgcmLog.info('Loaded %d observations of %d stars from star cache in %.1f seconds.' %
+                              (self.nStarObs, self.nStars, time.time() - startTime))
+
+        self._finishStars(fgcmPars, flagID=flagID, flagFlag=flagFlag,
+                          computeNobs=computeNobs)
+
+    def _applyQuantityCuts(self, pos):
+        """
+        Cut down the stars with the configured quantity cuts.
+
+        parameters
+        ----------
+        pos: numpy recarray
+           Star positions (POS table of the index file)
+
+        returns
+        -------
+        pos: numpy recarray
+           Star positions after cuts
+        """
+
+        if len(self.quantityCuts) == 0:
+            return pos
+
+        cut = None
+        for qcut in self.quantityCuts:
+            quant = qcut[0].upper()
+            qmin = qcut[1]
+            qmax = qcut[2]
+
+            if quant not in pos.dtype.names:
+                raise ValueError("Could not find cut quantity %s in indexfile %s[POS]" %
+                                 (quant, self.indexFile))
+
+            if cut is None:
+                cut = ((pos[quant] >= qmin) & (pos[quant] <= qmax))
+            else:
+                cut &= ((pos[quant] >= qmin) & (pos[quant] <= qmax))
+
+        nCut = np.sum(~cut)
+        self.fgcmLog.info('Cutting %d objects from extra quantities' % (nCut))
+
+        return pos[cut]
+
+    def _readRefstars(self):
+        """
+        Read the reference stars, if available.
+
+        returns
+        -------
+        refID: int array (or None)
+        refMag: float array (or None)
+        refMagErr: float array (or None)
+        """
+
+        if self.refstarFile is None:
+            return None, None, None
+
+        import fitsio
+
+        startTime = time.time()
+        self.fgcmLog.debug('Reading in reference stars...')
+        ref = fitsio.read(self.refstarFile, ext=1, lower=True)
+        if not self.quietMode:
+            self.fgcmLog.info('Done reading %d reference stars in %.1f seconds.' %
+                              (ref.size, time.time() - startTime))
+
+        return ref['fgcm_id'], ref['mag'], ref['mag_err']
+
+    def _readFlagStars(self):
+        """
+        Read the list of previously flagged stars, if available.
+
+        returns
+        -------
+        flagID: int array (or None)
+        flagFlag: int array (or None)
+        """
+
+        if self.inFlagStarFile is None:
+            return None, None
+
+        import fitsio
+
+        self.fgcmLog.debug('Reading in list of previous flagged stars from %s' %
+                           (self.inFlagStarFile))
+
+        inFlagStars = fitsio.read(self.inFlagStarFile, ext=1, upper=True)
+
+        return inFlagStars['OBJID'], inFlagStars['OBJFLAG']
 
     def loadStars(self, fgcmPars,
                   obsExp, obsCCD, obsRA, obsDec, obsMag, obsMagErr, obsFilterName,
@@ -279,8 +654,8 @@ class FgcmStars(object):
            Raw ADU magnitude for each observation
         obsMagErr: float array
            Raw ADU magnitude error for each observation
-        obsFilterName: string array
-           Filter name for each observation
+        obsFilterName: string or int array
+           Filter name (or LUT filter index) for each observation
         objID: int array
            Unique ID number for each object
         objRA: double array
@@ -315,54 +690,107 @@ class FgcmStars(object):
 
         # FIXME: check that these are all the same length!
 
-        self.obsIndexHandle = snmm.createArray(obsRA.size, dtype='i4')
-        snmm.getArray(self.obsIndexHandle)[:] = np.arange(obsRA.size)
+        self._allocateObsArrays(obsRA.size, (obsX is not None and obsY is not None),
+                                hasPsfCandidate=(psfCandidate is not None))
+
+        filterCounts = self._fillObsArrays(slice(None), obsExp, obsCCD, obsRA, obsDec,
+                                           obsMag, obsMagErr,
+                                           getFilterCodes(obsFilterName, self.lutFilterNames),
+                                           obsX=obsX, obsY=obsY,
+                                           psfCandidate=psfCandidate)
+
+        self._finishLoadStars(fgcmPars, filterCounts,
+                              objID, objRA, objDec, objObsIndex, objNobs,
+                              refID=refID, refMag=refMag, refMagErr=refMagErr,
+                              flagID=flagID, flagFlag=flagFlag,
+                              computeNobs=computeNobs)
+
+    def _allocateObsArrays(self, nStarObs, hasXY, hasPsfCandidate=False):
+        """
+        Create the shared observation arrays, to be filled with
+        _fillObsArrays().
+
+        parameters
+        ----------
+        nStarObs: int
+           Total number of observations
+        hasXY: bool
+           Observations have x/y positions
+        hasPsfCandidate: bool, default=False
+           Observations have psf candidate flags
+        """
 
         # need to stuff into shared memory objects.
         #  nStarObs: total number of observations of all stars
-        self.nStarObs = obsRA.size
+        self.nStarObs = nStarObs
+
+        self.obsIndexHandle = self._createObsArray('obsIndex', 'i4')
+        snmm.getArray(self.obsIndexHandle)[:] = np.arange(self.nStarObs)
+
+        # With a star store, the static input columns are mapped read-only
+        #  from the store rather than copied.
+        useStore = (self.starStore is not None)
 
         #  obsExp: exposure number of individual observation (pointed by obsIndex)
-        self.obsExpHandle = snmm.createArray(self.nStarObs,dtype='i4')
+        if useStore:
+            self.obsExpHandle = self.starStore.mapColumn('obsExp')
+        else:
+            self.obsExpHandle = snmm.createArray(self.nStarObs,dtype='i4')
         #  obsExpIndex: exposure index
-        self.obsExpIndexHandle = snmm.createArray(self.nStarObs,dtype='i4')
+        self.obsExpIndexHandle = self._createObsArray('obsExpIndex', 'i4')
         #  obsCCD: ccd number of individual observation
-        self.obsCCDHandle = snmm.createArray(self.nStarObs,dtype='i2')
+        if useStore:
+            self.obsCCDHandle = self.starStore.mapColumn('obsCCD')
+        else:
+            self.obsCCDHandle = snmm.createArray(self.nStarObs,dtype='i2')
         #  obsBandIndex: band index of individual observation
-        self.obsBandIndexHandle = snmm.createArray(self.nStarObs,dtype='i2')
+        self.obsBandIndexHandle = self._createObsArray('obsBandIndex', 'i2')
         #  obsLUTFilterIndex: filter index in LUT of individual observation
-        self.obsLUTFilterIndexHandle = snmm.createArray(self.nStarObs,dtype='i2')
+        self.obsLUTFilterIndexHandle = self._createObsArray('obsLUTFilterIndex', 'i2')
         #  obsFlag: individual bad observation
-        self.obsFlagHandle = snmm.createArray(self.nStarObs,dtype='i2')
+        self.obsFlagHandle = self._createObsArray('obsFlag', 'i2')
         #  obsRA: RA of individual observation
-        self.obsRAHandle = snmm.createArray(self.nStarObs,dtype='f8')
         #  obsDec: Declination of individual observation
-        self.obsDecHandle = snmm.createArray(self.nStarObs,dtype='f8')
+        if useStore:
+            self.obsRAHandle = self.starStore.mapColumn('obsRA')
+            self.obsDecHandle = self.starStore.mapColumn('obsDec')
+        else:
+            self.obsRAHandle = snmm.createArray(self.nStarObs,dtype='f8')
+            self.obsDecHandle = snmm.createArray(self.nStarObs,dtype='f8')
         #  obsSecZenith: secant(zenith) of individual observation
-        self.obsSecZenithHandle = snmm.createArray(self.nStarObs,dtype='f8')
+        self.obsSecZenithHandle = self._createObsArray('obsSecZenith', self.obsFloatDtype)
         #  obsMagADU: log raw ADU counts of individual observation
         ## FIXME: need to know default zeropoint?
-        self.obsMagADUHandle = snmm.createArray(self.nStarObs,dtype='f4')
+        self.obsMagADUHandle = self._createObsArray('obsMagADU', 'f4')
         #  obsMagADUErr: raw ADU counts error of individual observation
-        self.obsMagADUErrHandle = snmm.createArray(self.nStarObs,dtype='f4')
+        self.obsMagADUErrHandle = self._createObsArray('obsMagADUErr', 'f4')
         #  obsMagADUModelErr: modeled ADU counts error of individual observation
-        self.obsMagADUModelErrHandle = snmm.createArray(self.nStarObs,dtype='f4')
+        self.obsMagADUModelErrHandle = self._createObsArray('obsMagADUModelErr', 'f4')
         #  obsSuperStarApplied: SuperStar correction that was applied
-        self.obsSuperStarAppliedHandle = snmm.createArray(self.nStarObs,dtype='f4')
+        self.obsSuperStarAppliedHandle = self._createObsArray('obsSuperStarApplied', 'f4')
         #  obsMagStd: corrected (to standard passband) mag of individual observation
-        self.obsMagStdHandle = snmm.createArray(self.nStarObs,dtype='f4',syncAccess=True)
-        if (obsX is not None and obsY is not None):
+        #   (each worker chunk owns the observations of its stars, so this is
+        #    written without a lock)
+        self.obsMagStdHandle = self._createObsArray('obsMagStd', 'f4')
+        #  obsObjIDIndex: object ID Index of each observation
+        #    (to get objID, then objID[obsObjIDIndex]
+        self.obsObjIDIndexHandle = self._createObsArray('obsObjIDIndex', 'i4')
+        if hasXY:
             self.hasXY = True
 
             #  obsX: x position on the CCD of the given observation
-            self.obsXHandle = snmm.createArray(self.nStarObs,dtype='f4')
             #  obsY: y position on the CCD of the given observation
-            self.obsYHandle = snmm.createArray(self.nStarObs,dtype='f4')
+            if useStore:
+                self.obsXHandle = self.starStore.mapColumn('obsX')
+                self.obsYHandle = self.starStore.mapColumn('obsY')
+            else:
+                self.obsXHandle = snmm.createArray(self.nStarObs,dtype='f4')
+                self.obsYHandle = snmm.createArray(self.nStarObs,dtype='f4')
         else:
             # hasXY = False
             if self.superStarSubCCD:
                 raise ValueError("Input stars do not have x/y but superStarSubCCD is set.")
-        if psfCandidate is not None:
+        if hasPsfCandidate:
             self.hasPsfCandidate = True
 
             self.fgcmLog.info('PSF Candidate Flags found')
@@ -370,59 +798,135 @@ class FgcmStars(object):
             # psfCandidate: bool flag if this is a single-epoch psf candidate
             self.psfCandidateHandle = snmm.createArray(self.nStarObs, dtype=np.bool)
 
-        if (refID is not None and refMag is not None and refMagErr is not None):
-            self.hasRefstars = True
-
-            # Remove any duplicates...
-            _, refUInd = np.unique(refID, return_index=True)
+    def _fillObsArrays(self, dest, obsExp, obsCCD, obsRA, obsDec, obsMag, obsMagErr,
+                       obsLUTFilterIndexIn, obsX=None, obsY=None, psfCandidate=None):
+        """
+        Fill (part of) the shared observation arrays, and match the
+        observations to filters and bands.
 
-            if refUInd.size < refID.size:
-                self.fgcmLog.info("Removing %d duplicate reference stars." %
-                                  (refID.size - refUInd.size))
-                refID = refID[refUInd]
-                refMag = refMag[refUInd, :]
-                refMagErr = refMagErr[refUInd, :]
+        parameters
+        ----------
+        dest: slice or int array
+           Where in the observation arrays to put these observations
+        obsExp: int array
+           Exposure number (or equivalent) for each observation
+        obsCCD: int array
+           CCD number (or equivalent) for each observation
+        obsRA: double array
+           RA for each observation (degrees)
+        obsDec: double array
+           Dec for each observation (degrees)
+        obsMag: float array
+           Raw ADU magnitude for each observation
+        obsMagErr: float array
+           Raw ADU magnitude error for each observation
+        obsLUTFilterIndexIn: int array
+           LUT filter index for each observation (-1 if not in the LUT),
+           from getFilterCodes()
+        obsX: float array, optional
+           x position for each observation
+        obsY: float array, optional
+           y position for each observation
+        psfCandidate: bool array, optional
+           Flag if this star was a psf candidate in single-epoch images
 
-            self.nRefstars = refID.size
+        returns
+        -------
+        filterCounts: int array
+           Number of these observations in each LUT filter
+        """
 
-            # refID: matched ID of reference stars
-            self.refIDHandle = snmm.createArray(self.nRefstars, dtype='i4')
-            # refMag: absolute magnitudes of reference stars
-            self.refMagHandle = snmm.createArray((self.nRefstars, self.nBands), dtype='f4')
-            # refMagErr: absolute magnitude errors of reference stars
-            self.refMagErrHandle = snmm.createArray((self.nRefstars, self.nBands), dtype='f4')
+        # With a star store, the static input columns are already mapped.
+        useStore = (self.starStore is not None)
 
-        snmm.getArray(self.obsExpHandle)[:] = obsExp
-        snmm.getArray(self.obsCCDHandle)[:] = obsCCD
-        snmm.getArray(self.obsRAHandle)[:] = obsRA
-        snmm.getArray(self.obsDecHandle)[:] = obsDec
+        if not useStore:
+            snmm.getArray(self.obsExpHandle)[dest] = obsExp
+            snmm.getArray(self.obsCCDHandle)[dest] = obsCCD
+            snmm.getArray(self.obsRAHandle)[dest] = obsRA
+            snmm.getArray(self.obsDecHandle)[dest] = obsDec
         # We will apply the approximate AB scaling here, it will make
         # any plots we make have sensible units; will make 99 a sensible sentinal value;
         # and is arbitrary anyway and doesn't enter the fits.
-        snmm.getArray(self.obsMagADUHandle)[:] = obsMag + self.zptABNoThroughput
-        snmm.getArray(self.obsMagADUErrHandle)[:] = obsMagErr
-        snmm.getArray(self.obsMagStdHandle)[:] = obsMag + self.zptABNoThroughput  # same as raw at first
-        snmm.getArray(self.obsSuperStarAppliedHandle)[:] = 0.0
-        if self.hasXY:
-            snmm.getArray(self.obsXHandle)[:] = obsX
-            snmm.getArray(self.obsYHandle)[:] = obsY
+        obsMagADU = obsMag + self.zptABNoThroughput
+        snmm.getArray(self.obsMagADUHandle)[dest] = obsMagADU
+        snmm.getArray(self.obsMagADUErrHandle)[dest] = obsMagErr
+        snmm.getArray(self.obsMagStdHandle)[dest] = obsMagADU  # same as raw at first
+        snmm.getArray(self.obsSuperStarAppliedHandle)[dest] = 0.0
+        if self.hasXY and not useStore:
+            snmm.getArray(self.obsXHandle)[dest] = obsX
+            snmm.getArray(self.obsYHandle)[dest] = obsY
         if self.hasPsfCandidate:
-            snmm.getArray(self.psfCandidateHandle)[:] = psfCandidate
+            snmm.getArray(self.psfCandidateHandle)[dest] = psfCandidate
 
-        if self.hasRefstars:
-            # And filter out bad signal to noise, per band, if desired,
-            # before filling the arrays
-            if self.refStarSnMin > 0.0:
-                for i in range(self.nBands):
-                    maxErr = (2.5 / np.log(10.)) * (1. / self.refStarSnMin)
-                    bad, = np.where(refMagErr[:, i] > maxErr)
-                    refMag[bad, i] = 99.0
-                    refMagErr[bad, i] = 99.0
+        # match bands and filters to indices
+        # new version for multifilter support
+        # Observations in filters not in the LUT are left as allocated.
 
-            snmm.getArray(self.refIDHandle)[:] = refID
-            snmm.getArray(self.refMagHandle)[:, :] = refMag
-            snmm.getArray(self.refMagErrHandle)[:, :] = refMagErr
+        obsLUTFilterIndexIn = np.asarray(obsLUTFilterIndexIn)
+
+        use, = np.where(obsLUTFilterIndexIn >= 0)
+        filterCounts = np.bincount(obsLUTFilterIndexIn[use],
+                                   minlength=len(self.lutFilterNames)).astype(np.int64)
+
+        if use.size > 0:
+            lutFilterIndex = obsLUTFilterIndexIn[use]
+            if isinstance(dest, slice):
+                use = use + (dest.start or 0)
+            else:
+                use = dest[use]
+            snmm.getArray(self.obsLUTFilterIndexHandle)[use] = lutFilterIndex
+            snmm.getArray(self.obsBandIndexHandle)[use] = self.lutFilterBandIndex[lutFilterIndex]
+
+        return filterCounts
+
+    def _finishLoadStars(self, fgcmPars, filterCounts,
+                         objID, objRA, objDec, objObsIndex, objNobs,
+                         refID=None, refMag=None, refMagErr=None,
+                         flagID=None, flagFlag=None, computeNobs=True,
+                         starCacheKey=None):
+        """
+        Finish loading stars after the observation arrays have been filled:
+        load the objects and reference stars, match observations to
+        exposures and objects, and flag bad observations and stars.
+
+        parameters
+        ----------
+        fgcmPars: fgcmParameters
+        filterCounts: int array
+           Number of observations in each LUT filter
+        objID: int array
+           Unique ID number for each object
+        objRA: double array
+           RA for each object (degrees)
+        objDec: double array
+           Dec for each object (degrees)
+        objObsIndex: int array
+           For each object, where in the obs table to look
+        objNobs: int array
+           number of observations of this object (all bands)
+        refID: int array, optional
+           ID of each object that is an absolute reference
+        refMag: float array, optional
+           Absolute mag for each reference object, (nref, nmag).
+        refMagErr: float array, optional
+           Absolute magnitude error for each reference object (nref, nmag).
+        flagID: int array, optional
+           ID of each object that is flagged from previous cycle
+        flagFlag: int array, optional
+           Flag value from previous cycle
+        computeNobs: bool, default=True
+           Compute number of good observations of each object?
+        starCacheKey: string, optional
+           Save the derived arrays to the star cache with this key
+        """
 
+        self._loadRefstars(refID, refMag, refMagErr)
+
+        for filterIndex, filterName in enumerate(self.lutFilterNames):
+            if filterName not in self.filterToBand:
+                self.fgcmLog.warn('Observations with filter %s not in config' % (filterName))
+            if filterCounts[filterIndex] == 0:
+                self.fgcmLog.info('No observations in filter %s' % (filterName))
 
         self.fgcmLog.debug('Applying sigma0Phot = %.4f to mag errs' %
                            (self.sigma0Phot))
@@ -458,7 +962,7 @@ class FgcmStars(object):
                                     snmm.getArray(self.obsExpHandle)[:])
         obsExpIndex[b] = a
         if not self.quietMode:
-            self.fgcmLog.info('Observations matched in %.1f seconds.' %
+            self.fgcmLog.info('Observations matched to exposures in %.1f seconds.' %
                               (time.time() - startTime))
 
         bad, = np.where(obsExpIndex < 0)
@@ -468,55 +972,137 @@ class FgcmStars(object):
             self.fgcmLog.info('Flagging %d observations with no associated exposure.' %
                              (bad.size))
 
-        # match bands and filters to indices
+        self._allocateObjArrays(objID.size)
+
+        snmm.getArray(self.objIDHandle)[:] = objID
+        snmm.getArray(self.objRAHandle)[:] = objRA
+        snmm.getArray(self.objDecHandle)[:] = objDec
+
+        snmm.getArray(self.objObsIndexHandle)[:] = objObsIndex
+        snmm.getArray(self.objNobsHandle)[:] = objNobs
+
+
+        #  minObjID: minimum object ID
+        self.minObjID = np.min(snmm.getArray(self.objIDHandle))
+        #  maxObjID: maximum object ID
+        self.maxObjID = np.max(snmm.getArray(self.objIDHandle))
+
         startTime = time.time()
-        self.fgcmLog.debug('Matching observations to bands.')
+        self.fgcmLog.debug('Indexing star observations...')
+        obsObjIDIndex = snmm.getArray(self.obsObjIDIndexHandle)
+        objID = snmm.getArray(self.objIDHandle)
+        obsIndex = snmm.getArray(self.obsIndexHandle)
+        objObsIndex = snmm.getArray(self.objObsIndexHandle)
+        objNobs = snmm.getArray(self.objNobsHandle)
+        ## FIXME: check if this extra obsIndex reference is necessary or not.
+        ##   probably extraneous.
+        for i in range(self.nStars):
+            obsObjIDIndex[obsIndex[objObsIndex[i]:objObsIndex[i]+objNobs[i]]] = i
+        if not self.quietMode:
+            self.fgcmLog.info('Done indexing in %.1f seconds.' %
+                              (time.time() - startTime))
 
-        # new version for multifilter support
+        obsObjIDIndex = None
+        objID = None
+        obsIndex = None
+        objObsIndex = None
+        objNobs = None
 
-        obsFilterNameIsEncoded = False
-        try:
-            test = obsFilterName[0].decode('utf-8')
-            obsFilterNameIsEncoded = True
-        except AttributeError:
-            pass
+        # note: if this takes too long it can be moved to the star computation,
+        #       but it seems pretty damn fast (which may raise the question of
+        #       why it needs to be precomputed...)
+        # compute secZenith for every observation
 
-        # First, we have the filterNames
-        for filterIndex,filterName in enumerate(self.lutFilterNames):
-            try:
-                bandIndex = self.bands.index(self.filterToBand[filterName])
-            except KeyError:
-                self.fgcmLog.warn('Observations with filter %s not in config' % (filterName))
-                bandIndex = -1
+        startTime=time.time()
+        self.fgcmLog.debug('Computing secZenith for each star observation...')
+        objRARad = np.radians(snmm.getArray(self.objRAHandle))
+        objDecRad = np.radians(snmm.getArray(self.objDecHandle))
+        ## FIXME: deal with this at some point...
+        hi,=np.where(objRARad > np.pi)
+        objRARad[hi] -= 2*np.pi
+        obsExpIndex = snmm.getArray(self.obsExpIndexHandle)
+        obsObjIDIndex = snmm.getArray(self.obsObjIDIndexHandle)
+        obsIndex = snmm.getArray(self.obsIndexHandle)
 
-            # obsFilterName is an array from fits/numpy.  filterName needs to be encoded to match
-            if obsFilterNameIsEncoded:
-                use, = np.where(obsFilterName == filterName.encode('utf-8'))
-            else:
-                use, = np.where(obsFilterName == filterName)
-            if use.size == 0:
-                self.fgcmLog.info('No observations in filter %s' % (filterName))
-            else:
-                snmm.getArray(self.obsLUTFilterIndexHandle)[use] = filterIndex
-                snmm.getArray(self.obsBandIndexHandle)[use] = bandIndex
+        obsHARad = (fgcmPars.expTelHA[obsExpIndex] +
+                    fgcmPars.expTelRA[obsExpIndex] -
+                    objRARad[obsObjIDIndex])
+        tempSecZenith = 1./(np.sin(objDecRad[obsObjIDIndex]) * fgcmPars.sinLatitude +
+                            np.cos(objDecRad[obsObjIDIndex]) * fgcmPars.cosLatitude *
+                            np.cos(obsHARad))
+
+        bad,=np.where(obsFlag != 0)
+        tempSecZenith[bad] = 1.0  # filler here, but these stars aren't used
+        obsSecZenith = snmm.getArray(self.obsSecZenithHandle)
+        obsSecZenith[:] = tempSecZenith
+
+        # Check the airmass range
+        if ((np.min(obsSecZenith) < self.secZenithRange[0]) |
+            (np.max(obsSecZenith) > self.secZenithRange[1])):
+            raise ValueError("Input stars have a secZenith that is out of range of LUT."
+                             "Observed range is %.2f to %.2f, and LUT goes from %.2f to %.2f" % (np.min(obsSecZenith), np.max(obsSecZenith), self.secZenithRange[0], self.secZenithRange[1]))
 
         if not self.quietMode:
-            self.fgcmLog.info('Observations matched in %.1f seconds.' %
+            self.fgcmLog.info('Computed secZenith in %.1f seconds.' %
                               (time.time() - startTime))
 
-        #  nStars: total number of unique stars
-        self.nStars = objID.size
+        if starCacheKey is not None:
+            self._saveStarCache(starCacheKey)
+
+        self._finishStars(fgcmPars, flagID=flagID, flagFlag=flagFlag,
+                          computeNobs=computeNobs)
+
+    def _buildObsStarIndex(self):
+        """
+        Build the compressed (CSR) index from stars to observations: the
+        observations of star i are
+        obsStarSortIndex[objObsPtr[i]: objObsPtr[i + 1]], in increasing
+        order.  Built once after loading, this replaces matching the good
+        stars to obsObjIDIndex with every pass.
+        """
+
+        startTime = time.time()
+        self.fgcmLog.debug('Building star to observation index...')
+
+        obsObjIDIndex = snmm.getArray(self.obsObjIDIndexHandle)
+
+        #  objObsPtr: start of the observations of each object in obsStarSortIndex
+        self.objObsPtrHandle = snmm.createArray(self.nStars + 1, dtype='i8')
+        objObsPtr = snmm.getArray(self.objObsPtrHandle)
+        objObsPtr[0] = 0
+        objObsPtr[1:] = np.cumsum(np.bincount(obsObjIDIndex, minlength=self.nStars))
+
+        #  obsStarSortIndex: observation indices, sorted by object index
+        self.obsStarSortIndexHandle = self._createObsArray('obsStarSortIndex', 'i4')
+        obsStarSortIndex = snmm.getArray(self.obsStarSortIndexHandle)
+        if np.all(obsObjIDIndex[1:] >= obsObjIDIndex[: -1]):
+            # The usual case: observations are already grouped by object
+            obsStarSortIndex[:] = np.arange(self.nStarObs)
+        else:
+            obsStarSortIndex[:] = np.argsort(obsObjIDIndex, kind='stable')
+
+        self.fgcmLog.debug('Built star to observation index in %.1f seconds.' %
+                           (time.time() - startTime))
+
+    def _finishStars(self, fgcmPars, flagID=None, flagFlag=None, computeNobs=True):
+        """
+        Finish loading stars after the observation and object arrays are
+        set: match reference stars, flag and reserve stars, and count the
+        observations of each star.
+
+        parameters
+        ----------
+        fgcmPars: fgcmParameters
+        flagID: int array, optional
+           ID of each object that is flagged from previous cycle
+        flagFlag: int array, optional
+           Flag value from previous cycle
+        computeNobs: bool, default=True
+           Compute number of good observations of each object?
+        """
+
+        self._buildObsStarIndex()
 
-        #  objID: unique object ID
-        self.objIDHandle = snmm.createArray(self.nStars,dtype='i4')
-        #  objRA: mean RA for object
-        self.objRAHandle = snmm.createArray(self.nStars,dtype='f8')
-        #  objDec: mean Declination for object
-        self.objDecHandle = snmm.createArray(self.nStars,dtype='f8')
-        #  objObsIndex: for each object, the first
-        self.objObsIndexHandle = snmm.createArray(self.nStars,dtype='i4')
-        #  objNobs: number of observations of this object (all bands)
-        self.objNobsHandle = snmm.createArray(self.nStars,dtype='i4')
         #  objNGoodObsHandle: number of good observations, per band
         self.objNGoodObsHandle = snmm.createArray((self.nStars,self.nBands),dtype='i4')
         #  objNTotalObsHandle: number of all observations, per band
@@ -525,38 +1111,6 @@ class FgcmStars(object):
             #  objNPsfCandidateHandle: number of observations that are a psf candidate, per band
             self.objNPsfCandidateHandle = snmm.createArray((self.nStars, self.nBands), dtype='i4')
 
-        snmm.getArray(self.objIDHandle)[:] = objID
-        snmm.getArray(self.objRAHandle)[:] = objRA
-        snmm.getArray(self.objDecHandle)[:] = objDec
-
-        snmm.getArray(self.objObsIndexHandle)[:] = objObsIndex
-        snmm.getArray(self.objNobsHandle)[:] = objNobs
-
-
-        #  minObjID: minimum object ID
-        self.minObjID = np.min(snmm.getArray(self.objIDHandle))
-        #  maxObjID: maximum object ID
-        self.maxObjID = np.max(snmm.getArray(self.objIDHandle))
-
-        #  obsObjIDIndex: object ID Index of each observation
-        #    (to get objID, then objID[obsObjIDIndex]
-
-        startTime = time.time()
-        self.fgcmLog.debug('Indexing star observations...')
-        self.obsObjIDIndexHandle = snmm.createArray(self.nStarObs,dtype='i4')
-        obsObjIDIndex = snmm.getArray(self.obsObjIDIndexHandle)
-        objID = snmm.getArray(self.objIDHandle)
-        obsIndex = snmm.getArray(self.obsIndexHandle)
-        objObsIndex = snmm.getArray(self.objObsIndexHandle)
-        objNobs = snmm.getArray(self.objNobsHandle)
-        ## FIXME: check if this extra obsIndex reference is necessary or not.
-        ##   probably extraneous.
-        for i in range(self.nStars):
-            obsObjIDIndex[obsIndex[objObsIndex[i]:objObsIndex[i]+objNobs[i]]] = i
-        if not self.quietMode:
-            self.fgcmLog.info('Done indexing in %.1f seconds.' %
-                              (time.time() - startTime))
-
         # And we need to match the reference stars if necessary
         if self.hasRefstars:
             # self.refIdHandle
@@ -570,6 +1124,7 @@ class FgcmStars(object):
 
             objID = snmm.getArray(self.objIDHandle)
             refID = snmm.getArray(self.refIDHandle)
+            refMag = snmm.getArray(self.refMagHandle)
 
             a, b = esutil.numpy_util.match(refID, objID)
             objRefIDIndex[b] = a
@@ -589,14 +1144,9 @@ class FgcmStars(object):
                 self.fgcmLog.info('Done matching reference stars in %.1f seconds.' %
                                   (time.time() - startTime))
 
-        obsObjIDIndex = None
         objID = None
-        obsIndex = None
-        objObsIndex = None
-        objNobs = None
         refID = None
         refMag = None
-        refMagErr = None
 
         # and create a objFlag which flags bad stars as they fall out...
 
@@ -649,53 +1199,19 @@ class FgcmStars(object):
         # And we need to record the mean mag, error, SED slopes...
 
         #  objMagStdMean: mean standard magnitude of each object, per band
-        self.objMagStdMeanHandle = snmm.createArray((self.nStars,self.nBands),dtype='f4',
-                                                    syncAccess=True)
+        #   (each worker chunk owns its stars, so this is written without a lock)
+        self.objMagStdMeanHandle = snmm.createArray((self.nStars,self.nBands),dtype='f4')
         #  objMagStdMeanErr: error on the mean standard mag of each object, per band
         self.objMagStdMeanErrHandle = snmm.createArray((self.nStars,self.nBands),dtype='f4')
         #  objSEDSlope: linearized approx. of SED slope of each object, per band
-        self.objSEDSlopeHandle = snmm.createArray((self.nStars,self.nBands),dtype='f4',
-                                                  syncAccess=True)
+        self.objSEDSlopeHandle = snmm.createArray((self.nStars,self.nBands),dtype='f4')
         #  objMagStdMeanNoChrom: mean std mag of each object, no chromatic correction, per band
         self.objMagStdMeanNoChromHandle = snmm.createArray((self.nStars,self.nBands),dtype='f4')
 
-        # note: if this takes too long it can be moved to the star computation,
-        #       but it seems pretty damn fast (which may raise the question of
-        #       why it needs to be precomputed...)
-        # compute secZenith for every observation
-
-        startTime=time.time()
-        self.fgcmLog.debug('Computing secZenith for each star observation...')
-        objRARad = np.radians(snmm.getArray(self.objRAHandle))
-        objDecRad = np.radians(snmm.getArray(self.objDecHandle))
-        ## FIXME: deal with this at some point...
-        hi,=np.where(objRARad > np.pi)
-        objRARad[hi] -= 2*np.pi
-        obsExpIndex = snmm.getArray(self.obsExpIndexHandle)
-        obsObjIDIndex = snmm.getArray(self.obsObjIDIndexHandle)
-        obsIndex = snmm.getArray(self.obsIndexHandle)
-
-        obsHARad = (fgcmPars.expTelHA[obsExpIndex] +
-                    fgcmPars.expTelRA[obsExpIndex] -
-                    objRARad[obsObjIDIndex])
-        tempSecZenith = 1./(np.sin(objDecRad[obsObjIDIndex]) * fgcmPars.sinLatitude +
-                            np.cos(objDecRad[obsObjIDIndex]) * fgcmPars.cosLatitude *
-                            np.cos(obsHARad))
-
-        bad,=np.where(obsFlag != 0)
-        tempSecZenith[bad] = 1.0  # filler here, but these stars aren't used
-        obsSecZenith = snmm.getArray(self.obsSecZenithHandle)
-        obsSecZenith[:] = tempSecZenith
-
-        # Check the airmass range
-        if ((np.min(obsSecZenith) < self.secZenithRange[0]) |
-            (np.max(obsSecZenith) > self.secZenithRange[1])):
-            raise ValueError("Input stars have a secZenith that is out of range of LUT."
-                             "Observed range is %.2f to %.2f, and LUT goes from %.2f to %.2f" % (np.min(obsSecZenith), np.max(obsSecZenith), self.secZenithRange[0], self.secZenithRange[1]))
-
-        if not self.quietMode:
-            self.fgcmLog.info('Computed secZenith in %.1f seconds.' %
-                              (time.time() - startTime))
+        # The flags have been (re)loaded
+        self.objFlagGeneration.advance()
+        self.obsFlagGeneration.advance()
+        self.objNGoodObsGeneration.advance()
 
         if (computeNobs):
             self.fgcmLog.debug('Checking stars with all exposure numbers')
@@ -706,6 +1222,104 @@ class FgcmStars(object):
 
         self.starsLoaded = True
 
+    def _loadRefstars(self, refID, refMag, refMagErr):
+        """
+        Load the reference stars into shared memory, if available.
+
+        parameters
+        ----------
+        refID: int array (or None)
+           ID of each object that is an absolute reference
+        refMag: float array (or None)
+           Absolute mag for each reference object, (nref, nmag).
+        refMagErr: float array (or None)
+           Absolute magnitude error for each reference object (nref, nmag).
+        """
+
+        if (refID is not None and refMag is not None and refMagErr is not None):
+            self.hasRefstars = True
+
+            # Remove any duplicates...
+            _, refUInd = np.unique(refID, return_index=True)
+
+            if refUInd.size < refID.size:
+                self.fgcmLog.info("Removing %d duplicate reference stars." %
+                                  (refID.size - refUInd.size))
+                refID = refID[refUInd]
+                refMag = refMag[refUInd, :]
+                refMagErr = refMagErr[refUInd, :]
+
+            self.nRefstars = refID.size
+
+            # refID: matched ID of reference stars
+            self.refIDHandle = snmm.createArray(self.nRefstars, dtype='i4')
+            # refMag: absolute magnitudes of reference stars
+            self.refMagHandle = snmm.createArray((self.nRefstars, self.nBands), dtype='f4')
+            # refMagErr: absolute magnitude errors of reference stars
+            self.refMagErrHandle = snmm.createArray((self.nRefstars, self.nBands), dtype='f4')
+
+        if self.hasRefstars:
+            # And filter out bad signal to noise, per band, if desired,
+            # before filling the arrays
+            if self.refStarSnMin > 0.0:
+                for i in range(self.nBands):
+                    maxErr = (2.5 / np.log(10.)) * (1. / self.refStarSnMin)
+                    bad, = np.where(refMagErr[:, i] > maxErr)
+                    refMag[bad, i] = 99.0
+                    refMagErr[bad, i] = 99.0
+
+            snmm.getArray(self.refIDHandle)[:] = refID
+            snmm.getArray(self.refMagHandle)[:, :] = refMag
+            snmm.getArray(self.refMagErrHandle)[:, :] = refMagErr
+
+    def _allocateObjArrays(self, nStars):
+        """
+        Create the shared object arrays.
+
+        parameters
+        ----------
+        nStars: int
+           Total number of stars
+        """
+
+        #  nStars: total number of unique stars
+        self.nStars = nStars
+
+        #  objID: unique object ID
+        self.objIDHandle = snmm.createArray(self.nStars,dtype='i4')
+        #  objRA: mean RA for object
+        self.objRAHandle = snmm.createArray(self.nStars,dtype='f8')
+        #  objDec: mean Declination for object
+        self.objDecHandle = snmm.createArray(self.nStars,dtype='f8')
+        #  objObsIndex: for each object, the first
+        self.objObsIndexHandle = snmm.createArray(self.nStars,dtype='i4')
+        #  objNobs: number of observations of this object (all bands)
+        self.objNobsHandle = snmm.createArray(self.nStars,dtype='i4')
+
+    def _createObsArray(self, name, dtype, syncAccess=False):
+        """
+        Create a per-observation array, as a memory-mapped scratch array
+         when using a star store, or in shared memory otherwise.
+
+        parameters
+        ----------
+        name: string
+           Name of the array
+        dtype: numpy dtype
+        syncAccess: bool, default=False
+           Associate array with lock
+
+        returns
+        -------
+        handle: int
+           snmm handle
+        """
+
+        if self.starStore is not None:
+            return self.starStore.createScratchArray(name, dtype, syncAccess=syncAccess)
+
+        return snmm.createArray(self.nStarObs, dtype=dtype, syncAccess=syncAccess)
+
     def reloadStarMagnitudes(self, obsMag, obsMagErr):
         """
         Reload star magnitudes, used when automating multiple fit cycles in memory.
@@ -735,6 +1349,7 @@ class FgcmStars(object):
         obsMagADUModelErr[:] = snmm.getArray(self.obsMagADUErrHandle)[:]
 
         snmm.getArray(self.objNGoodObsHandle)[:, :] = 0
+        self.objNGoodObsGeneration.advance()
 
         snmm.getArray(self.objMagStdMeanHandle)[:, :] = 0.0
         snmm.getArray(self.objMagStdMeanErrHandle)[:, :] = 0.0
@@ -815,6 +1430,9 @@ class FgcmStars(object):
 
             self.fgcmLog.info('Flagging %d of %d stars with TEMPORARY_BAD_STAR' % (bad.size,self.nStars))
 
+        self.objNGoodObsGeneration.advance()
+        self.objFlagGeneration.advance()
+
 
     def selectStarsMinObsExpAndCCD(self, goodExps, goodCCDs, minObsPerBand=None):
         """
@@ -886,6 +1504,9 @@ class FgcmStars(object):
         objFlag[bad] |= objFlagDict['TOO_FEW_OBS']
         self.fgcmLog.info('Flagging %d of %d stars with TOO_FEW_OBS' % (bad.size,self.nStars))
 
+        self.objNGoodObsGeneration.advance()
+        self.objFlagGeneration.advance()
+
     def computeNTotalStats(self, fgcmPars):
         """
         Compute ntotal statistics and psf candidate statistics if available.
@@ -982,6 +1603,125 @@ class FgcmStars(object):
 
         return np.where(goodFlag)[0]
 
+    def getSubsampleStarIndices(self, goodStars, fraction, nside):
+        """
+        Get a deterministic, spatially balanced subsample of stars.  The same
+        fraction of stars (ordered by index) is taken from each healpix pixel,
+        starting at an offset given by a hash of the pixel number, so that
+        pixels with few stars are not over-sampled.
+
+        parameters
+        ----------
+        goodStars: np.array
+           Indices of the good stars
+        fraction: float
+           Fraction of stars to keep
+        nside: int
+           Healpix nside for balancing the subsample
+
+        returns
+        -------
+        subStars: np.array of subsampled star indices
+        """
+
+        import healpy as hp
+
+        theta = (90.0 - snmm.getArray(self.objDecHandle)[goodStars]) * np.pi / 180.
+        phi = snmm.getArray(self.objRAHandle)[goodStars] * np.pi / 180.
+
+        ipring = hp.ang2pix(nside, theta, phi)
+
+        # Rank of each star within its pixel
+        st = np.lexsort((goodStars, ipring))
+        ipringSorted = ipring[st]
+        rank = np.arange(st.size) - np.searchsorted(ipringSorted, ipringSorted)
+
+        # Offset (in [0, 1)) of each pixel, from a multiplicative hash of the
+        #  pixel number
+        offset = ((ipringSorted.astype(np.uint64) * np.uint64(2654435761)) %
+                  np.uint64(2**32)).astype(np.float64) / 2.**32
+
+        # Every 1/fraction-th star in each pixel, starting at the offset
+        keep = (np.floor(rank * fraction + offset) > np.floor((rank - 1) * fraction + offset))
+
+        return np.sort(goodStars[st[keep]])
+
+    def getShardStarIndices(self, nShards, nside):
+        """
+        Split all the stars into shards of neighboring healpix pixels, with
+        about the same number of observations in each shard.
+
+        parameters
+        ----------
+        nShards: int
+           Number of shards
+        nside: int
+           Healpix nside of the pixels (which are not split between shards)
+
+        returns
+        -------
+        shardStars: list of np.arrays
+           Star indices (in increasing order) of each shard
+        """
+
+        import healpy as hp
+
+        theta = (90.0 - snmm.getArray(self.objDecHandle)) * np.pi / 180.
+        phi = snmm.getArray(self.objRAHandle) * np.pi / 180.
+
+        # The nest ordering keeps neighboring pixels together
+        ipnest = hp.ang2pix(nside, theta, phi, nest=True)
+        st = np.argsort(ipnest, kind='stable')
+        ipnestSorted = ipnest[st]
+
+        # Split at the pixel boundaries nearest to equal numbers of observations
+        boundaries = np.concatenate(([0], np.where(np.diff(ipnestSorted) != 0)[0] + 1))
+        if boundaries.size < nShards:
+            raise ValueError("Only %d healpix pixels (nside %d) have stars, too few for %d shards" %
+                             (boundaries.size, nside, nShards))
+        cumObs = np.concatenate(([0], np.cumsum(snmm.getArray(self.objNobsHandle)[st])))
+        obsAtBoundaries = cumObs[boundaries]
+
+        targets = cumObs[-1] * np.arange(1, nShards) / float(nShards)
+        splitIndices = np.clip(np.searchsorted(obsAtBoundaries, targets), 1, boundaries.size - 1)
+        lower = (targets - obsAtBoundaries[splitIndices - 1]) < (obsAtBoundaries[splitIndices] - targets)
+        splitIndices[lower] -= 1
+        # And make sure that every shard has at least one pixel
+        for i in range(splitIndices.size):
+            lowest = splitIndices[i - 1] + 1 if i > 0 else 1
+            splitIndices[i] = min(max(splitIndices[i], lowest),
+                                  boundaries.size - (splitIndices.size - i))
+        splits = boundaries[splitIndices]
+
+        return [np.sort(shard) for shard in np.split(st, splits)]
+
+    def getFlagGenerations(self, check=False):
+        """
+        Get the generations of the star flags.  A generation is advanced
+        whenever the corresponding array is written, so selections of good
+        stars and observations can be cached on these.
+
+        parameters
+        ----------
+        check: bool, default=False
+           Check (with a checksum) that the arrays have not changed without
+           advancing their generations.  For debugging.
+
+        returns
+        -------
+        generations: tuple[3]
+           Generations of objFlag, obsFlag and objNGoodObs
+        """
+
+        if check:
+            return (self.objFlagGeneration.check(snmm.getArray(self.objFlagHandle)),
+                    self.obsFlagGeneration.check(snmm.getArray(self.obsFlagHandle)),
+                    self.objNGoodObsGeneration.check(snmm.getArray(self.objNGoodObsHandle)))
+
+        return (self.objFlagGeneration.generation,
+                self.obsFlagGeneration.generation,
+                self.objNGoodObsGeneration.generation)
+
     def getGoodObsIndices(self, goodStars, expFlag=None, requireSED=False, checkBadMag=False):
         """
         Get the good observation indices.
@@ -1006,12 +1746,9 @@ class FgcmStars(object):
 
         """
 
-        obsObjIDIndex = snmm.getArray(self.obsObjIDIndexHandle)
         obsFlag = snmm.getArray(self.obsFlagHandle)
 
-        goodStarsSub, goodObs = esutil.numpy_util.match(goodStars,
-                                                        obsObjIDIndex,
-                                                        presorted=True)
+        goodStarsSub, goodObs = self.getObsIndicesForStars(goodStars)
 
         if goodStarsSub[0] != 0:
             raise ValueError("Very strange error that goodStarsSub first element is non-zero.")
@@ -1048,6 +1785,68 @@ class FgcmStars(object):
 
         return goodStarsSub[okFlag], goodObs[okFlag]
 
+    def getObsIndicesForStars(self, stars):
+        """
+        Get all the observations of a set of stars, from the star to
+        observation index.
+
+        parameters
+        ----------
+        stars: np.array
+           Indices of the stars
+
+        returns
+        -------
+        starsSub: np.array
+           Sub-indices of the stars matched to the observations (increasing)
+        obs: np.array
+           Indices of the observations, grouped by star and matched to starsSub
+        """
+
+        objObsPtr = snmm.getArray(self.objObsPtrHandle)
+        obsStarSortIndex = snmm.getArray(self.obsStarSortIndexHandle)
+
+        starts = objObsPtr[stars]
+        counts = objObsPtr[np.asarray(stars) + 1] - starts
+
+        starsSub = np.repeat(np.arange(counts.size), counts)
+        # position of each observation within the sorted index
+        offsets = np.cumsum(counts) - counts
+        pos = np.arange(starsSub.size) + (starts - offsets)[starsSub]
+
+        return starsSub, obsStarSortIndex[pos]
+
+    def splitGoodObsIndices(self, goodStars, goodStarsSub, goodObs, nSections,
+                            nCore=1, stage=None):
+        """
+        Split good stars and their observations into chunks for workers,
+        balanced by expected cost with the chunk planner.
+
+        parameters
+        ----------
+        goodStars: np.array
+           Indices of the good stars
+        goodStarsSub: np.array
+           Sub-indices of the good stars matched to good observations,
+           from getGoodObsIndices()
+        goodObs: np.array
+           Indices of good observations, matched to goodStarsSub
+        nSections: int
+           Number of full-size chunks
+        nCore: int, default=1
+           Number of worker processes
+        stage: string, optional
+           Name of the stage, to select the chunk cost model
+
+        returns
+        -------
+        workerList: list of (goodStars, goodObs) tuples
+           Chunks, in the order they should be run
+        """
+
+        return self.chunkPlanner.plan(goodStars, goodStarsSub, goodObs, nSections,
+                                      nCore=nCore, stage=stage)
+
     def plotStarMap(self,mapType='initial'):
         """
         Plot star map.
@@ -1119,13 +1918,7 @@ class FgcmStars(object):
         objSEDSlope = snmm.getArray(self.objSEDSlopeHandle)
         objNGoodObs = snmm.getArray(self.objNGoodObsHandle)
 
-        objMagStdMeanLock = snmm.getArrayBase(self.objMagStdMeanHandle).get_lock()
-        objSEDSlopeLock = snmm.getArrayBase(self.objSEDSlopeHandle).get_lock()
-
-        # protect access when copying to local
-        objMagStdMeanLock.acquire()
         objMagStdMeanOI = objMagStdMean[objIndicesIn, :]
-        objMagStdMeanLock.release()
 
         # and make a temporary local copy of the SED
         objSEDSlopeOI = np.zeros((objIndicesIn.size, self.nBands), dtype='f4')
@@ -1180,10 +1973,8 @@ class FgcmStars(object):
                     objSEDSlopeOI[use, bandIndex] = (
                         sedTerm['constant'] * S[sedTerm['primaryTerm']][use])
 
-        # Save the values, protected
-        objSEDSlopeLock.acquire()
+        # Save the values
         objSEDSlope[objIndicesIn,:] = objSEDSlopeOI
-        objSEDSlopeLock.release()
 
     def computeObjectSEDSlopesLUT(self, objIndicesIn, fgcmLUT):
         """
@@ -1201,17 +1992,8 @@ class FgcmStars(object):
         objMagStdMean = snmm.getArray(self.objMagStdMeanHandle)
         objSEDSlope = snmm.getArray(self.objSEDSlopeHandle)
 
-        objMagStdMeanLock = snmm.getArrayBase(self.objMagStdMeanHandle).get_lock()
-        objSEDSlopeLock = snmm.getArrayBase(self.objSEDSlopeHandle).get_lock()
-
-        # protect access to copy to local
-        objMagStdMeanLock.acquire()
-
         objMagStdMeanOI = objMagStdMean[objIndicesIn,:]
 
-        # release access
-        objMagStdMeanLock.release()
-
         # and make a temporary local copy of the SED
         #objSEDSlopeOI = np.zeros((objIndicesIn.size,self.nBands),dtype='f4')
 
@@ -1222,13 +2004,10 @@ class FgcmStars(object):
         # do the look-up
         objSEDSlopeOI = fgcmLUT.computeSEDSlopes(objSEDColorOI)
 
-        # and save the values, protected
-        objSEDSlopeLock.acquire()
+        # and save the values
 
         objSEDSlope[objIndicesIn,:] = objSEDSlopeOI
 
-        objSEDSlopeLock.release()
-
     def computeAbsOffset(self):
         """
         Compute the absolute offset
@@ -1245,6 +2024,32 @@ class FgcmStars(object):
             self.fgcmLog.warn("Cannot compute abs offset without reference stars.")
             return np.zeros(self.nBands)
 
+        return self.absOffsetFromSums(*self.computeAbsOffsetSums())
+
+    def computeAbsOffsetSums(self, stars=None):
+        """
+        Compute the weighted sums of the offsets between the mean magnitudes
+        and the reference magnitudes, which can be added up over sets of stars.
+
+        Parameters
+        ----------
+        stars: `np.array`, optional
+           Indices of the stars to use.  Default is all the stars.
+
+        Returns
+        -------
+        deltaOffsetSum: `np.array`
+           Float array (nBands) with the weighted sum of the offsets
+        deltaOffsetWtSum: `np.array`
+           Float array (nBands) with the sum of the weights
+        """
+
+        deltaOffsetRef = np.zeros(self.nBands)
+        deltaOffsetWtRef = np.zeros(self.nBands)
+
+        if not self.hasRefstars:
+            return deltaOffsetRef, deltaOffsetWtRef
+
         # Set things up
         objMagStdMean = snmm.getArray(self.objMagStdMeanHandle)
         objMagStdMeanErr = snmm.getArray(self.objMagStdMeanErrHandle)
@@ -1254,14 +2059,13 @@ class FgcmStars(object):
         refMagErr = snmm.getArray(self.refMagErrHandle)
 
         goodStars = self.getGoodStarIndices(includeReserve=False, checkMinObs=True)
+        if stars is not None:
+            goodStars = np.intersect1d(goodStars, stars, assume_unique=True)
 
         use, = np.where((objRefIDIndex[goodStars] >= 0) &
                         ((objFlag[goodStars] & objFlagDict['REFSTAR_OUTLIER']) == 0))
         goodRefStars = goodStars[use]
 
-        deltaOffsetRef = np.zeros(self.nBands)
-        deltaOffsetWtRef = np.zeros(self.nBands)
-
         gdStarInd, gdBandInd = np.where((objMagStdMean[goodRefStars, :] < 90.0) &
                                         (refMag[objRefIDIndex[goodRefStars], :] < 90.0))
         delta = objMagStdMean[goodRefStars, :] - refMag[objRefIDIndex[goodRefStars], :]
@@ -1271,6 +2075,29 @@ class FgcmStars(object):
         np.add.at(deltaOffsetRef, gdBandInd, delta[gdStarInd, gdBandInd] * wt[gdStarInd, gdBandInd])
         np.add.at(deltaOffsetWtRef, gdBandInd, wt[gdStarInd, gdBandInd])
 
+        return deltaOffsetRef, deltaOffsetWtRef
+
+    @staticmethod
+    def absOffsetFromSums(deltaOffsetSum, deltaOffsetWtSum):
+        """
+        Compute the absolute offset from the weighted sums.
+
+        Parameters
+        ----------
+        deltaOffsetSum: `np.array`
+           Float array (nBands) with the weighted sum of the offsets
+        deltaOffsetWtSum: `np.array`
+           Float array (nBands) with the sum of the weights
+
+        Returns
+        -------
+        deltaOffsetRef: `np.array`
+           Float array (nBands) that is the delta offset in abs mag
+        """
+
+        deltaOffsetRef = np.array(deltaOffsetSum, dtype=np.float64)
+        deltaOffsetWtRef = np.asarray(deltaOffsetWtSum)
+
         # Make sure we have a measurement in the band
         ok, = np.where(deltaOffsetWtRef > 0.0)
         deltaOffsetRef[ok] /= deltaOffsetWtRef[ok]
@@ -1411,6 +2238,8 @@ class FgcmStars(object):
                 objFlag[cancel] &= ~objFlagDict['BAD_COLOR']
                 self.fgcmLog.info('Cancelling BAD_COLOR flag on %d reference stars' % (cancel.size))
 
+        self.objFlagGeneration.advance()
+
     def performSuperStarOutlierCuts(self, fgcmPars, reset=False):
         """
         Do outlier cuts from common ccd/filter/epochs
@@ -1464,6 +2293,8 @@ class FgcmStars(object):
         self.fgcmLog.info("Marked %d observations (%.4f%%) as SUPERSTAR_OUTLIER" %
                           (nbad, 100. * float(nbad)/float(goodObs.size)))
 
+        self.obsFlagGeneration.advance()
+
         # Now we need to flag stars that might have fallen below our threshold
         # when we flagged these outliers
         goodExpsIndex, = np.where(fgcmPars.expFlag == 0)
@@ -1616,9 +2447,7 @@ class FgcmStars(object):
         #resMask = 255 & ~objFlagDict['RESERVED']
         goodStars, = np.where((objFlag & resMask) == 0)
 
-        goodStarsSub, goodObs = esutil.numpy_util.match(goodStars,
-                                                        obsObjIDIndex,
-                                                        presorted=True)
+        goodStarsSub, goodObs = self.getObsIndicesForStars(goodStars)
 
         # Do we want to allow more selection of exposures here?
         gd, = np.where((obsFlag[goodObs] == 0) &
@@ -2,6 +2,7 @@ from __future__ import division, absolute_import, print_function
 from builtins import range
 
 import numpy as np
+import zlib
 
 
 def _pickle_method(m):
@@ -63,6 +64,118 @@ class MaxFitIterations(Exception):
     pass
 
 
+class FlagGeneration(object):
+    """
+    Generation counter for a flag array.  Every code path which writes the
+    array calls advance(), so selections that depend on the flags can be
+    cached on the generation without inspecting the array.  In debug mode
+    the array can be passed to check() to verify (with a checksum) that it
+    has not been changed without advancing the generation.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self._checksum = None
+
+    def advance(self):
+        """
+        Advance the generation (after the flags have been written).
+        """
+
+        self._checksum = None
+        self.generation += 1
+
+    def check(self, array):
+        """
+        Check that the array has not changed within the current generation.
+        This computes a checksum of the whole array, so is only meant for
+        debugging.  Raises RuntimeError if the array changed without the
+        generation advancing.
+
+        parameters
+        ----------
+        array: numpy array
+           Flag array
+
+        returns
+        -------
+        generation: int
+           Current generation
+        """
+
+        array = np.ascontiguousarray(array)
+        checksum = (array.shape, zlib.crc32(array.view(np.uint8).ravel()))
+
+        if self._checksum is None:
+            self._checksum = checksum
+        elif checksum != self._checksum:
+            raise RuntimeError("Flag array changed without advancing its generation.")
+
+        return self.generation
+
+
+def getFilterCodes(filterNameArray, filterNames):
+    """
+    Convert filter names into integer filter codes, with a vectorized lookup.
+
+    The code of a name is its index in filterNames, or -1 if it is not there.
+     Byte and unicode names are matched, as are names padded with whitespace
+     (as read from fits tables).  Integer arrays are taken to be codes
+     already.
+
+    parameters
+    ----------
+    filterNameArray: string array
+       Filter name of each observation
+    filterNames: list of strings
+       Filter names, in code order
+
+    returns
+    -------
+    filterCodes: int16 array
+       Filter code of each observation
+    """
+
+    filterNameArray = np.asarray(filterNameArray)
+
+    if filterNameArray.dtype.kind in 'iu':
+        return filterNameArray.astype(np.int16)
+
+    filterCodes = np.full(filterNameArray.shape, -1, dtype=np.int16)
+    if filterNameArray.size == 0 or len(filterNames) == 0:
+        return filterCodes
+
+    isBytes = (filterNameArray.dtype.kind == 'S')
+    width = filterNameArray.dtype.itemsize // (1 if isBytes else 4)
+
+    # Sorted lookup table of the names, as is and padded to the array width
+    tableNames = []
+    tableCodes = []
+    for code, filterName in enumerate(filterNames):
+        for name in set([filterName, filterName.ljust(width)]):
+            tableNames.append(name.encode('utf-8') if isBytes else name)
+            tableCodes.append(code)
+    tableNames = np.array(tableNames)
+    tableCodes = np.array(tableCodes, dtype=np.int16)
+    st = np.argsort(tableNames)
+    tableNames = tableNames[st]
+    tableCodes = tableCodes[st]
+
+    def _lookup(names):
+        ind = np.clip(np.searchsorted(tableNames, names), 0, tableNames.size - 1)
+        return np.where(tableNames[ind] == names, tableCodes[ind], -1).astype(np.int16)
+
+    filterCodes[:] = _lookup(filterNameArray)
+
+    # Any other padding is stripped from the (few) distinct unmatched names
+    missing, = np.where(filterCodes.ravel() < 0)
+    if missing.size > 0:
+        uniqueNames, inverse = np.unique(filterNameArray.ravel()[missing], return_inverse=True)
+        filterCodes.ravel()[missing] = _lookup(np.char.strip(uniqueNames))[inverse]
+
+    return filterCodes
+
+
 def getMemoryString(location):
     """
     Get a string for memory usage (current and peak) for logging.
@@ -91,6 +204,49 @@ def getMemoryString(location):
 
     return memoryString
 
+def getProcessMemory():
+    """
+    Get the current and peak resident memory of this process.
+
+    returns
+    -------
+    rss: int
+       Current resident set size (bytes), 0 if not available
+    peak: int
+       Peak resident set size (bytes), 0 if not available
+    """
+
+    result = {'vmrss:': 0, 'vmhwm:': 0}
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                parts = line.split()
+                if len(parts) > 1 and parts[0].lower() in result:
+                    result[parts[0].lower()] = int(parts[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+
+    return result['vmrss:'], result['vmhwm:']
+
+def resetPeakMemory():
+    """
+    Reset the peak resident memory of this process to the current resident
+    memory (only available on Linux).
+
+    returns
+    -------
+    reset: bool
+       True if the peak was reset
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as clearRefs:
+            clearRefs.write('5')
+    except (IOError, OSError):
+        return False
+
+    return True
+
 def dataBinner(x,y,binSize,xRange,nTrial=100,xNorm=-1.0,minPerBin=5):
     """
     Bin data and compute errors via bootstrap resampling.  All median statistics.
@@ -627,3 +783,65 @@ def checkFlaggedExposuresPerBand(log, fgcmPars):
         inBandBad, = np.where(fgcmPars.expFlag[inBand] > 0)
         if inBandBad.size >= (inBand.size - 1):
             raise RuntimeError("FATAL: All observations in %s band have been cut!")
+
+def compareZeropoints(zpStruct1, zpStruct2, expField='EXPNUM', ccdField='CCDNUM'):
+    """
+    Compare two sets of zeropoints (e.g. from fits with different obsPrecision),
+    per band, for the exposure/ccds with photometric zeropoints in both.
+
+    parameters
+    ----------
+    zpStruct1: numpy recarray
+       Zeropoints, as saved by FgcmZeropoints.saveZptFits()
+    zpStruct2: numpy recarray
+       Zeropoints to compare to
+    expField: string, default='EXPNUM'
+       Exposure field name
+    ccdField: string, default='CCDNUM'
+       CCD field name
+
+    returns
+    -------
+    report: numpy recarray
+       One row per band, with 'BAND', 'NZPT' (number compared), and the
+       'MEDIAN', 'RMS' and 'MAXABS' of the difference zpStruct2 - zpStruct1
+       (mag) of 'FGCM_ZPT', and of 'FGCM_ZPTERR' ('MAXABS_ERR').
+    """
+
+    photometric = (zpFlagDict['PHOTOMETRIC_FIT_EXPOSURE'] |
+                   zpFlagDict['PHOTOMETRIC_NOTFIT_EXPOSURE'])
+
+    # Match on a combined exposure/ccd key
+    maxCCD = max(np.max(zpStruct1[ccdField]), np.max(zpStruct2[ccdField])) + 1
+    key1 = zpStruct1[expField].astype(np.int64) * maxCCD + zpStruct1[ccdField]
+    key2 = zpStruct2[expField].astype(np.int64) * maxCCD + zpStruct2[ccdField]
+    _, a, b = np.intersect1d(key1, key2, return_indices=True)
+
+    use, = np.where(((zpStruct1['FGCM_FLAG'][a] & photometric) > 0) &
+                    ((zpStruct2['FGCM_FLAG'][b] & photometric) > 0))
+    a = a[use]
+    b = b[use]
+
+    bands = np.char.strip(zpStruct1['BAND'][a].astype(str))
+    uBands = np.unique(bands)
+
+    report = np.zeros(uBands.size, dtype=[('BAND', bands.dtype),
+                                          ('NZPT', 'i4'),
+                                          ('MEDIAN', 'f8'),
+                                          ('RMS', 'f8'),
+                                          ('MAXABS', 'f8'),
+                                          ('MAXABS_ERR', 'f8')])
+
+    for i, band in enumerate(uBands):
+        inBand, = np.where(bands == band)
+        delta = zpStruct2['FGCM_ZPT'][b[inBand]] - zpStruct1['FGCM_ZPT'][a[inBand]]
+        deltaErr = zpStruct2['FGCM_ZPTERR'][b[inBand]] - zpStruct1['FGCM_ZPTERR'][a[inBand]]
+
+        report['BAND'][i] = band
+        report['NZPT'][i] = inBand.size
+        report['MEDIAN'][i] = np.median(delta)
+        report['RMS'][i] = np.sqrt(np.mean(delta**2.))
+        report['MAXABS'][i] = np.max(np.abs(delta))
+        report['MAXABS_ERR'][i] = np.max(np.abs(deltaErr))
+
+    return report
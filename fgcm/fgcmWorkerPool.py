@@ -0,0 +1,274 @@
+from __future__ import division, absolute_import, print_function
+
+import time
+import tracemalloc
+import multiprocessing
+
+from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmUtilities import getProcessMemory
+from .fgcmUtilities import resetPeakMemory
+
+# Objects which are reachable by the worker processes.  This is filled in
+# the parent immediately before the pool is started and is inherited by
+# the workers when they are forked, so the objects are never pickled.
+_workerObjects = {}
+
+# The id of the last per-call state applied to each object in a worker.
+_workerStateIds = {}
+
+
+def _getAttrPath(obj, attrPath):
+    """
+    Get a (possibly dotted) attribute from an object.
+    """
+    for attr in attrPath.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _setAttrPath(obj, attrPath, value):
+    """
+    Set a (possibly dotted) attribute on an object.
+    """
+    attrs = attrPath.split('.')
+    for attr in attrs[:-1]:
+        obj = getattr(obj, attr)
+    setattr(obj, attrs[-1], value)
+
+
+def _runWorkerTask(task):
+    """
+    Run a method of a registered object in a worker process.  Not to be
+    called on its own.
+
+    parameters
+    ----------
+    task: tuple[6]
+       (objectKey, methodName, stateId, state, workerItem, traceMemory)
+
+    returns
+    -------
+    result: tuple[4]
+       (return value of the method, time taken in seconds,
+        peak resident memory in bytes, peak traced allocations in bytes;
+        both memory values are 0 if traceMemory is False)
+    """
+
+    key, methodName, stateId, state, item, traceMemory = task
+
+    obj = _workerObjects[key]
+
+    # Only apply the per-call state once per call in each worker
+    if _workerStateIds.get(key) != stateId:
+        for attrPath in state:
+            _setAttrPath(obj, attrPath, state[attrPath])
+        _workerStateIds[key] = stateId
+
+    # The memory is only measured when asked for, as it adds /proc
+    #  reads and writes to every task
+    if traceMemory:
+        resetPeakMemory()
+        tracemalloc.start()
+
+    startTime = time.time()
+    result = getattr(obj, methodName)(item)
+    taskTime = time.time() - startTime
+
+    tracedPeak = 0
+    peakRss = 0
+    if traceMemory:
+        _, tracedPeak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _, peakRss = getProcessMemory()
+
+    return result, taskTime, peakRss, tracedPeak
+
+
+class FgcmWorkerPool(object):
+    """
+    Class to hold a persistent multiprocessing pool that may be shared
+     by several of the fit cycle stages.
+
+    The workers are forked with all the registered objects in place, so
+     that each map only needs to send the per-call state (typically the
+     exposure parameters) and the star/observation indices.  The pool is
+     (re)started lazily when a new object is mapped over, or when new
+     shared memory arrays have been created since the workers were forked.
+
+    parameters
+    ----------
+    nCore: int
+       Number of worker processes
+    fgcmLog: FgcmLogger
+       Logger object
+    """
+
+    def __init__(self, nCore, fgcmLog):
+
+        self.nCore = nCore
+        self.fgcmLog = fgcmLog
+
+        self._pool = None
+        self._objects = {}
+        self._poolObjectKeys = set()
+        self._poolGeneration = -1
+        self._stateId = 0
+
+        self.nStarts = 0
+        self.startupTime = 0.0
+        self.nMaps = 0
+        self.computeTime = 0.0
+        # Time taken by each task of the last map (seconds)
+        self.lastTaskTimes = None
+        # Peak resident memory of the worker for each task of the last map,
+        #  including the shared memory it has touched, if traced (bytes)
+        self.lastTaskPeakRss = None
+        # Peak memory allocated by each task of the last map, if traced (bytes)
+        self.lastTaskTracedMemory = None
+
+    def map(self, obj, methodName, workerList, stateAttrs=(), traceMemory=False):
+        """
+        Map a method of an object over a list of worker inputs.
+
+        parameters
+        ----------
+        obj: object
+           Object with the worker method
+        methodName: string
+           Name of the worker method
+        workerList: list
+           List of inputs to the worker method
+        stateAttrs: list of strings, optional
+           (Dotted) attribute names of obj which are sent to the workers
+           for this call, e.g. 'fgcmPars.expLnPwv'
+        traceMemory: bool, default=False
+           Trace the memory allocated by each task (with tracemalloc, which
+           slows down the workers), and its peak resident memory
+
+        returns
+        -------
+        results: list
+           List of return values of the worker method
+        """
+
+        key = id(obj)
+        self._objects[key] = obj
+
+        startupTime = 0.0
+        if self._needsStart():
+            startupTime = self._start()
+
+        self._stateId += 1
+        state = {}
+        for attrPath in stateAttrs:
+            state[attrPath] = _getAttrPath(obj, attrPath)
+
+        tasks = [(key, methodName, self._stateId, state, item, traceMemory)
+                 for item in workerList]
+
+        computeStartTime = time.time()
+        timedResults = self._pool.map(_runWorkerTask, tasks, chunksize=1)
+        computeTime = time.time() - computeStartTime
+
+        results = [elt[0] for elt in timedResults]
+        self.lastTaskTimes = [elt[1] for elt in timedResults]
+        self.lastTaskPeakRss = [elt[2] for elt in timedResults] if traceMemory else None
+        self.lastTaskTracedMemory = [elt[3] for elt in timedResults] if traceMemory else None
+
+        self.nMaps += 1
+        self.computeTime += computeTime
+
+        self.fgcmLog.debug('%s.%s on %d cores: %.2f s pool startup, %.2f s compute' %
+                           (type(obj).__name__, methodName, self.nCore,
+                            startupTime, computeTime))
+
+        return results
+
+    def _needsStart(self):
+        """
+        Check if the pool needs to be (re)started.
+        """
+
+        if self._pool is None:
+            return True
+
+        if not set(self._objects.keys()).issubset(self._poolObjectKeys):
+            return True
+
+        if snmm.getGeneration() != self._poolGeneration:
+            return True
+
+        return False
+
+    def _start(self):
+        """
+        (Re)start the pool with all the registered objects.
+
+        returns
+        -------
+        startupTime: float
+           Time to start the pool (seconds)
+        """
+
+        startTime = time.time()
+
+        self._stop()
+
+        _workerObjects.clear()
+        _workerObjects.update(self._objects)
+
+        self._poolObjectKeys = set(self._objects.keys())
+        self._poolGeneration = snmm.getGeneration()
+
+        # The workers must be forked to inherit _workerObjects
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise RuntimeError("FgcmWorkerPool requires the 'fork' multiprocessing start "
+                               "method, which is not available on this platform.")
+
+        self._pool = context.Pool(processes=self.nCore)
+
+        startupTime = time.time() - startTime
+
+        self.nStarts += 1
+        self.startupTime += startupTime
+
+        return startupTime
+
+    def _stop(self):
+        """
+        Stop the pool workers.
+        """
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def close(self):
+        """
+        Close the pool and release the registered objects.
+        """
+
+        self._stop()
+        self._objects = {}
+        self._poolObjectKeys = set()
+        _workerObjects.clear()
+
+    def logTimingSummary(self):
+        """
+        Log the total pool startup and compute time.
+        """
+
+        self.fgcmLog.info('Worker pool: %d start(s) took %.2f s; %d map(s) took %.2f s.' %
+                          (self.nStarts, self.startupTime, self.nMaps, self.computeTime))
+
+    def __getstate__(self):
+        # Don't try to pickle the logger or the pool
+
+        state = self.__dict__.copy()
+        del state['fgcmLog']
+        state['_pool'] = None
+        state['_objects'] = {}
+        return state
@@ -298,21 +298,17 @@ class FgcmZeropoints(object):
                                              self.fgcmPars.expAlpha[zpExpIndex],
                                              ccdSecZenith,
                                              zpCCDIndex,
-                                             self.fgcmPars.expPmb[zpExpIndex])
-        zpStruct['FGCM_I0'][:] = self.fgcmLUT.computeI0(self.fgcmPars.expLnPwv[zpExpIndex],
-                                                        self.fgcmPars.expO3[zpExpIndex],
-                                                        self.fgcmPars.expLnTau[zpExpIndex],
-                                                        self.fgcmPars.expAlpha[zpExpIndex],
-                                                        ccdSecZenith,
-                                                        self.fgcmPars.expPmb[zpExpIndex],
-                                                        lutIndices)
-        zpStruct['FGCM_I10'][:] = self.fgcmLUT.computeI1(self.fgcmPars.expLnPwv[zpExpIndex],
-                                                         self.fgcmPars.expO3[zpExpIndex],
-                                                         self.fgcmPars.expLnTau[zpExpIndex],
-                                                         self.fgcmPars.expAlpha[zpExpIndex],
-                                                         ccdSecZenith,
-                                                         self.fgcmPars.expPmb[zpExpIndex],
-                                                         lutIndices) / zpStruct['FGCM_I0'][:]
+                                             self.fgcmPars.expPmb[zpExpIndex],
+                                             flat=True)
+        I0, _, I10 = self.fgcmLUT.computeI0I1(self.fgcmPars.expLnPwv[zpExpIndex],
+                                              self.fgcmPars.expO3[zpExpIndex],
+                                              self.fgcmPars.expLnTau[zpExpIndex],
+                                              self.fgcmPars.expAlpha[zpExpIndex],
+                                              ccdSecZenith,
+                                              self.fgcmPars.expPmb[zpExpIndex],
+                                              lutIndices)
+        zpStruct['FGCM_I0'][:] = I0
+        zpStruct['FGCM_I10'][:] = I10
 
         # Set the tilings, gray values, and zptvar
 
@@ -15,10 +15,8 @@ try:
 except ImportError:
     import copyreg
 
-import multiprocessing
-from multiprocessing import Pool
-
 from .sharedNumpyMemManager import SharedNumpyMemManager as snmm
+from .fgcmWorkerPool import FgcmWorkerPool
 
 copyreg.pickle(types.MethodType, _pickle_method)
 
@@ -29,13 +27,21 @@ class FgcmZpsToApply(object):
     Parameters
     ----------
     fgcmConfig: FgcmConfig
+    fgcmPars: FgcmParameters
+    fgcmStars: FgcmStars
+    fgcmLUT: FgcmLUT
+    fgcmWorkerPool: FgcmWorkerPool, optional
+       Persistent worker pool.  If None, a pool is made for each call.
     """
 
-    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmLUT):
+    def __init__(self, fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, fgcmWorkerPool=None):
         self.fgcmLog = fgcmConfig.fgcmLog
 
         self.fgcmLog.debug('Initializing fgcmZpsToApply.')
 
+        # this may be None, in which case we make a pool for each call
+        self.fgcmWorkerPool = fgcmWorkerPool
+
         self.fgcmPars = fgcmPars
         self.fgcmStars = fgcmStars
         self.fgcmLUT = fgcmLUT
@@ -51,7 +57,10 @@ class FgcmZpsToApply(object):
         self.nStarPerRun = fgcmConfig.nStarPerRun
         self.quietMode = fgcmConfig.quietMode
 
-        self.I10StdBand = fgcmConfig.I10StdBand
+        # Per-observation quantities are computed with this precision
+        self.obsDtype = np.dtype(fgcmConfig.obsPrecision)
+
+        self.I10StdBand = fgcmConfig.I10StdBand.astype(self.obsDtype)
 
         if fgcmConfig.useSedLUT and self.fgcmLUT.hasSedLUT:
             self.useSedLUT = True
@@ -144,30 +153,24 @@ class FgcmZpsToApply(object):
 
         goodStarsSub, goodObs = self.fgcmStars.getGoodObsIndices(goodStars, expFlag=self.fgcmPars.expFlag)
 
-        proc = multiprocessing.Process()
-        workerIndex = proc._identity[0] + 1
-        proc = None
-
         nSections = goodStars.size // self.nStarPerRun + 1
-        goodStarsList = np.array_split(goodStars, nSections)
-
-        splitValues = np.zeros(nSections - 1, dtype='i4')
-        for i in range(1, nSections):
-            splitValues[i - 1] = goodStarsList[i][0]
-
-        splitIndices = np.searchsorted(goodStars[goodStarsSub], splitValues)
-
-        goodObsList = np.split(goodObs, splitIndices)
-
-        workerList = list(zip(goodStarsList, goodObsList))
-
-        workerList.sort(key=lambda elt:elt[1].size, reverse=True)
+        workerList = self.fgcmStars.splitGoodObsIndices(goodStars, goodStarsSub,
+                                                        goodObs, nSections,
+                                                        nCore=self.nCore,
+                                                        stage='zpsToApply')
+
+        # use the persistent pool if we have one
+        if self.fgcmWorkerPool is not None:
+            pool = self.fgcmWorkerPool
+        else:
+            pool = FgcmWorkerPool(self.nCore, self.fgcmLog)
 
-        pool = Pool(processes=self.nCore)
-        pool.map(self._worker, workerList, chunksize=1)
+        pool.map(self, '_worker', workerList)
+        self.fgcmStars.chunkPlanner.recordTiming('zpsToApply', workerList,
+                                                 pool.lastTaskTimes)
 
-        pool.close()
-        pool.join()
+        if self.fgcmWorkerPool is None:
+            pool.close()
 
         self.fgcmStars.magStdComputed = True
 
@@ -204,42 +207,46 @@ class FgcmZpsToApply(object):
         zpZpt = snmm.getArray(self.zpZptHandle)
         zpI10 = snmm.getArray(self.zpI10Handle)
 
-        # and the arrays for locking access
-        objMagStdMeanLock = snmm.getArrayBase(self.fgcmStars.objMagStdMeanHandle).get_lock()
-        obsMagStdLock = snmm.getArrayBase(self.fgcmStars.obsMagStdHandle).get_lock()
-
         # cut these down now, faster later
         obsObjIDIndexGO = esutil.numpy_util.to_native(obsObjIDIndex[goodObs])
         obsBandIndexGO = esutil.numpy_util.to_native(obsBandIndex[goodObs])
         obsLUTFilterIndexGO = esutil.numpy_util.to_native(obsLUTFilterIndex[goodObs])
         obsExpIndexGO = esutil.numpy_util.to_native(obsExpIndex[goodObs])
         obsCCDIndexGO = esutil.numpy_util.to_native(obsCCDIndex[goodObs])
-        I10GO = esutil.numpy_util.to_native(zpI10[obsExpIndexGO, obsCCDIndexGO])
+        I10GO = esutil.numpy_util.to_native(zpI10[obsExpIndexGO, obsCCDIndexGO]).astype(self.obsDtype,
+                                                                                      copy=False)
+
+        # compact local star index for accumulating the mean magnitudes,
+        #  where uStarsGO[obsLocalIndexGO] == obsObjIDIndexGO
+        uStarsGO, obsLocalIndexGO = np.unique(obsObjIDIndexGO, return_inverse=True)
+        nBands = objMagStdMean.shape[1]
 
         obsMagErr2GO = obsMagADUModelErr[goodObs]**2.
 
-        obsMagGO = (obsMagADU[goodObs] + zpZpt[obsExpIndexGO, obsCCDIndexGO] +
-                    -2.5 * np.log10(self.fgcmPars.expExptime[obsExpIndexGO]) -
-                    self.zptABNoThroughput)
+        # The zeropoint terms are per exposure/ccd, and are combined in
+        #  float64 before conversion to the observation precision
+        zptGO = (zpZpt[obsExpIndexGO, obsCCDIndexGO] +
+                 -2.5 * np.log10(self.fgcmPars.expExptime[obsExpIndexGO]) -
+                 self.zptABNoThroughput)
+        obsMagGO = obsMagADU[goodObs] + zptGO.astype(self.obsDtype, copy=False)
 
         # Compute the mean
 
-        wtSum = np.zeros_like(objMagStdMean, dtype='f8')
-        objMagStdMeanTemp = np.zeros_like(objMagStdMean)
+        wtSum = np.zeros((uStarsGO.size, nBands), dtype='f8')
+        objMagStdMeanTemp = np.zeros((uStarsGO.size, nBands), dtype='f8')
 
         add_at_2d(wtSum,
-                  (obsObjIDIndexGO, obsBandIndexGO),
+                  (obsLocalIndexGO, obsBandIndexGO),
                   1./obsMagErr2GO)
         add_at_2d(objMagStdMeanTemp,
-                  (obsObjIDIndexGO, obsBandIndexGO),
+                  (obsLocalIndexGO, obsBandIndexGO),
                   obsMagGO / obsMagErr2GO)
 
-        gd = np.where(wtSum > 0.0)
+        gdLocal = np.where(wtSum > 0.0)
+        gd = (uStarsGO[gdLocal[0]], gdLocal[1])
 
-        objMagStdMeanLock.acquire()
-        objMagStdMean[gd] = objMagStdMeanTemp[gd] / wtSum[gd]
-        objMagStdMeanErr[gd] = np.sqrt(1. / wtSum[gd])
-        objMagStdMeanLock.release()
+        objMagStdMean[gd] = objMagStdMeanTemp[gdLocal] / wtSum[gdLocal]
+        objMagStdMeanErr[gd] = np.sqrt(1. / wtSum[gdLocal])
 
         # Compute the SEDs
 
@@ -257,36 +264,33 @@ class FgcmZpsToApply(object):
                                                        obsBandIndexGO] *
                                      self.I10StdBand[obsBandIndexGO]))
 
-        obsMagStdLock.acquire()
         obsMagStd[goodObs] = obsMagGO + deltaStdGO
         obsMagStdGO = obsMagStd[goodObs]
-        obsMagStdLock.release()
 
         # Compute the mean (again)
 
-        wtSum = np.zeros_like(objMagStdMean, dtype='f8')
-        objMagStdMeanTemp = np.zeros_like(objMagStdMean)
-        objMagStdMeanNoChromTemp = np.zeros_like(objMagStdMean)
+        wtSum = np.zeros((uStarsGO.size, nBands), dtype='f8')
+        objMagStdMeanTemp = np.zeros((uStarsGO.size, nBands), dtype='f8')
+        objMagStdMeanNoChromTemp = np.zeros((uStarsGO.size, nBands), dtype='f8')
 
         add_at_2d(wtSum,
-                  (obsObjIDIndexGO, obsBandIndexGO),
+                  (obsLocalIndexGO, obsBandIndexGO),
                   1./obsMagErr2GO)
         add_at_2d(objMagStdMeanTemp,
-                  (obsObjIDIndexGO, obsBandIndexGO),
+                  (obsLocalIndexGO, obsBandIndexGO),
                   obsMagStdGO / obsMagErr2GO)
         add_at_2d(objMagStdMeanNoChromTemp,
-                  (obsObjIDIndexGO, obsBandIndexGO),
+                  (obsLocalIndexGO, obsBandIndexGO),
                   obsMagGO / obsMagErr2GO)
 
-        gd = np.where(wtSum > 0.0)
+        gdLocal = np.where(wtSum > 0.0)
+        gd = (uStarsGO[gdLocal[0]], gdLocal[1])
 
         # Record the mean
 
-        objMagStdMeanLock.acquire()
-        objMagStdMean[gd] = objMagStdMeanTemp[gd] / wtSum[gd]
-        objMagStdMeanNoChrom[gd] = objMagStdMeanNoChromTemp[gd] / wtSum[gd]
-        objMagStdMeanErr[gd] = np.sqrt(1. / wtSum[gd])
-        objMagStdMeanLock.release()
+        objMagStdMean[gd] = objMagStdMeanTemp[gdLocal] / wtSum[gdLocal]
+        objMagStdMeanNoChrom[gd] = objMagStdMeanNoChromTemp[gdLocal] / wtSum[gdLocal]
+        objMagStdMeanErr[gd] = np.sqrt(1. / wtSum[gdLocal])
 
     def __getstate__(self):
         # Don't try to pickle the logger.
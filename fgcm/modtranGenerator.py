@@ -43,12 +43,24 @@ class ModtranGenerator(object):
         except:
             raise ValueError("Could not find environment variable MODTRAN_PATH")
 
+        self._makeRunPath()
+
+        # now do a test run to get conversions
+        self._defaultConversionRun()
+
+    def _makeRunPath(self):
+        """
+        internal method to make a temporary path for running modtran
+        """
         # make a temporary path for running...
         try:
             self.tempRunPath = tempfile.mkdtemp()
         except:
             raise IOError("Could not make temporary directory for MODTRAN")
 
+        # only the process that made the path may remove it
+        self._runPathPid = os.getpid()
+
         # and make the modtran.in file
         self.modtranRoot = 'modtranGenerator'
         try:
@@ -64,8 +76,42 @@ class ModtranGenerator(object):
         except:
             raise IOError("Could not link in modtran and data")
 
-        # now do a test run to get conversions
-        self._defaultConversionRun()
+    def clone(self):
+        """
+        Make an independent generator, with its own temporary run path, that
+         reuses the conversion factors of this one (without the test run).
+         Clones may be run concurrently, e.g. in different processes.
+
+        returns
+        -------
+        modGen: ModtranGenerator
+        """
+
+        modGen = ModtranGenerator.__new__(ModtranGenerator)
+        modGen.elevation = self.elevation
+        modGen.modtranPath = self.modtranPath
+        modGen.tempRunPath = None
+        modGen.atm = None
+
+        modGen._makeRunPath()
+
+        modGen._o3DefaultSealevel = self._o3DefaultSealevel
+        modGen._h2oDefaultSealevel = self._h2oDefaultSealevel
+        modGen.pwvScaleValue = self.pwvScaleValue
+        modGen.o3ScaleValue = self.o3ScaleValue
+        modGen.pmbElevation = self.pmbElevation
+
+        return modGen
+
+    def _removeRunPath(self):
+        """
+        internal method to remove the temporary run path
+        """
+        if self.tempRunPath is not None:
+            if (os.path.isdir(self.tempRunPath) and
+                    os.getpid() == getattr(self, '_runPathPid', os.getpid())):
+                shutil.rmtree(self.tempRunPath)
+            self.tempRunPath = None
 
     def _defaultConversionRun(self):
         """
@@ -173,8 +219,19 @@ class ModtranGenerator(object):
             # Line of sight cards
             f.write('    0\n')
 
+        # remove the output of any previous run, so a failed run is not
+        #  mistaken for a new one
+        outputFiles = ['%s/%s.%s' % (self.tempRunPath, self.modtranRoot, ext) for ext in ['tp6', '7sc']]
+        for outputFile in outputFiles:
+            if os.path.isfile(outputFile):
+                os.remove(outputFile)
+
         subprocess.call('cd %s; ./runmodt4.exe' % (self.tempRunPath),shell=True)
 
+        for outputFile in outputFiles:
+            if not os.path.isfile(outputFile):
+                raise RuntimeError("MODTRAN run failed to write %s" % (outputFile))
+
     def __call__(self, pmb=778.0, pwv=3.0, o3=263.0, tau=0.03, lambdaNorm=7750.0,
                  alpha=1.0, zenith=33.55731, co2MX=CO2MX_DEFAULT,
                  lambdaRange=[300.0,1100.0], lambdaStep=0.5, ctranslamstd=None):
@@ -328,13 +385,7 @@ class ModtranGenerator(object):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.tempRunPath is not None:
-            if (os.path.isdir(self.tempRunPath)):
-                shutil.rmtree(self.tempRunPath)
-            self.tempRunPath = None
+        self._removeRunPath()
 
     def __del__(self):
-        if self.tempRunPath is not None:
-            if (os.path.isdir(self.tempRunPath)):
-                shutil.rmtree(self.tempRunPath)
-            self.tempRunPath = None
+        self._removeRunPath()
@@ -1,12 +1,143 @@
 from __future__ import division, absolute_import, print_function
 
+import os
+import sys
+import atexit
+import itertools
 import numpy as np
 import multiprocessing
-
-import ctypes
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
 
 # Adapted from http://stackoverflow.com/questions/10721915/shared-memory-objects-in-python-multiprocessing
 
+# Prefix for the names of shared memory segments created by fgcm.
+SHARED_MEMORY_PREFIX = 'fgcm'
+
+
+class SharedArrayBase(object):
+    """
+    Named shared memory segment backing a wrapped numpy array.
+
+    parameters
+    ----------
+    sharedMemory: multiprocessing.shared_memory.SharedMemory
+       Shared memory segment
+    lock: multiprocessing.Lock, optional
+       Lock associated with the array (for syncAccess arrays)
+    owner: bool, default=True
+       This process created the segment and is responsible for unlinking it
+    """
+
+    def __init__(self, sharedMemory, lock=None, owner=True):
+        self.sharedMemory = sharedMemory
+        self.lock = lock
+        self.owner = owner
+        self.ownerPid = os.getpid()
+
+    @property
+    def name(self):
+        return self.sharedMemory.name
+
+    def get_lock(self):
+        """
+        Get the lock associated with the array, as with multiprocessing.Array.
+        """
+        if self.lock is None:
+            raise RuntimeError("Shared array %s was not created with syncAccess=True" %
+                               (self.name))
+        return self.lock
+
+    def release(self):
+        """
+        Close the segment in this process, and unlink it if this process
+        created it.  The memory is returned to the system once every process
+        has released its mapping.
+        """
+        try:
+            self.sharedMemory.close()
+        except BufferError:
+            # There are still numpy views on the buffer; the mapping will be
+            # released when they are garbage collected.
+            pass
+
+        if self.owner and os.getpid() == self.ownerPid:
+            try:
+                self.sharedMemory.unlink()
+            except FileNotFoundError:
+                pass
+            self.owner = False
+
+
+def _attachSharedMemory(name):
+    """
+    Attach to an existing named shared memory segment without registering
+    it with the resource tracker, so that this process exiting does not
+    unlink a segment that it does not own.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=False, track=False)
+
+    # Older versions always register attached segments with the (possibly
+    # shared) resource tracker, so skip the registration.
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        sharedMemory = shared_memory.SharedMemory(name=name, create=False)
+    finally:
+        resource_tracker.register = register
+    return sharedMemory
+
+
+class MappedArrayBase(object):
+    """
+    Memory-mapped .npy file backing a wrapped numpy array.
+
+    parameters
+    ----------
+    filename: string
+       Name of the .npy file
+    readOnly: bool
+       The file is mapped read-only
+    lock: multiprocessing.Lock, optional
+       Lock associated with the array (for syncAccess arrays)
+    deleteOnFree: bool, default=False
+       Remove the file when the array is freed (for scratch arrays)
+    """
+
+    def __init__(self, filename, readOnly, lock=None, deleteOnFree=False):
+        self.filename = filename
+        self.readOnly = readOnly
+        self.lock = lock
+        self.deleteOnFree = deleteOnFree
+        self.ownerPid = os.getpid()
+
+    @property
+    def name(self):
+        return self.filename
+
+    def get_lock(self):
+        """
+        Get the lock associated with the array, as with multiprocessing.Array.
+        """
+        if self.lock is None:
+            raise RuntimeError("Mapped array %s was not created with syncAccess=True" %
+                               (self.name))
+        return self.lock
+
+    def release(self):
+        """
+        Remove the file if it is a scratch file created by this process.  The
+        mapping itself is released when the array is garbage collected.
+        """
+        if self.deleteOnFree and os.getpid() == self.ownerPid:
+            try:
+                os.remove(self.filename)
+            except (IOError, OSError):
+                pass
+            self.deleteOnFree = False
+
+
 '''
 Singleton Pattern
 '''
@@ -14,6 +145,16 @@ class SharedNumpyMemManager(object):
     """
     Class to wrap numpy variables in shared memory for multiprocessing.
 
+    The arrays are stored in named POSIX shared memory segments
+    (multiprocessing.shared_memory), so they may be used from forked worker
+    processes, or attached by name from spawn/forkserver workers or a
+    separate process.  Segments are unlinked when freed, and any remaining
+    segments created by this process are unlinked on exit.
+
+    Arrays may also be backed by memory-mapped .npy files (see mapArray(),
+    and createArray() with mmapFile), which are shared page-for-page between
+    processes and need not fit in memory.
+
     Parameters
     ----------
     None
@@ -33,14 +174,20 @@ class SharedNumpyMemManager(object):
     # Create an array with an associated lock
     >>> lockArrayHandle = snmm.createArray(100, dtype='f4', syncAccess=True)
     # Get the lock associated with the array
-    >>> lockArrayLock = snmm.getArraybase(lockArrayHandle).get_lock()
+    >>> lockArrayLock = snmm.getArrayBase(lockArrayHandle).get_lock()
     # Acquire the lock
     >>> lockArrayLock.acquire()
     # Do work
-    >>> lockArray = snmm.getArray(lockArrayHandle)E
+    >>> lockArray = snmm.getArray(lockArrayHandle)
     # Release lock
     >>> lockArrayLock.release()
 
+    To use the arrays from a spawned process, export the array specs and
+    import them in the new process (e.g. in a Pool initializer).  The handles
+    are preserved, so objects holding handles work unchanged:
+    >>> pool = multiprocessing.get_context('spawn').Pool(
+    ...     initializer=snmm.importArrays, initargs=(snmm.exportArrays(),))
+
     Note that the array is a pointer to the shared memory, so when
     run in multiprocessing the shared memory is not copied.
 
@@ -54,6 +201,8 @@ class SharedNumpyMemManager(object):
 
     _initSize = 1024
 
+    _supportedDtypes = (np.float32, np.float64, np.int32, np.int64, np.int16, np.bool_)
+
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -68,8 +217,12 @@ class SharedNumpyMemManager(object):
         self.lock = multiprocessing.Lock()
         self.cur = 0
         self.cnt = 0
+        self.generation = 0
         self.sharedArrayBases = [None] * SharedNumpyMemManager._initSize
         self.sharedArrays = [None] * SharedNumpyMemManager._initSize
+        self.segmentCounter = itertools.count()
+
+        atexit.register(self.__cleanup)
 
     def __createArrayLike(self, inArray, syncAccess=False, dtype=None):
         """
@@ -83,68 +236,103 @@ class SharedNumpyMemManager(object):
 
         return self.__createArray(dimensions, dtype=dtype, syncAccess=syncAccess)
 
-    def __createArray(self, dimensions, dtype=np.float64, syncAccess=False):
+    def __createArray(self, dimensions, dtype=np.float64, syncAccess=False, mmapFile=None):
         """
         Create an array
         """
+        if mmapFile is not None:
+            return self.__createMappedArray(mmapFile, dimensions, dtype, syncAccess)
+
         # convert to dtype type (in case short code)
         dtype = np.dtype(dtype)
-        if (dtype == np.float32):
-            ctype = ctypes.c_float
-        elif (dtype == np.float64):
-            ctype = ctypes.c_double
-        elif (dtype == np.int32):
-            ctype = ctypes.c_int32
-        elif (dtype == np.int64):
-            ctype = ctypes.c_int64
-        elif (dtype == np.int16):
-            ctype = ctypes.c_int16
-        elif (dtype == np.bool):
-            ctype = ctypes.c_bool
-        else:
+        if dtype.type not in SharedNumpyMemManager._supportedDtypes:
+            raise ValueError("Unsupported dtype")
+
+        # shared memory segments must have a non-zero size
+        nBytes = max(int(np.prod(dimensions)) * dtype.itemsize, 1)
+
+        # create array in a new named shared memory segment, which is
+        # zero-filled on creation
+        name = '%s_%d_%d' % (SHARED_MEMORY_PREFIX, os.getpid(), next(self.segmentCounter))
+        try:
+            sharedMemory = shared_memory.SharedMemory(name=name, create=True, size=nBytes)
+        except OSError:
+            raise MemoryError("Failed to allocate memory for shared array.  Note that /dev/shm must have more space than allocated shared memory.")
+
+        # The lock is made in the spawn context so that it may be passed
+        # to spawned processes (via exportArrays) as well as forked ones.
+        arrayLock = multiprocessing.get_context('spawn').Lock() if syncAccess else None
+
+        # do a reshape for correct dimensions
+        # The result is a view on the shared memory buffer
+        array = np.ndarray(dimensions, dtype=dtype, buffer=sharedMemory.buf)
+
+        # return handle to the shared memory numpy array
+        return self.__registerArray(SharedArrayBase(sharedMemory, lock=arrayLock), array)
+
+    def __createMappedArray(self, filename, dimensions, dtype, syncAccess):
+        """
+        Create a zeroed scratch array in a new memory-mapped .npy file
+        """
+        dtype = np.dtype(dtype)
+        if dtype.type not in SharedNumpyMemManager._supportedDtypes:
             raise ValueError("Unsupported dtype")
 
+        try:
+            array = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                              shape=tuple(int(d) for d in np.atleast_1d(dimensions)))
+        except (IOError, OSError):
+            raise MemoryError("Failed to create memory-mapped array %s." % (filename))
+
+        arrayLock = multiprocessing.get_context('spawn').Lock() if syncAccess else None
+
+        return self.__registerArray(MappedArrayBase(filename, False, lock=arrayLock,
+                                                    deleteOnFree=True),
+                                    array)
+
+    def __mapArray(self, filename, readOnly=True, syncAccess=False):
+        """
+        Map an existing .npy file
+        """
+        if not os.path.isfile(filename):
+            raise IOError("Could not find array file %s" % (filename))
+
+        array = np.load(filename, mmap_mode='r' if readOnly else 'r+')
+
+        arrayLock = multiprocessing.get_context('spawn').Lock() if syncAccess else None
+
+        return self.__registerArray(MappedArrayBase(filename, readOnly, lock=arrayLock),
+                                    array)
+
+    def __registerArray(self, base, array):
+        """
+        Register an array and its base, and return the handle
+        """
         # This lock is only needed when creating the array, which is fast
         # It is not used when accessing data
         self.lock.acquire()
 
-        # double size if necessary
-        if (self.cnt >= len(self.sharedArrays)):
-            self.sharedArrays = self.sharedArrays + [None] * len(self.sharedArrays)
-            self.sharedArrayBases = self.sharedArrayBases + [None] * len(self.sharedArrayBases)
+        try:
+            # double size if necessary
+            if (self.cnt >= len(self.sharedArrays)):
+                self.sharedArrays = self.sharedArrays + [None] * len(self.sharedArrays)
+                self.sharedArrayBases = self.sharedArrayBases + [None] * len(self.sharedArrayBases)
 
-        # next handle
-        self.__getNextFreeHdl()
+            # next handle
+            self.__getNextFreeHdl()
 
-        # create array in shared memory segment
-        if (syncAccess):
-            try:
-                self.sharedArrayBases[self.cur] = multiprocessing.Array(ctype,
-                                                                        int(np.prod(dimensions)))
-            except:
-                raise MemoryError("Failed to allocate memory for shared array.  Note that $TMPDIR must have more space than allocated shared memory.")
-            self.sharedArrays[self.cur] = np.frombuffer(self.sharedArrayBases[self.cur].get_obj(),dtype=dtype)
-        else:
-            try:
-                self.sharedArrayBases[self.cur] = multiprocessing.RawArray(ctype,
-                                                                           int(np.prod(dimensions)))
-            except:
-                raise MemoryError("Failed to allocate memory for shared array.  Note that $TMPDIR must have more space than allocated shared memory.")
-            self.sharedArrays[self.cur] = np.frombuffer(self.sharedArrayBases[self.cur],dtype=dtype)
-
-        # do a reshape for correct dimensions
-        # Returns a masked array containing the same data, but with a new shape.
-        # The result is a view on the original array
-        self.sharedArrays[self.cur] = self.sharedArrays[self.cur].reshape(dimensions)
+            self.sharedArrayBases[self.cur] = base
+            self.sharedArrays[self.cur] = array
 
-        # update cnt
-        self.cnt += 1
+            # update cnt and the generation of created arrays
+            self.cnt += 1
+            self.generation += 1
 
-        # Release the creation lock
-        self.lock.release()
+            hdl = self.cur
+        finally:
+            self.lock.release()
 
-        # return handle to the shared memory numpy array
-        return self.cur
+        return hdl
 
     def __getNextFreeHdl(self):
         """
@@ -154,7 +342,7 @@ class SharedNumpyMemManager(object):
         while self.sharedArrays[self.cur] is not None:
             self.cur = (self.cur + 1) % len(self.sharedArrays)
             if orgCur == self.cur:
-                raise SharedNumpyMemManagerError('Max Number of Shared Numpy Arrays Exceeded!')
+                raise RuntimeError('Max Number of Shared Numpy Arrays Exceeded!')
 
     def __freeArray(self, hdl):
         """
@@ -164,16 +352,81 @@ class SharedNumpyMemManager(object):
         # set reference to None
         if self.sharedArrays[hdl] is not None: # consider multiple calls to free
             self.sharedArrays[hdl] = None
+            self.sharedArrayBases[hdl].release()
             self.sharedArrayBases[hdl] = None
             self.cnt -= 1
         self.lock.release()
 
+    def __exportArrays(self):
+        specs = {}
+        for hdl, base in enumerate(self.sharedArrayBases):
+            if base is None:
+                continue
+            array = self.sharedArrays[hdl]
+            if isinstance(base, MappedArrayBase):
+                # Scratch files are opened read-write, and are not removed
+                # by the importing process
+                mode = 'r' if base.readOnly else 'r+'
+            else:
+                mode = 'shm'
+            specs[hdl] = (mode, base.name, array.shape, array.dtype.str, base.lock)
+        return specs
+
+    def __importArrays(self, specs):
+        self.lock.acquire()
+        try:
+            maxHdl = max(specs.keys()) if len(specs) > 0 else -1
+            while maxHdl >= len(self.sharedArrays):
+                self.sharedArrays = self.sharedArrays + [None] * len(self.sharedArrays)
+                self.sharedArrayBases = self.sharedArrayBases + [None] * len(self.sharedArrayBases)
+
+            for hdl in specs:
+                mode, name, shape, dtype, arrayLock = specs[hdl]
+                if self.sharedArrays[hdl] is not None:
+                    if self.sharedArrayBases[hdl].name == name:
+                        continue
+                    raise RuntimeError("Shared array handle %d is already in use." % (hdl))
+
+                if mode == 'shm':
+                    sharedMemory = _attachSharedMemory(name)
+                    self.sharedArrayBases[hdl] = SharedArrayBase(sharedMemory, lock=arrayLock,
+                                                                 owner=False)
+                    self.sharedArrays[hdl] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                                        buffer=sharedMemory.buf)
+                else:
+                    self.sharedArrayBases[hdl] = MappedArrayBase(name, mode == 'r',
+                                                                 lock=arrayLock)
+                    self.sharedArrays[hdl] = np.load(name, mmap_mode=mode)
+                self.cnt += 1
+
+            self.generation += 1
+        finally:
+            self.lock.release()
+
+    def __cleanup(self):
+        """
+        Release all the segments, unlinking those created by this process.
+        """
+        for hdl, base in enumerate(self.sharedArrayBases):
+            if base is None:
+                continue
+            self.sharedArrays[hdl] = None
+            base.release()
+            self.sharedArrayBases[hdl] = None
+        self.cnt = 0
+
+    def __getGeneration(self):
+        return self.generation
+
     def __getArray(self, i):
         return self.sharedArrays[i]
 
     def __getArrayBase(self, i):
         return self.sharedArrayBases[i]
 
+    def __getArrayName(self, i):
+        return self.sharedArrayBases[i].name
+
     @staticmethod
     def getInstance():
         if not SharedNumpyMemManager._instance:
@@ -193,9 +446,29 @@ class SharedNumpyMemManager(object):
            float32, float64, int16, int32, int64, or bool
         syncAccess: bool, default False
            Associate array with lock
+        mmapFile: string, optional
+           Back the (zeroed) array with this new memory-mapped .npy file,
+           which is removed when the array is freed
         """
         return SharedNumpyMemManager.getInstance().__createArray(*args, **kwargs)
 
+    @staticmethod
+    def mapArray(*args, **kwargs):
+        """
+        Wrap an existing .npy file as a memory-mapped array.  All processes
+        share the same pages, and the file is never removed.
+
+        Parameters
+        ----------
+        filename: string
+           Name of .npy file
+        readOnly: bool, default True
+           Map the file read-only
+        syncAccess: bool, default False
+           Associate array with lock
+        """
+        return SharedNumpyMemManager.getInstance().__mapArray(*args, **kwargs)
+
     @staticmethod
     def createArrayLike(*args, **kwargs):
         """
@@ -231,8 +504,8 @@ class SharedNumpyMemManager(object):
     @staticmethod
     def getArrayBase(*args, **kwargs):
         """
-        Get a reference to an array base (multiprocessing.Array,
-        and not just wrapped numpy array)
+        Get a reference to an array base (SharedArrayBase or MappedArrayBase,
+        with get_lock(), and not just wrapped numpy array)
 
         Parameters
         ----------
@@ -241,14 +514,94 @@ class SharedNumpyMemManager(object):
 
         Returns
         -------
-        Reterence to multiprocessing.Array base
+        Reference to SharedArrayBase or MappedArrayBase
         """
         return SharedNumpyMemManager.getInstance().__getArrayBase(*args, **kwargs)
 
+    @staticmethod
+    def getArrayName(*args, **kwargs):
+        """
+        Get the name of the shared memory segment (or the file name, for
+        memory-mapped arrays) of an array, which may be used to attach to the
+        array from another process.
+
+        Parameters
+        ----------
+        handle: integer
+           Array handle
+
+        Returns
+        -------
+        Shared memory segment name
+        """
+        return SharedNumpyMemManager.getInstance().__getArrayName(*args, **kwargs)
+
+    @staticmethod
+    def attachArray(name, dimensions, dtype):
+        """
+        Attach to a named shared array from another process.  The segment is
+        not unlinked by this process.
+
+        Parameters
+        ----------
+        name: string
+           Shared memory segment name, from getArrayName()
+        dimensions: scalar or tuple
+           Numpy array dimensions
+        dtype: numpy dtype
+           Numpy array dtype
+
+        Returns
+        -------
+        array: numpy array
+           Array on the shared memory
+        sharedMemory: multiprocessing.shared_memory.SharedMemory
+           Segment, which must be kept alive while the array is in use
+        """
+        sharedMemory = _attachSharedMemory(name)
+        return np.ndarray(dimensions, dtype=np.dtype(dtype), buffer=sharedMemory.buf), sharedMemory
+
+    @staticmethod
+    def exportArrays(*args, **kwargs):
+        """
+        Export the specs of all the current arrays, for importArrays() in a
+        spawned process.  The specs include the array locks, so they must be
+        passed at process creation (e.g. as Pool initargs).
+
+        Returns
+        -------
+        Dict of handle: (mode, name, shape, dtype, lock)
+        """
+        return SharedNumpyMemManager.getInstance().__exportArrays(*args, **kwargs)
+
+    @staticmethod
+    def importArrays(*args, **kwargs):
+        """
+        Attach to the arrays from exportArrays(), with the same handles.
+
+        Parameters
+        ----------
+        specs: dict
+           Dict of handle: (mode, name, shape, dtype, lock) from exportArrays()
+        """
+        return SharedNumpyMemManager.getInstance().__importArrays(*args, **kwargs)
+
+    @staticmethod
+    def getGeneration(*args, **kwargs):
+        """
+        Get the number of arrays created so far.  This is used to check if
+        forked worker processes can see all the current arrays.
+
+        Returns
+        -------
+        Integer generation counter
+        """
+        return SharedNumpyMemManager.getInstance().__getGeneration(*args, **kwargs)
+
     @staticmethod
     def freeArray(*args, **kwargs):
         """
-        Free wrapped array
+        Free wrapped array, and unlink the shared memory segment
 
         Parameters
         ----------
@@ -257,7 +610,13 @@ class SharedNumpyMemManager(object):
         """
         return SharedNumpyMemManager.getInstance().__freeArray(*args, **kwargs)
 
+    @staticmethod
+    def cleanup(*args, **kwargs):
+        """
+        Free all the wrapped arrays, and unlink the shared memory segments
+        created by this process.  This is run automatically on exit.
+        """
+        return SharedNumpyMemManager.getInstance().__cleanup(*args, **kwargs)
+
 # Init Singleton on module load
 SharedNumpyMemManager.getInstance()
-
-
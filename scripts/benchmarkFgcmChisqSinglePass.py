@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import matplotlib
+matplotlib.use("Agg")  # noqa E402
+
+import time
+import argparse
+import numpy as np
+import fgcm
+import yaml
+
+
+def benchmark(fgcmChisq, parArray, singlePass, computeDerivatives, debug, nRepeat):
+    """
+    Return the median time of the chisq evaluations, and the chisq and
+    gradient (None without derivatives) of the last one.
+    """
+
+    fgcmChisq.singlePass = singlePass
+
+    # Warm up (and split the chunks)
+    fgcmChisq(parArray, computeDerivatives=computeDerivatives, debug=debug)
+
+    times = []
+    for i in range(nRepeat):
+        startTime = time.time()
+        result = fgcmChisq(parArray, computeDerivatives=computeDerivatives, debug=debug)
+        times.append(time.time() - startTime)
+
+    if computeDerivatives:
+        fitChisq, dChisqdP = result
+        dChisqdP = np.array(dChisqdP)
+    else:
+        fitChisq, dChisqdP = result, None
+
+    return np.median(times), fitChisq, dChisqdP
+
+
+def compareSinglePass(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, nCore, nRepeat):
+    """
+    Time the two-pass (magnitudes, then chisq) and single-pass chisq
+    evaluations, with and without derivatives, in a single process and on
+    a worker pool (if nCore > 1), and check that the chisq and gradient are
+    bit-identical.
+    """
+
+    parArray = fgcmPars.getParArray(fitterUnits=False)
+
+    modes = [('single process', True)]
+    if nCore > 1:
+        modes.append(('pool, %d workers' % (nCore), False))
+
+    fgcmWorkerPool = fgcm.FgcmWorkerPool(nCore, fgcmConfig.fgcmLog)
+    try:
+        fgcmChisq = fgcm.FgcmChisq(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT,
+                                   fgcmWorkerPool=fgcmWorkerPool)
+        fgcmChisq.nCore = nCore
+
+        different = False
+        for name, debug in modes:
+            for computeDerivatives in [False, True]:
+                twoTime, twoChisq, twoGrad = benchmark(fgcmChisq, parArray, False,
+                                                       computeDerivatives, debug, nRepeat)
+                oneTime, oneChisq, oneGrad = benchmark(fgcmChisq, parArray, True,
+                                                       computeDerivatives, debug, nRepeat)
+
+                if twoChisq != oneChisq or (computeDerivatives and
+                                            not np.array_equal(twoGrad, oneGrad)):
+                    different = True
+
+                print("%s, %s derivatives: two-pass %.3f s, single-pass %.3f s (%.2fx)" %
+                      (name, 'with' if computeDerivatives else 'no', twoTime, oneTime,
+                       twoTime / oneTime))
+    finally:
+        fgcmWorkerPool.close()
+
+    if different:
+        raise RuntimeError("Single-pass and two-pass chisq evaluations give different results.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the single-pass vs two-pass chisq evaluation')
+
+    parser.add_argument('-c','--config', action='store', type=str, required=True,
+                        help='YAML config file (the same as the fit cycle)')
+    parser.add_argument('-n','--nCore', action='store', type=int, default=2,
+                        help='Number of worker processes')
+    parser.add_argument('-r','--nRepeat', action='store', type=int, default=5,
+                        help='Number of timing repeats')
+
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        configDict = yaml.load(f, Loader=yaml.SafeLoader)
+
+    print("Configuration read from %s" % (args.config))
+
+    # Only the chisq is evaluated: no output
+    configDict['clobber'] = True
+    configDict['printOnly'] = True
+    configDict['doPlots'] = False
+    configDict.pop('chisqNodes', None)
+    configDict.pop('checkpointPath', None)
+    configDict.pop('resume', None)
+
+    fgcmConfig = fgcm.FgcmConfig.configWithFits(configDict, noOutput=True)
+
+    fgcmLUT = fgcm.FgcmLUT.initFromFits(fgcmConfig.lutFile,
+                                        filterToBand=fgcmConfig.filterToBand)
+
+    if fgcmConfig.cycleNumber == 0:
+        fgcmPars = fgcm.FgcmParameters.newParsWithFits(fgcmConfig, fgcmLUT)
+    else:
+        fgcmPars = fgcm.FgcmParameters.loadParsWithFits(fgcmConfig)
+
+    fgcmStars = fgcm.FgcmStars(fgcmConfig)
+    fgcmStars.loadStarsFromFits(fgcmPars, computeNobs=True)
+
+    goodExpsIndex, = np.where(fgcmPars.expFlag == 0)
+    fgcmStars.selectStarsMinObsExpIndex(goodExpsIndex)
+
+    compareSinglePass(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, args.nCore, args.nRepeat)
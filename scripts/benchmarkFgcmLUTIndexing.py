@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import time
+import tracemalloc
+import argparse
+import numpy as np
+import fgcm
+from fgcm.sharedNumpyMemManager import SharedNumpyMemManager as snmm
+
+try:
+    from numba import jit
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+
+# The tuple-indexed I0/I1 interpolation as it was before flat indexing, with
+#  the offsets computed from the 7 per-axis indices of each observation
+if has_numba:
+    @jit(nopython=True)
+    def tupleInterpI0I1(lutShape, indices, gridStart, gridDelta,
+                        lnPwv, o3, lnTau, alpha, secZenith, pmbFactor,
+                        i0Luts, i1Luts):
+        ccdStride = 1
+        secZenithStride = lutShape[6] * ccdStride
+        alphaStride = lutShape[5] * secZenithStride
+        tauStride = lutShape[4] * alphaStride
+        o3Stride = lutShape[3] * tauStride
+        pwvStride = lutShape[2] * o3Stride
+        filterStride = lutShape[1] * pwvStride
+
+        nObs = pmbFactor.size
+        I0 = np.zeros(nObs)
+        I1 = np.zeros(nObs)
+        I10 = np.zeros(nObs)
+
+        for i in range(nObs):
+            off = (indices[0][i] * filterStride + indices[1][i] * pwvStride +
+                   indices[2][i] * o3Stride + indices[3][i] * tauStride +
+                   indices[4][i] * alphaStride + indices[5][i] * secZenithStride +
+                   indices[6][i] * ccdStride)
+            offSecZenithPlus = off
+            if indices[5][i] + 1 < lutShape[5]:
+                offSecZenithPlus = off + secZenithStride
+            offPwvPlus = off
+            if indices[1][i] + 1 < lutShape[1]:
+                offPwvPlus = off + pwvStride
+
+            dlnPwv = lnPwv[i] - (gridStart[0] + indices[1][i] * gridDelta[0])
+            dO3 = o3[i] - (gridStart[1] + indices[2][i] * gridDelta[1])
+            dlnTau = lnTau[i] - (gridStart[2] + indices[3][i] * gridDelta[2])
+            dAlpha = alpha[i] - (gridStart[3] + indices[4][i] * gridDelta[3])
+            dSecZenith = secZenith[i] - (gridStart[4] + indices[5][i] * gridDelta[4])
+
+            I0[i] = pmbFactor[i] * (i0Luts[0][off] +
+                                    dlnPwv * i0Luts[1][off] +
+                                    dO3 * i0Luts[2][off] +
+                                    dlnTau * i0Luts[3][off] +
+                                    dAlpha * i0Luts[4][off] +
+                                    dSecZenith * i0Luts[5][off] +
+                                    dlnTau * dSecZenith * (i0Luts[3][offSecZenithPlus] -
+                                                           i0Luts[3][off]) / gridDelta[4] +
+                                    dlnPwv * dSecZenith * (i0Luts[1][offSecZenithPlus] -
+                                                           i0Luts[1][off]) / gridDelta[4] +
+                                    dlnPwv * (dlnPwv - gridDelta[0]) * (i0Luts[1][offPwvPlus] -
+                                                                        i0Luts[1][off]))
+            I1[i] = pmbFactor[i] * (i1Luts[0][off] +
+                                    dlnPwv * i1Luts[1][off] +
+                                    dO3 * i1Luts[2][off] +
+                                    dlnTau * i1Luts[3][off] +
+                                    dAlpha * i1Luts[4][off] +
+                                    dSecZenith * i1Luts[5][off] +
+                                    dlnTau * dSecZenith * (i1Luts[3][offSecZenithPlus] -
+                                                           i1Luts[3][off]) / gridDelta[4] +
+                                    dlnPwv * dSecZenith * (i1Luts[1][offSecZenithPlus] -
+                                                           i1Luts[1][off]) / gridDelta[4] +
+                                    dlnPwv * (dlnPwv - gridDelta[0]) * (i1Luts[1][offPwvPlus] -
+                                                                        i1Luts[1][off]))
+            I10[i] = I1[i] / I0[i]
+
+        return I0, I1, I10
+else:
+    def tupleInterpI0I1(lutShape, indices, gridStart, gridDelta,
+                        lnPwv, o3, lnTau, alpha, secZenith, pmbFactor,
+                        i0Luts, i1Luts):
+        off = np.ravel_multi_index(indices, lutShape)
+        secZenithStride = lutShape[6]
+        pwvStride = int(np.prod(lutShape[2:]))
+
+        offSecZenithPlus = np.where(indices[5] + 1 < lutShape[5], off + secZenithStride, off)
+        offPwvPlus = np.where(indices[1] + 1 < lutShape[1], off + pwvStride, off)
+
+        dlnPwv = lnPwv - (gridStart[0] + indices[1] * gridDelta[0])
+        dO3 = o3 - (gridStart[1] + indices[2] * gridDelta[1])
+        dlnTau = lnTau - (gridStart[2] + indices[3] * gridDelta[2])
+        dAlpha = alpha - (gridStart[3] + indices[4] * gridDelta[3])
+        dSecZenith = secZenith - (gridStart[4] + indices[5] * gridDelta[4])
+
+        Is = []
+        for luts in (i0Luts, i1Luts):
+            dLnPwvLut = luts[1][off]
+            dLnTauLut = luts[3][off]
+            Is.append(pmbFactor * (luts[0][off] +
+                                   dlnPwv * dLnPwvLut +
+                                   dO3 * luts[2][off] +
+                                   dlnTau * dLnTauLut +
+                                   dAlpha * luts[4][off] +
+                                   dSecZenith * luts[5][off] +
+                                   dlnTau * dSecZenith * (luts[3][offSecZenithPlus] -
+                                                          dLnTauLut) / gridDelta[4] +
+                                   dlnPwv * dSecZenith * (luts[1][offSecZenithPlus] -
+                                                          dLnPwvLut) / gridDelta[4] +
+                                   dlnPwv * (dlnPwv - gridDelta[0]) * (luts[1][offPwvPlus] -
+                                                                       dLnPwvLut)))
+
+        return Is[0], Is[1], Is[1] / Is[0]
+
+
+def randomObservations(fgcmLUT, nObs, seed):
+    """
+    Generate random observation parameters which span the LUT grid.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    return (rng.randint(0, len(fgcmLUT.filterNames), nObs).astype(np.int32),
+            rng.uniform(fgcmLUT.lnPwv[0], fgcmLUT.lnPwv[-1], nObs),
+            rng.uniform(fgcmLUT.o3[0], fgcmLUT.o3[-1], nObs),
+            rng.uniform(fgcmLUT.lnTau[0], fgcmLUT.lnTau[-1], nObs),
+            rng.uniform(fgcmLUT.alpha[0], fgcmLUT.alpha[-1], nObs),
+            rng.uniform(fgcmLUT.secZenith[0], fgcmLUT.secZenith[-1], nObs),
+            rng.randint(0, fgcmLUT.nCCD, nObs).astype(np.int32),
+            rng.uniform(fgcmLUT.pmbElevation - 20.0, fgcmLUT.pmbElevation + 20.0, nObs))
+
+
+def runFlatLookups(fgcmLUT, obs):
+    """
+    Run the look-ups done for each observation in FgcmChisq, with flat
+    indexing.
+    """
+
+    filterIndex, lnPwv, o3, lnTau, alpha, secZenith, ccdIndex, pmb = obs
+
+    indices = fgcmLUT.getIndices(filterIndex, lnPwv, o3, lnTau, alpha, secZenith,
+                                 ccdIndex, pmb, flat=True)
+    I0, I1, I10 = fgcmLUT.computeI0I1(lnPwv, o3, lnTau, alpha, secZenith, pmb, indices)
+    fgcmLUT.computeLogDerivatives(indices, I0)
+    fgcmLUT.computeLogDerivativesI1(indices, I0, I10, np.zeros_like(I0))
+
+    return I0, I1
+
+
+def runTupleLookups(fgcmLUT, obs):
+    """
+    Run the same look-ups with the tuple indexing used before flat indexing:
+    the interpolation computes the offsets from the per-axis indices, and
+    the log derivatives are gathered with 7-D fancy indexing.
+    """
+
+    filterIndex, lnPwv, o3, lnTau, alpha, secZenith, ccdIndex, pmb = obs
+
+    indices = fgcmLUT.getIndices(filterIndex, lnPwv, o3, lnTau, alpha, secZenith,
+                                 ccdIndex, pmb)
+
+    lutI0 = snmm.getArray(fgcmLUT.lutI0Handle)
+
+    i0Luts = (lutI0.reshape(-1),
+              snmm.getArray(fgcmLUT.lutDLnPwvHandle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDO3Handle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDLnTauHandle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDAlphaHandle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDSecZenithHandle).reshape(-1))
+    i1Luts = (snmm.getArray(fgcmLUT.lutI1Handle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDLnPwvI1Handle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDO3I1Handle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDLnTauI1Handle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDAlphaI1Handle).reshape(-1),
+              snmm.getArray(fgcmLUT.lutDSecZenithI1Handle).reshape(-1))
+
+    gridStart = (float(fgcmLUT.lnPwv[0]), float(fgcmLUT.o3[0]), float(fgcmLUT.lnTau[0]),
+                 float(fgcmLUT.alpha[0]), float(fgcmLUT.secZenith[0]))
+    gridDelta = (float(fgcmLUT.lnPwvDelta), float(fgcmLUT.o3Delta), float(fgcmLUT.lnTauDelta),
+                 float(fgcmLUT.alphaDelta), float(fgcmLUT.secZenithDelta))
+
+    I0, I1, I10 = tupleInterpI0I1(lutI0.shape, tuple(indices[:-1]), gridStart, gridDelta,
+                                  lnPwv, o3, lnTau, alpha, secZenith, indices[-1],
+                                  i0Luts, i1Luts)
+
+    magConstant = fgcmLUT.magConstant
+    (magConstant * snmm.getArray(fgcmLUT.lutDLnPwvHandle)[indices[:-1]] / I0,
+     magConstant * snmm.getArray(fgcmLUT.lutDO3Handle)[indices[:-1]] / I0,
+     magConstant * snmm.getArray(fgcmLUT.lutDLnTauHandle)[indices[:-1]] / I0,
+     magConstant * snmm.getArray(fgcmLUT.lutDAlphaHandle)[indices[:-1]] / I0)
+
+    sedSlope = np.zeros_like(I0)
+    preFactor = magConstant * (sedSlope / (1. + sedSlope * I10)) * (1. / I0)
+    (preFactor * (snmm.getArray(fgcmLUT.lutDLnPwvI1Handle)[indices[:-1]] -
+                  I10 * snmm.getArray(fgcmLUT.lutDLnPwvHandle)[indices[:-1]]),
+     preFactor * (snmm.getArray(fgcmLUT.lutDO3I1Handle)[indices[:-1]] -
+                  I10 * snmm.getArray(fgcmLUT.lutDO3Handle)[indices[:-1]]),
+     preFactor * (snmm.getArray(fgcmLUT.lutDLnTauI1Handle)[indices[:-1]] -
+                  I10 * snmm.getArray(fgcmLUT.lutDLnTauHandle)[indices[:-1]]),
+     preFactor * (snmm.getArray(fgcmLUT.lutDAlphaI1Handle)[indices[:-1]] -
+                  I10 * snmm.getArray(fgcmLUT.lutDAlphaHandle)[indices[:-1]]))
+
+    return I0, I1
+
+
+def benchmark(runLookups, fgcmLUT, obs, nRepeat):
+    """
+    Return the best time and the peak traced memory of the look-ups.
+    """
+
+    # Warm up (and compile the kernel if numba is available)
+    runLookups(fgcmLUT, tuple(o[: 10] for o in obs))
+
+    bestTime = None
+    for i in range(nRepeat):
+        startTime = time.time()
+        runLookups(fgcmLUT, obs)
+        elapsed = time.time() - startTime
+        if bestTime is None or elapsed < bestTime:
+            bestTime = elapsed
+
+    tracemalloc.start()
+    I0, I1 = runLookups(fgcmLUT, obs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return bestTime, peak, I0, I1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark tuple vs flat-offset LUT indexing')
+
+    parser.add_argument('-l', '--lutFile', action='store', type=str, required=True,
+                        help='FGCM look-up table file')
+    parser.add_argument('-n', '--nObs', action='store', type=int, default=1000000,
+                        help='Number of random observations')
+    parser.add_argument('-r', '--nRepeat', action='store', type=int, default=5,
+                        help='Number of timing repeats')
+    parser.add_argument('-s', '--seed', action='store', type=int, default=12345,
+                        help='Random seed')
+
+    args = parser.parse_args()
+
+    fgcmLUT = fgcm.FgcmLUT.initFromFits(args.lutFile)
+    obs = randomObservations(fgcmLUT, args.nObs, args.seed)
+
+    tupleTime, tuplePeak, tupleI0, tupleI1 = benchmark(runTupleLookups, fgcmLUT, obs, args.nRepeat)
+    flatTime, flatPeak, flatI0, flatI1 = benchmark(runFlatLookups, fgcmLUT, obs, args.nRepeat)
+
+    print("%d observations, %d repeats" % (args.nObs, args.nRepeat))
+    print("tuple indexing: %.3f s, %.1f MB peak" % (tupleTime, tuplePeak / 1024. / 1024.))
+    print("flat indexing:  %.3f s, %.1f MB peak" % (flatTime, flatPeak / 1024. / 1024.))
+
+    if not np.array_equal(tupleI0, flatI0) or not np.array_equal(tupleI1, flatI1):
+        raise RuntimeError("Flat and tuple LUT indexing give different results.")
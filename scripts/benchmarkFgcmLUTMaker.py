@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import time
+import tempfile
+import argparse
+import numpy as np
+import fgcm
+
+
+def makeSyntheticAtmosphereTable(fileName, args):
+    """
+    Make an atmosphere table with smooth synthetic transmissions, so that the
+    benchmark does not need MODTRAN.
+    """
+
+    atmTable = fgcm.FgcmAtmosphereTable({}, atmosphereTableFile=fileName)
+
+    atmTable.elevation = 4139.0
+    atmTable.pmbElevation = 621.0
+    atmTable.pmbStd = 621.0
+    atmTable.pwvStd = 3.0
+    atmTable.o3Std = 263.0
+    atmTable.tauStd = 0.03
+    atmTable.alphaStd = 1.0
+    atmTable.secZenithStd = 1.2
+    atmTable.lambdaRange = np.array([3000.0, 11000.0])
+    atmTable.lambdaStep = args.lambdaStep
+    atmTable.lambdaNorm = 7750.0
+
+    atmTable.atmLambda = np.arange(atmTable.lambdaRange[0],
+                                   atmTable.lambdaRange[1] + atmTable.lambdaStep / 2.,
+                                   atmTable.lambdaStep)
+    lam = atmTable.atmLambda
+
+    atmTable.pmb = np.linspace(580.0, 640.0, 5)
+    atmTable.pmbDelta = atmTable.pmb[1] - atmTable.pmb[0]
+    atmTable.lnPwv = np.linspace(np.log(0.5), np.log(12.0), args.nPwv)
+    atmTable.lnPwvDelta = atmTable.lnPwv[1] - atmTable.lnPwv[0]
+    atmTable.o3 = np.linspace(200.0, 400.0, args.nO3)
+    atmTable.o3Delta = atmTable.o3[1] - atmTable.o3[0]
+    atmTable.lnTau = np.linspace(np.log(0.002), np.log(0.25), args.nTau)
+    atmTable.lnTauDelta = atmTable.lnTau[1] - atmTable.lnTau[0]
+    atmTable.alpha = np.linspace(0.25, 1.75, args.nAlpha)
+    atmTable.alphaDelta = atmTable.alpha[1] - atmTable.alpha[0]
+    atmTable.secZenith = np.linspace(1.0, 2.0, args.nZenith)
+    atmTable.secZenithDelta = atmTable.secZenith[1] - atmTable.secZenith[0]
+
+    pwvPlus = np.exp(np.append(atmTable.lnPwv, atmTable.lnPwv[-1] + atmTable.lnPwvDelta))
+    o3Plus = np.append(atmTable.o3, atmTable.o3[-1] + atmTable.o3Delta)
+    secZenithPlus = np.append(atmTable.secZenith, atmTable.secZenith[-1] + atmTable.secZenithDelta)
+
+    h2oBands = (np.exp(-0.5 * ((lam - 9400.) / 250.)**2.) +
+                0.5 * np.exp(-0.5 * ((lam - 8200.) / 150.)**2.))
+    o3Band = np.exp(-0.5 * ((lam - 6000.) / 800.)**2.)
+    o2Bands = 0.5 * np.exp(-0.5 * ((lam - 7620.) / 20.)**2.)
+
+    atmTable.pwvAtmTable = np.exp(-0.05 * pwvPlus[:, np.newaxis, np.newaxis] *
+                                  secZenithPlus[np.newaxis, :, np.newaxis] *
+                                  h2oBands[np.newaxis, np.newaxis, :])
+    atmTable.o3AtmTable = np.exp(-1e-4 * o3Plus[:, np.newaxis, np.newaxis] *
+                                 secZenithPlus[np.newaxis, :, np.newaxis] *
+                                 o3Band[np.newaxis, np.newaxis, :])
+    atmTable.o2AtmTable = 1.0 - o2Bands[np.newaxis, :] * secZenithPlus[:, np.newaxis] / 2.
+    atmTable.rayleighAtmTable = np.exp(-0.3 * secZenithPlus[:, np.newaxis] *
+                                       (lam[np.newaxis, :] / 4000.)**(-4.))
+
+    atmTable.atmStdTrans = (atmTable.o2AtmTable[0, :] * atmTable.rayleighAtmTable[0, :] *
+                            atmTable.pwvAtmTable[0, 0, :] * atmTable.o3AtmTable[0, 0, :])
+
+    atmTable.saveTable(fileName, clobber=True)
+
+
+def makeThroughputDict(filterNames, nCCD, seed):
+    """
+    Make top-hat-like throughputs with random per-CCD variations.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    lam = np.arange(2900.0, 11100.0, 1.0)
+    centers = np.linspace(4500.0, 9500.0, len(filterNames))
+
+    throughputDict = {}
+    for filterName, center in zip(filterNames, centers):
+        tDict = {'LAMBDA': lam}
+        for ccdIndex in range(nCCD):
+            shift = rng.normal(scale=20.0)
+            scale = rng.uniform(0.8, 1.0)
+            tDict[ccdIndex] = scale / (1.0 + ((lam - center - shift) / 600.0)**8.)
+        throughputDict[filterName] = tDict
+
+    return throughputDict
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the FgcmLUTMaker look-up table integration')
+
+    parser.add_argument('-f', '--nFilter', action='store', type=int, default=3,
+                        help='Number of filters')
+    parser.add_argument('-n', '--nCCD', action='store', type=int, default=8,
+                        help='Number of CCDs')
+    parser.add_argument('-j', '--nCore', action='store', type=int, default=1,
+                        help='Number of processes for the vectorized integration')
+    parser.add_argument('-l', '--lambdaStep', action='store', type=float, default=2.0,
+                        help='Wavelength step (A)')
+    parser.add_argument('--nPwv', action='store', type=int, default=5)
+    parser.add_argument('--nO3', action='store', type=int, default=3)
+    parser.add_argument('--nTau', action='store', type=int, default=5)
+    parser.add_argument('--nAlpha', action='store', type=int, default=4)
+    parser.add_argument('--nZenith', action='store', type=int, default=5)
+    parser.add_argument('-s', '--skipLoop', action='store_true', default=False,
+                        help='Skip the (slow) reference loop integration')
+    parser.add_argument('-r', '--rtol', action='store', type=float, default=1e-5,
+                        help='Relative tolerance for equivalence with the reference')
+
+    args = parser.parse_args()
+
+    tempDir = tempfile.mkdtemp()
+    atmFile = os.path.join(tempDir, 'fgcm_atm_benchmark.fits')
+    makeSyntheticAtmosphereTable(atmFile, args)
+
+    filterNames = ['f%d' % (i) for i in range(args.nFilter)]
+
+    lutConfig = {'atmosphereTableName': atmFile,
+                 'filterNames': filterNames,
+                 'stdFilterNames': filterNames,
+                 'nCCD': args.nCCD,
+                 'nCore': args.nCore,
+                 'logger': fgcm.FgcmLogger(os.path.join(tempDir, 'benchmark.log'), 'WARN')}
+
+    fgcmLUTMaker = fgcm.FgcmLUTMaker(lutConfig)
+    fgcmLUTMaker.setThroughputs(makeThroughputDict(filterNames, args.nCCD, 12345))
+
+    startTime = time.time()
+    fgcmLUTMaker.makeLUT()
+    makeTime = time.time() - startTime
+
+    tauPlus = np.exp(np.append(fgcmLUTMaker.lnTau, fgcmLUTMaker.lnTau[-1] + fgcmLUTMaker.lnTauDelta))
+    alphaPlus = np.append(fgcmLUTMaker.alpha, fgcmLUTMaker.alpha[-1] + fgcmLUTMaker.alphaDelta)
+    airmassPlus = fgcmLUTMaker.secZenithToAirmass(np.append(fgcmLUTMaker.secZenith,
+                                                            fgcmLUTMaker.secZenith[-1] +
+                                                            fgcmLUTMaker.secZenithDelta))
+
+    startTime = time.time()
+    lutPlus = fgcmLUTMaker._integrateLUT(tauPlus, alphaPlus, airmassPlus)
+    vectorTime = time.time() - startTime
+
+    print("LUT shape %s (%d integrals each for I0/I1)" %
+          (str(lutPlus.shape), lutPlus.size))
+    print("makeLUT:                %.3f s" % (makeTime))
+    print("vectorized integration: %.3f s on %d core(s)" % (vectorTime, args.nCore))
+
+    if not args.skipLoop:
+        startTime = time.time()
+        lutPlusLoop = fgcmLUTMaker._integrateLUTLoop(tauPlus, alphaPlus, airmassPlus)
+        loopTime = time.time() - startTime
+
+        print("loop integration:       %.3f s (%.1fx slower)" % (loopTime, loopTime / vectorTime))
+
+        for name in ['I0', 'I1']:
+            # I1 crosses zero, so compare to the scale of I0
+            scale = np.abs(lutPlusLoop['I0']).max()
+            maxDiff = np.abs(lutPlus[name].astype(np.float64) - lutPlusLoop[name]).max() / scale
+            print("%s max difference (relative to max I0): %.3g" % (name, maxDiff))
+            if maxDiff > args.rtol:
+                raise RuntimeError("Vectorized and loop %s integration differ by %.3g" % (name, maxDiff))
+
+    os.remove(atmFile)
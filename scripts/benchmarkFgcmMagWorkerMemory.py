@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import matplotlib
+matplotlib.use("Agg")  # noqa E402
+
+import time
+import tracemalloc
+import argparse
+import numpy as np
+import fgcm
+import yaml
+
+
+def benchmarkMagWorker(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, nChunkStars, nRepeat):
+    """
+    Time FgcmChisq._magWorker on the first chunk of a chisq evaluation, and
+    trace its peak memory.  The shared star and observation arrays are
+    allocated before tracing, so the peak only counts the worker's own
+    temporary arrays.
+
+    parameters
+    ----------
+    fgcmConfig: FgcmConfig
+    fgcmPars: FgcmParameters
+    fgcmStars: FgcmStars
+    fgcmLUT: FgcmLUT
+    nChunkStars: int
+       Number of stars per chunk
+    nRepeat: int
+       Number of timing repeats
+
+    returns
+    -------
+    nGoodStars: int
+       Number of good stars in the catalog
+    nChunkObs: int
+       Number of observations in the chunk
+    bestTime: float
+       Best time of the worker (seconds)
+    peak: int
+       Peak traced memory of the worker (bytes)
+    """
+
+    parArray = fgcmPars.getParArray(fitterUnits=False)
+
+    fgcmChisq = fgcm.FgcmChisq(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT)
+    fgcmChisq.nCore = 1
+    fgcmChisq.nStarPerRun = nChunkStars
+
+    # One evaluation sets up the chunks and the per-call worker state
+    fgcmChisq(parArray, computeDerivatives=True, debug=True)
+
+    nGoodStars = fgcmChisq.matchCache['goodStars'].size
+    goodStarsAndObs = fgcmChisq.matchCache['workerList'][0]
+
+    bestTime = None
+    for i in range(nRepeat):
+        startTime = time.time()
+        fgcmChisq._magWorker(goodStarsAndObs)
+        elapsed = time.time() - startTime
+        if bestTime is None or elapsed < bestTime:
+            bestTime = elapsed
+
+    tracemalloc.start()
+    fgcmChisq._magWorker(goodStarsAndObs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return nGoodStars, goodStarsAndObs[1].size, bestTime, peak
+
+
+def loadFitCycle(configFile):
+    """
+    Load the config, LUT, parameters and stars of a fit cycle config file,
+    with no output.
+    """
+
+    with open(configFile) as f:
+        configDict = yaml.load(f, Loader=yaml.SafeLoader)
+
+    configDict['clobber'] = True
+    configDict['printOnly'] = True
+    configDict['doPlots'] = False
+    configDict.pop('chisqNodes', None)
+    configDict.pop('checkpointPath', None)
+    configDict.pop('resume', None)
+
+    fgcmConfig = fgcm.FgcmConfig.configWithFits(configDict, noOutput=True)
+
+    fgcmLUT = fgcm.FgcmLUT.initFromFits(fgcmConfig.lutFile,
+                                        filterToBand=fgcmConfig.filterToBand)
+
+    if fgcmConfig.cycleNumber == 0:
+        fgcmPars = fgcm.FgcmParameters.newParsWithFits(fgcmConfig, fgcmLUT)
+    else:
+        fgcmPars = fgcm.FgcmParameters.loadParsWithFits(fgcmConfig)
+
+    fgcmStars = fgcm.FgcmStars(fgcmConfig)
+    fgcmStars.loadStarsFromFits(fgcmPars, computeNobs=True)
+
+    goodExpsIndex, = np.where(fgcmPars.expFlag == 0)
+    fgcmStars.selectStarsMinObsExpIndex(goodExpsIndex)
+
+    return fgcmConfig, fgcmPars, fgcmStars, fgcmLUT
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the mag worker memory does not grow with the number of stars')
+
+    parser.add_argument('-c', '--config', action='store', type=str, nargs='+', required=True,
+                        help='YAML config files (the same as the fit cycle) of catalogs of different sizes')
+    parser.add_argument('-s', '--nChunkStars', action='store', type=int, default=10000,
+                        help='Number of stars per chunk')
+    parser.add_argument('-t', '--tolerance', action='store', type=float, default=0.1,
+                        help='Allowed fractional growth of the peak memory per chunk observation')
+    parser.add_argument('-r', '--nRepeat', action='store', type=int, default=3,
+                        help='Number of timing repeats')
+
+    args = parser.parse_args()
+
+    if len(args.config) < 2:
+        raise RuntimeError("At least two config files are required.")
+
+    peaksPerObs = []
+    for configFile in args.config:
+        fgcmConfig, fgcmPars, fgcmStars, fgcmLUT = loadFitCycle(configFile)
+
+        nGoodStars, nChunkObs, elapsed, peak = benchmarkMagWorker(fgcmConfig, fgcmPars,
+                                                                  fgcmStars, fgcmLUT,
+                                                                  args.nChunkStars,
+                                                                  args.nRepeat)
+        peaksPerObs.append(peak / nChunkObs)
+        print("%s: %d stars, %d chunk observations: %.4f s, %.2f MB peak (%.1f bytes/obs)" %
+              (configFile, nGoodStars, nChunkObs, elapsed, peak / 1024. / 1024.,
+               peak / nChunkObs))
+
+    if max(peaksPerObs) > (1.0 + args.tolerance) * min(peaksPerObs):
+        raise RuntimeError("Mag worker peak memory grows with the number of stars.")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import time
+import tracemalloc
+import argparse
+import numpy as np
+import esutil
+import fgcm
+
+
+def syntheticField(nStars, nObsPerStar, size, scatter, seed):
+    """
+    Generate a synthetic field of stars, and of observations scattered
+    around them.  Half of the stars are in a dense cluster at the center.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    ra0, dec0 = 45.0, -30.0
+    nCluster = nStars // 2
+    starRA = np.append(rng.uniform(ra0 - size / 2., ra0 + size / 2., nStars - nCluster),
+                       rng.normal(ra0, size / 40., nCluster))
+    starDec = np.append(rng.uniform(dec0 - size / 2., dec0 + size / 2., nStars - nCluster),
+                        rng.normal(dec0, size / 40., nCluster))
+
+    nObs = nStars * nObsPerStar
+    obsRA = (np.repeat(starRA, nObsPerStar) +
+             rng.normal(0.0, scatter / 3600., nObs) / np.cos(np.radians(dec0)))
+    obsDec = np.repeat(starDec, nObsPerStar) + rng.normal(0.0, scatter / 3600., nObs)
+
+    perm = rng.permutation(nObs)
+
+    return starRA, starDec, obsRA[perm], obsDec[perm]
+
+
+def benchmark(matcher, ra1, dec1, radius, ra2, dec2, nRepeat):
+    """
+    Return the best time, the peak traced memory, and the matched pairs.
+    """
+
+    bestTime = None
+    for i in range(nRepeat):
+        startTime = time.time()
+        matcher.match(ra1, dec1, radius, ra2, dec2, maxmatch=0)
+        elapsed = time.time() - startTime
+        if bestTime is None or elapsed < bestTime:
+            bestTime = elapsed
+
+    tracemalloc.start()
+    i1, i2 = matcher.match(ra1, dec1, radius, ra2, dec2, maxmatch=0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    pairs = np.sort(i1.astype(np.int64) * ra2.size + i2.astype(np.int64))
+
+    return bestTime, peak, pairs
+
+
+def nEdgeDifferences(diffPairs, ra1, dec1, radius, ra2, dec2, tolerance=1e-4):
+    """
+    Count the differing pairs which are at the edge of the match radius (to
+    a fraction tolerance), where the backend precision decides the match.
+    """
+
+    if diffPairs.size == 0:
+        return 0
+
+    i1 = diffPairs // ra2.size
+    i2 = diffPairs % ra2.size
+    dist = esutil.coords.sphdist(ra1[i1], dec1[i1], ra2[i2], dec2[i2])
+
+    return np.sum(np.abs(dist - radius) < tolerance * radius)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the FGCM matcher backends')
+
+    parser.add_argument('-n', '--nStars', action='store', type=int, default=10000,
+                        help='Number of synthetic stars')
+    parser.add_argument('-o', '--nObsPerStar', action='store', type=int, default=10,
+                        help='Number of observations of each star')
+    parser.add_argument('-a', '--size', action='store', type=float, default=2.0,
+                        help='Size of the field (degrees)')
+    parser.add_argument('-m', '--matchRadius', action='store', type=float, default=1.0,
+                        help='Match radius (arcseconds)')
+    parser.add_argument('-c', '--chunkSize', action='store', type=int, default=1000000,
+                        help='Query chunk size of the kdtree matcher')
+    parser.add_argument('-b', '--backends', action='store', type=str, default='smatch,htm,kdtree',
+                        help='Comma-separated matcher backends (the first is the reference)')
+    parser.add_argument('-r', '--nRepeat', action='store', type=int, default=3,
+                        help='Number of timing repeats')
+    parser.add_argument('-s', '--seed', action='store', type=int, default=12345,
+                        help='Random seed')
+
+    args = parser.parse_args()
+
+    starRA, starDec, obsRA, obsDec = syntheticField(args.nStars, args.nObsPerStar,
+                                                    args.size, args.matchRadius / 3.,
+                                                    args.seed)
+    radius = args.matchRadius / 3600.
+
+    matchers = []
+    for backend in args.backends.split(','):
+        try:
+            matchers.append(fgcm.FgcmMatcher(backend, chunkSize=args.chunkSize))
+        except ValueError as e:
+            print("Skipping %s: %s" % (backend, str(e)))
+
+    print("%d stars, %d observations, %d repeats" % (starRA.size, obsRA.size, args.nRepeat))
+
+    # The self-match of observations (primary stars), and the match of
+    #  stars to observations (matched stars)
+    tests = [('self', obsRA, obsDec, obsRA, obsDec),
+             ('cross', starRA, starDec, obsRA, obsDec)]
+
+    mismatched = False
+    for name, ra1, dec1, ra2, dec2 in tests:
+        refPairs = None
+        for matcher in matchers:
+            elapsed, peak, pairs = benchmark(matcher, ra1, dec1, radius, ra2, dec2, args.nRepeat)
+
+            if refPairs is None:
+                refPairs = pairs
+                diffPairs = np.zeros(0, dtype=np.int64)
+            else:
+                diffPairs = np.append(np.setdiff1d(pairs, refPairs, assume_unique=True),
+                                      np.setdiff1d(refPairs, pairs, assume_unique=True))
+            nEdge = nEdgeDifferences(diffPairs, ra1, dec1, radius, ra2, dec2)
+            if diffPairs.size > nEdge:
+                mismatched = True
+
+            print("%-5s match, %-6s: %.3f s, %.2f Mmatch/s, %.1f MB peak, %d matches, "
+                  "%d differ (%d at the radius edge)" %
+                  (name, matcher.backend, elapsed, pairs.size / elapsed / 1e6,
+                   peak / 1024. / 1024., pairs.size, diffPairs.size, nEdge))
+
+    if mismatched:
+        raise RuntimeError("Matcher backends give different matches.")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import shutil
+import tempfile
+import argparse
+import numpy as np
+import fgcm
+
+
+atmConfig = {'elevation': 2663.0,
+             'pmbRange': [770.0, 790.0], 'pmbSteps': 3,
+             'pwvRange': [0.1, 12.0], 'pwvSteps': 5,
+             'o3Range': [220.0, 310.0], 'o3Steps': 3,
+             'tauRange': [0.002, 0.35], 'tauSteps': 3,
+             'alphaRange': [0.0, 2.0], 'alphaSteps': 3,
+             'zenithRange': [0.0, 70.0], 'zenithSteps': 4,
+             'pmbStd': 778.0, 'pwvStd': 3.0, 'o3Std': 263.0,
+             'tauStd': 0.030, 'alphaStd': 1.0, 'airmassStd': 1.2,
+             'lambdaRange': [5000.0, 10000.0], 'lambdaStep': 5.0}
+
+
+def makeFakeModtranPath(fakeModtran, tempPath):
+    """
+    Make a MODTRAN_PATH directory with the stand-in MODTRAN executable.
+    """
+
+    modtranPath = os.path.join(tempPath, 'modtran')
+    os.makedirs(os.path.join(modtranPath, 'DATA'))
+    os.symlink(os.path.abspath(fakeModtran), os.path.join(modtranPath, 'runmodt4.exe'))
+
+    return modtranPath
+
+
+def generateTable(nCore, checkpointPath=None, failAfter=None, counterFile=None, runLog=None):
+    """
+    Generate the table, and return its arrays.  With failAfter, the stand-in
+    MODTRAN fails after that many runs (counted in counterFile).
+    """
+
+    for name, value in [('FGCM_FAKE_MODTRAN_FAIL_AFTER', failAfter),
+                        ('FGCM_FAKE_MODTRAN_COUNTER', counterFile),
+                        ('FGCM_FAKE_MODTRAN_RUNLOG', runLog)]:
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = str(value)
+
+    config = atmConfig.copy()
+    config['nCore'] = nCore
+    if checkpointPath is not None:
+        config['checkpointPath'] = checkpointPath
+
+    fgcmAtmosphereTable = fgcm.FgcmAtmosphereTable(config)
+    fgcmAtmosphereTable.generateTable()
+
+    return [fgcmAtmosphereTable.atmStdTrans, fgcmAtmosphereTable.pwvAtmTable,
+            fgcmAtmosphereTable.o3AtmTable, fgcmAtmosphereTable.o2AtmTable,
+            fgcmAtmosphereTable.rayleighAtmTable]
+
+
+def compareTables(name, tables, refTables):
+    """
+    Raise if the tables are not identical to the reference tables.
+    """
+
+    for table, refTable in zip(tables, refTables):
+        if not np.array_equal(table, refTable):
+            raise RuntimeError("The %s atmosphere table differs from the serial table." % (name))
+
+    print("%s table is identical to the serial table." % (name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check parallel and resumed atmosphere table generation with a stand-in MODTRAN')
+
+    parser.add_argument('-n', '--nCore', action='store', type=int, default=3,
+                        help='Number of MODTRAN runs to make at once')
+    parser.add_argument('-f', '--failAfter', action='store', type=int, default=10,
+                        help='Number of runs before the interrupted generation fails')
+    parser.add_argument('-m', '--fakeModtran', action='store', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                             'fakeFgcmModtran.py'),
+                        help='Stand-in MODTRAN executable')
+
+    args = parser.parse_args()
+
+    tempPath = tempfile.mkdtemp()
+    try:
+        os.environ['MODTRAN_PATH'] = makeFakeModtranPath(args.fakeModtran, tempPath)
+
+        serialTables = generateTable(1)
+
+        runLog = os.path.join(tempPath, 'runs.log')
+        parallelTables = generateTable(args.nCore, runLog=runLog)
+        compareTables('Parallel', parallelTables, serialTables)
+
+        # The generator of the table, and one clone for each worker
+        with open(runLog) as f:
+            runPaths = set(f.read().split())
+        if len(runPaths) > args.nCore + 1:
+            raise RuntimeError("%d MODTRAN run directories were used on %d cores." %
+                               (len(runPaths), args.nCore))
+        leftPaths = [runPath for runPath in runPaths if os.path.isdir(runPath)]
+        if len(leftPaths) > 0:
+            raise RuntimeError("MODTRAN run directories were not removed: %s" %
+                               (', '.join(leftPaths)))
+        print("Parallel table used %d MODTRAN run directories, all removed." % (len(runPaths)))
+
+        checkpointPath = os.path.join(tempPath, 'checkpoint')
+        try:
+            generateTable(args.nCore, checkpointPath=checkpointPath,
+                          failAfter=args.failAfter,
+                          counterFile=os.path.join(tempPath, 'counter'))
+        except RuntimeError as e:
+            print("Interrupted generation failed as expected: %s" % (e))
+        else:
+            raise RuntimeError("The interrupted generation did not fail; reduce failAfter.")
+
+        resumedTables = generateTable(args.nCore, checkpointPath=checkpointPath)
+        compareTables('Resumed', resumedTables, serialTables)
+    finally:
+        shutil.rmtree(tempPath)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import matplotlib
+matplotlib.use("Agg")  # noqa E402
+
+import os
+import binascii
+import argparse
+import multiprocessing
+import numpy as np
+import fgcm
+import yaml
+
+
+def serveNode(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, connection):
+    """
+    Start a chisq node on any free local port, send its address back on
+    the connection, and serve until shut down.
+    """
+
+    fgcmChisqNode = fgcm.FgcmChisqNode(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT,
+                                       ('127.0.0.1', 0))
+    connection.send(fgcmChisqNode.address)
+    connection.close()
+
+    fgcmChisqNode.serve()
+
+
+def compareChisqNodes(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, nNodes, tolerance):
+    """
+    Compare the fit partial sums (with derivatives) evaluated by a single
+    process with those evaluated by a cluster of local chisq nodes.
+
+    The nodes are forked from this process, so they share its star arrays;
+    each node only writes to the stars of its own shard.
+
+    parameters
+    ----------
+    fgcmConfig: FgcmConfig
+    fgcmPars: FgcmParameters
+    fgcmStars: FgcmStars
+    fgcmLUT: FgcmLUT
+    nNodes: int
+       Number of local nodes
+    tolerance: float
+       Allowed difference of the partial sums, relative to the largest
+       partial sum of the same kind (the shards are added up in a different
+       order than the single process)
+
+    returns
+    -------
+    maxDiff: float
+       Largest relative difference of the partial sums
+    """
+
+    parArray = fgcmPars.getParArray(fitterUnits=False)
+
+    fgcmChisq = fgcm.FgcmChisq(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT)
+    localSums = fgcmChisq.computePartialSums(parArray, computeDerivatives=True,
+                                             debug=True).copy()
+
+    context = multiprocessing.get_context('fork')
+
+    processes = []
+    addresses = []
+    try:
+        for i in range(nNodes):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=serveNode,
+                                      args=(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, sender))
+            process.start()
+            processes.append(process)
+            sender.close()
+            addresses.append(receiver.recv())
+            receiver.close()
+
+        fgcmConfig.chisqNodes = ['%s:%d' % (address[0], address[1]) for address in addresses]
+
+        fgcmChisq.cluster = fgcm.FgcmChisqCluster(fgcmConfig, fgcmPars, fgcmStars)
+        try:
+            fgcmChisq.cluster.sync()
+            clusterSums = fgcmChisq.computePartialSums(parArray, computeDerivatives=True).copy()
+        finally:
+            fgcmChisq.cluster.close(shutdown=True)
+            fgcmChisq.cluster = None
+    finally:
+        for process in processes:
+            process.join(timeout=60)
+            if process.is_alive():
+                process.terminate()
+
+    # The partial sums are (derivatives, touches, reference derivatives,
+    #  reference touches) for each parameter, then the chisq and counts.
+    #  The number of touches depends on the chunks, and only whether a
+    #  parameter is touched is used.
+    nFitPars = fgcmPars.nFitPars
+    for i in [1, 3]:
+        touched = slice(i * nFitPars, (i + 1) * nFitPars)
+        if not np.array_equal(localSums[touched] > 0, clusterSums[touched] > 0):
+            raise RuntimeError("Chisq nodes touch different parameters than the single process.")
+
+    maxDiff = 0.0
+    for sums in [slice(0, nFitPars), slice(2 * nFitPars, 3 * nFitPars),
+                 slice(4 * nFitPars, None)]:
+        scale = np.max(np.abs(localSums[sums]))
+        if scale > 0.0:
+            maxDiff = max(maxDiff, np.max(np.abs(clusterSums[sums] - localSums[sums])) / scale)
+
+    if maxDiff > tolerance:
+        raise RuntimeError("Chisq node partial sums differ from the single process "
+                           "(relative difference %.3g)." % (maxDiff))
+
+    return maxDiff
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that chisq nodes give the same partial sums as a single process')
+
+    parser.add_argument('-c','--config', action='store', type=str, required=True,
+                        help='YAML config file (the same as the fit cycle)')
+    parser.add_argument('-n','--nNodes', action='store', type=int, default=3,
+                        help='Number of local chisq nodes')
+    parser.add_argument('-t','--tolerance', action='store', type=float, default=1e-10,
+                        help='Allowed relative difference of the partial sums')
+
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        configDict = yaml.load(f, Loader=yaml.SafeLoader)
+
+    print("Configuration read from %s" % (args.config))
+
+    # Only the chisq is evaluated: no output
+    configDict['clobber'] = True
+    configDict['printOnly'] = True
+    configDict['doPlots'] = False
+    configDict.pop('chisqNodes', None)
+    configDict.pop('checkpointPath', None)
+    configDict.pop('resume', None)
+
+    # The local nodes only listen on localhost, with a random key
+    configDict.pop('chisqNodeAuthKeyFile', None)
+    os.environ['FGCM_CHISQ_NODE_AUTHKEY'] = binascii.hexlify(os.urandom(16)).decode('ascii')
+
+    fgcmConfig = fgcm.FgcmConfig.configWithFits(configDict, noOutput=True)
+
+    fgcmLUT = fgcm.FgcmLUT.initFromFits(fgcmConfig.lutFile,
+                                        filterToBand=fgcmConfig.filterToBand)
+
+    if fgcmConfig.cycleNumber == 0:
+        fgcmPars = fgcm.FgcmParameters.newParsWithFits(fgcmConfig, fgcmLUT)
+    else:
+        fgcmPars = fgcm.FgcmParameters.loadParsWithFits(fgcmConfig)
+
+    fgcmStars = fgcm.FgcmStars(fgcmConfig)
+    fgcmStars.loadStarsFromFits(fgcmPars, computeNobs=True)
+
+    goodExpsIndex, = np.where(fgcmPars.expFlag == 0)
+    fgcmStars.selectStarsMinObsExpIndex(goodExpsIndex)
+
+    maxDiff = compareChisqNodes(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT,
+                                args.nNodes, args.tolerance)
+
+    print("Chisq node (%d nodes) and single process partial sums agree (relative difference %.3g)." %
+          (args.nNodes, maxDiff))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import matplotlib
+matplotlib.use("Agg")  # noqa E402
+
+import argparse
+import numpy as np
+import fgcm
+import yaml
+from fgcm.sharedNumpyMemManager import SharedNumpyMemManager as snmm
+
+
+def evaluateChisq(fgcmChisq, fgcmStars, parArray, debug):
+    """
+    Run one chisq evaluation with derivatives, and return copies of the
+    chisq, gradient, and the observation and mean standard magnitudes.
+    """
+
+    fitChisq, dChisqdP = fgcmChisq(parArray, computeDerivatives=True, debug=debug)
+
+    return (np.atleast_1d(fitChisq).copy(), np.array(dChisqdP),
+            snmm.getArray(fgcmStars.obsMagStdHandle).copy(),
+            snmm.getArray(fgcmStars.objMagStdMeanHandle).copy())
+
+
+def compareChisqPool(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT, nCore, nStarPerRun):
+    """
+    Compare a single-process (debug) chisq evaluation with a worker pool
+    evaluation split into several chunks.
+
+    parameters
+    ----------
+    fgcmConfig: FgcmConfig
+    fgcmPars: FgcmParameters
+    fgcmStars: FgcmStars
+    fgcmLUT: FgcmLUT
+    nCore: int
+       Number of worker processes (at least 2)
+    nStarPerRun: int
+       Number of stars per chunk of the pool evaluation
+
+    returns
+    -------
+    nChunks: int
+       Number of chunks of the pool evaluation
+    """
+
+    if nCore < 2:
+        raise RuntimeError("The pool evaluation requires at least 2 workers.")
+
+    parArray = fgcmPars.getParArray(fitterUnits=False)
+
+    fgcmWorkerPool = fgcm.FgcmWorkerPool(nCore, fgcmConfig.fgcmLog)
+    try:
+        fgcmChisq = fgcm.FgcmChisq(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT,
+                                   fgcmWorkerPool=fgcmWorkerPool)
+        fgcmChisq.nCore = nCore
+        fgcmChisq.nStarPerRun = nStarPerRun
+
+        debugResults = evaluateChisq(fgcmChisq, fgcmStars, parArray, True)
+        poolResults = evaluateChisq(fgcmChisq, fgcmStars, parArray, False)
+        nChunks = len(fgcmChisq.matchCache['workerList'])
+    finally:
+        fgcmWorkerPool.close()
+
+    if nChunks < 2:
+        raise RuntimeError("The pool evaluation ran in a single chunk; reduce nStarPerRun.")
+
+    names = ['chisq', 'gradient', 'obsMagStd', 'objMagStdMean']
+    different = [name for name, debugArray, poolArray in zip(names, debugResults, poolResults)
+                 if not np.array_equal(debugArray, poolArray)]
+
+    if len(different) > 0:
+        raise RuntimeError("Debug and pool chisq evaluations differ in %s." %
+                           (', '.join(different)))
+
+    return nChunks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that pool chisq evaluations are identical to single-process ones')
+
+    parser.add_argument('-c','--config', action='store', type=str, required=True,
+                        help='YAML config file (the same as the fit cycle)')
+    parser.add_argument('-n','--nCore', action='store', type=int, default=2,
+                        help='Number of worker processes')
+    parser.add_argument('-s','--nStarPerRun', action='store', type=int, default=10000,
+                        help='Number of stars per chunk')
+
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        configDict = yaml.load(f, Loader=yaml.SafeLoader)
+
+    print("Configuration read from %s" % (args.config))
+
+    # Only the chisq is evaluated: no output
+    configDict['clobber'] = True
+    configDict['printOnly'] = True
+    configDict['doPlots'] = False
+    configDict.pop('chisqNodes', None)
+    configDict.pop('checkpointPath', None)
+    configDict.pop('resume', None)
+
+    fgcmConfig = fgcm.FgcmConfig.configWithFits(configDict, noOutput=True)
+
+    fgcmLUT = fgcm.FgcmLUT.initFromFits(fgcmConfig.lutFile,
+                                        filterToBand=fgcmConfig.filterToBand)
+
+    if fgcmConfig.cycleNumber == 0:
+        fgcmPars = fgcm.FgcmParameters.newParsWithFits(fgcmConfig, fgcmLUT)
+    else:
+        fgcmPars = fgcm.FgcmParameters.loadParsWithFits(fgcmConfig)
+
+    fgcmStars = fgcm.FgcmStars(fgcmConfig)
+    fgcmStars.loadStarsFromFits(fgcmPars, computeNobs=True)
+
+    goodExpsIndex, = np.where(fgcmPars.expFlag == 0)
+    fgcmStars.selectStarsMinObsExpIndex(goodExpsIndex)
+
+    nChunks = compareChisqPool(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT,
+                               args.nCore, args.nStarPerRun)
+
+    print("Debug and pool (%d workers, %d chunks) chisq evaluations are identical." %
+          (args.nCore, nChunks))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import sys
+import argparse
+import fitsio
+import fgcm
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Code to compare two sets of FGCM zeropoints '
+                                     '(e.g. from fits with obsPrecision float64 and float32)')
+
+    parser.add_argument('zptFile1', action='store', type=str,
+                        help='Reference zeropoint file (*_zpt.fits)')
+    parser.add_argument('zptFile2', action='store', type=str,
+                        help='Zeropoint file to compare')
+    parser.add_argument('-e','--expField', action='store', type=str, default='EXPNUM',
+                        help='Exposure field name')
+    parser.add_argument('-d','--ccdField', action='store', type=str, default='CCDNUM',
+                        help='CCD field name')
+    parser.add_argument('-t','--tolerance', action='store', type=float, default=None,
+                        help='Maximum allowed absolute zeropoint difference (mmag); '
+                        'exit with an error if exceeded')
+
+    args = parser.parse_args()
+
+    zpStruct1 = fitsio.read(args.zptFile1, ext='ZPTS')
+    zpStruct2 = fitsio.read(args.zptFile2, ext='ZPTS')
+
+    report = fgcm.fgcmUtilities.compareZeropoints(zpStruct1, zpStruct2,
+                                                  expField=args.expField,
+                                                  ccdField=args.ccdField)
+
+    print('Zeropoint differences (%s - %s), photometric exposure/ccds (mmag):' %
+          (args.zptFile2, args.zptFile1))
+    print('%6s %10s %10s %10s %10s %12s' % ('band', 'nZpt', 'median', 'rms', 'max|d|', 'max|d(err)|'))
+    for row in report:
+        print('%6s %10d %10.4f %10.4f %10.4f %12.4f' % (row['BAND'], row['NZPT'],
+                                                        row['MEDIAN'] * 1000.,
+                                                        row['RMS'] * 1000.,
+                                                        row['MAXABS'] * 1000.,
+                                                        row['MAXABS_ERR'] * 1000.))
+
+    if args.tolerance is not None and report.size > 0:
+        if report['MAXABS'].max() * 1000. > args.tolerance:
+            print('Maximum zeropoint difference exceeds tolerance of %.4f mmag.' % (args.tolerance))
+            sys.exit(1)
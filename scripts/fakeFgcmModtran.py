@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+# A stand-in for the MODTRAN executable (runmodt4.exe), to check the
+#  atmosphere table generation without MODTRAN.  Link it as runmodt4.exe in
+#  a directory with an (empty) DATA directory, and set MODTRAN_PATH to that
+#  directory.  It reads the tp5 card written by ModtranGenerator, and writes
+#  tp6 and 7sc output with smooth synthetic transmissions.
+#
+# Optional environment variables:
+#  FGCM_FAKE_MODTRAN_COUNTER: file counting the runs (of all processes)
+#  FGCM_FAKE_MODTRAN_FAIL_AFTER: fail (with no output) after this many runs
+#  FGCM_FAKE_MODTRAN_RUNLOG: file to append the run directory of each run to
+
+import os
+import sys
+import fcntl
+import numpy as np
+
+
+def countRun(counterFile):
+    """
+    Count a run in the counter file, and return the number of earlier runs.
+    """
+
+    with open(counterFile, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        nRuns = len(f.read())
+        f.write('x')
+
+    return nRuns
+
+
+if __name__ == '__main__':
+    with open('modroot.in') as f:
+        modtranRoot = f.read().strip()
+
+    with open(modtranRoot + '.tp5') as f:
+        cards = f.read().splitlines()
+
+    # H2O and O3 scalings, zenith, and wavelength range (nm)
+    pwvScaled = float(cards[1].split()[3])
+    o3Scaled = float(cards[1].split()[4])
+    zenith = float(cards[4].split()[1])
+    lambdaMin, lambdaMax, lambdaStep = [float(x) for x in cards[5].split()[0: 3]]
+
+    if 'FGCM_FAKE_MODTRAN_RUNLOG' in os.environ:
+        with open(os.environ['FGCM_FAKE_MODTRAN_RUNLOG'], 'a') as f:
+            f.write('%s\n' % (os.getcwd()))
+
+    if 'FGCM_FAKE_MODTRAN_COUNTER' in os.environ:
+        nRuns = countRun(os.environ['FGCM_FAKE_MODTRAN_COUNTER'])
+        if nRuns >= int(os.environ.get('FGCM_FAKE_MODTRAN_FAIL_AFTER', nRuns + 1)):
+            sys.exit(1)
+
+    with open(modtranRoot + '.tp6', 'w') as f:
+        f.write(" OZONE DENSITIES\n   CONTAINED   0.3450  \n"
+                " THE WATER PROFILE\n   INITIAL:   1.7620  \n"
+                " H2O         O3\n\n   0.9000 0.2700\n")
+
+    nSteps = int(round((lambdaMax - lambdaMin) / lambdaStep)) + 1
+    lam = lambdaMin + np.arange(nSteps) * lambdaStep
+    secZenith = 1. / np.cos(np.radians(zenith))
+
+    h2o = np.exp(-pwvScaled * secZenith * np.exp(-0.5 * ((lam - 940.) / 25.)**2.))
+    o3 = np.exp(-o3Scaled * secZenith * 0.05 * np.exp(-0.5 * ((lam - 600.) / 80.)**2.))
+    o2 = 1.0 - 0.15 * secZenith * np.exp(-0.5 * ((lam - 762.) / 2.)**2.)
+    rayleigh = np.exp(-0.03 * secZenith * (lam / 400.)**(-4.))
+
+    with open(modtranRoot + '.7sc', 'w') as f:
+        for i in range(12):
+            f.write('header\n')
+        for i in range(nSteps):
+            f.write('%f %f %f %f %f 1.0 1.0 1.0 %f\n' %
+                    (lam[i], h2o[i] * o3[i] * o2[i] * rayleigh[i], h2o[i], o2[i], o3[i], rayleigh[i]))
+        f.write('end\n')
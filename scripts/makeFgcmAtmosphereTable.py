@@ -15,6 +15,10 @@ if __name__ == '__main__':
                         help='YAML config file')
     parser.add_argument('-C','--clobber', action='store', type=bool, required=False,
                         default=False,help='Clobber existing LUT?')
+    parser.add_argument('-j','--nCore', action='store', type=int, required=False,
+                        default=None,help='Number of MODTRAN runs to make at once (overrides config)')
+    parser.add_argument('-k','--checkpointPath', action='store', type=str, required=False,
+                        default=None,help='Checkpoint directory to resume from (overrides config)')
 
 
     args = parser.parse_args()
@@ -29,6 +33,11 @@ if __name__ == '__main__':
         print("atmosphereTableFile %s already found, and clobber set to False." % (lutConfig['atmosphereTableFile']))
         sys.exit(0)
 
+    if args.nCore is not None:
+        lutConfig['nCore'] = args.nCore
+    if args.checkpointPath is not None:
+        lutConfig['checkpointPath'] = args.checkpointPath
+
     fgcmAtmosphereTable = fgcm.FgcmAtmosphereTable(lutConfig)
     fgcmAtmosphereTable.generateTable()
     fgcmAtmosphereTable.saveTable(lutConfig['atmosphereTableFile'])
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import sys
+import argparse
+import fgcm
+import yaml
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Code to convert FGCM observation files to a memory-mapped star store')
+
+    parser.add_argument('-c','--config', action='store', type=str, required=True,
+                        help='YAML config file (with obsFile, indexFile, starStorePath)')
+    parser.add_argument('-C','--clobber', action='store_true', default=False,
+                        help='Clobber existing star store')
+
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        configDict = yaml.load(f, Loader=yaml.SafeLoader)
+
+    for key in ['obsFile', 'indexFile', 'starStorePath']:
+        if key not in configDict:
+            raise ValueError("Must include %s in config to run makeFgcmStarStore.py" % (key))
+
+    if fgcm.FgcmStarStore.exists(configDict['starStorePath']) and not args.clobber:
+        print("starStorePath %s already found, and clobber set to False." % (configDict['starStorePath']))
+        sys.exit(0)
+
+    fgcmLog = fgcm.FgcmLogger(None, configDict.get('logLevel', 'INFO'), printLogger=True)
+
+    fgcm.FgcmStarStore.convert(configDict['obsFile'],
+                               configDict['indexFile'],
+                               configDict['starStorePath'],
+                               fgcmLog,
+                               expField=configDict.get('expField', 'EXPNUM'),
+                               ccdField=configDict.get('ccdField', 'CCDNUM'),
+                               clobber=args.clobber)
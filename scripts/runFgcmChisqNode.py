@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+from __future__ import division, absolute_import, print_function
+
+import matplotlib
+matplotlib.use("Agg")  # noqa E402
+
+import argparse
+import fgcm
+import yaml
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Code to serve FGCM fit chisq evaluations for a fit cycle with chisqNodes')
+
+    parser.add_argument('-c','--config', action='store', type=str, required=True,
+                        help='YAML config file (the same as the fit cycle)')
+    parser.add_argument('-a','--address', action='store', type=str, required=True,
+                        help='Address to listen on (host:port, as listed in chisqNodes)')
+    parser.add_argument('-k','--authKeyFile', action='store', type=str, required=False,
+                        help='File with the authentication key (default: chisqNodeAuthKeyFile, '
+                        'or else the environment variable FGCM_CHISQ_NODE_AUTHKEY).  '
+                        'The node unpickles what it receives, so only listen on a trusted network.')
+
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        configDict = yaml.load(f, Loader=yaml.SafeLoader)
+
+    print("Configuration read from %s" % (args.config))
+
+    # The node only evaluates the chisq: no output, and no cluster of its own
+    configDict['clobber'] = True
+    configDict['printOnly'] = True
+    configDict['doPlots'] = False
+    configDict.pop('chisqNodes', None)
+    configDict.pop('checkpointPath', None)
+    configDict.pop('resume', None)
+    if args.authKeyFile is not None:
+        configDict['chisqNodeAuthKeyFile'] = args.authKeyFile
+
+    fgcmConfig = fgcm.FgcmConfig.configWithFits(configDict, noOutput=True)
+
+    # Refuse to start (before loading the stars) without a key
+    fgcm.fgcmChisqCluster.readNodeAuthKey(fgcmConfig.chisqNodeAuthKeyFile)
+
+    fgcmLUT = fgcm.FgcmLUT.initFromFits(fgcmConfig.lutFile,
+                                        filterToBand=fgcmConfig.filterToBand)
+
+    if fgcmConfig.cycleNumber == 0:
+        fgcmPars = fgcm.FgcmParameters.newParsWithFits(fgcmConfig, fgcmLUT)
+    else:
+        fgcmPars = fgcm.FgcmParameters.loadParsWithFits(fgcmConfig)
+
+    fgcmStars = fgcm.FgcmStars(fgcmConfig)
+    fgcmStars.loadStarsFromFits(fgcmPars, computeNobs=True)
+
+    fgcmChisqNode = fgcm.FgcmChisqNode(fgcmConfig, fgcmPars, fgcmStars, fgcmLUT,
+                                       fgcm.fgcmChisqCluster.parseNodeAddress(args.address))
+    fgcmChisqNode.serve()
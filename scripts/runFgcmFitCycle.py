@@ -18,6 +18,8 @@ if __name__ == '__main__':
                         help='YAML config file')
     parser.add_argument('-C','--clobber', action='store_true', default=False, help='Clobber existing run')
     parser.add_argument('-p','--printOnly', action='store_true', default=False, help='Only print logging to stdout')
+    parser.add_argument('-r','--resume', action='store_true', default=False,
+                        help='Resume from the checkpoint in checkpointPath')
 
     args = parser.parse_args()
 
@@ -28,6 +30,7 @@ if __name__ == '__main__':
 
     configDict['clobber'] = args.clobber
     configDict['printOnly'] = args.printOnly
+    configDict['resume'] = args.resume
 
     fgcmFitCycle = fgcm.FgcmFitCycle(configDict, useFits=True)
     fgcmFitCycle.runWithFits()
@@ -8,8 +8,20 @@ exec(open('fgcm/_version.py').read())
 
 scripts = ['scripts/runFgcmFitCycle.py',
            'scripts/makeFgcmAtmosphereTable.py',
+           'scripts/compareFgcmAtmosphereTable.py',
+           'scripts/fakeFgcmModtran.py',
            'scripts/listFgcmAtmosphereTables.py',
-           'scripts/applyFgcmZeropoints.py']
+           'scripts/applyFgcmZeropoints.py',
+           'scripts/benchmarkFgcmLUTIndexing.py',
+           'scripts/benchmarkFgcmLUTMaker.py',
+           'scripts/benchmarkFgcmMatcher.py',
+           'scripts/benchmarkFgcmMagWorkerMemory.py',
+           'scripts/benchmarkFgcmChisqSinglePass.py',
+           'scripts/makeFgcmStarStore.py',
+           'scripts/compareFgcmZeropoints.py',
+           'scripts/compareFgcmChisqPool.py',
+           'scripts/compareFgcmChisqNodes.py',
+           'scripts/runFgcmChisqNode.py']
 
 name='fgcm'
 